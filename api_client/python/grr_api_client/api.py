@@ -39,11 +39,33 @@ class GrrApi(object):
   def ListHuntApprovals(self):
     return hunt.ListHuntApprovals(context=self._context)
 
+  def Batch(self, calls, max_concurrency=None):
+    """Makes multiple API calls concurrently.
 
-def InitHttp(api_endpoint=None, page_size=None, auth=None):
+    For example:
+      clients = api.Batch(api.Client(client_id).Get for client_id in ids)
+
+    Args:
+      calls: Iterable of callables that take no arguments.
+      max_concurrency: Maximum number of calls running at the same time.
+          Defaults to the connector's max_concurrency.
+
+    Returns:
+      Iterator over calls' results, in the same order as calls. If a call
+      raises, the exception is raised when its result is reached.
+    """
+    return self._context.SendBatchRequest(
+        calls, max_concurrency=max_concurrency)
+
+
+def InitHttp(api_endpoint=None, page_size=None, auth=None,
+             max_concurrency=None):
   """Inits an GRR API object with a HTTP connector."""
 
   connector = http_connector.HttpConnector(
-      api_endpoint=api_endpoint, page_size=page_size, auth=auth)
+      api_endpoint=api_endpoint,
+      page_size=page_size,
+      auth=auth,
+      max_concurrency=max_concurrency)
 
   return GrrApi(connector=connector)
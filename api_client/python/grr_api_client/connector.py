@@ -8,6 +8,11 @@ class Connector(object):
   def page_size(self):
     raise NotImplementedError()
 
+  @property
+  def max_concurrency(self):
+    """Maximum number of requests that may be sent at the same time."""
+    return 1
+
   def SendRequest(self, handler_name, args):
     raise NotImplementedError()
 
@@ -3,6 +3,7 @@
 
 import collections
 import json
+import threading
 import urlparse
 
 import requests
@@ -39,20 +40,36 @@ class HttpConnector(connector.Connector):
   JSON_PREFIX = ")]}\'\n"
   DEFAULT_PAGE_SIZE = 50
   DEFAULT_BINARY_CHUNK_SIZE = 66560
+  DEFAULT_MAX_CONCURRENCY = 1
 
-  def __init__(self, api_endpoint=None, auth=None, page_size=None):
+  def __init__(self,
+               api_endpoint=None,
+               auth=None,
+               page_size=None,
+               max_concurrency=None):
     super(HttpConnector, self).__init__()
 
     self.api_endpoint = api_endpoint
     self.auth = auth
     self._page_size = page_size or self.DEFAULT_PAGE_SIZE
+    self._max_concurrency = max_concurrency or self.DEFAULT_MAX_CONCURRENCY
+
+    # Connections are kept alive and reused by all the requests. The pool is
+    # big enough to hold a connection per concurrent request.
+    self.session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=1, pool_maxsize=self._max_concurrency)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
 
     self.csrf_token = None
+    self._initialized = False
+    self._initialization_lock = threading.Lock()
 
   def _GetCSRFToken(self):
     logger.debug("Fetching CSRF token from %s...", self.api_endpoint)
 
-    index_response = requests.get(self.api_endpoint, auth=self.auth)
+    index_response = self.session.get(self.api_endpoint, auth=self.auth)
     self._CheckResponseStatus(index_response)
 
     csrf_token = index_response.cookies.get("csrftoken")
@@ -73,7 +90,7 @@ class HttpConnector(connector.Connector):
 
     url = "%s/%s" % (self.api_endpoint.strip("/"),
                      "api/v2/reflection/api-methods")
-    response = requests.get(
+    response = self.session.get(
         url, headers=headers, cookies=cookies, auth=self.auth)
     self._CheckResponseStatus(response)
 
@@ -111,9 +128,16 @@ class HttpConnector(connector.Connector):
     self.urls = self.handlers_map.bind(parsed_endpoint_url.netloc, "/")
 
   def _InitializeIfNeeded(self):
-    if not self.csrf_token:
-      self.csrf_token = self._GetCSRFToken()
-      self._FetchRoutingMap()
+    if self._initialized:
+      return
+
+    # Requests may be sent from multiple threads, but the initialization has
+    # to be done only once.
+    with self._initialization_lock:
+      if not self._initialized:
+        self.csrf_token = self._GetCSRFToken()
+        self._FetchRoutingMap()
+        self._initialized = True
 
   def _CoerceValueToQueryStringType(self, field, value):
     if isinstance(value, bool):
@@ -221,6 +245,10 @@ class HttpConnector(connector.Connector):
   def page_size(self):
     return self._page_size
 
+  @property
+  def max_concurrency(self):
+    return self._max_concurrency
+
   def SendRequest(self, handler_name, args):
     self._InitializeIfNeeded()
     method_descriptor = self.api_methods[handler_name]
@@ -228,8 +256,7 @@ class HttpConnector(connector.Connector):
     request = self.BuildRequest(method_descriptor.name, args)
     prepped_request = request.prepare()
 
-    session = requests.Session()
-    response = session.send(prepped_request)
+    response = self.session.send(prepped_request)
     self._CheckResponseStatus(response)
 
     content = response.content
@@ -251,8 +278,7 @@ class HttpConnector(connector.Connector):
     request = self.BuildRequest(method_descriptor.name, args)
     prepped_request = request.prepare()
 
-    session = requests.Session()
-    response = session.send(prepped_request, stream=True)
+    response = self.session.send(prepped_request, stream=True)
     self._CheckResponseStatus(response)
 
     def GenerateChunks():
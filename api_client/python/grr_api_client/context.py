@@ -22,20 +22,66 @@ class GrrApiContext(object):
     return self.connector.SendRequest(handler_name, args)
 
   def _GeneratePages(self, handler_name, args):
-    offset = args.offset
+    """Generates result pages, prefetching them if the connector allows.
 
-    while True:
+    The first page is always requested on its own. The following pages are
+    requested ahead of time only if the first page was full, and never past
+    the total_count reported by the first page. Pages past it are requested
+    one at a time until an empty one is returned, in case the total was out of
+    date.
+
+    Args:
+      handler_name: Name of the API handler to call.
+      args: Handler's arguments. Have to have offset and count fields.
+
+    Yields:
+      Result pages.
+    """
+    page_size = self.connector.page_size
+    end = args.offset + args.count if args.count else None
+
+    def SendPageRequest(offset):
       args_copy = utils.CopyProto(args)
       args_copy.offset = offset
-      args_copy.count = self.connector.page_size
-      result = self.connector.SendRequest(handler_name, args_copy)
+      args_copy.count = page_size
+      return self.connector.SendRequest(handler_name, args_copy)
+
+    first_page = SendPageRequest(args.offset)
+    yield first_page
+    if not first_page.items:
+      return
+
+    offset = args.offset + page_size
+    prefetch_end = end
+    total_count = getattr(first_page, "total_count", None)
+    if len(first_page.items) < page_size:
+      prefetch_end = offset
+    elif total_count:
+      prefetch_end = min(end or total_count, total_count)
+
+    offsets = itertools.count(offset, page_size)
+    if prefetch_end is not None:
+      offsets = itertools.takewhile(lambda o: o < prefetch_end, offsets)
+
+    # Pages that follow the first empty one may be requested in advance, but
+    # they're never returned.
+    for result in utils.MapConcurrently(
+        SendPageRequest, offsets, max_workers=self.connector.max_concurrency):
+      yield result
 
+      if not result.items:
+        return
+
+      offset += page_size
+
+    while end is None or offset < end:
+      result = SendPageRequest(offset)
       yield result
 
       if not result.items:
-        break
+        return
 
-      offset += self.connector.page_size
+      offset += page_size
 
   def SendIteratorRequest(self, handler_name, args):
     if not args or not hasattr(args, "count"):
@@ -60,6 +106,22 @@ class GrrApiContext(object):
   def SendStreamingRequest(self, handler_name, args):
     return self.connector.SendStreamingRequest(handler_name, args)
 
+  def SendBatchRequest(self, calls, max_concurrency=None):
+    """Makes given API calls concurrently.
+
+    Args:
+      calls: Iterable of callables that take no arguments.
+      max_concurrency: Maximum number of calls running at the same time.
+          Defaults to the connector's max_concurrency.
+
+    Returns:
+      Iterator over calls' results, in the same order as calls.
+    """
+    return utils.MapConcurrently(
+        lambda call: call(),
+        calls,
+        max_workers=max_concurrency or self.connector.max_concurrency)
+
   @property
   def username(self):
     if not self.user:
@@ -1,7 +1,11 @@
 #!/usr/bin/env python
 """Utility functions and classes for GRR API client library."""
 
+import collections
 import itertools
+import Queue
+import sys
+import threading
 
 from google.protobuf import symbol_database
 
@@ -37,6 +41,95 @@ def MapItemsIterator(function, items):
       items=itertools.imap(function, items), total_count=items.total_count)
 
 
+class _Task(object):
+  """A function call scheduled by MapConcurrently."""
+
+  def __init__(self, function, item):
+    super(_Task, self).__init__()
+
+    self.function = function
+    self.item = item
+    self.result = None
+    self.exc_info = None
+    self.done = threading.Event()
+
+  def Run(self):
+    try:
+      self.result = self.function(self.item)
+    except Exception:  # pylint: disable=broad-except
+      self.exc_info = sys.exc_info()
+    finally:
+      self.done.set()
+
+  def GetResult(self):
+    self.done.wait()
+    if self.exc_info:
+      raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+
+    return self.result
+
+
+def _RunTasks(tasks_queue):
+  while True:
+    task = tasks_queue.get()
+    if task is None:
+      return
+
+    task.Run()
+
+
+def MapConcurrently(function, items, max_workers=1):
+  """Lazily applies a function to every item using a pool of threads.
+
+  At most max_workers calls run at the same time and the items iterable is
+  consumed only as fast as the results are, so it may be infinite. If a call
+  raises, the exception is raised when its result is reached.
+
+  Args:
+    function: Function of a single argument.
+    items: Iterable with arguments to the function.
+    max_workers: Maximum number of concurrent calls. If it's 1, the function
+        is called in the current thread.
+
+  Yields:
+    Results of the calls, in the order of items.
+  """
+  if max_workers <= 1:
+    for item in items:
+      yield function(item)
+    return
+
+  tasks_queue = Queue.Queue()
+  workers = []
+  for _ in range(max_workers):
+    worker = threading.Thread(target=_RunTasks, args=(tasks_queue,))
+    worker.daemon = True
+    worker.start()
+    workers.append(worker)
+
+  try:
+    pending = collections.deque()
+    for item in items:
+      task = _Task(function, item)
+      tasks_queue.put(task)
+      pending.append(task)
+
+      if len(pending) >= max_workers:
+        yield pending.popleft().GetResult()
+
+    while pending:
+      yield pending.popleft().GetResult()
+  finally:
+    # Workers finish the calls that are already running and exit.
+    while True:
+      try:
+        tasks_queue.get_nowait()
+      except Queue.Empty:
+        break
+    for _ in workers:
+      tasks_queue.put(None)
+
+
 class BinaryChunkIterator(object):
   """Iterator object for binary streams."""
 
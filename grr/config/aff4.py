@@ -17,6 +17,32 @@ config_lib.DEFINE_integer(
 config_lib.DEFINE_integer("AFF4.intermediate_cache_max_size", 2000,
                           "Maximum size of the AFF4 index cache.")
 
+config_lib.DEFINE_integer(
+    "AFF4.keyword_index_cache_age", 0,
+    "The number of seconds keyword index posting lists live in the cache. "
+    "Changes made by other processes are not visible until then, so only "
+    "enable this in processes that tolerate stale search results. 0 disables "
+    "the cache.")
+
+config_lib.DEFINE_integer(
+    "AFF4.keyword_index_cache_max_size", 1000,
+    "Maximum number of keyword index posting lists in the cache.")
+
+config_lib.DEFINE_integer(
+    "AFF4.collection_index_cache_age", 0,
+    "The number of seconds indexes of sequential collections live in the "
+    "cache. Index entries written, and collections deleted or recreated, by "
+    "other processes are not noticed until then. 0 disables the cache.")
+
+config_lib.DEFINE_integer(
+    "AFF4.collection_index_cache_max_size", 1000,
+    "Maximum number of sequential collection indexes in the cache.")
+
+config_lib.DEFINE_integer(
+    "AFF4.collection_index_updater_threads", 4,
+    "The number of threads updating sequential collection indexes in the "
+    "background.")
+
 config_lib.DEFINE_string(
     "AFF4.change_email", None,
     "Email used by AFF4NotificationEmailListener to notify "
@@ -76,6 +76,51 @@ config_lib.DEFINE_integer(
     help=("Number of file handles kept in the SQLite "
           "data_store cache."))
 
+config_lib.DEFINE_integer(
+    "SqliteDatastore.database_index_refresh_interval",
+    default=60,
+    help=("Interval (in seconds) after which the in-memory index of database "
+          "files, used by prefix scans, is rebuilt from the files on disk. "
+          "Files created by the data store itself are indexed immediately, "
+          "but files created by other processes are missed by scans until "
+          "then. If 0, the files on disk are listed for every prefix scan."))
+
+config_lib.DEFINE_choice(
+    "SqliteDatastore.journal_mode",
+    default="OFF",
+    choices=["OFF", "WAL"],
+    help=("The journal mode of the SQLite databases. OFF shares a single "
+          "connection per database file between readers and writers. WAL "
+          "uses write-ahead logging with a writer thread per database file, "
+          "which commits concurrent writes together, and a pool of read "
+          "connections which don't block on the writer."))
+
+config_lib.DEFINE_integer(
+    "SqliteDatastore.read_connections",
+    default=4,
+    help=("Number of read connections per database file in the WAL journal "
+          "mode."))
+
+config_lib.DEFINE_integer(
+    "SqliteDatastore.wal_autocheckpoint",
+    default=1000,
+    help=("Number of pages in the write-ahead log which trigger an automatic "
+          "checkpoint, or 0 to disable automatic checkpoints."))
+
+config_lib.DEFINE_choice(
+    "SqliteDatastore.wal_checkpoint_mode",
+    default="PASSIVE",
+    choices=["PASSIVE", "FULL", "RESTART", "TRUNCATE"],
+    help=("The mode of the checkpoints periodically run by the writer threads "
+          "in the WAL journal mode."))
+
+config_lib.DEFINE_integer(
+    "SqliteDatastore.wal_checkpoint_interval",
+    default=60,
+    help=("Minimum interval (in seconds) between the checkpoints run by the "
+          "writer threads after commits in the WAL journal mode, or 0 to only "
+          "checkpoint automatically."))
+
 # MySQLAdvanced data store.
 config_lib.DEFINE_string("Mysql.host", "localhost",
                          "The MySQL server hostname.")
@@ -55,6 +55,11 @@ config_lib.DEFINE_integer("Worker.queue_shards", 5,
                           "Queue notifications will be sharded across "
                           "this number of datastore subjects.")
 
+config_lib.DEFINE_integer(
+    "Worker.hunt_result_queue_shards", 4,
+    "Number of shards of the queue of hunt results waiting to be processed "
+    "by output plugins.")
+
 config_lib.DEFINE_integer("Worker.notification_expiry_time", 600,
                           "The queue manager expires stale notifications "
                           "after this many seconds.")
@@ -249,6 +254,24 @@ config_lib.DEFINE_integer(
     help="Maximum lifetime (in seconds) of data in the "
     "stats store. Default is three days.")
 
+config_lib.DEFINE_integer(
+    "StatsStore.rollup_ttl_1m",
+    default=60 * 60 * 24 * 14,
+    help="Maximum lifetime (in seconds) of the 1 minute resolution "
+    "stats store rollups. Default is two weeks.")
+
+config_lib.DEFINE_integer(
+    "StatsStore.rollup_ttl_1h",
+    default=60 * 60 * 24 * 90,
+    help="Maximum lifetime (in seconds) of the 1 hour resolution "
+    "stats store rollups. Default is 90 days.")
+
+config_lib.DEFINE_integer(
+    "StatsStore.rollup_ttl_1d",
+    default=60 * 60 * 24 * 365 * 2,
+    help="Maximum lifetime (in seconds) of the 1 day resolution "
+    "stats store rollups. Default is two years.")
+
 config_lib.DEFINE_bool(
     "AdminUI.allow_hunt_results_delete",
     default=False,
@@ -389,23 +389,18 @@ class ApiAddClientsLabelsHandler(api_call_handler_base.ApiCallHandler):
     audit_events = []
 
     try:
-      index = client_index.CreateClientIndex(token=token)
-      client_objs = aff4.FACTORY.MultiOpen(
+      client_urns = client_index.BulkAddLabels(
           [cid.ToClientURN() for cid in args.client_ids],
-          aff4_type=aff4_grr.VFSGRRClient,
-          mode="rw",
+          args.labels,
+          owner=token.username,
           token=token)
-      for client_obj in client_objs:
-        client_obj.AddLabels(*args.labels)
-        index.AddClient(client_obj)
-        client_obj.Close()
-
+      for client_urn in client_urns:
         audit_events.append(
             events.AuditEvent(
                 user=token.username,
                 action="CLIENT_ADD_LABEL",
                 flow_name="handler.ApiAddClientsLabelsHandler",
-                client=client_obj.urn,
+                client=client_urn,
                 description=audit_description))
     finally:
       events.Events.PublishMultipleEvents(
@@ -423,17 +418,6 @@ class ApiRemoveClientsLabelsHandler(api_call_handler_base.ApiCallHandler):
 
   args_type = ApiRemoveClientsLabelsArgs
 
-  def RemoveClientLabels(self, client, labels_names):
-    """Removes labels with given names from a given client object."""
-
-    affected_owners = set()
-    for label in client.GetLabels():
-      if label.name in labels_names and label.owner != "GRR":
-        affected_owners.add(label.owner)
-
-    for owner in affected_owners:
-      client.RemoveLabels(*labels_names, owner=owner)
-
   def Handle(self, args, token=None):
     audit_description = ",".join([
         token.username + u"." + utils.SmartUnicode(name) for name in args.labels
@@ -441,24 +425,19 @@ class ApiRemoveClientsLabelsHandler(api_call_handler_base.ApiCallHandler):
     audit_events = []
 
     try:
-      index = client_index.CreateClientIndex(token=token)
-      client_objs = aff4.FACTORY.MultiOpen(
+      # Labels assigned by GRR itself can't be removed by users.
+      client_urns = client_index.BulkRemoveLabels(
           [cid.ToClientURN() for cid in args.client_ids],
-          aff4_type=aff4_grr.VFSGRRClient,
-          mode="rw",
+          args.labels,
+          ignored_owners=["GRR"],
           token=token)
-      for client_obj in client_objs:
-        index.RemoveClientLabels(client_obj)
-        self.RemoveClientLabels(client_obj, args.labels)
-        index.AddClient(client_obj)
-        client_obj.Close()
-
+      for client_urn in client_urns:
         audit_events.append(
             events.AuditEvent(
                 user=token.username,
                 action="CLIENT_REMOVE_LABEL",
                 flow_name="handler.ApiRemoveClientsLabelsHandler",
-                client=client_obj.urn,
+                client=client_urn,
                 description=audit_description))
     finally:
       events.Events.PublishMultipleEvents(
@@ -673,12 +673,8 @@ class ApiGetHuntClientCompletionStatsHandler(
         mode="r",
         token=token)
 
-    clients_by_status = hunt.GetClientsByStatus()
-    started_clients = clients_by_status["STARTED"]
-    completed_clients = clients_by_status["COMPLETED"]
-
-    (start_stats, complete_stats) = self._SampleClients(started_clients,
-                                                        completed_clients)
+    start_stats, complete_stats = (
+        hunt.GetClientCompletionStats().GetDataPoints())
 
     if len(start_stats) > target_size:
       # start_stats and complete_stats are equally big, so resample both
@@ -688,54 +684,6 @@ class ApiGetHuntClientCompletionStatsHandler(
     return ApiGetHuntClientCompletionStatsResult().InitFromDataPoints(
         start_stats, complete_stats)
 
-  def _SampleClients(self, started_clients, completed_clients):
-    # immediately return on empty client data
-    if not started_clients and not completed_clients:
-      return ([], [])
-
-    cdict = {}
-    for client in started_clients:
-      cdict.setdefault(client, []).append(client.age)
-
-    fdict = {}
-    for client in completed_clients:
-      fdict.setdefault(client, []).append(client.age)
-
-    cl_age = [int(min(x) / 1e6) for x in cdict.values()]
-    fi_age = [int(min(x) / 1e6) for x in fdict.values()]
-
-    cl_hist = {}
-    fi_hist = {}
-
-    for age in cl_age:
-      cl_hist.setdefault(age, 0)
-      cl_hist[age] += 1
-
-    for age in fi_age:
-      fi_hist.setdefault(age, 0)
-      fi_hist[age] += 1
-
-    t0 = min(cl_age) - 1
-    times = [t0]
-    cl = [0]
-    fi = [0]
-
-    all_times = set(cl_age) | set(fi_age)
-    cl_count = 0
-    fi_count = 0
-
-    for time in sorted(all_times):
-      cl_count += cl_hist.get(time, 0)
-      fi_count += fi_hist.get(time, 0)
-
-      times.append(time)
-      cl.append(cl_count)
-      fi.append(fi_count)
-
-    # Convert to hours, starting from 0.
-    times = [(t - t0) / 3600.0 for t in times]
-    return (zip(times, cl), zip(times, fi))
-
   def _Resample(self, stats, target_size):
     """Resamples the stats to have a specific number of data points."""
     t_first = stats[0][0]
@@ -100,10 +100,25 @@ class ApiGetStatsStoreMetricHandler(api_call_handler_base.ApiCallHandler):
     result = ApiStatsStoreMetric(
         start=base_start_time, end=end_time, metric_name=args.metric_name)
 
-    data = stats_store.MultiReadStats(
+    requested_duration = end_time - start_time
+    if requested_duration >= rdfvalue.Duration("90d"):
+      sampling_duration = rdfvalue.Duration("1d")
+    elif requested_duration >= rdfvalue.Duration("7d"):
+      sampling_duration = rdfvalue.Duration("1h")
+    elif requested_duration >= rdfvalue.Duration("1d"):
+      sampling_duration = rdfvalue.Duration("5m")
+    elif requested_duration >= rdfvalue.Duration("6h"):
+      sampling_duration = rdfvalue.Duration("1m")
+    else:
+      sampling_duration = rdfvalue.Duration("30s")
+
+    # Read the coarsest rollup which is still fine-grained enough for the
+    # sampling duration, with raw samples where the rollup has none.
+    data = stats_store.MultiReadStatsForInterval(
         process_ids=filtered_ids,
         metric_name=utils.SmartStr(args.metric_name),
-        timestamp=(start_time, end_time))
+        timestamp=(start_time, end_time),
+        sampling_interval=sampling_duration)
 
     if not data:
       return result
@@ -117,14 +132,6 @@ class ApiGetStatsStoreMetricHandler(api_call_handler_base.ApiCallHandler):
     if metric_metadata.fields_defs:
       query.InAll()
 
-    requested_duration = end_time - start_time
-    if requested_duration >= rdfvalue.Duration("1d"):
-      sampling_duration = rdfvalue.Duration("5m")
-    elif requested_duration >= rdfvalue.Duration("6h"):
-      sampling_duration = rdfvalue.Duration("1m")
-    else:
-      sampling_duration = rdfvalue.Duration("30s")
-
     if metric_metadata.metric_type == metric_metadata.MetricType.COUNTER:
       query.TakeValue().MakeIncreasing().Normalize(
           sampling_duration,
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""This module contains tests for stats API handlers."""
+
+
+
+from grr.gui.api_plugins import stats as stats_plugin
+
+from grr.lib import aff4
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import stats
+from grr.lib import test_lib
+from grr.lib import utils
+
+from grr.lib.aff4_objects import stats_store as aff4_stats_store
+
+
+# Zero start times are treated as unset by the handler, so samples are written
+# starting a day after the epoch.
+_START_TIME = rdfvalue.RDFDatetime().FromSecondsFromEpoch(24 * 60 * 60)
+
+
+def _CreateStatsCollector():
+  stats_collector = stats.StatsCollector()
+  stats_collector.RegisterCounterMetric(
+      "sample_counter", docstring="Sample counter metric.")
+  return stats_collector
+
+
+def _WriteCounterSamples(token, count, interval):
+  """Writes count samples of sample_counter, one every interval."""
+  stats_collector = _CreateStatsCollector()
+
+  with utils.Stubber(stats, "STATS", stats_collector):
+    stats_store = aff4.FACTORY.Create(
+        None, aff4_stats_store.StatsStore, mode="w", token=token)
+    for i in range(count):
+      with test_lib.FakeTime(_START_TIME + interval * i):
+        stats_collector.IncrementCounter("sample_counter")
+        stats_store.WriteStats(process_id="worker_1", sync=False)
+    stats_store.Close()
+
+
+class ApiGetStatsStoreMetricHandlerTest(test_lib.GRRBaseTest):
+  """Test for ApiGetStatsStoreMetricHandler."""
+
+  def setUp(self):
+    super(ApiGetStatsStoreMetricHandlerTest, self).setUp()
+    self.handler = stats_plugin.ApiGetStatsStoreMetricHandler()
+    self.args = stats_plugin.ApiGetStatsStoreMetricArgs(
+        component="WORKER",
+        metric_name="sample_counter",
+        start=_START_TIME,
+        end=_START_TIME + rdfvalue.Duration("10d"))
+
+  def _DeleteStats(self, end=None, resolution=None):
+    stats_store = aff4.FACTORY.Create(
+        None, aff4_stats_store.StatsStore, mode="w", token=self.token)
+    # Only the stats of registered metrics are deleted.
+    with utils.Stubber(stats, "STATS", _CreateStatsCollector()):
+      stats_store.DeleteStats(
+          process_id="worker_1",
+          timestamp=(0, end or rdfvalue.RDFDatetime.Now()),
+          sync=True,
+          resolution=resolution)
+
+  def testLongTimeRangesAreServedFromRollups(self):
+    _WriteCounterSamples(self.token, 2 * 24 * 60, rdfvalue.Duration("1m"))
+    self._DeleteStats()
+
+    result = self.handler.Handle(self.args, token=self.token)
+    # 10 days sampled hourly from the hourly rollup, which has the first
+    # sample of every hour.
+    self.assertEqual(len(result.data_points), 10 * 24)
+    self.assertEqual(result.data_points[0].value, 60 + 1)
+    self.assertEqual(result.data_points[46].value, 47 * 60 + 1)
+    self.assertEqual(result.data_points[-1].value, 47 * 60 + 1)
+
+  def testRawSamplesAreUsedIfRollupsAreMissing(self):
+    _WriteCounterSamples(self.token, 2 * 24 * 60, rdfvalue.Duration("1m"))
+    self._DeleteStats(resolution=rdfvalue.Duration("1h"))
+
+    result = self.handler.Handle(self.args, token=self.token)
+    # Data points are the latest samples of the hours, which start 10 minutes
+    # before the requested start time.
+    self.assertEqual(len(result.data_points), 10 * 24)
+    self.assertEqual(result.data_points[0].value, 60 + 50)
+    self.assertEqual(result.data_points[46].value, 47 * 60 + 50)
+
+  def testRawSamplesAreUsedWhereRollupsAreMissing(self):
+    _WriteCounterSamples(self.token, 2 * 24 * 60, rdfvalue.Duration("1m"))
+    # The hourly rollup only covers the second day.
+    self._DeleteStats(
+        end=_START_TIME + rdfvalue.Duration("1d"),
+        resolution=rdfvalue.Duration("1h"))
+
+    result = self.handler.Handle(self.args, token=self.token)
+    self.assertEqual(len(result.data_points), 10 * 24)
+    # Raw samples are used on the first day...
+    self.assertEqual(result.data_points[0].value, 60 + 50)
+    self.assertEqual(result.data_points[22].value, 23 * 60 + 50)
+    # ...and the rollup on the second one.
+    self.assertEqual(result.data_points[46].value, 47 * 60 + 1)
+
+
+class ApiGetStatsStoreMetricHandlerBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark serving a week of stats from rollups and from raw samples."""
+
+  def _TimeHandler(self, name):
+    handler = stats_plugin.ApiGetStatsStoreMetricHandler()
+    args = stats_plugin.ApiGetStatsStoreMetricArgs(
+        component="WORKER",
+        metric_name="sample_counter",
+        start=_START_TIME,
+        end=_START_TIME + rdfvalue.Duration("7d"))
+    self.TimeIt(
+        lambda: handler.Handle(args, token=self.token),
+        name=name,
+        repetitions=3)
+
+  @test_lib.SetLabel("benchmark")
+  def testWeekOfSamples(self):
+    samples_count = 7 * 24 * 12
+
+    _WriteCounterSamples(self.token, samples_count, rdfvalue.Duration("5m"))
+    self._TimeHandler("Rollups")
+
+    data_store.DB.Clear()
+    aff4.FACTORY.Flush()
+    with utils.Stubber(aff4_stats_store.StatsStoreProcessData,
+                       "ROLLUP_RESOLUTIONS", []):
+      _WriteCounterSamples(self.token, samples_count, rdfvalue.Duration("5m"))
+    self._TimeHandler("Raw samples")
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -81,41 +81,53 @@ class ApiValueRenderer(object):
 
   @classmethod
   def GetRendererForValueOrClass(cls, value, limit_lists=-1):
-    """Returns renderer corresponding to a given value and rendering args."""
+    """Returns renderer corresponding to a given value and rendering args.
+
+    Renderers don't keep any per-value state, so a single renderer instance
+    is created and reused for every (class, limit_lists) pair.
+
+    Args:
+      value: Value (or class) to find the renderer for.
+      limit_lists: Lists limit passed to the renderer.
+
+    Returns:
+      An ApiValueRenderer instance.
+
+    Raises:
+      RuntimeError: if no renderer could be found.
+    """
 
     if inspect.isclass(value):
       value_cls = value
     else:
       value_cls = value.__class__
 
-    cache_key = "%s_%d" % (value_cls.__name__, limit_lists)
+    cache_key = (value_cls, limit_lists)
     try:
-      renderer_cls = cls._renderers_cache[cache_key]
+      return cls._renderers_cache[cache_key]
     except KeyError:
-      candidates = []
-      for candidate in ApiValueRenderer.classes.values():
-        if candidate.value_class:
-          candidate_class = candidate.value_class
-        else:
-          continue
-
-        if inspect.isclass(value):
-          if aff4.issubclass(value_cls, candidate_class):
-            candidates.append((candidate, candidate_class))
-        else:
-          if isinstance(value, candidate_class):
-            candidates.append((candidate, candidate_class))
-
-      if not candidates:
-        raise RuntimeError("No renderer found for value %s." %
-                           value.__class__.__name__)
-
-      candidates = sorted(
-          candidates, key=lambda candidate: len(candidate[1].mro()))
-      renderer_cls = candidates[-1][0]
-      cls._renderers_cache[cache_key] = renderer_cls
-
-    return renderer_cls(limit_lists=limit_lists)
+      pass
+
+    candidates = []
+    for candidate in ApiValueRenderer.classes.values():
+      if candidate.value_class:
+        candidate_class = candidate.value_class
+      else:
+        continue
+
+      if aff4.issubclass(value_cls, candidate_class):
+        candidates.append((candidate, candidate_class))
+
+    if not candidates:
+      raise RuntimeError("No renderer found for value %s." %
+                         value_cls.__name__)
+
+    candidates = sorted(
+        candidates, key=lambda candidate: len(candidate[1].mro()))
+    renderer = candidates[-1][0](limit_lists=limit_lists)
+    cls._renderers_cache[cache_key] = renderer
+
+    return renderer
 
   def __init__(self, limit_lists=-1):
     super(ApiValueRenderer, self).__init__()
@@ -433,10 +445,31 @@ class ApiRDFProtoStructRenderer(ApiValueRenderer):
   value_processors = []
   descriptor_processors = []
 
+  # Names of the fields of each RDFProtoStruct class, keyed by class.
+  _field_names_cache = {}
+
+  def _GetFieldNames(self, value_cls):
+    """Returns names of all the fields of a given RDFProtoStruct class."""
+    descriptors = value_cls.type_infos.descriptors
+    try:
+      num_descriptors, field_names = self._field_names_cache[value_cls]
+      # Late bound fields are appended to type_infos once their types are
+      # defined, in which case the cached list has to be rebuilt.
+      if num_descriptors == len(descriptors):
+        return field_names
+    except KeyError:
+      pass
+
+    field_names = tuple(desc.name for desc in descriptors)
+    self._field_names_cache[value_cls] = (len(descriptors), field_names)
+    return field_names
+
   def RenderValue(self, value):
-    result = value.AsDict()
-    for k, v in result.items():
-      result[k] = self._PassThrough(v)
+    result = {}
+    raw_data = value.GetRawData()
+    for name in self._GetFieldNames(value.__class__):
+      if name in raw_data:
+        result[name] = self._PassThrough(value.Get(name))
 
     for processor in self.value_processors:
       result = processor(self, result, value)
@@ -568,7 +601,62 @@ def RenderValue(value, limit_lists=-1):
   return renderer.RenderValue(value)
 
 
+def _CopyDescriptor(descriptor):
+  """Copies a descriptor, sharing only its default values.
+
+  Default values can be of any RDFValue type and not all of them survive a
+  serialization round trip, so they are shared. They're never modified.
+
+  Args:
+    descriptor: ApiRDFValueDescriptor or one of its nested structs.
+
+  Returns:
+    A copy of the descriptor.
+  """
+  result = descriptor.__class__()
+  for field, value in descriptor.ListSetFields():
+    if field.name == "default":
+      pass
+    elif isinstance(field, rdf_structs.ProtoList):
+      value = [
+          _CopyDescriptor(v)
+          if isinstance(v, rdf_structs.RDFProtoStruct) else v for v in value
+      ]
+    elif isinstance(value, rdf_structs.RDFProtoStruct):
+      value = _CopyDescriptor(value)
+
+    result.Set(field.name, value)
+
+  return result
+
+
+# Type descriptors keyed by (class, number of fields).
+_type_descriptors_cache = {}
+
+
 def BuildTypeDescriptor(value_cls):
+  """Returns type descriptor of a given class.
+
+  Descriptors only depend on the class, so they're built once per process.
+  Every call returns a new copy that the caller is free to modify.
+
+  Args:
+    value_cls: Class to build the descriptor for.
+
+  Returns:
+    ApiRDFValueDescriptor.
+  """
+  type_infos = getattr(value_cls, "type_infos", None)
+  # Late bound fields are added to the class once their types are defined,
+  # so the number of fields is a part of the key.
+  cache_key = (value_cls, len(type_infos.descriptors) if type_infos else 0)
+  try:
+    return _CopyDescriptor(_type_descriptors_cache[cache_key])
+  except KeyError:
+    pass
+
   renderer = ApiValueRenderer.GetRendererForValueOrClass(value_cls)
+  result = renderer.BuildTypeDescriptor(value_cls)
+  _type_descriptors_cache[cache_key] = _CopyDescriptor(result)
 
-  return renderer.BuildTypeDescriptor(value_cls)
+  return result
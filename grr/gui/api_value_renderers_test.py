@@ -4,10 +4,19 @@
 
 
 from grr.gui import api_value_renderers
+# pylint: disable=unused-import
+# Defines ApiClientId used by ApiHuntResult.
+from grr.gui.api_plugins import client as client_plugin
+# pylint: enable=unused-import
+from grr.gui.api_plugins import hunt as hunt_plugin
+from grr.gui.api_plugins import reflection as reflection_plugin
 
 from grr.lib import flags
+from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import tests_pb2
 
@@ -98,6 +107,41 @@ class ApiRDFProtoStructRendererTest(test_lib.GRRBaseTest):
     })
 
 
+class ApiValueRendererTest(test_lib.GRRBaseTest):
+  """Test for ApiValueRenderer."""
+
+  def testRendererInstancesAreReusedPerClassAndLimit(self):
+    sample = ApiRDFProtoStructRendererSample(index=0)
+
+    renderer = api_value_renderers.ApiValueRenderer.GetRendererForValueOrClass(
+        sample)
+    self.assertIsInstance(renderer,
+                          api_value_renderers.ApiRDFProtoStructRenderer)
+    self.assertIs(
+        api_value_renderers.ApiValueRenderer.GetRendererForValueOrClass(
+            ApiRDFProtoStructRendererSample), renderer)
+
+    limited = api_value_renderers.ApiValueRenderer.GetRendererForValueOrClass(
+        sample, limit_lists=1)
+    self.assertIsNot(limited, renderer)
+    self.assertEqual(limited.limit_lists, 1)
+
+  def testTypeDescriptorsAreBuiltOncePerClass(self):
+    descriptor = api_value_renderers.BuildTypeDescriptor(
+        ApiRDFProtoStructRendererSample)
+    self.assertEqual(descriptor.name, "ApiRDFProtoStructRendererSample")
+    self.assertEqual([f.name for f in descriptor.fields], ["index", "values"])
+
+    # Callers get their own copy, so changing it doesn't affect the cache.
+    descriptor.fields[0].name = "changed"
+    descriptor.name = "changed"
+    cached = api_value_renderers.BuildTypeDescriptor(
+        ApiRDFProtoStructRendererSample)
+    self.assertIsNot(cached, descriptor)
+    self.assertEqual(cached.name, "ApiRDFProtoStructRendererSample")
+    self.assertEqual([f.name for f in cached.fields], ["index", "values"])
+
+
 class ApiGrrMessageRendererTest(test_lib.GRRBaseTest):
   """Test for ApiGrrMessageRenderer."""
 
@@ -154,6 +198,63 @@ class ApiGrrMessageRendererTest(test_lib.GRRBaseTest):
     self.assertEqual(data, model_data)
 
 
+class ApiValueRenderersBenchmark(test_lib.AverageMicroBenchmarks):
+  """Measures rendering of large API results."""
+
+  REPEATS = 3
+  NUM_RESULTS = 2000
+
+  def _ClearCaches(self):
+    api_value_renderers.ApiValueRenderer._renderers_cache.clear()
+    api_value_renderers.ApiRDFProtoStructRenderer._field_names_cache.clear()
+    # pylint: disable=protected-access
+    api_value_renderers._type_descriptors_cache.clear()
+    # pylint: enable=protected-access
+
+  def _BuildHuntResultsPage(self):
+    result = hunt_plugin.ApiListHuntResultsResult(total_count=self.NUM_RESULTS)
+    for i in xrange(self.NUM_RESULTS):
+      payload = rdf_client.StatEntry(
+          pathspec=rdf_paths.PathSpec(
+              path="/tmp/file%d" % i, pathtype=rdf_paths.PathSpec.PathType.OS),
+          st_mode=33184,
+          st_size=i,
+          st_mtime=1336129892)
+      result.items.Append(
+          client_id="C.%016X" % i,
+          payload_type="StatEntry",
+          payload=payload,
+          timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(i))
+
+    return result
+
+  @test_lib.SetLabel("benchmark")
+  def testRenderHuntResultsPage(self):
+    """Renders a page of 2k hunt results."""
+    page = self._BuildHuntResultsPage()
+
+    def RenderPage(clear_caches):
+      if clear_caches:
+        self._ClearCaches()
+      api_value_renderers.RenderValue(page)
+
+    self.TimeIt(RenderPage, name="Cold", clear_caches=True)
+    self.TimeIt(RenderPage, name="Cached", clear_caches=False)
+
+  @test_lib.SetLabel("benchmark")
+  def testListRDFValueDescriptors(self):
+    """Lists descriptors of all the RDFValue classes."""
+    handler = reflection_plugin.ApiListRDFValuesDescriptorsHandler()
+
+    def BuildDescriptors(clear_caches):
+      if clear_caches:
+        self._ClearCaches()
+      handler.Handle(None, token=self.token)
+
+    self.TimeIt(BuildDescriptors, name="Cold", clear_caches=True)
+    self.TimeIt(BuildDescriptors, name="Cached", clear_caches=False)
+
+
 def main(argv):
   test_lib.main(argv)
 
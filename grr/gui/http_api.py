@@ -5,6 +5,7 @@
 
 import itertools
 import json
+import os
 import time
 import traceback
 import urllib2
@@ -288,6 +289,76 @@ class HttpRequestHandler(object):
     else:
       raise ValueError("Invalid format_mode: %s", format_mode)
 
+  @staticmethod
+  def _HasItemsToStream(result, format_mode=None):
+    """Checks if result's repeated "items" field should be streamed."""
+    if result is None or format_mode == JsonMode.PROTO3_JSON_MODE:
+      return False
+
+    items_field = result.type_infos.get("items")
+    return (isinstance(items_field, rdf_structs.ProtoList) and
+            result.HasField("items"))
+
+  def _FormatResultAsJsonChunks(self, result, format_mode=None):
+    """Formats a list result as JSON, rendering its items one by one.
+
+    List results (e.g. hunt results) may contain many thousands of items.
+    Instead of rendering the whole result into a dict and encoding it with
+    a single json.dumps() call, everything but the items is rendered up front
+    and the items are rendered and encoded lazily, one at a time, as the
+    response is being sent.
+
+    The first item is rendered before this method returns, so that rendering
+    errors (which usually affect all the items alike) are raised while the
+    request is being handled and not after the response status has been sent.
+
+    Args:
+      result: Handler's result. Has to have a repeated "items" field.
+      format_mode: JsonMode to use.
+
+    Returns:
+      An iterator of JSON-encoded chunks.
+    """
+    # Render everything except the items with a placeholder where the items
+    # list should go.
+    header = result.__class__()
+    for field, value in result.ListSetFields():
+      if field.name != "items":
+        header.Set(field.name, value)
+
+    placeholder = "placeholder-%s" % os.urandom(16).encode("hex")
+    rendered_data = self._FormatResultAsJson(header, format_mode=format_mode)
+    if format_mode == JsonMode.GRR_JSON_MODE:
+      rendered_data["value"]["items"] = placeholder
+    else:
+      rendered_data["items"] = placeholder
+
+    str_data = json.dumps(
+        rendered_data, cls=JSONEncoderWithRDFPrimitivesSupport)
+    prefix, suffix = str_data.split(json.dumps(placeholder), 1)
+
+    items = iter(result.items)
+    first_chunks = [prefix + "["]
+    for item in itertools.islice(items, 1):
+      first_chunks.append(self._FormatListItemAsJson(item, format_mode))
+
+    return itertools.chain(first_chunks,
+                           self._GenerateJsonChunks(items, suffix, format_mode))
+
+  def _FormatListItemAsJson(self, item, format_mode):
+    rendered_item = api_value_renderers.RenderValue(item)
+    if format_mode == JsonMode.GRR_TYPE_STRIPPED_JSON_MODE:
+      rendered_item = api_value_renderers.StripTypeInfo(rendered_item)
+
+    return json.dumps(rendered_item, cls=JSONEncoderWithRDFPrimitivesSupport)
+
+  def _GenerateJsonChunks(self, items, suffix, format_mode):
+    """Yields the remaining JSON-encoded items and the suffix."""
+    for item in items:
+      yield "," + self._FormatListItemAsJson(item, format_mode)
+
+    yield "]" + suffix
+
   @staticmethod
   def CallApiHandler(handler, args, token=None):
     """Handles API call to a given handler with given args and token."""
@@ -307,6 +378,18 @@ class HttpRequestHandler(object):
   def __init__(self, router_matcher=None):
     self._router_matcher = router_matcher or RouterMatcher()
 
+  @staticmethod
+  def _EscapeJsonChunks(json_chunks):
+    """Prepends the XSSI protection prefix and escapes tags in JSON chunks."""
+    # To avoid IE content sniffing problems, escape the tags. Otherwise somebody
+    # may send a link with malicious payload that will be opened in IE (which
+    # does content sniffing and doesn't respect Content-Disposition header) and
+    # IE will treat the document as html and executre arbitrary JS that was
+    # passed with the payload.
+    yield ")]}'\n"
+    for chunk in json_chunks:
+      yield chunk.replace("<", r"\u003c").replace(">", r"\u003e")
+
   def _BuildResponse(self,
                      status,
                      rendered_data,
@@ -314,22 +397,35 @@ class HttpRequestHandler(object):
                      headers=None,
                      content_length=None,
                      token=None,
-                     no_audit_log=False):
-    """Builds HTTPResponse object from rendered data and HTTP status."""
+                     no_audit_log=False,
+                     json_chunks=None):
+    """Builds HTTPResponse object from rendered data and HTTP status.
+
+    Args:
+      status: HTTP status code.
+      rendered_data: Data to be JSON-encoded into the response body.
+      method_name: Name of the API method that produced the response.
+      headers: Additional headers to set.
+      content_length: Content length to report, if not the body's length.
+      token: ACL token of the request.
+      no_audit_log: If True, the X-No-Log header is set.
+      json_chunks: If set, an iterator of already JSON-encoded chunks that
+          is streamed instead of rendered_data.
+
+    Returns:
+      werkzeug Response object.
+    """
 
-    # To avoid IE content sniffing problems, escape the tags. Otherwise somebody
-    # may send a link with malicious payload that will be opened in IE (which
-    # does content sniffing and doesn't respect Content-Disposition header) and
-    # IE will treat the document as html and executre arbitrary JS that was
-    # passed with the payload.
-    str_data = json.dumps(
-        rendered_data, cls=JSONEncoderWithRDFPrimitivesSupport)
     # XSSI protection and tags escaping
-    rendered_data = ")]}'\n" + str_data.replace("<", r"\u003c").replace(
-        ">", r"\u003e")
+    if json_chunks is None:
+      str_data = json.dumps(
+          rendered_data, cls=JSONEncoderWithRDFPrimitivesSupport)
+      body = "".join(self._EscapeJsonChunks([str_data]))
+    else:
+      body = self._EscapeJsonChunks(json_chunks)
 
     response = werkzeug_wrappers.Response(
-        rendered_data,
+        body,
         status=status,
         content_type="application/json; charset=utf-8")
     response.headers[
@@ -474,12 +570,19 @@ class HttpRequestHandler(object):
       else:
         format_mode = GetRequestFormatMode(request, method_metadata)
         result = self.CallApiHandler(handler, args, token=token)
-        rendered_data = self._FormatResultAsJson(
-            result, format_mode=format_mode)
+        if self._HasItemsToStream(result, format_mode=format_mode):
+          rendered_data = None
+          json_chunks = self._FormatResultAsJsonChunks(
+              result, format_mode=format_mode)
+        else:
+          rendered_data = self._FormatResultAsJson(
+              result, format_mode=format_mode)
+          json_chunks = None
 
         return self._BuildResponse(
             200,
             rendered_data,
+            json_chunks=json_chunks,
             method_name=method_metadata.name,
             no_audit_log=method_metadata.no_audit_log_required,
             token=token)
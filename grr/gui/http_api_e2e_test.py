@@ -11,6 +11,7 @@ import hashlib
 import json
 import os
 import StringIO
+import time
 import zipfile
 
 import portpicker
@@ -19,6 +20,7 @@ import requests
 import logging
 
 from grr_api_client import api as grr_api
+from grr_api_client import errors as grr_api_errors
 from grr.gui import api_auth_manager
 from grr.gui import webauth
 from grr.gui import wsgiapp
@@ -29,6 +31,7 @@ from grr.lib import flags
 from grr.lib import flow
 from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.flows.general import file_finder
 from grr.lib.flows.general import processes
@@ -290,6 +293,84 @@ class ApiClientLibLabelsTest(ApiE2ETest):
         ])
 
 
+class ApiClientLibBatchTest(ApiE2ETest):
+  """Tests concurrent requests in GRR Python API client library."""
+
+  def _CountPageRequests(self, api, query):
+    connector = api._context.connector  # pylint: disable=protected-access
+    send_request = connector.SendRequest
+    requests_sent = []
+
+    def CountingSendRequest(handler_name, args):
+      requests_sent.append(args.offset)
+      return send_request(handler_name, args)
+
+    with utils.Stubber(connector, "SendRequest", CountingSendRequest):
+      results = list(api.SearchClients(query=query))
+
+    return results, requests_sent
+
+  def testBatchReturnsResultsInOrder(self):
+    client_urns = self.SetupClients(5)
+    client_ids = [urn.Basename() for urn in client_urns]
+
+    clients = list(
+        self.api.Batch(
+            self.api.Client(client_id=client_id).Get
+            for client_id in client_ids))
+
+    self.assertEqual([c.client_id for c in clients], client_ids)
+
+  def testBatchPreservesOrderWhenLaterCallsFinishFirst(self):
+    # Calls are started in order, so the later ones wait less.
+    calls = [(lambda i=i: time.sleep(0.05 * (5 - i)) or i) for i in range(5)]
+    self.assertEqual(list(self.api.Batch(calls, max_concurrency=5)), range(5))
+
+  def testBatchRaisesErrorsAtTheirPosition(self):
+    client_id = self.SetupClients(1)[0].Basename()
+
+    results = self.api.Batch([
+        self.api.Client(client_id=client_id).Get,
+        self.api.Hunt("H:123456").Get,
+    ])
+
+    self.assertEqual(results.next().client_id, client_id)
+    with self.assertRaises(grr_api_errors.ResourceNotFoundError):
+      results.next()
+
+  def testPaginatedResultsArePrefetched(self):
+    client_urns = sorted(self.SetupClients(7))
+
+    for max_concurrency in [1, 4]:
+      api = grr_api.InitHttp(
+          api_endpoint=self.endpoint,
+          page_size=2,
+          max_concurrency=max_concurrency)
+
+      clients = list(api.SearchClients(query="."))
+      self.assertEqual(
+          sorted(c.data.urn for c in clients), [str(u) for u in client_urns])
+
+  def testSmallResultsAreNotPrefetched(self):
+    self.SetupClients(1)
+    api = grr_api.InitHttp(
+        api_endpoint=self.endpoint, page_size=2, max_concurrency=4)
+
+    # A short first page is followed only by the request that finds the
+    # end of the results, just like without prefetching.
+    results, requests_sent = self._CountPageRequests(api, ".")
+    self.assertEqual(len(results), 1)
+    self.assertEqual(requests_sent, [0, 2])
+
+  def testDefaultConnectorFetchesPagesSequentially(self):
+    self.SetupClients(3)
+    api = grr_api.InitHttp(api_endpoint=self.endpoint, page_size=2)
+
+    results, requests_sent = self._CountPageRequests(api, ".")
+    self.assertEqual(len(results), 3)
+    self.assertEqual(requests_sent, [0, 2, 4])
+
+
 class CSRFProtectionTest(ApiE2ETest):
   """Tests GRR's CSRF protection logic for the HTTP API."""
 
@@ -10,6 +10,7 @@ import urllib2
 from grr.gui import api_auth_manager
 from grr.gui import api_call_handler_base
 from grr.gui import api_call_router
+from grr.gui import api_value_renderers
 from grr.gui import http_api
 
 from grr.lib import access_control
@@ -37,6 +38,27 @@ class SampleGetHandler(api_call_handler_base.ApiCallHandler):
     return SampleGetHandlerResult(method="GET", path=args.path, foo=args.foo)
 
 
+class SampleListHandlerArgs(rdf_structs.RDFProtoStruct):
+  protobuf = tests_pb2.SampleListHandlerArgs
+
+
+class SampleListHandlerResult(rdf_structs.RDFProtoStruct):
+  protobuf = tests_pb2.SampleListHandlerResult
+
+
+class SampleListHandler(api_call_handler_base.ApiCallHandler):
+
+  args_type = SampleListHandlerArgs
+  result_type = SampleListHandlerResult
+
+  def Handle(self, args, token=None):
+    items = [
+        SampleGetHandlerResult(method="GET", path="<%d>" % i)
+        for i in range(args.count)
+    ]
+    return SampleListHandlerResult(items=items, total_count=args.count)
+
+
 class SampleStreamingHandler(api_call_handler_base.ApiCallHandler):
 
   def _Generate(self):
@@ -98,6 +120,12 @@ class TestHttpApiRouter(api_call_router.ApiCallRouter):
   def SampleRaisingGet(self, args, token=None):
     raise access_control.UnauthorizedAccess("oh no", subject="aff4:/foo/bar")
 
+  @api_call_router.Http("GET", "/test_sample_list")
+  @api_call_router.ArgsType(SampleListHandlerArgs)
+  @api_call_router.ResultType(SampleListHandlerResult)
+  def SampleList(self, args, token=None):
+    return SampleListHandler()
+
   @api_call_router.Http("GET", "/test_sample/streaming")
   @api_call_router.ResultBinaryStream()
   def SampleStreamingGet(self, args, token=None):
@@ -283,6 +311,102 @@ class HttpRequestHandlerTest(test_lib.GRRBaseTest):
     self.assertEqual(list(response.iter_encoded()), ["foo", "bar", "blah"])
     self.assertEqual(response.headers["Content-Length"], "1337")
 
+  def testListItemsAreRenderedIncrementally(self):
+    response = self._RenderResponse(
+        self._CreateRequest(
+            "GET", "/test_sample_list", query_parameters={"count": "3"}))
+
+    # XSSI prefix, header, one chunk per item, and the closing bracket.
+    chunks = list(response.iter_encoded())
+    self.assertEqual(len(chunks), 6)
+
+    content = "".join(chunks)
+    # Tags have to be escaped in streamed items as well.
+    self.assertNotIn("<", content[5:])
+    self.assertEqual(
+        json.loads(content[5:]),
+        {"total_count": 3,
+         "items": [{"type": "SampleGetHandlerResult",
+                    "value": {
+                        "method": {"type": "unicode", "value": "GET",
+                                   "age": 0},
+                        "path": {"type": "unicode", "value": "<%d>" % i,
+                                 "age": 0}},
+                    "age": 0} for i in range(3)]})
+
+  def testEmptyListIsRendered(self):
+    response = self._RenderResponse(
+        self._CreateRequest(
+            "GET", "/test_sample_list", query_parameters={"count": "0"}))
+    self.assertEqual(
+        self._GetResponseContent(response), {"total_count": 0, "items": []})
+
+  def testListItemRenderingErrorResultsIn500(self):
+    render_value = api_value_renderers.RenderValue
+
+    def RaisingRenderValue(value, *args, **kwargs):
+      if isinstance(value, SampleGetHandlerResult) and value.path == "<0>":
+        raise RuntimeError("Can't render item.")
+      return render_value(value, *args, **kwargs)
+
+    with utils.Stubber(api_value_renderers, "RenderValue", RaisingRenderValue):
+      response = self._RenderResponse(
+          self._CreateRequest(
+              "GET", "/test_sample_list", query_parameters={"count": "3"}))
+
+    # The error surfaces before the status is sent, and the body is the
+    # complete JSON error payload instead of a truncated list.
+    self.assertEqual(response.status_code, 500)
+    content = self._GetResponseContent(response)
+    self.assertEqual(content["message"], "Can't render item.")
+
+  def testListItemsAreRenderedAsTheResponseIsSent(self):
+    render_value = api_value_renderers.RenderValue
+    rendered_paths = []
+
+    def RecordingRenderValue(value, *args, **kwargs):
+      if isinstance(value, SampleGetHandlerResult):
+        rendered_paths.append(value.path)
+      return render_value(value, *args, **kwargs)
+
+    with utils.Stubber(api_value_renderers, "RenderValue",
+                       RecordingRenderValue):
+      response = self._RenderResponse(
+          self._CreateRequest(
+              "GET", "/test_sample_list", query_parameters={"count": "3"}))
+      # Only the first item is rendered before the status is sent.
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(rendered_paths, ["<0>"])
+
+      chunks = response.iter_encoded()
+      # XSSI prefix, header and the first item.
+      for _ in range(3):
+        chunks.next()
+      self.assertEqual(rendered_paths, ["<0>"])
+
+      chunks.next()
+      self.assertEqual(rendered_paths, ["<0>", "<1>"])
+
+      list(chunks)
+      self.assertEqual(rendered_paths, ["<0>", "<1>", "<2>"])
+
+  def testStreamedListMatchesFullRenderingInAllModes(self):
+    result = SampleListHandler().Handle(SampleListHandlerArgs(count=5))
+    for mode in [
+        http_api.JsonMode.GRR_JSON_MODE,
+        http_api.JsonMode.GRR_ROOT_TYPES_STRIPPED_JSON_MODE,
+        http_api.JsonMode.GRR_TYPE_STRIPPED_JSON_MODE
+    ]:
+      streamed = "".join(
+          self.request_handler._FormatResultAsJsonChunks(
+              result, format_mode=mode))
+      expected = json.loads(
+          json.dumps(
+              self.request_handler._FormatResultAsJson(
+                  result, format_mode=mode),
+              cls=http_api.JSONEncoderWithRDFPrimitivesSupport))
+      self.assertEqual(json.loads(streamed), expected)
+
   def testBinaryStreamReturnsContentLengthViaHeadMethod(self):
     response = self._RenderResponse(
         self._CreateRequest("HEAD", "/test_sample/streaming"))
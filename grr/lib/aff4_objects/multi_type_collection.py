@@ -107,7 +107,8 @@ class MultiTypeCollection(aff4.AFF4Object):
                  type_name,
                  after_timestamp=None,
                  include_suffix=False,
-                 max_records=None):
+                 max_records=None,
+                 prefetch_pages=0):
     """Scans for stored records.
 
     Scans through the collection, returning stored values ordered by timestamp.
@@ -124,6 +125,9 @@ class MultiTypeCollection(aff4.AFF4Object):
       max_records: The maximum number of records to return. Defaults to
         unlimited.
 
+      prefetch_pages: If set, the number of pages of records read ahead in a
+        background thread, see SequentialCollection.Scan().
+
     Yields:
       Pairs (timestamp, rdf_value), indicating that rdf_value was stored at
       timestamp.
@@ -137,7 +141,8 @@ class MultiTypeCollection(aff4.AFF4Object):
     for item in sub_collection.Scan(
         after_timestamp=after_timestamp,
         include_suffix=include_suffix,
-        max_records=max_records):
+        max_records=max_records,
+        prefetch_pages=prefetch_pages):
       yield item
 
   def LengthByType(self, type_name):
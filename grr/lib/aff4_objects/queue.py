@@ -33,7 +33,7 @@ class Queue(aff4.AFF4Object):
     return urn.Add("Records").Add("%016x.%06x" % (timestamp, suffix))
 
   @classmethod
-  def StaticAdd(cls, queue_urn, token, rdf_value):
+  def StaticAdd(cls, queue_urn, token, rdf_value, mutation_pool=None):
     """Adds an rdf value the queue.
 
     Adds an rdf value to a queue. Does not require that the queue be locked, or
@@ -47,6 +47,9 @@ class Queue(aff4.AFF4Object):
 
       rdf_value: The rdf value to add to the queue.
 
+      mutation_pool: An optional MutationPool object to write to. If not given,
+        the data_store is used directly.
+
     Raises:
       ValueError: rdf_value has unexpected type.
 
@@ -61,11 +64,17 @@ class Queue(aff4.AFF4Object):
       queue_urn = rdfvalue.RDFURN(queue_urn)
 
     result_subject = cls._MakeURN(queue_urn, timestamp)
-    data_store.DB.Set(result_subject,
-                      cls.VALUE_ATTRIBUTE,
-                      rdf_value.SerializeToString(),
-                      timestamp=timestamp,
-                      token=token)
+    if mutation_pool:
+      mutation_pool.Set(result_subject,
+                        cls.VALUE_ATTRIBUTE,
+                        rdf_value.SerializeToString(),
+                        timestamp=timestamp)
+    else:
+      data_store.DB.Set(result_subject,
+                        cls.VALUE_ATTRIBUTE,
+                        rdf_value.SerializeToString(),
+                        timestamp=timestamp,
+                        token=token)
 
   def Add(self, rdf_value):
     """Adds an rdf value to the queue.
@@ -123,6 +132,22 @@ class Queue(aff4.AFF4Object):
     if not self.locked:
       raise aff4.LockError("Queue must be locked to claim records.")
 
+    results = self._ReadUnclaimedRecords(
+        limit=limit,
+        start_time=start_time,
+        record_filter=record_filter,
+        max_filtered=max_filtered)
+
+    expiration = rdfvalue.RDFDatetime.Now() + rdfvalue.Duration(timeout)
+
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for subject, _ in results:
+        mutation_pool.Set(subject, self.LOCK_ATTRIBUTE, expiration)
+    return results
+
+  def _ReadUnclaimedRecords(self, limit, start_time, record_filter,
+                            max_filtered):
+    """Reads up to limit unclaimed records, see ClaimRecords()."""
     now = rdfvalue.RDFDatetime.Now()
 
     after_urn = None
@@ -162,13 +187,29 @@ class Queue(aff4.AFF4Object):
       if len(results) >= limit:
         break
 
-    expiration = rdfvalue.RDFDatetime.Now() + rdfvalue.Duration(timeout)
-
-    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
-      for subject, _ in results:
-        mutation_pool.Set(subject, self.LOCK_ATTRIBUTE, expiration)
     return results
 
+  def PeekRecords(self, limit=1, start_time=None):
+    """Returns up to limit unclaimed records without claiming them.
+
+    The queue does not need to be locked, so the records may be claimed by
+    someone else at any time.
+
+    Args:
+      limit: The number of records to return.
+
+      start_time: If set, only records with a timestamp after this point are
+        returned.
+
+    Returns:
+      A list (id, record) of the oldest unclaimed records.
+    """
+    return self._ReadUnclaimedRecords(
+        limit=limit,
+        start_time=start_time,
+        record_filter=lambda x: False,
+        max_filtered=0)
+
   def RefreshClaims(self, ids, timeout="30m"):
     """Refreshes claims on records identified by ids.
 
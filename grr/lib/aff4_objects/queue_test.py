@@ -159,6 +159,26 @@ class QueueTest(test_lib.AFF4ObjectTest):
     self.assertEqual(50, len(results))
     self.assertEqual(50, results[0][1])
 
+  def testPeekReturnsUnclaimedRecordsWithoutClaimingThem(self):
+    queue_urn = "aff4:/queue_test/testPeekReturnsUnclaimedRecordsWithoutClaim"
+    with aff4.FACTORY.Create(queue_urn, TestQueue, token=self.token) as queue:
+      for i in range(100):
+        queue.Add(rdfvalue.RDFInteger(i))
+
+    with aff4.FACTORY.OpenWithLock(
+        queue_urn, lease_time=200, token=self.token) as queue:
+      queue.ClaimRecords(limit=10)
+
+    # Peeking does not need a lock and skips claimed records.
+    queue = aff4.FACTORY.Open(queue_urn, TestQueue, token=self.token)
+    results = queue.PeekRecords(limit=5)
+    self.assertEqual([10, 11, 12, 13, 14], [r for _, r in results])
+    self.assertEqual(queue.PeekRecords(limit=5), results)
+
+    with aff4.FACTORY.OpenWithLock(
+        queue_urn, lease_time=200, token=self.token) as queue:
+      self.assertEqual(90, len(queue.ClaimRecords()))
+
   def testClaimCleansSpuriousLocks(self):
     queue_urn = "aff4:/queue_test/testClaimCleansSpuriousLocks"
     with aff4.FACTORY.Create(queue_urn, TestQueue, token=self.token) as queue:
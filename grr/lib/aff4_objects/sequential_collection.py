@@ -2,13 +2,18 @@
 """A collection of records stored sequentially.
 """
 
+import bisect
 import collections
+import heapq
 import random
+import struct
 import threading
 import time
+import zlib
 
 from grr.lib import access_control
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import rdfvalue
 from grr.lib import registry
@@ -35,6 +40,9 @@ class SequentialCollection(aff4.AFF4Object):
   # The largest possible suffix - maximum value expressible by 6 hex digits.
   MAX_SUFFIX = 2**24 - 1
 
+  # The number of records in a page read ahead by a prefetching Scan().
+  PREFETCH_PAGE_SIZE = 1000
+
   @classmethod
   def _MakeURN(cls, urn, timestamp, suffix=None):
     if suffix is None:
@@ -158,7 +166,11 @@ class SequentialCollection(aff4.AFF4Object):
         suffix=suffix,
         **kwargs)
 
-  def Scan(self, after_timestamp=None, include_suffix=False, max_records=None):
+  def Scan(self,
+           after_timestamp=None,
+           include_suffix=False,
+           max_records=None,
+           prefetch_pages=0):
     """Scans for stored records.
 
     Scans through the collection, returning stored values ordered by timestamp.
@@ -174,11 +186,26 @@ class SequentialCollection(aff4.AFF4Object):
       max_records: The maximum number of records to return. Defaults to
         unlimited.
 
+      prefetch_pages: If set, records are read and decoded in a background
+        thread, which keeps up to this many pages of PREFETCH_PAGE_SIZE records
+        ahead of the caller.
+
     Yields:
       Pairs (timestamp, rdf_value), indicating that rdf_value was stored at
       timestamp.
 
     """
+    if prefetch_pages:
+      for item in utils.Prefetch(
+          self.Scan(
+              after_timestamp=after_timestamp,
+              include_suffix=include_suffix,
+              max_records=max_records),
+          max_pages=prefetch_pages,
+          page_size=self.PREFETCH_PAGE_SIZE):
+        yield item
+      return
+
     after_urn = None
     if after_timestamp is not None:
       if isinstance(after_timestamp, tuple):
@@ -230,23 +257,31 @@ class SequentialCollection(aff4.AFF4Object):
 
 
 class BackgroundIndexUpdater(object):
-  """Updates IndexedSequentialCollection objects in the background."""
+  """Updates IndexedSequentialCollection objects in the background.
+
+  UpdateLoop() may be run by several threads at once, each updating a different
+  collection. A collection is queued at most once until an update starts.
+  """
   INDEX_DELAY = 240
 
   exit_now = False
 
   def __init__(self):
     self.to_process = collections.deque()
+    self.queued_urns = set()
     self.cv = threading.Condition()
 
   def ExitNow(self):
     with self.cv:
       self.exit_now = True
       self.to_process.append(None)
-      self.cv.notify()
+      self.cv.notify_all()
 
   def AddIndexToUpdate(self, index_urn):
     with self.cv:
+      if index_urn in self.queued_urns:
+        return
+      self.queued_urns.add(index_urn)
       self.to_process.append((index_urn, time.time() + self.INDEX_DELAY))
       self.cv.notify()
 
@@ -265,7 +300,10 @@ class BackgroundIndexUpdater(object):
           self.cv.wait()
         next_update = self.to_process.popleft()
         if next_update is None:
+          # Leave the marker for the other threads running this loop.
+          self.to_process.appendleft(None)
           return
+        self.queued_urns.discard(next_update[0])
 
       now = time.time()
       next_urn = next_update[0]
@@ -283,12 +321,41 @@ BACKGROUND_INDEX_UPDATER = BackgroundIndexUpdater()
 class UpdaterStartHook(registry.InitHook):
 
   def RunOnce(self):
-    t = threading.Thread(
-        None,
-        BACKGROUND_INDEX_UPDATER.UpdateLoop,
-        name="SequentialCollectionIndexUpdater")
-    t.daemon = True
-    t.start()
+    for i in range(config_lib.CONFIG["AFF4.collection_index_updater_threads"]):
+      t = threading.Thread(
+          None,
+          BACKGROUND_INDEX_UPDATER.UpdateLoop,
+          name="SequentialCollectionIndexUpdater%d" % i)
+      t.daemon = True
+      t.start()
+
+
+_INDEX_CACHE = None
+_INDEX_CACHE_CONFIG = None
+_INDEX_CACHE_LOCK = threading.Lock()
+
+
+def GetIndexCache():
+  """Returns the process-wide cache of IndexedSequentialCollection indexes.
+
+  Cached indexes map collection URNs to the (index, record_numbers) pairs used
+  by IndexedSequentialCollection. Index entries never change once written, so
+  a cached index may only lack entries written by other processes since. A
+  collection deleted, or deleted and recreated, by another process is not
+  noticed until the cached index expires, so the cache is disabled unless
+  AFF4.collection_index_cache_age is set.
+  """
+  global _INDEX_CACHE, _INDEX_CACHE_CONFIG
+
+  cache_config = (config_lib.CONFIG["AFF4.collection_index_cache_max_size"],
+                  config_lib.CONFIG["AFF4.collection_index_cache_age"])
+  with _INDEX_CACHE_LOCK:
+    if _INDEX_CACHE is None or _INDEX_CACHE_CONFIG != cache_config:
+      max_size, max_age = cache_config
+      _INDEX_CACHE = utils.AgeBasedCache(max_size=max_size, max_age=max_age)
+      _INDEX_CACHE_CONFIG = cache_config
+
+    return _INDEX_CACHE
 
 
 class IndexedSequentialCollection(SequentialCollection):
@@ -299,6 +366,11 @@ class IndexedSequentialCollection(SequentialCollection):
 
   IMPLEMENTATION NOTE: The index is created lazily, and for records older than
     INDEX_WRITE_DELAY.
+
+  Reads which scan the collection write an index entry every INDEX_SPACING
+  records. Reads starting at a random record number additionally write entries
+  every MIN_INDEX_SPACING records over the last INDEX_SPACING records skipped,
+  so the index gets denser where the collection is accessed at random.
   """
 
   # How many records between index entries. Subclasses may change this.  The
@@ -308,6 +380,10 @@ class IndexedSequentialCollection(SequentialCollection):
 
   INDEX_SPACING = 1024
 
+  # How many records between index entries written by random access reads.
+
+  MIN_INDEX_SPACING = 64
+
   # An attribute name of the form "index:sc_<i>" at timestamp <t> indicates that
   # the item with record number i was stored at timestamp t. The timestamp
   # suffix is stored as the value.
@@ -322,21 +398,37 @@ class IndexedSequentialCollection(SequentialCollection):
   def __init__(self, urn, **kwargs):
     super(IndexedSequentialCollection, self).__init__(urn, **kwargs)
     self._index = None
+    # The sorted record numbers in the index.
+    self._indexed = None
+
+  @property
+  def _max_indexed(self):
+    return self._indexed[-1]
 
   def _ReadIndex(self):
     if self._index:
       return
+
+    cache = GetIndexCache()
+    try:
+      self._index, self._indexed = cache.Get(self.urn)
+      return
+    except KeyError:
+      pass
+
     self._index = {0: (0, 0)}
-    self._max_indexed = 0
     for (attr, value, ts) in data_store.DB.ResolvePrefix(
         self.urn, self.INDEX_ATTRIBUTE_PREFIX, token=self.token):
       i = int(attr[len(self.INDEX_ATTRIBUTE_PREFIX):], 16)
       self._index[i] = (ts, int(value, 16))
-      self._max_indexed = max(i, self._max_indexed)
+    self._indexed = sorted(self._index)
 
-  def _MaybeWriteIndex(self, i, ts, mutation_pool):
+    if cache.max_age > 0:
+      cache.Put(self.urn, (self._index, self._indexed))
+
+  def _MaybeWriteIndex(self, i, ts, mutation_pool, spacing=None):
     """Write index marker i."""
-    if i > self._max_indexed and i % self.INDEX_SPACING == 0:
+    if i % (spacing or self.INDEX_SPACING) == 0 and i not in self._index:
       # We only write the index if the timestamp is more than 5 minutes in the
       # past: hacky defense against a late write changing the count.
       if ts[0] < (rdfvalue.RDFDatetime.Now() - self.INDEX_WRITE_DELAY
@@ -350,47 +442,57 @@ class IndexedSequentialCollection(SequentialCollection):
                             "%06x" % ts[1],
                             timestamp=ts[0],
                             replace=True)
-          self._index[i] = ts
-          self._max_indexed = max(i, self._max_indexed)
         except access_control.UnauthorizedAccess:
           pass
 
-  def _IndexedScan(self, i, max_records=None):
+        # The index is shared through the cache, the entry must be in the dict
+        # before its record number can be found.
+        self._index[i] = ts
+        bisect.insort(self._indexed, i)
+
+  def _IndexedScan(self, i, max_records=None, prefetch_pages=0):
     """Scan records starting with index i."""
     self._ReadIndex()
 
     # The record number that we will read next.
-    idx = 0
+    idx = self._indexed[bisect.bisect_right(self._indexed, i) - 1]
     # The timestamp that we will start reading from.
-    start_ts = 0
-    if i >= self._max_indexed:
-      start_ts = max((0, 0), (self._index[self._max_indexed][0],
-                              self._index[self._max_indexed][1] - 1))
-      idx = self._max_indexed
-    else:
-      try:
-        possible_idx = i - i % self.INDEX_SPACING
-        start_ts = (max(0, self._index[possible_idx][0]),
-                    self._index[possible_idx][1] - 1)
-        idx = possible_idx
-      except KeyError:
-        pass
+    start_ts = max((0, 0), (self._index[idx][0], self._index[idx][1] - 1))
 
     if max_records is not None:
       max_records += i - idx
 
+    # Skipped records from here on are indexed densely.
+    dense_from = i - self.INDEX_SPACING
+
     with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
       for (ts, value) in self.Scan(
           after_timestamp=start_ts,
           max_records=max_records,
-          include_suffix=True):
-        self._MaybeWriteIndex(idx, ts, mutation_pool)
+          include_suffix=True,
+          prefetch_pages=prefetch_pages):
+        if dense_from < idx < i:
+          self._MaybeWriteIndex(
+              idx, ts, mutation_pool, spacing=self.MIN_INDEX_SPACING)
+        else:
+          self._MaybeWriteIndex(idx, ts, mutation_pool)
         if idx >= i:
           yield (idx, ts, value)
         idx += 1
 
-  def GenerateItems(self, offset=0):
-    for (_, _, value) in self._IndexedScan(offset):
+  def GenerateItems(self, offset=0, prefetch_pages=0):
+    """Yields the records starting with record number offset.
+
+    Args:
+      offset: The number of the first record to return.
+      prefetch_pages: If set, the number of pages of records read ahead in a
+        background thread, see SequentialCollection.Scan().
+
+    Yields:
+      The records.
+    """
+    for (_, _, value) in self._IndexedScan(
+        offset, prefetch_pages=prefetch_pages):
       yield value
 
   def __getitem__(self, index):
@@ -433,6 +535,11 @@ class IndexedSequentialCollection(SequentialCollection):
       BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(collection_urn)
     return r
 
+  def OnDelete(self, deletion_pool=None):
+    GetIndexCache().ExpireObject(self.urn)
+    super(IndexedSequentialCollection, self).OnDelete(
+        deletion_pool=deletion_pool)
+
 
 class GeneralIndexedCollection(IndexedSequentialCollection):
   """An indexed sequential collection of RDFValues with different types."""
@@ -462,3 +569,464 @@ class GrrMessageCollection(IndexedSequentialCollection):
   def AddAsMessage(self, rdfvalue_in, source):
     """Helper method to add rdfvalues as GrrMessages for testing."""
     self.Add(rdf_flows.GrrMessage(payload=rdfvalue_in, source=source))
+
+
+class PackedSequentialCollection(SequentialCollection):
+  """A sequential collection which packs its records into compressed blocks.
+
+  New records are written to a buffer, one row per record, exactly like in a
+  SequentialCollection. Once they are older than SEAL_DELAY, buffered records
+  are sealed into blocks of BLOCK_SIZE records: a block is a single compressed
+  row which starts with the keys and offsets of its records. This saves the per
+  row overhead of the data store, and deleting the collection only deletes a
+  row per block.
+
+  Scan() merges the blocks and the buffer, so it returns the records ordered by
+  timestamp like a SequentialCollection does. Records are numbered in the order
+  they are sealed, followed by the buffered records. A record written with a
+  timestamp older than the newest sealed record stays in the buffer, so it is
+  numbered after the sealed ones. Records sealed while the collection is read
+  are returned once, in the position they had in the buffer.
+  """
+
+  # The number of records in a sealed block.
+  BLOCK_SIZE = 1024
+
+  # Only records older than this are sealed: defense against late writes
+  # changing the order of the records.
+  SEAL_DELAY = rdfvalue.Duration("3m")
+
+  # The number of buffered records read at once by Scan() and GenerateItems().
+  BUFFER_PAGE_SIZE = 1000
+
+  # The attribute where the blocks are stored.
+  BLOCK_ATTRIBUTE = "aff4:sequential_block"
+
+  # An attribute "index:sb_<i>" of the collection indicates that record number
+  # i is the first record of a block. The value is "<timestamp>.<suffix> <n>"
+  # where n is the number of records in the block.
+  BLOCK_INDEX_ATTRIBUTE_PREFIX = "index:sb_"
+
+  # Block header: the number of records, followed by a (timestamp, suffix, end
+  # offset) entry per record.
+  _BLOCK_HEADER = struct.Struct("<I")
+  _BLOCK_ENTRY = struct.Struct("<QII")
+
+  def __init__(self, urn, **kwargs):
+    super(PackedSequentialCollection, self).__init__(urn, **kwargs)
+    self._blocks = None
+
+  @classmethod
+  def _PackBlock(cls, records):
+    """Packs a list of ((timestamp, suffix), serialized value) records."""
+    header = [cls._BLOCK_HEADER.pack(len(records))]
+    offset = 0
+    for (timestamp, suffix), value in records:
+      offset += len(value)
+      header.append(cls._BLOCK_ENTRY.pack(timestamp, suffix, offset))
+    return zlib.compress("".join(header + [value for _, value in records]))
+
+  @classmethod
+  def _UnpackBlock(cls, data):
+    """Returns the list of ((timestamp, suffix), serialized value) records."""
+    data = zlib.decompress(data)
+    count, = cls._BLOCK_HEADER.unpack_from(data)
+    start = cls._BLOCK_HEADER.size + count * cls._BLOCK_ENTRY.size
+    records = []
+    offset = 0
+    for i in xrange(count):
+      timestamp, suffix, end = cls._BLOCK_ENTRY.unpack_from(
+          data, cls._BLOCK_HEADER.size + i * cls._BLOCK_ENTRY.size)
+      records.append(((timestamp, suffix), data[start + offset:start + end]))
+      offset = end
+    return records
+
+  def _BlockURN(self, key):
+    return self.urn.Add("Blocks").Add("%016x.%06x" % key)
+
+  def _ReadBlockIndex(self):
+    """Reads the (first record number, first key, record count) of blocks."""
+    self._blocks = []
+    for attribute, value, _ in data_store.DB.ResolvePrefix(
+        self.urn, self.BLOCK_INDEX_ATTRIBUTE_PREFIX, token=self.token):
+      key, count = self._ParseBlockIndexValue(value)
+      self._blocks.append(
+          (int(attribute[len(self.BLOCK_INDEX_ATTRIBUTE_PREFIX):], 16), key,
+           count))
+    self._blocks.sort()
+
+  @classmethod
+  def _ParseBlockIndexValue(cls, value):
+    key, count = value.split(" ")
+    timestamp, suffix = key.split(".")
+    return (int(timestamp, 16), int(suffix, 16)), int(count, 16)
+
+  def _ReadNewBlocks(self):
+    """Reads the blocks sealed since the block index was read.
+
+    Blocks are numbered by their first record, so the next block, if there is
+    one, is numbered with the count of the records sealed so far.
+
+    Returns:
+      The list of ((timestamp, suffix), serialized value) records of the new
+      blocks, which are added to the block index.
+    """
+    records = []
+    while True:
+      sealed_count = self._SealedCount()
+      value, _ = data_store.DB.Resolve(
+          self.urn,
+          self.BLOCK_INDEX_ATTRIBUTE_PREFIX + "%08x" % sealed_count,
+          token=self.token)
+      if value is None:
+        return records
+
+      key, count = self._ParseBlockIndexValue(value)
+      self._blocks.append((sealed_count, key, count))
+      records.extend(self._ReadBlock(key))
+
+  def _SealedCount(self):
+    if not self._blocks:
+      return 0
+    first_record, _, count = self._blocks[-1]
+    return first_record + count
+
+  def _ReadBlock(self, first_key):
+    value, _ = data_store.DB.Resolve(
+        self._BlockURN(first_key), self.BLOCK_ATTRIBUTE, token=self.token)
+    return self._UnpackBlock(value)
+
+  def _LastBlockKeys(self):
+    """Returns the keys of the records in the last indexed block."""
+    if not self._blocks:
+      return set()
+    return set(key for key, _ in self._ReadBlock(self._blocks[-1][1]))
+
+  @classmethod
+  def _PrecedingKey(cls, key):
+    timestamp, suffix = key
+    if suffix:
+      return (timestamp, suffix - 1)
+    return (timestamp - 1, cls.MAX_SUFFIX)
+
+  def _ScanBlocks(self, first_block, end_block):
+    """Yields the records of the indexed blocks first_block to end_block."""
+    if first_block >= end_block:
+      return
+
+    after_urn = utils.SmartStr(
+        self._BlockURN(self._PrecedingKey(self._blocks[first_block][1])))
+    for _, _, value in data_store.DB.ScanAttribute(
+        self.urn.Add("Blocks"),
+        self.BLOCK_ATTRIBUTE,
+        after_urn=after_urn,
+        max_records=end_block - first_block,
+        token=self.token):
+      for record in self._UnpackBlock(value):
+        yield record
+
+  def _ScanBuffer(self, after_key=None, skip_keys=()):
+    """Yields the buffered records ordered by key.
+
+    Records may be sealed, and deleted from the buffer, while it is read. A
+    block is indexed before its records are deleted, so the block index is
+    checked after every page of the buffer is read. The records of new blocks
+    which come after the pages read before are merged with the buffer.
+
+    Args:
+      after_key: If set, only records with larger keys are returned.
+      skip_keys: Keys of sealed records which are skipped if they are still
+        in the buffer.
+
+    Yields:
+      ((timestamp, suffix), serialized value) records.
+    """
+    skip_keys = set(skip_keys)
+    sealed = collections.deque()
+    while True:
+      after_urn = None
+      if after_key is not None:
+        after_urn = utils.SmartStr(self._MakeURN(self.urn, *after_key))
+      page = [(self._ParseURN(subject), value)
+              for subject, _, value in data_store.DB.ScanAttribute(
+                  self.urn.Add("Results"),
+                  self.ATTRIBUTE,
+                  after_urn=after_urn,
+                  max_records=self.BUFFER_PAGE_SIZE,
+                  token=self.token)]
+
+      # Records deleted before the page was read are in blocks indexed by now,
+      # and those up to after_key were read from the buffer already.
+      for key, value in self._ReadNewBlocks():
+        skip_keys.add(key)
+        if after_key is None or key > after_key:
+          sealed.append((key, value))
+
+      last_page = len(page) < self.BUFFER_PAGE_SIZE
+      if not last_page:
+        after_key = page[-1][0]
+      buffered = [(key, value) for key, value in page if key not in skip_keys]
+      merged = []
+      while sealed and (last_page or sealed[0][0] <= after_key):
+        merged.append(sealed.popleft())
+      for record in heapq.merge(buffered, merged):
+        yield record
+
+      if last_page:
+        return
+
+  def _ParseRecord(self, record):
+    (timestamp, suffix), value = record
+    rdf_value = self.RDF_TYPE.FromSerializedString(value)
+    rdf_value.age = timestamp
+    return (timestamp, suffix), rdf_value
+
+  def Scan(self,
+           after_timestamp=None,
+           include_suffix=False,
+           max_records=None,
+           prefetch_pages=0):
+    """Scans for stored records, see SequentialCollection.Scan()."""
+    if prefetch_pages:
+      for item in utils.Prefetch(
+          self.Scan(
+              after_timestamp=after_timestamp,
+              include_suffix=include_suffix,
+              max_records=max_records),
+          max_pages=prefetch_pages,
+          page_size=self.PREFETCH_PAGE_SIZE):
+        yield item
+      return
+
+    self._ReadBlockIndex()
+
+    after_key = None
+    if after_timestamp is not None:
+      if isinstance(after_timestamp, tuple):
+        after_key = after_timestamp
+      else:
+        after_key = (after_timestamp, self.MAX_SUFFIX)
+
+    first_block = 0
+    if after_key is not None:
+      first_block = max(
+          0,
+          bisect.bisect_right([key for _, key, _ in self._blocks], after_key) -
+          1)
+
+    sealed = ((key, 0, value)
+              for key, value in self._ScanBlocks(first_block, len(self._blocks))
+              if after_key is None or key > after_key)
+    buffered = ((key, 1, value)
+                for key, value in self._ScanBuffer(after_key=after_key))
+
+    last_key = None
+    record_count = 0
+    for key, _, value in heapq.merge(sealed, buffered):
+      # A record being sealed may be read from both its block and the buffer.
+      if key == last_key:
+        continue
+      last_key = key
+
+      _, rdf_value = self._ParseRecord((key, value))
+      if include_suffix:
+        yield (key, rdf_value)
+      else:
+        yield (key[0], rdf_value)
+
+      record_count += 1
+      if max_records and record_count >= max_records:
+        return
+
+  def MultiResolve(self, timestamps):
+    """Lookup multiple values by (timestamp, suffix) pairs."""
+    self._ReadBlockIndex()
+    first_keys = [key for _, key, _ in self._blocks]
+
+    keys_by_block = {}
+    for key in timestamps:
+      key = tuple(key)
+      block = bisect.bisect_right(first_keys, key) - 1
+      keys_by_block.setdefault(block, set()).add(key)
+
+    buffered = keys_by_block.pop(-1, set())
+    if keys_by_block:
+      block_urns = [self._BlockURN(first_keys[b]) for b in keys_by_block]
+      for _, values in data_store.DB.MultiResolvePrefix(
+          block_urns, self.BLOCK_ATTRIBUTE, token=self.token):
+        for key, value in self._UnpackBlock(values[0][1]):
+          block = bisect.bisect_right(first_keys, key) - 1
+          if key in keys_by_block.get(block, ()):
+            keys_by_block[block].remove(key)
+            yield self._ParseRecord((key, value))[1]
+
+    for keys in keys_by_block.itervalues():
+      buffered.update(keys)
+    if buffered:
+      for rdf_value in super(PackedSequentialCollection,
+                             self).MultiResolve(sorted(buffered)):
+        yield rdf_value
+
+  def GenerateItems(self, offset=0, prefetch_pages=0):
+    """Yields the records starting with record number offset."""
+    if prefetch_pages:
+      for item in utils.Prefetch(
+          self.GenerateItems(offset=offset),
+          max_pages=prefetch_pages,
+          page_size=self.PREFETCH_PAGE_SIZE):
+        yield item
+      return
+
+    self._ReadBlockIndex()
+    sealed_count = self._SealedCount()
+
+    if offset < sealed_count:
+      first_block = bisect.bisect_right(
+          [first_record for first_record, _, _ in self._blocks], offset) - 1
+      record_number = self._blocks[first_block][0]
+      for record in self._ScanBlocks(first_block, len(self._blocks)):
+        if record_number >= offset:
+          yield self._ParseRecord(record)[1]
+        record_number += 1
+      offset = sealed_count
+
+    # The records of the last block may not be deleted from the buffer yet.
+    record_number = sealed_count
+    for record in self._ScanBuffer(skip_keys=self._LastBlockKeys()):
+      if record_number >= offset:
+        yield self._ParseRecord(record)[1]
+      record_number += 1
+
+  def __getitem__(self, index):
+    if index >= 0:
+      for value in self.GenerateItems(offset=index):
+        return value
+      raise IndexError("collection index out of range")
+    else:
+      raise RuntimeError("Index must be >= 0")
+
+  def __iter__(self):
+    return self.GenerateItems()
+
+  def CalculateLength(self):
+    self._ReadBlockIndex()
+    sealed_count = self._SealedCount()
+    buffered_count = 0
+    for _ in self._ScanBuffer(skip_keys=self._LastBlockKeys()):
+      buffered_count += 1
+    return sealed_count + buffered_count
+
+  def __len__(self):
+    return self.CalculateLength()
+
+  def SealBlocks(self, seal_partial_block=False):
+    """Packs the buffered records older than SEAL_DELAY into blocks.
+
+    The records of a block are deleted from the buffer after the block is
+    indexed. If a previous call was interrupted before that, the records of
+    the last block are deleted first.
+
+    Args:
+      seal_partial_block: If True, the buffered records which don't fill a
+        whole block are sealed too. Otherwise they stay in the buffer until
+        there are enough of them.
+
+    Returns:
+      The number of sealed records.
+    """
+    try:
+      lock = data_store.DB.LockRetryWrapper(
+          self.urn.Add("Blocks"), blocking=False, token=self.token)
+    except data_store.DBSubjectLockError:
+      # Another process is sealing this collection.
+      return 0
+
+    with lock:
+      self._ReadBlockIndex()
+      after_urn = None
+      last_block_keys = self._LastBlockKeys()
+      if last_block_keys:
+        after_urn = utils.SmartStr(
+            self._MakeURN(self.urn,
+                          *self._PrecedingKey(self._blocks[-1][1])))
+        last_key = max(last_block_keys)
+
+      cutoff = (rdfvalue.RDFDatetime.Now() - self.SEAL_DELAY
+               ).AsMicroSecondsFromEpoch()
+      sealed_subjects = []
+      records = []
+      for subject, timestamp, value in data_store.DB.ScanAttribute(
+          self.urn.Add("Results"),
+          self.ATTRIBUTE,
+          after_urn=after_urn,
+          token=self.token):
+        key = self._ParseURN(subject)
+        if key in last_block_keys:
+          sealed_subjects.append(subject)
+          continue
+        # Only records newer than all the sealed ones can be sealed.
+        if last_block_keys and key < last_key:
+          continue
+        if timestamp >= cutoff:
+          break
+        records.append((subject, key, value))
+
+      if sealed_subjects:
+        data_store.DB.DeleteSubjects(
+            sealed_subjects, sync=True, token=self.token)
+
+      if not seal_partial_block:
+        del records[len(records) - len(records) % self.BLOCK_SIZE:]
+
+      sealed_count = self._SealedCount()
+      for i in xrange(0, len(records), self.BLOCK_SIZE):
+        block = records[i:i + self.BLOCK_SIZE]
+        first_key = block[0][1]
+        # The block and its index entry are written before the buffered
+        # records are deleted, so the records can always be read.
+        with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+          mutation_pool.Set(
+              self._BlockURN(first_key),
+              self.BLOCK_ATTRIBUTE,
+              self._PackBlock([(key, value) for _, key, value in block]),
+              timestamp=first_key[0])
+          mutation_pool.Set(
+              self.urn,
+              self.BLOCK_INDEX_ATTRIBUTE_PREFIX + "%08x" % sealed_count,
+              "%016x.%06x %x" % (first_key + (len(block),)),
+              timestamp=first_key[0])
+        data_store.DB.DeleteSubjects(
+            [subject for subject, _, _ in block], sync=True, token=self.token)
+        sealed_count += len(block)
+
+      self._blocks = None
+      return len(records)
+
+  def UpdateIndex(self):
+    """Called by the BackgroundIndexUpdater."""
+    self.SealBlocks()
+
+  @classmethod
+  def StaticAdd(cls,
+                collection_urn,
+                token,
+                rdf_value,
+                timestamp=None,
+                suffix=None,
+                **kwargs):
+    r = super(PackedSequentialCollection, cls).StaticAdd(
+        collection_urn, token, rdf_value, timestamp, suffix, **kwargs)
+    if random.randint(0, cls.BLOCK_SIZE) == 0:
+      BACKGROUND_INDEX_UPDATER.AddIndexToUpdate(collection_urn)
+    return r
+
+  def OnDelete(self, deletion_pool=None):
+    pool = data_store.DB.GetMutationPool(self.token)
+    for subject, _, _ in data_store.DB.ScanAttribute(
+        self.urn.Add("Blocks"), self.BLOCK_ATTRIBUTE, token=self.token):
+      pool.DeleteSubject(subject)
+      if pool.Size() > 50000:
+        pool.Flush()
+    pool.Flush()
+    super(PackedSequentialCollection, self).OnDelete(
+        deletion_pool=deletion_pool)
@@ -1,15 +1,21 @@
 #!/usr/bin/env python
 """Tests for SequentialCollection and related subclasses."""
 
+import random
 import threading
+import time
 
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib import utils
 
 from grr.lib.aff4_objects import sequential_collection
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
 
 
 class TestSequentialCollection(sequential_collection.SequentialCollection):
@@ -201,6 +207,115 @@ class IndexedSequentialCollectionTest(test_lib.AFF4ObjectTest):
         for i in range(data_size - 1020, data_size - 1040, -1):
           self.assertEqual(collection[i], i)
 
+  def testRandomAccessIndexesDensely(self):
+    urn = "aff4:/sequential_collection/testRandomAccessIndexesDensely"
+    with aff4.FACTORY.Create(
+        urn, TestIndexedSequentialCollection, token=self.token) as collection:
+      for i in range(4 * 1024):
+        collection.Add(rdfvalue.RDFInteger(i))
+
+    with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() + rdfvalue.Duration(
+        "10m")):
+      collection = aff4.FACTORY.Open(urn, token=self.token)
+      self.assertEqual(collection[3000], 3000)
+      # Sparse entries up to the last INDEX_SPACING records skipped, dense ones
+      # after that.
+      self.assertEqual(
+          sorted(collection._index.keys()),
+          [0, 1024] + range(1984, 3000, 64))
+
+      self.assertEqual(collection.CalculateLength(), 4 * 1024)
+      self.assertEqual(sorted(collection._index.keys())[-2:], [2944, 3072])
+
+      # Lookups near the offset only read the records after the closest entry.
+      with test_lib.Instrument(sequential_collection.SequentialCollection,
+                               "Scan") as scan:
+        self.assertEqual(collection[3010], 3010)
+        self.assertEqual(scan.kwargs[0]["max_records"], 3010 - 2944 + 1)
+
+    # The entries were written to the data store.
+    sequential_collection.GetIndexCache().Flush()
+    collection = aff4.FACTORY.Open(urn, token=self.token)
+    _ = collection[0]
+    self.assertIn(2944, collection._index)
+
+  def testIndexIsCached(self):
+    urn = "aff4:/sequential_collection/testIndexIsCached"
+    with aff4.FACTORY.Create(
+        urn, TestIndexedSequentialCollection, token=self.token) as collection:
+      for i in range(2 * 1024):
+        collection.Add(rdfvalue.RDFInteger(i))
+
+    with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() + rdfvalue.Duration(
+        "10m")), test_lib.ConfigOverrider({
+            "AFF4.collection_index_cache_age": 600
+        }):
+      collection = aff4.FACTORY.Open(urn, token=self.token)
+      self.assertEqual(collection.CalculateLength(), 2 * 1024)
+
+      with test_lib.Instrument(data_store.DB, "ResolvePrefix") as resolve:
+        collection = aff4.FACTORY.Open(urn, token=self.token)
+        self.assertEqual(collection[1500], 1500)
+        self.assertNotIn(
+            TestIndexedSequentialCollection.INDEX_ATTRIBUTE_PREFIX,
+            [args[1] for args in resolve.args])
+        self.assertIn(1024, collection._index)
+
+      # Entries written through one collection object are seen by others.
+      other_collection = aff4.FACTORY.Open(urn, token=self.token)
+      other_collection._ReadIndex()
+      self.assertIn(1472, other_collection._index)
+
+    aff4.FACTORY.Delete(urn, token=self.token)
+    self.assertNotIn(collection.urn, sequential_collection.GetIndexCache())
+
+  def testIndexIsNotCachedByDefault(self):
+    urn = "aff4:/sequential_collection/testIndexIsNotCachedByDefault"
+    with aff4.FACTORY.Create(
+        urn, TestIndexedSequentialCollection, token=self.token) as collection:
+      collection.Add(rdfvalue.RDFInteger(0))
+
+    self.assertEqual(aff4.FACTORY.Open(urn, token=self.token)[0], 0)
+    self.assertEqual(len(sequential_collection.GetIndexCache()), 0)
+
+  def testUpdaterQueuesCollectionsOnce(self):
+    biu = sequential_collection.BackgroundIndexUpdater()
+    biu.AddIndexToUpdate("aff4:/sequential_collection/a")
+    biu.AddIndexToUpdate("aff4:/sequential_collection/b")
+    biu.AddIndexToUpdate("aff4:/sequential_collection/a")
+    self.assertEqual([urn for urn, _ in biu.to_process], [
+        "aff4:/sequential_collection/a", "aff4:/sequential_collection/b"
+    ])
+
+  def testUpdaterThreadsAllExit(self):
+    biu = sequential_collection.BackgroundIndexUpdater()
+    threads = [threading.Thread(None, biu.UpdateLoop) for _ in range(3)]
+    for t in threads:
+      t.daemon = True
+      t.start()
+
+    biu.ExitNow()
+    for t in threads:
+      t.join(timeout=10)
+      self.assertFalse(t.is_alive())
+
+  def testPrefetchingReads(self):
+    with aff4.FACTORY.Create(
+        "aff4:/sequential_collection/testPrefetchingReads",
+        TestIndexedSequentialCollection,
+        token=self.token) as collection:
+      for i in range(100):
+        collection.Add(rdfvalue.RDFInteger(i))
+
+      with utils.Stubber(collection, "PREFETCH_PAGE_SIZE", 8):
+        self.assertEqual(
+            list(collection.GenerateItems(prefetch_pages=2)), range(100))
+        self.assertEqual(
+            list(collection.GenerateItems(offset=42, prefetch_pages=2)),
+            range(42, 100))
+        self.assertEqual(
+            list(collection.Scan(prefetch_pages=2)), list(collection.Scan()))
+
   def testListing(self):
     test_urn = "aff4:/sequential_collection/testIndexedListing"
     with aff4.FACTORY.Create(
@@ -270,6 +385,313 @@ class GeneralIndexedCollectionTest(test_lib.AFF4ObjectTest):
       self.assertEqual(collection[1], "the meaning of life")
 
 
+class TestPackedSequentialCollection(
+    sequential_collection.PackedSequentialCollection):
+  RDF_TYPE = rdfvalue.RDFInteger
+
+  BLOCK_SIZE = 16
+
+
+class PackedSequentialCollectionTest(test_lib.AFF4ObjectTest):
+
+  def _AddRecords(self, collection, values, timestamp):
+    keys = []
+    for i, value in enumerate(values):
+      keys.append(
+          collection.Add(
+              rdfvalue.RDFInteger(value),
+              timestamp=timestamp + rdfvalue.Duration("%ds" % i)))
+    return keys
+
+  def testSealAndRead(self):
+    with aff4.FACTORY.Create(
+        "aff4:/sequential_collection/testSealAndRead",
+        TestPackedSequentialCollection,
+        token=self.token) as collection:
+      old_timestamp = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+      keys = self._AddRecords(collection, range(100), old_timestamp)
+      self._AddRecords(collection, range(100, 110), rdfvalue.RDFDatetime.Now())
+
+      # Only full blocks of records older than the delay are sealed.
+      self.assertEqual(collection.SealBlocks(), 96)
+      self.assertEqual(collection.SealBlocks(), 0)
+      self.assertEqual(collection.SealBlocks(seal_partial_block=True), 4)
+
+      self.assertEqual([v for _, v in collection.Scan()], range(110))
+      self.assertEqual(list(collection), range(110))
+      self.assertEqual(len(collection), 110)
+      for i in [0, 15, 16, 50, 99, 100, 109]:
+        self.assertEqual(collection[i], i)
+      self.assertRaises(IndexError, collection.__getitem__, 110)
+      self.assertEqual(
+          list(collection.GenerateItems(offset=95)), range(95, 110))
+
+      results = list(collection.Scan(after_timestamp=keys[40], max_records=5))
+      self.assertEqual([v for _, v in results], range(41, 46))
+      self.assertEqual(results[0][0], keys[41][0])
+      self.assertEqual(results[0][1].age, keys[41][0])
+      results = list(
+          collection.Scan(after_timestamp=keys[79][0], include_suffix=True))
+      self.assertEqual(results[0], (keys[80], 80))
+
+      self.assertEqual(
+          sorted(collection.MultiResolve(keys[10:90:10] + keys[96:])),
+          range(10, 90, 10) + range(96, 100))
+
+  def testLateWrite(self):
+    with aff4.FACTORY.Create(
+        "aff4:/sequential_collection/testLateWrite",
+        TestPackedSequentialCollection,
+        token=self.token) as collection:
+      old_timestamp = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+      self._AddRecords(collection, range(32), old_timestamp)
+      self.assertEqual(collection.SealBlocks(), 32)
+
+      # Written between the records 9 and 10.
+      collection.Add(
+          rdfvalue.RDFInteger(100),
+          timestamp=old_timestamp.AsMicroSecondsFromEpoch() + 9500000)
+      self.assertEqual(collection.SealBlocks(seal_partial_block=True), 0)
+
+      # Scanning returns the records in timestamp order, but the late record
+      # is numbered after the sealed ones.
+      self.assertEqual([v for _, v in collection.Scan()],
+                       range(10) + [100] + range(10, 32))
+      self.assertEqual(list(collection), range(32) + [100])
+      self.assertEqual(collection[32], 100)
+
+  def _BufferedCount(self, urn):
+    return len(
+        list(
+            data_store.DB.ScanAttribute(
+                rdfvalue.RDFURN(urn).Add("Results"),
+                TestPackedSequentialCollection.ATTRIBUTE,
+                token=self.token)))
+
+  def testSealWhileReading(self):
+    old_timestamp = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+    readers = {
+        "GenerateItems": lambda c: c.GenerateItems(),
+        "Scan": lambda c: (v for _, v in c.Scan())
+    }
+    for name, reader in readers.iteritems():
+      urn = "aff4:/sequential_collection/testSealWhileReading" + name
+      with aff4.FACTORY.Create(
+          urn, TestPackedSequentialCollection, token=self.token) as collection:
+        self._AddRecords(collection, range(16), old_timestamp)
+        self.assertEqual(collection.SealBlocks(), 16)
+        self._AddRecords(collection, range(16, 64),
+                         old_timestamp + rdfvalue.Duration("16s"))
+
+      with utils.Stubber(TestPackedSequentialCollection, "BUFFER_PAGE_SIZE",
+                         10):
+        collection = aff4.FACTORY.Open(urn, token=self.token)
+        items = reader(collection)
+        values = [next(items) for _ in range(20)]
+        # The rest of the buffer is sealed, and deleted, while it is read.
+        self.assertEqual(
+            aff4.FACTORY.Open(urn, token=self.token).SealBlocks(), 48)
+        self.assertEqual(self._BufferedCount(urn), 0)
+        values.extend(items)
+
+      self.assertEqual(values, range(64), name)
+
+  def testInterruptedSeal(self):
+    urn = "aff4:/sequential_collection/testInterruptedSeal"
+    with aff4.FACTORY.Create(
+        urn, TestPackedSequentialCollection, token=self.token) as collection:
+      old_timestamp = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+      self._AddRecords(collection, range(40), old_timestamp)
+
+      delete_subjects = data_store.DB.DeleteSubjects
+
+      def DeleteSubjects(subjects, **kwargs):
+        if subjects:
+          raise data_store.Error("Interrupted.")
+        delete_subjects(subjects, **kwargs)
+
+      # The first block is indexed, but its records stay in the buffer.
+      with utils.Stubber(data_store.DB, "DeleteSubjects", DeleteSubjects):
+        self.assertRaises(data_store.Error, collection.SealBlocks)
+      self.assertEqual(self._BufferedCount(urn), 40)
+
+      self.assertEqual(list(collection), range(40))
+      self.assertEqual([v for _, v in collection.Scan()], range(40))
+      self.assertEqual(len(collection), 40)
+
+      # Sealing again deletes them.
+      self.assertEqual(collection.SealBlocks(seal_partial_block=True), 24)
+      self.assertEqual(self._BufferedCount(urn), 0)
+      self.assertEqual(list(collection), range(40))
+      self.assertEqual(len(collection), 40)
+
+  def testDelete(self):
+    urn = "aff4:/sequential_collection/testPackedDelete"
+    with aff4.FACTORY.Create(
+        urn, TestPackedSequentialCollection, token=self.token) as collection:
+      old_timestamp = rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+      self._AddRecords(collection, range(40), old_timestamp)
+      collection.SealBlocks()
+
+    aff4.FACTORY.Delete(urn, token=self.token)
+
+    self.assertFalse([
+        subject for subject in data_store.DB.subjects
+        if subject.startswith(urn)
+    ])
+    with aff4.FACTORY.Create(
+        urn, TestPackedSequentialCollection, token=self.token) as collection:
+      self.assertEqual(len(collection), 0)
+      self.assertEqual(list(collection.Scan()), [])
+
+
+class GrrMessageCollection(sequential_collection.IndexedSequentialCollection):
+  RDF_TYPE = rdf_flows.GrrMessage
+
+
+class PackedGrrMessageCollection(
+    sequential_collection.PackedSequentialCollection):
+  RDF_TYPE = rdf_flows.GrrMessage
+
+
+class SequentialCollectionStorageBenchmark(test_lib.MicroBenchmarks):
+  """Compares the packed and the indexed sequential collections."""
+
+  units = "s"
+
+  RECORDS = 5000
+
+  def setUp(self):
+    super(SequentialCollectionStorageBenchmark, self).setUp(
+        ["Rows", "Size (KB)"], ["<10", "<10"])
+
+  def _MakeRecord(self, i):
+    return rdf_flows.GrrMessage(
+        source="C.%016x" % (i % 100),
+        payload=rdf_client.StatEntry(
+            pathspec=rdf_paths.PathSpec(
+                path="/usr/lib/file%d" % i, pathtype="OS"),
+            st_size=i,
+            st_mtime=1400000000 + i))
+
+  def _Benchmark(self, name, collection_cls):
+    urn = rdfvalue.RDFURN("aff4:/benchmark").Add(name)
+    aff4.FACTORY.Create(
+        urn, collection_cls, mode="w", token=self.token).Close()
+    records = [self._MakeRecord(i) for i in xrange(self.RECORDS)]
+    timestamp = (rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+                ).AsMicroSecondsFromEpoch()
+    size_before = data_store.DB.Size()
+    rows_before = len(data_store.DB.subjects)
+
+    start_time = time.time()
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for i, record in enumerate(records):
+        collection_cls.StaticAdd(
+            urn,
+            self.token,
+            record,
+            timestamp=timestamp + i,
+            mutation_pool=mutation_pool)
+    self.AddResult("%s Add" % name, time.time() - start_time, self.RECORDS, "",
+                   "")
+
+    collection = aff4.FACTORY.Open(urn, token=self.token)
+    if hasattr(collection, "SealBlocks"):
+      start_time = time.time()
+      collection.SealBlocks(seal_partial_block=True)
+      self.AddResult("%s Seal" % name, time.time() - start_time, 1, "", "")
+
+    start_time = time.time()
+    for _ in collection.Scan():
+      pass
+    self.AddResult("%s Scan" % name, time.time() - start_time, 1,
+                   len(data_store.DB.subjects) - rows_before,
+                   (data_store.DB.Size() - size_before) / 1024)
+
+    start_time = time.time()
+    for _ in collection.GenerateItems(offset=self.RECORDS / 2):
+      break
+    self.AddResult("%s Read from the middle" % name, time.time() - start_time,
+                   1, "", "")
+
+    start_time = time.time()
+    aff4.FACTORY.Delete(urn, token=self.token)
+    self.AddResult("%s Delete" % name, time.time() - start_time, 1, "", "")
+
+  @test_lib.SetLabel("benchmark")
+  def testStorage(self):
+    self._Benchmark("Indexed", GrrMessageCollection)
+    self._Benchmark("Packed", PackedGrrMessageCollection)
+
+
+class IndexedSequentialCollectionLookupBenchmark(
+    test_lib.AverageMicroBenchmarks):
+  """Measures reading single records at offsets clustered around hot spots."""
+
+  RECORDS = 20000
+  LOOKUPS = 200
+
+  def _CreateCollection(self, name):
+    # The fake data store scans all the rows, start from an empty one.
+    data_store.DB.Clear()
+    aff4.FACTORY.Flush()
+    sequential_collection.GetIndexCache().Flush()
+
+    urn = rdfvalue.RDFURN("aff4:/benchmark").Add(name)
+    aff4.FACTORY.Create(
+        urn, TestIndexedSequentialCollection, mode="w",
+        token=self.token).Close()
+    timestamp = (rdfvalue.RDFDatetime.Now() - rdfvalue.Duration("1h")
+                ).AsMicroSecondsFromEpoch()
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for i in xrange(self.RECORDS):
+        TestIndexedSequentialCollection.StaticAdd(
+            urn,
+            self.token,
+            rdfvalue.RDFInteger(i),
+            timestamp=timestamp + i,
+            mutation_pool=mutation_pool)
+
+    aff4.FACTORY.Open(urn, token=self.token).UpdateIndex()
+    return urn
+
+  def _Offsets(self):
+    rnd = random.Random(0)
+    hot_spots = [rnd.randrange(self.RECORDS - 1000) for _ in range(20)]
+    return iter([
+        rnd.choice(hot_spots) + rnd.randrange(1000)
+        for _ in xrange(self.LOOKUPS)
+    ])
+
+  def _TimeLookups(self, name, urn, reopen=False):
+    offsets = self._Offsets()
+    collection = aff4.FACTORY.Open(urn, token=self.token)
+
+    def Lookup():
+      if reopen:
+        return aff4.FACTORY.Open(urn, token=self.token)[next(offsets)]
+      return collection[next(offsets)]
+
+    self.TimeIt(Lookup, name=name, repetitions=self.LOOKUPS)
+
+  @test_lib.SetLabel("benchmark")
+  def testLookups(self):
+    with test_lib.ConfigOverrider({"AFF4.collection_index_cache_age": 600}):
+      with utils.Stubber(TestIndexedSequentialCollection, "MIN_INDEX_SPACING",
+                         TestIndexedSequentialCollection.INDEX_SPACING):
+        self._TimeLookups("Fixed spacing", self._CreateCollection("fixed"))
+
+      self._TimeLookups("Adaptive spacing",
+                        self._CreateCollection("adaptive"))
+
+      urn = self._CreateCollection("reopened")
+      self._TimeLookups("Adaptive spacing, reopened", urn, reopen=True)
+
+    urn = self._CreateCollection("uncached")
+    self._TimeLookups("Adaptive spacing, reopened, no cache", urn, reopen=True)
+
+
 def main(argv):
   # Run the full test suite
   test_lib.GrrTestProgram(argv=argv)
@@ -31,6 +31,21 @@ stored as datastore row attributes.
 Statistics is written to the data store by StatsStoreWorker. It periodically
 fetches values for all the metrics and writes them to corresponding
 object on AFF4.
+
+Alongside the raw samples, downsampled copies of the statistics (rollups) are
+written with 1 minute, 1 hour and 1 day resolutions as
+aff4:stats_store_<resolution>/<metric name> attributes. A rollup keeps the
+first sample written in every period of its resolution, i.e. it is a
+decimation of the raw samples and not an aggregate of them. Counters and
+event metrics are cumulative, so rates computed from a rollup are the average
+rates between its samples, just like with raw samples (except that counter
+resets within a period are not seen). Gauges, on the other hand, are read as
+their value at the start of every period: the rollup does not reflect the
+minimum, maximum or mean value within a period.
+
+Queries over long time ranges read the coarsest rollup that is still adequate
+for the requested sampling interval (see MultiReadStatsForInterval), and every
+resolution has its own retention period.
 """
 
 
@@ -137,6 +152,11 @@ class StatsStoreProcessData(aff4.AFF4Object):
 
   STATS_STORE_PREFIX = "aff4:stats_store/"
 
+  # Resolutions of the downsampled copies of the stats.
+  ROLLUP_RESOLUTIONS = [
+      rdfvalue.Duration("1m"), rdfvalue.Duration("1h"), rdfvalue.Duration("1d")
+  ]
+
   ALL_TIMESTAMPS = data_store.DataStore.ALL_TIMESTAMPS
   NEWEST_TIMESTAMP = data_store.DataStore.NEWEST_TIMESTAMP
 
@@ -163,8 +183,31 @@ class StatsStoreProcessData(aff4.AFF4Object):
           self.Schema.METRICS_METADATA, store_metadata, age=timestamp)
       self.Flush(sync=sync)
 
-  def WriteStats(self, timestamp=None, sync=False):
-    to_set = {}
+  @classmethod
+  def GetPrefix(cls, resolution=None):
+    """Returns attributes prefix of the stats with the given resolution.
+
+    Args:
+      resolution: One of ROLLUP_RESOLUTIONS or None for the raw samples.
+
+    Returns:
+      The prefix of the attributes the stats are stored in.
+    """
+    if resolution is None:
+      return cls.STATS_STORE_PREFIX
+
+    return "aff4:stats_store_%s/" % resolution
+
+  def WriteStats(self, timestamp=None, sync=False, rollup_resolutions=None):
+    """Writes current stats values to the data store.
+
+    Args:
+      timestamp: The timestamp to write the values with.
+      sync: Whether to write synchronously.
+      rollup_resolutions: The rollups which should get the values in addition
+        to the raw samples.
+    """
+    values = {}
     metrics_metadata = stats.STATS.GetAllMetricsMetadata()
     self.WriteMetadataDescriptors(
         metrics_metadata, timestamp=timestamp, sync=sync)
@@ -185,14 +228,19 @@ class StatsStoreProcessData(aff4.AFF4Object):
           store_value.fields_values = store_fields_values
           store_value.SetValue(value, metadata.value_type)
 
-          to_set.setdefault(self.STATS_STORE_PREFIX + name,
-                            []).append(store_value)
+          values.setdefault(name, []).append(store_value)
       else:
         value = stats.STATS.GetMetricValue(name)
         store_value = StatsStoreValue()
         store_value.SetValue(value, metadata.value_type)
 
-        to_set[self.STATS_STORE_PREFIX + name] = [store_value]
+        values[name] = [store_value]
+
+    to_set = {}
+    for resolution in [None] + list(rollup_resolutions or []):
+      prefix = self.GetPrefix(resolution)
+      for name, store_values in values.iteritems():
+        to_set[prefix + name] = store_values
 
     # Write actual data
     data_store.DB.MultiSet(
@@ -203,15 +251,26 @@ class StatsStoreProcessData(aff4.AFF4Object):
         timestamp=timestamp,
         sync=sync)
 
-  def DeleteStats(self, timestamp=ALL_TIMESTAMPS, sync=False):
-    """Deletes all stats in the given time range."""
+  def DeleteStats(self, timestamp=ALL_TIMESTAMPS, sync=False, resolution=None):
+    """Deletes all stats in the given time range.
+
+    Args:
+      timestamp: The time range to delete the stats in.
+      sync: Whether to delete synchronously.
+      resolution: If set, the rollup to delete the stats from. Otherwise, raw
+        samples are deleted.
+
+    Raises:
+      ValueError: if timestamp is NEWEST_TIMESTAMP.
+    """
 
     if timestamp == self.NEWEST_TIMESTAMP:
       raise ValueError("Can't use NEWEST_TIMESTAMP in DeleteStats.")
 
+    prefix = self.GetPrefix(resolution)
     predicates = []
     for key in stats.STATS.GetAllMetricsMetadata().keys():
-      predicates.append(self.STATS_STORE_PREFIX + key)
+      predicates.append(prefix + key)
 
     start = None
     end = None
@@ -242,17 +301,65 @@ class StatsStore(aff4.AFF4Volume):
     if self.urn is None:
       self.urn = self.DATA_STORE_ROOT
 
+    # Maps (process id, resolution) to the last period a rollup was written in.
+    self.rollup_periods = {}
+
   def WriteStats(self, process_id=None, timestamp=None, sync=False):
-    """Writes current stats values to the data store with a given timestamp."""
+    """Writes current stats values to the data store with a given timestamp.
+
+    The values are also written to every rollup which hasn't been written to
+    by this object in the current period of the rollup's resolution.
+
+    Args:
+      process_id: Id of the process the stats belong to.
+      timestamp: The timestamp to write the values with. Defaults to now.
+      sync: Whether to write synchronously.
+
+    Raises:
+      ValueError: if process_id is not set.
+    """
     if not process_id:
       raise ValueError("process_id can't be None")
 
+    if timestamp is None:
+      timestamp = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+
+    rollup_resolutions = []
+    for resolution in StatsStoreProcessData.ROLLUP_RESOLUTIONS:
+      period = int(timestamp) // resolution.microseconds
+      key = (process_id, resolution.seconds)
+      if self.rollup_periods.get(key) != period:
+        self.rollup_periods[key] = period
+        rollup_resolutions.append(resolution)
+
     process_data = aff4.FACTORY.Create(
         self.urn.Add(process_id),
         StatsStoreProcessData,
         mode="rw",
         token=self.token)
-    process_data.WriteStats(timestamp=timestamp, sync=sync)
+    process_data.WriteStats(
+        timestamp=timestamp,
+        sync=sync,
+        rollup_resolutions=rollup_resolutions)
+
+  @staticmethod
+  def GetResolutionForInterval(sampling_interval):
+    """Picks the coarsest resolution adequate for a sampling interval.
+
+    Args:
+      sampling_interval: rdfvalue.Duration the data will be normalized with.
+
+    Returns:
+      One of StatsStoreProcessData.ROLLUP_RESOLUTIONS or None if raw samples
+      have to be used.
+    """
+    result = None
+    for resolution in StatsStoreProcessData.ROLLUP_RESOLUTIONS:
+      if resolution <= sampling_interval and (result is None or
+                                              resolution > result):
+        result = resolution
+
+    return result
 
   def ListUsedProcessIds(self):
     """List process ids that were used when saving data to stats store."""
@@ -297,7 +404,8 @@ class StatsStore(aff4.AFF4Volume):
                 process_id=None,
                 metric_name=None,
                 timestamp=ALL_TIMESTAMPS,
-                limit=10000):
+                limit=10000,
+                resolution=None):
     """Reads stats values from the data store for the current process."""
     if not process_id:
       raise ValueError("process_id can't be None")
@@ -306,7 +414,8 @@ class StatsStore(aff4.AFF4Volume):
         process_ids=[process_id],
         metric_name=metric_name,
         timestamp=timestamp,
-        limit=limit)
+        limit=limit,
+        resolution=resolution)
     try:
       return results[process_id]
     except KeyError:
@@ -316,8 +425,24 @@ class StatsStore(aff4.AFF4Volume):
                      process_ids=None,
                      metric_name=None,
                      timestamp=ALL_TIMESTAMPS,
-                     limit=10000):
-    """Reads historical data for multiple process ids at once."""
+                     limit=10000,
+                     resolution=None):
+    """Reads historical data for multiple process ids at once.
+
+    Args:
+      process_ids: Ids of the processes to read the stats of. Defaults to all
+        the used process ids.
+      metric_name: If set, only the stats of this metric are read.
+      timestamp: The time range to read the stats in.
+      limit: Maximum number of values to read per process.
+      resolution: If set, the rollup to read the stats from. Otherwise, raw
+        samples are read.
+
+    Returns:
+      A dict mapping process ids to dicts mapping metric names to lists of
+      (value, timestamp) pairs (nested in dicts keyed by field values for
+      metrics with fields).
+    """
     if not process_ids:
       process_ids = self.ListUsedProcessIds()
 
@@ -327,9 +452,10 @@ class StatsStore(aff4.AFF4Volume):
         self.DATA_STORE_ROOT.Add(process_id) for process_id in process_ids
     ]
 
+    prefix = StatsStoreProcessData.GetPrefix(resolution)
     multi_query_results = data_store.DB.MultiResolvePrefix(
         subjects,
-        StatsStoreProcessData.STATS_STORE_PREFIX + (metric_name or ""),
+        prefix + (metric_name or ""),
         token=self.token,
         timestamp=timestamp,
         limit=limit)
@@ -343,7 +469,7 @@ class StatsStore(aff4.AFF4Volume):
 
       part_results = {}
       for predicate, value_string, timestamp in subject_results:
-        metric_name = predicate[len(StatsStoreProcessData.STATS_STORE_PREFIX):]
+        metric_name = predicate[len(prefix):]
 
         try:
           metadata = subject_metadata_map[metric_name]
@@ -373,7 +499,101 @@ class StatsStore(aff4.AFF4Volume):
 
     return results
 
-  def DeleteStats(self, process_id=None, timestamp=ALL_TIMESTAMPS, sync=False):
+  @classmethod
+  def _IterSeries(cls, stats_data, path=()):
+    """Yields (path, values) pairs of all the series in a process' stats."""
+    if hasattr(stats_data, "iteritems"):
+      for key, value in stats_data.iteritems():
+        for result in cls._IterSeries(value, path + (key,)):
+          yield result
+    else:
+      yield path, stats_data
+
+  def MultiReadStatsForInterval(self,
+                                process_ids=None,
+                                metric_name=None,
+                                timestamp=None,
+                                sampling_interval=None,
+                                limit=10000):
+    """Reads stats for a time range that is going to be sampled at an interval.
+
+    The stats are read from the coarsest rollup which is still adequate for
+    the sampling interval (see GetResolutionForInterval). Rollups don't cover
+    the time before they were introduced, or after they expired, so raw samples
+    are used for every period of the rollup's resolution without rollup
+    samples of a process.
+
+    Args:
+      process_ids: Ids of the processes to read the stats of. Defaults to all
+        the used process ids.
+      metric_name: If set, only the stats of this metric are read.
+      timestamp: A (start, end) tuple with the time range to read the stats in.
+      sampling_interval: rdfvalue.Duration the data will be normalized with.
+      limit: Maximum number of values to read per process and resolution.
+
+    Returns:
+      Stats in the same format as returned by MultiReadStats.
+    """
+    if not process_ids:
+      process_ids = self.ListUsedProcessIds()
+
+    resolution = self.GetResolutionForInterval(sampling_interval)
+    results = self.MultiReadStats(
+        process_ids=process_ids,
+        metric_name=metric_name,
+        timestamp=timestamp,
+        limit=limit,
+        resolution=resolution)
+    if resolution is None:
+      return results
+
+    period = resolution.microseconds
+    start, end = [int(t) for t in timestamp]
+    all_periods = set(xrange(start // period, end // period + 1))
+
+    missing_periods = {}
+    for process_id in process_ids:
+      covered_periods = set()
+      for _, values in self._IterSeries(results.get(process_id, {})):
+        covered_periods.update(ts // period for _, ts in values)
+
+      if all_periods - covered_periods:
+        missing_periods[process_id] = all_periods - covered_periods
+
+    if not missing_periods:
+      return results
+
+    # A single raw read covers the missing periods of all the processes.
+    first_period = min(min(periods) for periods in missing_periods.values())
+    last_period = max(max(periods) for periods in missing_periods.values())
+    raw_results = self.MultiReadStats(
+        process_ids=sorted(missing_periods),
+        metric_name=metric_name,
+        timestamp=(max(start, first_period * period),
+                   min(end, (last_period + 1) * period - 1)),
+        limit=limit)
+
+    for process_id, raw_data in raw_results.iteritems():
+      periods = missing_periods[process_id]
+      for path, values in self._IterSeries(raw_data):
+        values = [(v, ts) for v, ts in values if ts // period in periods]
+        if not values:
+          continue
+
+        current_dict = results.setdefault(process_id, {})
+        for key in path[:-1]:
+          current_dict = current_dict.setdefault(key, {})
+        series = current_dict.setdefault(path[-1], [])
+        series.extend(values)
+        series.sort(key=lambda x: x[1])
+
+    return results
+
+  def DeleteStats(self,
+                  process_id=None,
+                  timestamp=ALL_TIMESTAMPS,
+                  sync=False,
+                  resolution=None):
     """Deletes all stats in the given time range."""
 
     if not process_id:
@@ -384,7 +604,8 @@ class StatsStore(aff4.AFF4Volume):
         StatsStoreProcessData,
         mode="w",
         token=self.token)
-    process_data.DeleteStats(timestamp=timestamp, sync=sync)
+    process_data.DeleteStats(
+        timestamp=timestamp, sync=sync, resolution=resolution)
 
 
 class StatsStoreDataQuery(object):
@@ -420,7 +641,7 @@ class StatsStoreDataQuery(object):
   def _TimeSeriesFromData(self, data, attr=None):
     """Build time series from StatsStore data."""
 
-    series = timeseries.Timeseries()
+    series = timeseries.CompactTimeseries()
 
     for value, timestamp in data:
       if attr:
@@ -439,13 +660,13 @@ class StatsStoreDataQuery(object):
 
   @property
   def ts(self):
-    """Return single timeseries.Timeseries built by this query."""
+    """Return single timeseries.CompactTimeseries built by this query."""
 
     if self.time_series is None:
       raise RuntimeError("Time series weren't built yet.")
 
     if not self.time_series:
-      return timeseries.Timeseries()
+      return timeseries.CompactTimeseries()
 
     return self.time_series[0]
 
@@ -688,17 +909,29 @@ class StatsStoreWorker(object):
 
       logging.debug("Removing old stats from stats store." "")
       try:
-        now = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
-        self.stats_store.DeleteStats(
-            process_id=self.process_id,
-            timestamp=(0, now - config_lib.CONFIG["StatsStore.ttl"] * 1000000),
-            sync=False)
+        self.DeleteOldStats()
       except Exception as e:  # pylint: disable=broad-except
         logging.exception(
             "StatsStore exception caught during DeleteStats(): %s", e)
 
       time.sleep(self.sleep)
 
+  def DeleteOldStats(self):
+    """Deletes raw samples and rollups past their retention periods."""
+    now = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+    self.stats_store.DeleteStats(
+        process_id=self.process_id,
+        timestamp=(0, now - config_lib.CONFIG["StatsStore.ttl"] * 1000000),
+        sync=False)
+
+    for resolution in StatsStoreProcessData.ROLLUP_RESOLUTIONS:
+      ttl = config_lib.CONFIG["StatsStore.rollup_ttl_%s" % resolution]
+      self.stats_store.DeleteStats(
+          process_id=self.process_id,
+          timestamp=(0, now - ttl * 1000000),
+          sync=False,
+          resolution=resolution)
+
   def Run(self):
     self.RunAsync().join()
 
@@ -450,6 +450,147 @@ class StatsStoreTest(test_lib.AFF4ObjectTest):
     self.assertTrue("counter" in metadata_by_id["pid1"].AsDict())
     self.assertTrue("counter" in metadata_by_id["pid2"].AsDict())
 
+  def testRollupsKeepFirstValueInEveryPeriod(self):
+    stats.STATS.RegisterCounterMetric("counter")
+
+    # Write a value every 20 minutes for 4 hours.
+    for i in range(12):
+      stats.STATS.IncrementCounter("counter")
+      self.stats_store.WriteStats(
+          process_id=self.process_id,
+          timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(i * 20 * 60),
+          sync=True)
+
+    raw = self.stats_store.ReadStats(process_id=self.process_id)
+    self.assertEqual(len(raw["counter"]), 12)
+
+    minutes = self.stats_store.ReadStats(
+        process_id=self.process_id, resolution=rdfvalue.Duration("1m"))
+    self.assertEqual(minutes["counter"], raw["counter"])
+
+    hours = self.stats_store.ReadStats(
+        process_id=self.process_id, resolution=rdfvalue.Duration("1h"))
+    self.assertEqual([value for value, _ in hours["counter"]], [1, 4, 7, 10])
+
+    days = self.stats_store.ReadStats(
+        process_id=self.process_id, resolution=rdfvalue.Duration("1d"))
+    self.assertEqual(days["counter"], [(1, 0)])
+
+  def testGaugeRollupsKeepValueAtStartOfEveryPeriod(self):
+    stats.STATS.RegisterGaugeMetric("gauge", int)
+
+    # Rollups are not aggregates: values within a period other than the first
+    # one are not reflected in the rollup.
+    for i, value in enumerate([1, 100, 100, 2, 0, 0]):
+      stats.STATS.SetGaugeValue("gauge", value)
+      self.stats_store.WriteStats(
+          process_id=self.process_id,
+          timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(i * 20 * 60),
+          sync=True)
+
+    hours = self.stats_store.ReadStats(
+        process_id=self.process_id, resolution=rdfvalue.Duration("1h"))
+    self.assertEqual([value for value, _ in hours["gauge"]], [1, 2])
+
+  def testRawSamplesAreReadForPeriodsWithoutRollups(self):
+    stats.STATS.RegisterCounterMetric("counter", fields=[("source", str)])
+
+    # Write a value every 20 minutes for 4 hours.
+    for i in range(12):
+      stats.STATS.IncrementCounter("counter", fields=["http"])
+      self.stats_store.WriteStats(
+          process_id=self.process_id,
+          timestamp=rdfvalue.RDFDatetime().FromSecondsFromEpoch(i * 20 * 60),
+          sync=True)
+
+    # The hourly rollup only covers the last 2 hours.
+    self.stats_store.DeleteStats(
+        process_id=self.process_id,
+        timestamp=(0, 2 * 60 * 60 * 1000000 - 1),
+        sync=True,
+        resolution=rdfvalue.Duration("1h"))
+
+    stats_data = self.stats_store.MultiReadStatsForInterval(
+        process_ids=[self.process_id],
+        timestamp=(0, 4 * 60 * 60 * 1000000 - 1),
+        sampling_interval=rdfvalue.Duration("1h"))
+    self.assertEqual(
+        [value for value, _ in stats_data[self.process_id]["counter"]["http"]],
+        [1, 2, 3, 4, 5, 6, 7, 10])
+
+  def testRollupsWithFieldsAreReadCorrectly(self):
+    stats.STATS.RegisterCounterMetric("counter", fields=[("source", str)])
+    stats.STATS.IncrementCounter("counter", fields=["http"])
+    stats.STATS.IncrementCounter("counter", delta=2, fields=["rpc"])
+
+    self.stats_store.WriteStats(
+        process_id=self.process_id, timestamp=42, sync=True)
+
+    stats_history = self.stats_store.ReadStats(
+        process_id=self.process_id, resolution=rdfvalue.Duration("1h"))
+    self.assertEqual(stats_history["counter"]["http"], [(1, 42)])
+    self.assertEqual(stats_history["counter"]["rpc"], [(2, 42)])
+
+  def testDeleteStatsOnlyAffectsGivenResolution(self):
+    stats.STATS.RegisterCounterMetric("counter")
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(
+        process_id=self.process_id, timestamp=42, sync=True)
+
+    self.stats_store.DeleteStats(
+        process_id=self.process_id,
+        timestamp=(0, 100),
+        sync=True,
+        resolution=rdfvalue.Duration("1h"))
+
+    self.assertEqual(
+        self.stats_store.ReadStats(process_id=self.process_id)["counter"],
+        [(1, 42)])
+    self.assertFalse(
+        self.stats_store.ReadStats(
+            process_id=self.process_id, resolution=rdfvalue.Duration("1h")))
+    self.assertEqual(
+        self.stats_store.ReadStats(
+            process_id=self.process_id,
+            resolution=rdfvalue.Duration("1d"))["counter"], [(1, 42)])
+
+  def testWorkerDeletesStatsPastTheirRetentionPeriods(self):
+    stats.STATS.RegisterCounterMetric("counter")
+    stats.STATS.IncrementCounter("counter")
+    self.stats_store.WriteStats(
+        process_id=self.process_id, timestamp=42, sync=True)
+
+    worker = stats_store.StatsStoreWorker(self.stats_store, self.process_id)
+    with test_lib.ConfigOverrider({
+        "StatsStore.ttl": 60,
+        "StatsStore.rollup_ttl_1m": 60,
+        "StatsStore.rollup_ttl_1h": 60 * 60,
+        "StatsStore.rollup_ttl_1d": 60 * 60 * 24
+    }):
+      with test_lib.FakeTime(2 * 60 * 60):
+        worker.DeleteOldStats()
+
+    for resolution in [None, rdfvalue.Duration("1m"), rdfvalue.Duration("1h")]:
+      self.assertFalse(
+          self.stats_store.ReadStats(
+              process_id=self.process_id, resolution=resolution))
+    self.assertEqual(
+        self.stats_store.ReadStats(
+            process_id=self.process_id,
+            resolution=rdfvalue.Duration("1d"))["counter"], [(1, 42)])
+
+  def testGetResolutionForIntervalPicksCoarsestAdequateResolution(self):
+    get_resolution = self.stats_store.GetResolutionForInterval
+    self.assertIsNone(get_resolution(rdfvalue.Duration("30s")))
+    self.assertEqual(
+        get_resolution(rdfvalue.Duration("1m")), rdfvalue.Duration("1m"))
+    self.assertEqual(
+        get_resolution(rdfvalue.Duration("5m")), rdfvalue.Duration("1m"))
+    self.assertEqual(
+        get_resolution(rdfvalue.Duration("1h")), rdfvalue.Duration("1h"))
+    self.assertEqual(
+        get_resolution(rdfvalue.Duration("7d")), rdfvalue.Duration("1d"))
+
 
 class StatsStoreDataQueryTest(test_lib.AFF4ObjectTest):
   """Tests for StatsStoreDataQuery class."""
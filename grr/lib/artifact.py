@@ -163,17 +163,11 @@ class CollectArtifactDependencies(flow.GRRFlow):
     """
     artifact_set = set(self.args.artifact_list)
 
-    deps = artifact_registry.REGISTRY.SearchDependencies(
-        self.state.knowledge_base.os, artifact_set)
-    name_deps, self.state.all_deps = deps
-
-    # Find the any dependencies that don't have dependencies themselves as our
-    # starting point.
-    check_deps = name_deps.union(artifact_set)
-    no_deps_names = artifact_registry.REGISTRY.GetArtifactNames(
-        os_name=self.state.knowledge_base.os,
-        name_list=check_deps,
-        exclude_dependents=True)
+    # Any dependencies that don't have dependencies themselves are our starting
+    # point.
+    name_deps, self.state.all_deps, no_deps_names = (
+        artifact_registry.REGISTRY.GetCollectionPlan(
+            self.state.knowledge_base.os, artifact_set))
 
     # If the only artifacts with no dependencies are the ones we want to collect
     # that means there is nothing to do.
@@ -409,18 +403,14 @@ class KnowledgeBaseInitializationFlow(CollectArtifactDependencies):
     for artifact_name in kb_set:
       artifact_registry.REGISTRY.GetArtifact(artifact_name)
 
-    no_deps_names = artifact_registry.REGISTRY.GetArtifactNames(
-        os_name=self.state.knowledge_base.os,
-        name_list=kb_set,
-        exclude_dependents=True)
-
-    name_deps, self.state.all_deps = (
-        artifact_registry.REGISTRY.SearchDependencies(
+    name_deps, self.state.all_deps, no_deps_names = (
+        artifact_registry.REGISTRY.GetCollectionPlan(
             self.state.knowledge_base.os, kb_set))
 
     # We only retrieve artifacts that are explicitly listed in
     # Artifacts.knowledge_base + additions - skip.
     name_deps = name_deps.intersection(kb_set)
+    no_deps_names = no_deps_names.intersection(kb_set)
 
     # We're going to collect everything that doesn't have a dependency first.
     # Anything else we're waiting on a dependency before we can collect.
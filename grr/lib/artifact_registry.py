@@ -38,6 +38,12 @@ class ArtifactNotRegisteredError(Error):
   """Artifact is not present in the registry."""
 
 
+def _FrozenSet(values):
+  if values is None:
+    return None
+  return frozenset(values)
+
+
 class ArtifactRegistry(object):
   """A global registry of artifacts."""
 
@@ -45,6 +51,14 @@ class ArtifactRegistry(object):
   _sources = {"dirs": set(), "files": set(), "datastores": set()}
   _dirty = False
 
+  # Every change to the registered artifacts gives the registry a new version.
+  # Dependency lookups are memoized per version, so they are only recomputed
+  # once the artifacts change.
+  _last_version = 0
+  _version = 0
+  _memo = None
+  _memo_version = None
+
   def _LoadArtifactsFromDatastore(self,
                                   source_urns=None,
                                   token=None,
@@ -182,6 +196,47 @@ class ArtifactRegistry(object):
         self._sources["datastores"].add(d)
         self._dirty = True
 
+  def _Changed(self):
+    """Gives the registry a new version, invalidating memoized lookups."""
+    ArtifactRegistry._last_version += 1
+    self._version = ArtifactRegistry._last_version
+
+  def GetVersion(self):
+    """Returns the version of the registered artifacts."""
+    self._CheckDirty()
+    return self._version
+
+  def _Memoized(self, key, compute):
+    """Returns compute() memoized under key for the current registry version.
+
+    Args:
+      key: A hashable key identifying the lookup.
+      compute: A function computing the result of the lookup.
+
+    Returns:
+      The result of compute(), which callers must not modify.
+    """
+    if self._memo_version != self._version:
+      self._memo = {}
+      self._memo_version = self._version
+
+    try:
+      return self._memo[key]
+    except KeyError:
+      pass
+
+    version = self._version
+    result = compute()
+    # Don't store results computed while the registry changed underneath.
+    if version == self._version == self._memo_version:
+      self._memo[key] = result
+    return result
+
+  def _DatastoreArtifactsFingerprint(self):
+    return sorted((name, artifact.SerializeToString())
+                  for name, artifact in self._artifacts.iteritems()
+                  if artifact.loaded_from.startswith("datastore"))
+
   def RegisterArtifact(self,
                        artifact_rdfvalue,
                        source="datastore",
@@ -207,20 +262,24 @@ class ArtifactRegistry(object):
     # Clear any stale errors.
     artifact_rdfvalue.error_message = None
     self._artifacts[artifact_rdfvalue.name] = artifact_rdfvalue
+    self._Changed()
 
   def UnregisterArtifact(self, artifact_name):
     try:
       del self._artifacts[artifact_name]
     except KeyError:
       raise ValueError("Artifact %s unknown." % artifact_name)
+    self._Changed()
 
   def ClearRegistry(self):
     self._artifacts = {}
     self._dirty = True
+    self._Changed()
 
   def _ReloadArtifacts(self):
     """Load artifacts from all sources."""
     self._artifacts = {}
+    self._Changed()
     files_to_load = set()
     for dir_path in self._sources.get("dirs", set()):
       try:
@@ -244,12 +303,22 @@ class ArtifactRegistry(object):
         to_remove.append(name)
     for key in to_remove:
       self._artifacts.pop(key)
+    if to_remove:
+      self._Changed()
 
   def ReloadDatastoreArtifacts(self):
+    """Reloads the artifacts from the data store sources."""
+    version = self._version
+    fingerprint = self._DatastoreArtifactsFingerprint()
+
     # Make sure artifacts deleted by the UI don't reappear.
     self._UnregisterDatastoreArtifacts()
     self._LoadArtifactsFromDatastore(self._sources["datastores"])
 
+    # Memoized lookups stay valid if the same artifacts were loaded again.
+    if self._DatastoreArtifactsFingerprint() == fingerprint:
+      self._version = version
+
   def _CheckDirty(self, reload_datastore_artifacts=False):
     if self._dirty:
       self._dirty = False
@@ -283,6 +352,18 @@ class ArtifactRegistry(object):
       set of artifacts matching filter criteria
     """
     self._CheckDirty(reload_datastore_artifacts=reload_datastore_artifacts)
+    key = ("GetArtifacts", os_name, _FrozenSet(name_list), source_type,
+           exclude_dependents, _FrozenSet(provides))
+    return set(
+        self._Memoized(key, lambda: self._GetArtifacts(
+            os_name=os_name,
+            name_list=name_list,
+            source_type=source_type,
+            exclude_dependents=exclude_dependents,
+            provides=provides)))
+
+  def _GetArtifacts(self, os_name, name_list, source_type, exclude_dependents,
+                    provides):
     results = set()
     for artifact in self._artifacts.itervalues():
 
@@ -358,6 +439,24 @@ class ArtifactRegistry(object):
       (artifact_names, expansion_names): a tuple of sets, one with artifact
           names, the other expansion names
     """
+    if existing_artifact_deps is None and existing_expansion_deps is None:
+      self._CheckDirty()
+      artifact_deps, expansion_deps = self._Memoized(
+          ("SearchDependencies", os_name, frozenset(artifact_name_list)),
+          lambda: self._SearchDependencies(os_name, artifact_name_list))
+      return set(artifact_deps), set(expansion_deps)
+
+    return self._SearchDependencies(
+        os_name,
+        artifact_name_list,
+        existing_artifact_deps=existing_artifact_deps,
+        existing_expansion_deps=existing_expansion_deps)
+
+  def _SearchDependencies(self,
+                          os_name,
+                          artifact_name_list,
+                          existing_artifact_deps=None,
+                          existing_expansion_deps=None):
     artifact_deps = existing_artifact_deps or set()
     expansion_deps = existing_expansion_deps or set()
 
@@ -376,7 +475,7 @@ class ArtifactRegistry(object):
 
         if missing_artifacts:
           # Add those artifacts and any child dependencies
-          new_artifacts, new_expansions = self.SearchDependencies(
+          new_artifacts, new_expansions = self._SearchDependencies(
               os_name,
               new_artifact_names,
               existing_artifact_deps=artifact_deps,
@@ -386,6 +485,39 @@ class ArtifactRegistry(object):
 
     return artifact_deps, expansion_deps
 
+  def GetCollectionPlan(self, os_name, artifact_names):
+    """Plans the collection of artifacts along with their dependencies.
+
+    Plans are memoized until the registered artifacts change, so that the
+    many flows collecting the same artifacts on clients running the same OS
+    share a single dependency search.
+
+    Args:
+      os_name: operating system string
+      artifact_names: names of the artifacts to collect.
+
+    Returns:
+      (artifact_names, expansion_names, independent_names): a tuple of sets,
+          the artifacts needed to collect artifact_names along with their
+          dependencies, the expansions they depend on, and those of the
+          needed or requested artifacts which have no dependencies and can be
+          collected first.
+    """
+
+    def Plan():
+      artifact_deps, expansion_deps = self.SearchDependencies(
+          os_name, artifact_names)
+      independent_names = self.GetArtifactNames(
+          os_name=os_name,
+          name_list=artifact_deps.union(artifact_names),
+          exclude_dependents=True)
+      return artifact_deps, expansion_deps, independent_names
+
+    self._CheckDirty()
+    plan = self._Memoized(
+        ("GetCollectionPlan", os_name, frozenset(artifact_names)), Plan)
+    return tuple(set(names) for names in plan)
+
   def DumpArtifactsToYaml(self, sort_by_os=True):
     """Dump a list of artifacts into a yaml string."""
     artifact_list = self.GetArtifacts()
@@ -376,6 +376,91 @@ supported_os: [Linux]
         aff4.FACTORY.Open(
             artifact_store_urn, token=self.token))
 
+  def _CreateRegistry(self):
+    registry = artifact_registry.ArtifactRegistry()
+    registry.ClearRegistry()
+    registry.ClearSources()
+    return registry
+
+  def testCollectionPlanIsMemoizedUntilArtifactsChange(self):
+    registry = self._CreateRegistry()
+    # Artifacts validate against the global registry.
+    with utils.Stubber(artifact_registry, "REGISTRY", registry):
+      registry.AddFileSource(
+          os.path.join(config_lib.CONFIG["Test.data_dir"], "artifacts",
+                       "test_artifacts.json"))
+      version = registry.GetVersion()
+
+      artifact_names, expansion_names, independent_names = (
+          registry.GetCollectionPlan("Windows", ["DepsHomedir"]))
+      self.assertItemsEqual(artifact_names, [
+          "DepsHomedir", "DepsWindir", "DepsWindirRegex", "DepsControlSet"
+      ])
+      self.assertItemsEqual(
+          expansion_names,
+          ["environ_windir", "users.username", "current_control_set"])
+      self.assertItemsEqual(independent_names, ["DepsControlSet"])
+
+      # Callers get their own copies of the memoized plan.
+      artifact_names.clear()
+      artifact_names, _, _ = registry.GetCollectionPlan("Windows",
+                                                        ["DepsHomedir"])
+      self.assertEqual(len(artifact_names), 4)
+      self.assertEqual(registry.GetVersion(), version)
+
+      # Registering an artifact providing one of the expansions changes the
+      # plan.
+      provider = artifact_registry.Artifact(
+          name="DepsWindirProvider",
+          doc="Provides environ_windir.",
+          provides=["environ_windir"],
+          supported_os=["Windows"],
+          sources=[
+              artifact_registry.ArtifactSource(
+                  type=artifact_registry.ArtifactSource.SourceType.COMMAND,
+                  attributes={"cmd": "cmd.exe",
+                              "args": ["/c", "echo %WINDIR%"]})
+          ])
+      registry.RegisterArtifact(provider)
+      self.assertNotEqual(registry.GetVersion(), version)
+      artifact_names, _, independent_names = registry.GetCollectionPlan(
+          "Windows", ["DepsHomedir"])
+      self.assertIn("DepsWindirProvider", artifact_names)
+      self.assertIn("DepsWindirProvider", independent_names)
+
+      registry.UnregisterArtifact("DepsWindirProvider")
+      artifact_names, _, _ = registry.GetCollectionPlan("Windows",
+                                                        ["DepsHomedir"])
+      self.assertNotIn("DepsWindirProvider", artifact_names)
+
+  def testReloadingUnchangedDatastoreArtifactsKeepsVersion(self):
+    content = """
+name: DatastoreArtifact
+doc: here's the doc
+sources:
+- type: COMMAND
+  attributes:
+    args: ["--list"]
+    cmd: /usr/bin/dpkg
+supported_os: [Linux]
+"""
+    registry = self._CreateRegistry()
+    registry.AddDatastoreSources([aff4.ROOT_URN.Add("artifact_store")])
+    with utils.Stubber(artifact_registry, "REGISTRY", registry):
+      artifact.UploadArtifactYamlFile(content, token=self.token)
+
+      version = registry.GetVersion()
+      registry.ReloadDatastoreArtifacts()
+      self.assertEqual(registry.GetVersion(), version)
+
+      artifact.UploadArtifactYamlFile(
+          content.replace("DatastoreArtifact", "OtherDatastoreArtifact"),
+          token=self.token)
+      registry.ReloadDatastoreArtifacts()
+      self.assertNotEqual(registry.GetVersion(), version)
+      self.assertIn("OtherDatastoreArtifact",
+                    registry.GetArtifactNames(os_name="Linux"))
+
 
 class ArtifactFlowLinuxTest(ArtifactTest):
 
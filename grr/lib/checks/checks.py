@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 """Registry for filters and abstract classes for basic filter functionality."""
 import collections
+import cPickle
 import glob
 import itertools
+import multiprocessing
+import multiprocessing.pool
 import os
+import pickle
 
 import yaml
 
@@ -11,6 +15,7 @@ import logging
 
 from grr.lib import config_lib
 from grr.lib import registry
+from grr.lib import utils
 from grr.lib.checks import filters
 from grr.lib.checks import hints
 from grr.lib.checks import triggers
@@ -152,19 +157,21 @@ class Check(rdf_structs.RDFProtoStruct):
     else:
       return any(True for artifact in artifacts if artifact in self.artifacts)
 
-  def Parse(self, conditions, host_data):
+  def Parse(self, conditions, host_data, cache=None):
     """Runs methods that evaluate whether collected host_data has an issue.
 
     Args:
       conditions: A list of conditions to determine which Methods to trigger.
       host_data: A map of artifacts and rdf data.
+      cache: An optional FilterCache shared by the checks run on host_data.
 
     Returns:
       A CheckResult populated with Anomalies if an issue exists.
     """
     result = CheckResult(check_id=self.check_id)
     methods = self.SelectChecks(conditions)
-    result.ExtendAnomalies([m.Parse(conditions, host_data) for m in methods])
+    result.ExtendAnomalies(
+        [m.Parse(conditions, host_data, cache=cache) for m in methods])
     return result
 
   def Validate(self):
@@ -210,12 +217,13 @@ class Method(rdf_structs.RDFProtoStruct):
       target = p.target or self.target
       self.triggers.Add(p.artifact, target, p)
 
-  def Parse(self, conditions, host_data):
+  def Parse(self, conditions, host_data, cache=None):
     """Runs probes that evaluate whether collected data has an issue.
 
     Args:
       conditions: The trigger conditions.
       host_data: A map of artifacts and rdf data.
+      cache: An optional FilterCache shared by the checks run on host_data.
 
     Returns:
       Anomalies if an issue exists.
@@ -232,7 +240,7 @@ class Method(rdf_structs.RDFProtoStruct):
       else:
         rdf_data = artifact_data.get(str(p.result_context))
       try:
-        result = p.Parse(rdf_data)
+        result = p.Parse(rdf_data, cache=cache)
       except ProcessingError as e:
         raise ProcessingError("Bad artifact %s: %s" % (p.artifact, e))
       if result:
@@ -269,7 +277,7 @@ class Probe(rdf_structs.RDFProtoStruct):
     hinter = Hint(conf.get("hint", {}), reformat=False)
     self.matcher = Matcher(conf["match"], hinter)
 
-  def Parse(self, rdf_data):
+  def Parse(self, rdf_data, cache=None):
     """Process rdf data through filters. Test if results match expectations.
 
     Processing of rdf data is staged by a filter handler, which manages the
@@ -278,6 +286,7 @@ class Probe(rdf_structs.RDFProtoStruct):
 
     Args:
       rdf_data: An list containing 0 or more rdf values.
+      cache: An optional FilterCache to reuse filter results from.
 
     Returns:
       An anomaly if data didn't match expectations.
@@ -289,10 +298,10 @@ class Probe(rdf_structs.RDFProtoStruct):
     if not isinstance(rdf_data, (list, set)):
       raise ProcessingError("Bad host data format: %s" % type(rdf_data))
     if self.baseline:
-      comparison = self.baseliner.Parse(rdf_data)
+      comparison = self.baseliner.Parse(rdf_data, cache=cache)
     else:
       comparison = rdf_data
-    found = self.handler.Parse(comparison)
+    found = self.handler.Parse(comparison, cache=cache)
     results = self.hint.Render(found)
     return self.matcher.Detect(comparison, results)
 
@@ -321,7 +330,7 @@ class Filter(rdf_structs.RDFProtoStruct):
     filter_name = self.type or "Filter"
     self._filter = filters.Filter.GetFilter(filter_name)
 
-  def Parse(self, rdf_data):
+  def Parse(self, rdf_data, cache=None):
     """Process rdf data through the filter.
 
     Filters sift data according to filter rules. Data that passes the filter
@@ -332,13 +341,16 @@ class Filter(rdf_structs.RDFProtoStruct):
 
     Args:
       rdf_data: Host data that has already been processed by a Parser into RDF.
+      cache: An optional FilterCache to reuse filter results from.
 
     Returns:
       A list containing data items that matched the filter rules.
     """
-    if self._filter:
-      return list(self._filter.Parse(rdf_data, self.expression))
-    return rdf_data
+    if not self._filter:
+      return rdf_data
+    if cache is not None:
+      return cache.Parse(self._filter, self.expression, rdf_data)
+    return list(self._filter.Parse(rdf_data, self.expression))
 
   def Validate(self):
     """The filter exists, and has valid filter and hint expressions."""
@@ -348,6 +360,37 @@ class Filter(rdf_structs.RDFProtoStruct):
     ValidateMultiple(self.hint, "Filter has invalid hint")
 
 
+class FilterCache(object):
+  """Memoizes the results of filters applied to the same host data.
+
+  Checks often run the same filters over the same artifact data, and the output
+  of a shared filter is in turn the input of the next stage. Results are only
+  reused if the filtered data holds the same items as when the results were
+  computed, so adding, removing or replacing items is detected. Items modified
+  in place are not, so a cache should only live while a single host is
+  processed.
+  """
+
+  def __init__(self):
+    self._results = {}
+
+  def Parse(self, filter_obj, expression, rdf_data):
+    """Returns the results of filter_obj.Parse(rdf_data, expression)."""
+    key = (id(rdf_data), filter_obj.__class__, expression)
+    items = list(rdf_data)
+    try:
+      cached_items, results = self._results[key]
+      if len(cached_items) == len(items) and all(
+          a is b for a, b in itertools.izip(cached_items, items)):
+        return results
+    except KeyError:
+      pass
+
+    results = list(filter_obj.Parse(items, expression))
+    self._results[key] = (items, results)
+    return results
+
+
 class Hint(rdf_structs.RDFProtoStruct):
   """Human-formatted descriptions of problems, fixes and findings."""
 
@@ -513,11 +556,15 @@ class CheckRegistry(object):
 
   triggers = triggers.Triggers()
 
+  # Maps host profiles to the plans of the checks which apply to them.
+  plans = utils.FastStore(max_size=1000)
+
   @classmethod
   def Clear(cls):
     """Remove all checks and triggers from the registry."""
     cls.checks = {}
     cls.triggers = triggers.Triggers()
+    cls.plans.Flush()
 
   @classmethod
   def RegisterCheck(cls, check, source="unknown", overwrite_if_exists=False):
@@ -529,6 +576,7 @@ class CheckRegistry(object):
     check.loaded_from = source
     cls.checks[check.check_id] = check
     cls.triggers.Update(check.triggers, check)
+    cls.plans.Flush()
 
   @staticmethod
   def _AsList(arg):
@@ -625,6 +673,41 @@ class CheckRegistry(object):
         results.update(chk.triggers.Artifacts(*trigger))
     return results
 
+  @classmethod
+  def PlanChecks(cls, artifacts, os_name=None, cpe=None, labels=None):
+    """Selects the checks to run on a host, and the order to run them in.
+
+    Checks are grouped by the artifacts they use, so that checks sharing host
+    data run one after the other. Plans are cached per host profile, as most
+    hosts of a fleet share a handful of profiles.
+
+    Args:
+      artifacts: The names of the artifacts collected from the host.
+      os_name: 0+ OS names.
+      cpe: 0+ CPE identifiers.
+      labels: 0+ GRR labels.
+
+    Returns:
+      A tuple of the list of check ids to run and the list of conditions to
+      run them with.
+    """
+    try:
+      key = (frozenset(artifacts), tuple(cls._AsList(os_name)),
+             tuple(cls._AsList(cpe)), tuple(cls._AsList(labels)))
+      return cls.plans.Get(key)
+    except TypeError:
+      key = None
+    except KeyError:
+      pass
+
+    check_ids = sorted(
+        cls.FindChecks(artifacts, os_name, cpe, labels),
+        key=lambda check_id: (sorted(cls.checks[check_id].artifacts), check_id))
+    plan = (check_ids, list(cls.Conditions(artifacts, os_name, cpe, labels)))
+    if key is not None:
+      cls.plans.Put(key, plan)
+    return plan
+
   @classmethod
   def Process(cls,
               host_data,
@@ -648,9 +731,10 @@ class CheckRegistry(object):
       A CheckResult message for each check that was performed.
     """
     # All the conditions that apply to this host.
-    artifacts = host_data.keys()
-    check_ids = cls.FindChecks(artifacts, os_name, cpe, labels)
-    conditions = list(cls.Conditions(artifacts, os_name, cpe, labels))
+    check_ids, conditions = cls.PlanChecks(host_data.keys(), os_name, cpe,
+                                           labels)
+    # Filter results are shared by all the checks run on this host.
+    cache = FilterCache()
     for check_id in check_ids:
       # skip if check in list of excluded checks
       if exclude_checks and check_id in exclude_checks:
@@ -659,7 +743,7 @@ class CheckRegistry(object):
         continue
       try:
         chk = cls.checks[check_id]
-        yield chk.Parse(conditions, host_data)
+        yield chk.Parse(conditions, host_data, cache=cache)
       except ProcessingError as e:
         logging.warn("Check ID %s raised: %s", check_id, e)
 
@@ -718,6 +802,45 @@ def CheckHost(host_data,
       exclude_checks=exclude_checks)
 
 
+def _CheckHostInWorker(args):
+  host_data, kwargs = args
+  return list(CheckHost(host_data, **kwargs))
+
+
+def CheckHosts(hosts_data, processes=None, **kwargs):
+  """Perform all checks on a number of hosts.
+
+  Args:
+    hosts_data: A list of host_data dictionaries, as accepted by CheckHost.
+    processes: The number of worker processes to check the hosts in. Workers
+      are forked, so they run the checks registered in this process. If not
+      set, or if the workers can't be started or exchange data with this
+      process, hosts are checked in this process.
+    **kwargs: Arguments passed to CheckHost for every host.
+
+  Returns:
+    A list with the list of CheckResult messages of each host, in the order of
+    hosts_data.
+  """
+  if processes and processes > 1:
+    try:
+      pool = multiprocessing.Pool(processes)
+    except OSError as e:
+      logging.warn("Unable to start worker processes: %s", e)
+    else:
+      try:
+        return pool.map(_CheckHostInWorker,
+                        [(host_data, kwargs) for host_data in hosts_data])
+      except (pickle.PicklingError, cPickle.PicklingError,
+              multiprocessing.pool.MaybeEncodingError) as e:
+        logging.warn("Unable to pass host data to worker processes: %s", e)
+      finally:
+        pool.terminate()
+        pool.join()
+
+  return [list(CheckHost(host_data, **kwargs)) for host_data in hosts_data]
+
+
 def LoadConfigsFromFile(file_path):
   """Loads check definitions from a file."""
   with open(file_path) as data:
@@ -8,13 +8,16 @@ import yaml
 from grr.lib import config_lib
 from grr.lib import flags
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.checks import checks
 from grr.lib.checks import checks_test_lib
 from grr.lib.checks import filters
 from grr.lib.rdfvalues import anomaly as rdf_anomaly
 from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import paths as rdf_paths
 from grr.parsers import config_file as config_file_parsers
 from grr.parsers import linux_cmd_parser
+from grr.parsers import linux_pam_parser
 from grr.parsers import wmi_parser
 
 CHECKS_DIR = os.path.join(config_lib.CONFIG["Test.data_dir"], "checks")
@@ -297,6 +300,28 @@ class CheckRegistryTests(test_lib.GRRBaseTest):
             os_name="Linux", restrict_checks=["SW-CHECK"]))
     self.assertItemsEqual(expect, result)
 
+  def testPlanChecksIsCachedUntilChecksChange(self):
+    """Plans are reused for the same host profile until checks change."""
+    artifacts = ["DebianPackagesStatus", "SshdConfigFile"]
+    check_ids, conditions = checks.CheckRegistry.PlanChecks(
+        artifacts, os_name="Linux")
+    # Checks are grouped by the artifacts they use.
+    self.assertEqual("SW-CHECK", check_ids[0])
+    self.assertTrue(
+        set(["SW-CHECK", "SSHD-CHECK", "SSHD-PERMS"]).issubset(check_ids))
+    self.assertItemsEqual(
+        checks.CheckRegistry.Conditions(artifacts, os_name="Linux"),
+        conditions)
+    plan = checks.CheckRegistry.PlanChecks(
+        reversed(artifacts), os_name="Linux")
+    self.assertIs(plan[0], check_ids)
+
+    checks.CheckRegistry.RegisterCheck(
+        check=self.sw_chk, source="dpkg.out", overwrite_if_exists=True)
+    plan = checks.CheckRegistry.PlanChecks(artifacts, os_name="Linux")
+    self.assertIsNot(plan[0], check_ids)
+    self.assertEqual(plan[0], check_ids)
+
 
 class ProcessHostDataTests(checks_test_lib.HostCheckTest):
 
@@ -368,6 +393,39 @@ class ProcessHostDataTests(checks_test_lib.HostCheckTest):
     self.assertRanChecks(["SSHD-CHECK"], results)
     self.assertResultEqual(self.sshd, results["SSHD-CHECK"])
 
+  def testProcessHostsInPool(self):
+    hosts_data = [
+        self.SetKnowledgeBase("host%d.example.org" % i, host_os,
+                              dict(self.data))
+        for i, host_os in enumerate(["Linux", "Windows", "Darwin"])
+    ]
+    expected = checks.CheckHosts(hosts_data)
+    results = checks.CheckHosts(hosts_data, processes=2)
+    self.assertEqual(len(results), 3)
+    for host_results, host_expected in zip(results, expected):
+      self.assertItemsEqual([r.check_id for r in host_expected],
+                            [r.check_id for r in host_results])
+      for rslt, expect in zip(
+          sorted(host_results, key=lambda r: r.check_id),
+          sorted(host_expected, key=lambda r: r.check_id)):
+        self.assertResultEqual(expect, rslt)
+
+    linux_results = {r.check_id: r for r in results[0]}
+    self.assertResultEqual(self.netcat, linux_results["SW-CHECK"])
+    self.assertResultEqual(self.sshd, linux_results["SSHD-CHECK"])
+
+  def testProcessHostsWithoutPool(self):
+    host_data = self.SetKnowledgeBase("host.example.org", "Linux", self.data)
+
+    def FailingPool(processes):
+      raise OSError("Can't fork %d processes." % processes)
+
+    with utils.Stubber(checks.multiprocessing, "Pool", FailingPool):
+      results = checks.CheckHosts([host_data], processes=2)
+    self.assertEqual(len(results), 1)
+    linux_results = {r.check_id: r for r in results[0]}
+    self.assertResultEqual(self.netcat, linux_results["SW-CHECK"])
+
 
 class ChecksTestBase(test_lib.GRRBaseTest):
   pass
@@ -526,6 +584,45 @@ class CheckTest(ChecksTestBase):
     pass
 
 
+class FilterCacheTest(ChecksTestBase):
+  """Test the caching of filter results."""
+
+  def setUp(self, **kwargs):
+    super(FilterCacheTest, self).setUp(**kwargs)
+    self.filter = checks.Filter(
+        type="ObjectFilter", expression="name is 'netcat-traditional'")
+    self.cache = checks.FilterCache()
+
+  def testResultsAreReusedForTheSameData(self):
+    data = GetDPKGData()
+    result = self.filter.Parse(data, cache=self.cache)
+    self.assertEqual(1, len(result))
+    self.assertEqual("netcat-traditional", result[0].name)
+    self.assertIs(result, self.filter.Parse(data, cache=self.cache))
+    # Equivalent filters share results.
+    other = checks.Filter(
+        type="ObjectFilter", expression="name is 'netcat-traditional'")
+    self.assertIs(result, other.Parse(data, cache=self.cache))
+
+  def testResultsAreKeyedOnDataAndExpression(self):
+    data = GetDPKGData()
+    result = self.filter.Parse(data, cache=self.cache)
+    self.assertFalse(self.filter.Parse(list(data[:1]), cache=self.cache))
+    other = checks.Filter(type="ObjectFilter", expression="name is 'nothing'")
+    self.assertFalse(other.Parse(data, cache=self.cache))
+    self.assertIs(result, self.filter.Parse(data, cache=self.cache))
+
+  def testChangedDataIsFilteredAgain(self):
+    data = list(GetDPKGData())
+    result = self.filter.Parse(data, cache=self.cache)
+    self.assertEqual(1, len(result))
+
+    data.remove(result[0])
+    self.assertFalse(self.filter.Parse(data, cache=self.cache))
+    data.append(result[0])
+    self.assertEqual(result, self.filter.Parse(data, cache=self.cache))
+
+
 class CheckResultsTest(ChecksTestBase):
   """Test 'CheckResult' operations."""
 
@@ -604,6 +701,102 @@ class HintDefinitionTests(ChecksTestBase):
     self.assertEqual(generic_format.strip(), probe_2.hint.format)
 
 
+class CheckHostsBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark the checks in grr/checks over a fleet of Linux hosts."""
+
+  HOSTS = 10
+
+  def setUp(self):
+    super(CheckHostsBenchmark, self).setUp()
+    self.registered = checks.CheckRegistry.checks
+    checks.CheckRegistry.Clear()
+    checks.LoadChecksFromDirs(
+        [os.path.join(config_lib.CONFIG["Test.srcdir"], "grr", "checks")])
+    self.pam_config = self._GenPamConfig()
+    self.hosts_data = [self._GenHostData(i) for i in range(self.HOSTS)]
+
+  def tearDown(self):
+    checks.CheckRegistry.Clear()
+    for check in self.registered.values():
+      checks.CheckRegistry.RegisterCheck(check, overwrite_if_exists=True)
+    super(CheckHostsBenchmark, self).tearDown()
+
+  def _GenPamConfig(self):
+    """Parses a PAM configuration with a number of services."""
+    contents = ("auth required pam_unix.so\n"
+                "account required pam_access.so\n"
+                "password required pam_unix.so\n"
+                "session optional pam_motd.so\n")
+    services = ["ssh", "login", "sudo", "su", "cron", "other"]
+    stats, files = checks_test_lib.HostCheckTest.GenStatFileData(
+        {"/etc/pam.d/%s" % service: contents for service in services})
+    return list(linux_pam_parser.PAMParser().ParseMultiple(stats, files, None))
+
+  def _GenHostData(self, host_id):
+    """Generates host data for the artifacts used by the checks."""
+    host_data = checks_test_lib.HostCheckTest.SetKnowledgeBase(
+        "host%d.example.org" % host_id, "Linux")
+    modes = [0o0100640, 0o0100666, 0o0040777, 0o0120777]
+    stats = []
+    for i in range(50):
+      stats.append(
+          rdf_client.StatEntry(
+              pathspec=rdf_paths.PathSpec(
+                  path="/etc/file%d" % i, pathtype="OS"),
+              st_uid=i % 3,
+              st_gid=(i + host_id) % 5,
+              st_mode=modes[i % 4]))
+    for artifact in [
+        "RootEnvPath", "RootEnvPathDirs", "UserHomeDirs", "UserDotFiles",
+        "AllShellConfigs", "GlobalShellConfigs", "RootUserShellConfigs",
+        "LinuxLogFiles", "CronAtAllowDenyFiles", "AllLinuxScheduleFiles"
+    ]:
+      host_data[artifact] = {"ANOMALY": [], "PARSER": [], "RAW": list(stats)}
+    host_data["PamConfig"] = {
+        "ANOMALY": [],
+        "PARSER": self.pam_config,
+        "RAW": []
+    }
+    host_data["SshdConfigFile"] = {
+        "ANOMALY": [],
+        "PARSER": GetSSHDConfig(),
+        "RAW": []
+    }
+    processes = [
+        rdf_client.Process(name=name, pid=i, cmdline=[name])
+        for i, name in enumerate(["sshd", "cron", "ntpd", "rsyslogd"] * 10)
+    ]
+    host_data["ListProcessesGrr"] = {
+        "ANOMALY": [],
+        "PARSER": [],
+        "RAW": processes
+    }
+    return host_data
+
+  @test_lib.SetLabel("benchmark")
+  def testCheckHosts(self):
+    """Compare uncached, cached and pooled check runs."""
+
+    class UncachedFilterCache(checks.FilterCache):
+
+      def Parse(self, filter_obj, expression, rdf_data):
+        return list(filter_obj.Parse(rdf_data, expression))
+
+    with utils.Stubber(checks, "FilterCache", UncachedFilterCache):
+      self.TimeIt(
+          lambda: checks.CheckHosts(self.hosts_data),
+          name="Uncached",
+          repetitions=3)
+    self.TimeIt(
+        lambda: checks.CheckHosts(self.hosts_data),
+        name="Cached",
+        repetitions=3)
+    self.TimeIt(
+        lambda: checks.CheckHosts(self.hosts_data, processes=4),
+        name="Cached, 4 processes",
+        repetitions=3)
+
+
 def main(argv):
   # Run the full test suite
   test_lib.GrrTestProgram(argv=argv)
@@ -63,7 +63,7 @@ class BaseHandler(object):
       raise DefinitionError("Filters with invalid expressions: %s" %
                             ", ".join(bad_filters))
 
-  def Parse(self, results):
+  def Parse(self, results, cache=None):
     """Take the results and yield results that passed through the filters."""
     raise NotImplementedError()
 
@@ -71,7 +71,7 @@ class BaseHandler(object):
 class NoOpHandler(BaseHandler):
   """Abstract parser to pass results through parsers serially."""
 
-  def Parse(self, data):
+  def Parse(self, data, cache=None):
     """Take the results and yield results that passed through the filters."""
     return data
 
@@ -79,7 +79,7 @@ class NoOpHandler(BaseHandler):
 class ParallelHandler(BaseHandler):
   """Abstract parser to pass results through parsers in parallel."""
 
-  def Parse(self, raw_data):
+  def Parse(self, raw_data, cache=None):
     """Take the data and yield results that passed through the filters.
 
     The output of each filter is added to a result set. So long as the filter
@@ -88,6 +88,7 @@ class ParallelHandler(BaseHandler):
 
     Args:
       raw_data: An iterable series of rdf values.
+      cache: An optional checks.FilterCache to reuse filter results from.
 
     Returns:
       A list of rdf values that matched at least one filter.
@@ -97,27 +98,28 @@ class ParallelHandler(BaseHandler):
       self.results.update(raw_data)
     else:
       for f in self.filters:
-        self.results.update(f.Parse(raw_data))
+        self.results.update(f.Parse(raw_data, cache=cache))
     return list(self.results)
 
 
 class SerialHandler(BaseHandler):
   """Abstract parser to pass results through parsers serially."""
 
-  def Parse(self, raw_data):
+  def Parse(self, raw_data, cache=None):
     """Take the results and yield results that passed through the filters.
 
     The output of each filter is used as the input for successive filters.
 
     Args:
       raw_data: An iterable series of rdf values.
+      cache: An optional checks.FilterCache to reuse filter results from.
 
     Returns:
       A list of rdf values that matched all filters.
     """
     self.results = raw_data
     for f in self.filters:
-      self.results = f.Parse(self.results)
+      self.results = f.Parse(self.results, cache=cache)
     return self.results
 
 
@@ -222,8 +224,8 @@ class ObjectFilter(Filter):
 
   def _Compile(self, expression):
     try:
-      of = objectfilter.Parser(expression).Parse()
-      return of.Compile(objectfilter.LowercaseAttributeFilterImplementation)
+      return objectfilter.CompileQuery(
+          expression, objectfilter.LowercaseAttributeFilterImplementation)
     except objectfilter.Error as e:
       raise DefinitionError(e)
 
@@ -315,6 +317,8 @@ class StatFilter(Filter):
   """
   _KEYS = {"path_re", "file_re", "file_type", "uid", "gid", "mode", "mask"}
   _UID_GID_RE = re.compile(r"\A(!|>|>=|<=|<|=)([0-9]+)\Z")
+  # Expressions are parsed once and shared by all StatFilters.
+  _PARSED_EXPRESSIONS = utils.FastStore(max_size=1000)
   _PERM_RE = re.compile(r"\A[0-7]{4}\Z")
   _TYPES = {
       "BLOCK": stat.S_ISBLK,
@@ -380,12 +384,19 @@ class StatFilter(Filter):
 
   def _Load(self, expression):
     self._Flush()
+    try:
+      parsed, self.cfg = self._PARSED_EXPRESSIONS.Get(expression)
+      return parsed
+    except KeyError:
+      pass
+
     parser = config_file.KeyValueParser(
         kv_sep=":", sep=",", term=(r"\s+", r"\n"))
     parsed = {}
     for entry in parser.ParseEntries(expression):
       parsed.update(entry)
     self.cfg = rdf_protodict.AttributedDict(parsed)
+    self._PARSED_EXPRESSIONS.Put(expression, (parsed, self.cfg))
     return parsed
 
   def _Initialize(self):
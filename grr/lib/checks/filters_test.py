@@ -2,6 +2,7 @@
 """Tests for grr.lib.checks.filters."""
 import collections
 from grr.lib import flags
+from grr.lib import objectfilter
 from grr.lib import test_lib
 from grr.lib.checks import checks
 from grr.lib.checks import filters
@@ -453,6 +454,55 @@ class HandlerTests(test_lib.GRRBaseTest):
     self.assertItemsEqual(expected, handler.Parse(self.all))
 
 
+class ObjectFilterBenchmark(test_lib.AverageMicroBenchmarks):
+  """Compares interpreted and compiled objectfilter expressions."""
+
+  NUM_OBJECTS = 5000
+
+  def _TimeQuery(self, name, query, objs):
+    filter_imp = objectfilter.LowercaseAttributeFilterImplementation
+    interpreted = objectfilter.Parser(query).Parse().Compile(filter_imp)
+    compiled = objectfilter.CompileQuery(query, filter_imp)
+    self.assertEqual(interpreted.Filter(objs), compiled.Filter(objs))
+
+    self.TimeIt(
+        lambda: interpreted.Filter(objs),
+        name="%s interpreted" % name,
+        repetitions=5)
+    self.TimeIt(
+        lambda: compiled.Filter(objs), name="%s compiled" % name, repetitions=5)
+
+  @test_lib.SetLabel("benchmark")
+  def testStatEntries(self):
+    stats = []
+    for i in range(self.NUM_OBJECTS):
+      stats.append(
+          rdf_client.StatEntry(
+              pathspec=rdf_paths.PathSpec(
+                  path="/etc/file%d" % i if i % 2 else "/var/file%d" % i,
+                  pathtype="OS"),
+              st_mode=0o100644 | (0o002 if i % 7 == 0 else 0),
+              st_uid=i % 3,
+              st_size=i))
+
+    self._TimeQuery("StatEntry", "st_uid == 0 and st_size > 1000 and "
+                    "pathspec.path regexp '^/etc/'", stats)
+
+  @test_lib.SetLabel("benchmark")
+  def testProcesses(self):
+    names = ["sshd", "cron", "nginx", "bash", "python", "java"]
+    processes = []
+    for i in range(self.NUM_OBJECTS):
+      name = names[i % len(names)]
+      processes.append(
+          rdf_client.Process(
+              pid=i, ppid=1, name=name, exe="/usr/bin/%s" % name,
+              cmdline=[name, "-d" if i % 5 else "-f"]))
+
+    self._TimeQuery("Process", "name inset ['sshd', 'cron', 'nginx'] and "
+                    "cmdline contains '-d'", processes)
+
+
 def main(argv):
   test_lib.main(argv)
 
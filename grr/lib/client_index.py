@@ -5,11 +5,18 @@ An index of client machines, associating likely identifiers to client IDs.
 """
 
 
+import threading
+
+
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import keyword_index
 from grr.lib import rdfvalue
+from grr.lib import threadpool
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
+from grr.lib.aff4_objects import standard
+from grr.lib.rdfvalues import aff4_rdfvalues
 from grr.lib.rdfvalues import client as rdf_client
 
 # The system's primary client index.
@@ -147,11 +154,13 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
         start_time=start_time.AsMicroSecondsFromEpoch(),
         end_time=end_time.AsMicroSecondsFromEpoch())
 
-  def AnalyzeClient(self, client):
+  def AnalyzeClient(self, client, labels=None):
     """Finds the client_id and keywords for a client.
 
     Args:
       client: A VFSGRRClient record to find keywords for.
+      labels: Names of the client's labels. Defaults to the labels of the
+        client record.
 
     Returns:
       A tuple (client_id, keywords) where client_id is the client identifier and
@@ -248,7 +257,9 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
         for label in client_info.labels:
           TryAppend("label", label)
 
-    for label in client.GetLabelsNames():
+    if labels is None:
+      labels = client.GetLabelsNames()
+    for label in labels:
       TryAppend("label", label)
 
     return (client_id, keywords)
@@ -269,17 +280,61 @@ class ClientIndex(keyword_index.AFF4KeywordIndex):
     Args:
       client: A VFSGRRClient record.
     """
+    # This might actually delete a keyword with the same name as the label (if
+    # there is one). Usually the client keywords will be rebuilt after the
+    # deletion of the old labels though, so this can only destroy historic
+    # index data; normal search functionality will not be affected.
+    self.RemoveKeywordsForName(
+        self._ClientIdFromURN(client.urn),
+        self._LabelKeywords(client.GetLabelsNames()))
+
+  def _LabelKeywords(self, labels):
     keywords = []
-    for label in client.GetLabelsNames():
+    for label in labels:
       keyword = self._NormalizeKeyword(utils.SmartStr(label))
-      # This might actually delete a keyword with the same name as the label (if
-      # there is one). Usually the client keywords will be rebuilt after the
-      # deletion of the old labels though, so this can only destroy historic
-      # index data; normal search functionality will not be affected.
       keywords.append(keyword)
       keywords.append("label:%s" % keyword)
+    return keywords
+
+  def UpdateClientLabels(self,
+                         client_urn,
+                         added_labels=(),
+                         removed_labels=(),
+                         client=None,
+                         mutation_pool=None):
+    """Updates the label keywords of a client without reanalyzing it.
+
+    A label's name is also a keyword of the client, which may come from other
+    client attributes as well (e.g. a "linux" label on a Linux client).
+
+    Args:
+      client_urn: The client URN.
+      added_labels: Names of labels added to the client.
+      removed_labels: Names of labels the client no longer has.
+      client: An optional VFSGRRClient record with the client's attributes. If
+        given, the keywords of removed labels are removed unless the client
+        still has them otherwise. If not, only the "label:" keywords of
+        removed labels are removed.
+      mutation_pool: An optional MutationPool object to write to.
+    """
+    client_id = self._ClientIdFromURN(client_urn)
+    if removed_labels:
+      keywords = set(self._LabelKeywords(removed_labels))
+      if client is None:
+        keywords = set(k for k in keywords if k.startswith("label:"))
+      else:
+        labels = ((set(client.GetLabelsNames()) - set(removed_labels)) |
+                  set(added_labels))
+        _, client_keywords = self.AnalyzeClient(client, labels=labels)
+        keywords -= set(client_keywords)
 
-    self.RemoveKeywordsForName(self._ClientIdFromURN(client.urn), keywords)
+      self.RemoveKeywordsForName(
+          client_id, keywords, mutation_pool=mutation_pool)
+    if added_labels:
+      self.AddKeywordsForName(
+          client_id,
+          self._LabelKeywords(added_labels),
+          mutation_pool=mutation_pool)
 
 
 def GetClientURNsForHostnames(hostnames, token=None):
@@ -320,6 +375,253 @@ def GetMostRecentClient(client_list, token=None):
   return client_urn
 
 
+class _ClientsLabelsUpdater(threadpool.BatchConverter):
+  """Updates the labels of many clients in parallel batches.
+
+  Clients are not opened: only their type, labels and client info attributes
+  are read, and all the writes to the clients and the client index for a batch
+  go through a single mutation pool.
+  """
+
+  def __init__(self,
+               client_index,
+               batch_size=1000,
+               threadpool_size=10,
+               token=None):
+    super(_ClientsLabelsUpdater, self).__init__(
+        batch_size=batch_size,
+        threadpool_prefix="clients_labels_updater",
+        threadpool_size=threadpool_size)
+    self.client_index = client_index
+    self.token = token
+
+    self.lock = threading.Lock()
+    self.client_urns = []
+
+  def UpdateLabels(self, labels):
+    """Updates the labels of a single client.
+
+    Args:
+      labels: The client's AFF4ObjectLabelsList, to be modified in place.
+
+    Returns:
+      True if the labels were modified.
+    """
+    raise NotImplementedError()
+
+  def ConvertBatch(self, batch):
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+    predicates = [schema.TYPE.predicate, schema.LABELS.predicate]
+
+    client_urns = []
+    # Keys are URNs of clients which lost labels, values are (added, removed)
+    # tuples of label names.
+    removals = {}
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      for subject, values in data_store.DB.MultiResolvePrefix(
+          batch,
+          predicates,
+          timestamp=data_store.DB.NEWEST_TIMESTAMP,
+          token=self.token):
+        values = dict((predicate, value) for predicate, value, _ in values)
+
+        aff4_type = aff4.AFF4Object.classes.get(
+            utils.SmartStr(values.get(schema.TYPE.predicate)))
+        if aff4_type is None or not issubclass(aff4_type,
+                                               aff4_grr.VFSGRRClient):
+          continue
+
+        client_urn = rdfvalue.RDFURN(subject)
+        client_urns.append(client_urn)
+
+        serialized_labels = values.get(schema.LABELS.predicate)
+        if serialized_labels is None:
+          labels = schema.LABELS.attribute_type()
+        else:
+          labels = schema.LABELS.attribute_type.FromSerializedString(
+              serialized_labels)
+        old_names = set(labels.names)
+        if not self.UpdateLabels(labels):
+          continue
+        new_names = set(labels.names)
+
+        aff4.FACTORY.SetAttributes(
+            client_urn, {
+                schema.LABELS: [(labels.SerializeToDataStore(),
+                                 rdfvalue.RDFDatetime.Now())]
+            },
+            set([schema.LABELS]),
+            add_child_index=False,
+            mutation_pool=mutation_pool,
+            token=self.token)
+
+        added_names = new_names - old_names
+        removed_names = old_names - new_names
+        if removed_names:
+          removals[client_urn] = (added_names, removed_names)
+        else:
+          self.client_index.UpdateClientLabels(
+              client_urn,
+              added_labels=added_names,
+              mutation_pool=mutation_pool)
+
+      # The name of a removed label may also be a keyword the client has for
+      # other reasons, so clients losing labels are analyzed to keep those.
+      for client in aff4.FACTORY.MultiOpen(
+          list(removals),
+          aff4_type=aff4_grr.VFSGRRClient,
+          token=self.token):
+        added_names, removed_names = removals[client.urn]
+        self.client_index.UpdateClientLabels(
+            client.urn,
+            added_labels=added_names,
+            removed_labels=removed_names,
+            client=client,
+            mutation_pool=mutation_pool)
+
+    with self.lock:
+      self.client_urns.extend(client_urns)
+
+  def Update(self, client_urns):
+    """Updates the labels of the given clients.
+
+    Args:
+      client_urns: The URNs of the clients to update.
+
+    Returns:
+      A list of URNs of the given clients which exist.
+    """
+    self.client_urns = []
+    self.Convert(list(client_urns))
+    return self.client_urns
+
+
+class _ClientsLabelsAdder(_ClientsLabelsUpdater):
+  """Adds labels to many clients."""
+
+  def __init__(self, labels, owner, **kwargs):
+    super(_ClientsLabelsAdder, self).__init__(**kwargs)
+    self.labels = labels
+    self.owner = owner
+
+  def UpdateLabels(self, labels):
+    modified = False
+    now = rdfvalue.RDFDatetime.Now()
+    for label_name in self.labels:
+      modified |= labels.AddLabel(
+          aff4_rdfvalues.AFF4ObjectLabel(
+              name=label_name, owner=self.owner, timestamp=now))
+    return modified
+
+
+class _ClientsLabelsRemover(_ClientsLabelsUpdater):
+  """Removes labels from many clients."""
+
+  def __init__(self, labels, owner=None, ignored_owners=(), **kwargs):
+    super(_ClientsLabelsRemover, self).__init__(**kwargs)
+    self.labels = set(labels)
+    self.owner = owner
+    self.ignored_owners = set(ignored_owners)
+
+  def UpdateLabels(self, labels):
+    kept_labels = []
+    for label in labels:
+      if (label.name in self.labels and
+          self.owner in (None, label.owner) and
+          label.owner not in self.ignored_owners):
+        continue
+      kept_labels.append(label)
+
+    if len(kept_labels) == len(labels):
+      return False
+
+    labels.labels = kept_labels
+    return True
+
+
+def BulkAddLabels(client_urns,
+                  labels,
+                  owner,
+                  token=None,
+                  client_index=None,
+                  batch_size=1000,
+                  threadpool_size=10):
+  """Adds labels to many clients without opening them.
+
+  Args:
+    client_urns: The URNs of the clients to label.
+    labels: The names of the labels to add.
+    owner: The owner of the added labels.
+    token: The security token to use.
+    client_index: An optional client index to use. If not provided, use the
+      default client index.
+    batch_size: The number of clients written with a single mutation pool.
+    threadpool_size: The number of batches written in parallel.
+
+  Returns:
+    A list of URNs of the given clients which exist.
+  """
+  if client_index is None:
+    client_index = CreateClientIndex(token=token)
+
+  labelled_urns = _ClientsLabelsAdder(
+      labels,
+      owner,
+      client_index=client_index,
+      batch_size=batch_size,
+      threadpool_size=threadpool_size,
+      token=token).Update(client_urns)
+
+  if labelled_urns:
+    with aff4.FACTORY.Create(
+        standard.LabelSet.CLIENT_LABELS_URN,
+        standard.LabelSet,
+        mode="w",
+        token=token) as client_labels_index:
+      for label in labels:
+        client_labels_index.Add(label)
+
+  return labelled_urns
+
+
+def BulkRemoveLabels(client_urns,
+                     labels,
+                     owner=None,
+                     ignored_owners=(),
+                     token=None,
+                     client_index=None,
+                     batch_size=1000,
+                     threadpool_size=10):
+  """Removes labels from many clients without opening them.
+
+  Args:
+    client_urns: The URNs of the clients to unlabel.
+    labels: The names of the labels to remove.
+    owner: If set, only labels of this owner are removed. Otherwise labels of
+      all owners are removed.
+    ignored_owners: Owners whose labels are never removed.
+    token: The security token to use.
+    client_index: An optional client index to use. If not provided, use the
+      default client index.
+    batch_size: The number of clients written with a single mutation pool.
+    threadpool_size: The number of batches written in parallel.
+
+  Returns:
+    A list of URNs of the given clients which exist.
+  """
+  if client_index is None:
+    client_index = CreateClientIndex(token=token)
+
+  return _ClientsLabelsRemover(
+      labels,
+      owner=owner,
+      ignored_owners=ignored_owners,
+      client_index=client_index,
+      batch_size=batch_size,
+      threadpool_size=threadpool_size,
+      token=token).Update(client_urns)
+
+
 def BulkLabel(label, hostnames, token=None, client_index=None):
   """Assign a label to a group of clients based on hostname.
 
@@ -349,27 +651,30 @@ def BulkLabel(label, hostnames, token=None, client_index=None):
   # If a labelled client fqdn isn't in the set of target fqdns remove the label.
   # Labelled clients with a target fqdn need no action and are removed from the
   # set of target fqdns.
-  for client in aff4.FACTORY.MultiOpen(
-      labelled_urns, token=token, aff4_type=aff4_grr.VFSGRRClient, mode="rw"):
-    fqdn = utils.SmartStr(client.Get("FQDN")).lower()
-    if fqdn not in fqdns:
-      client_index.RemoveClientLabels(client)
-      client.RemoveLabels(label, owner="GRR")
-      client.Flush()
-      client_index.AddClient(client)
-    else:
+  fqdn_attribute = aff4_grr.VFSGRRClient.SchemaCls.FQDN
+  unlabelled_urns = set(labelled_urns)
+  for subject, values in data_store.DB.MultiResolvePrefix(
+      labelled_urns, [fqdn_attribute.predicate],
+      timestamp=data_store.DB.NEWEST_TIMESTAMP,
+      token=token):
+    fqdn = utils.SmartStr(values[0][1]).lower()
+    if fqdn in fqdns:
+      unlabelled_urns.discard(rdf_client.ClientURN(subject))
       fqdns.discard(fqdn)
 
+  BulkRemoveLabels(
+      unlabelled_urns, [label],
+      owner="GRR",
+      token=token,
+      client_index=client_index)
+
   # The residual set of fqdns needs labelling.
-  # Get the latest URN for these clients and open them to add the label.
+  # Get the latest URN for these clients and label them.
   urns = []
   keywords = ["+host:%s" % fqdn for fqdn in fqdns]
   for client_list in client_index.ReadClientPostingLists(keywords).itervalues():
     for client_id in client_list:
       urns.append(rdfvalue.RDFURN(client_id))
 
-  for client in aff4.FACTORY.MultiOpen(
-      urns, token=token, aff4_type=aff4_grr.VFSGRRClient, mode="rw"):
-    client.AddLabels(label, owner="GRR")
-    client.Flush()
-    client_index.AddClient(client)
+  BulkAddLabels(
+      urns, [label], owner="GRR", token=token, client_index=client_index)
@@ -287,6 +287,143 @@ class ClientIndexTest(test_lib.AFF4ObjectTest):
     self.assertItemsEqual(
         index.LookupClients(["label-1"]), [m[host] for host in hosts])
 
+  def testBulkAddAndRemoveLabels(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/client-index5/",
+        aff4_type=client_index.ClientIndex,
+        mode="rw",
+        token=self.token)
+
+    client_urns = self.SetupClients(3)
+    with aff4.FACTORY.Open(
+        client_urns[0], mode="rw", token=self.token) as client:
+      client.AddLabels("label-0", owner="GRR")
+      index.AddClient(client)
+    missing_urn = rdf_client.ClientURN("C.1000000000000009")
+
+    labelled_urns = client_index.BulkAddLabels(
+        client_urns + [missing_urn], ["label-0", "label-1"],
+        owner="test",
+        token=self.token,
+        client_index=index,
+        batch_size=2)
+    self.assertItemsEqual(labelled_urns, client_urns)
+    self.assertItemsEqual(index.LookupClients(["label:label-1"]), client_urns)
+    self.assertItemsEqual(index.LookupClients(["label-0"]), client_urns)
+
+    for client in aff4.FACTORY.MultiOpen(client_urns, token=self.token):
+      self.assertItemsEqual(client.GetLabelsNames(owner="test"),
+                            ["label-0", "label-1"])
+    self.assertIn("label-1",
+                  aff4_grr.GetAllClientLabels(token=self.token))
+
+    # Only the labels of the given owner are removed.
+    client_index.BulkRemoveLabels(
+        client_urns, ["label-0"],
+        owner="test",
+        token=self.token,
+        client_index=index,
+        batch_size=2)
+    self.assertItemsEqual(index.LookupClients(["label:label-0"]),
+                          client_urns[:1])
+    self.assertItemsEqual(index.LookupClients(["label:label-1"]), client_urns)
+
+    client_index.BulkRemoveLabels(
+        client_urns, ["label-0", "label-1"],
+        ignored_owners=["GRR"],
+        token=self.token,
+        client_index=index)
+    self.assertItemsEqual(index.LookupClients(["label:label-0"]),
+                          client_urns[:1])
+    self.assertEqual(index.LookupClients(["label:label-1"]), [])
+
+    client = aff4.FACTORY.Open(client_urns[0], token=self.token)
+    self.assertEqual(client.GetLabelsNames(), ["label-0"])
+    self.assertEqual(client.GetLabels()[0].owner, "GRR")
+
+
+  def testBulkRemoveLabelsKeepsOtherKeywordsOfTheClient(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/client-index5/",
+        aff4_type=client_index.ClientIndex,
+        mode="rw",
+        token=self.token)
+
+    client_urns = self.SetupClients(2, system="Linux")
+    for client in aff4.FACTORY.MultiOpen(client_urns, token=self.token):
+      index.AddClient(client)
+
+    client_index.BulkAddLabels(
+        client_urns, ["linux", "label-0"],
+        owner="test",
+        token=self.token,
+        client_index=index)
+    client_index.BulkRemoveLabels(
+        client_urns, ["linux", "label-0"],
+        owner="test",
+        token=self.token,
+        client_index=index)
+
+    self.assertItemsEqual(index.LookupClients(["linux"]), client_urns)
+    self.assertEqual(index.LookupClients(["label:linux"]), [])
+    self.assertEqual(index.LookupClients(["label-0"]), [])
+    self.assertEqual(index.LookupClients(["label:label-0"]), [])
+
+
+class ClientIndexBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark labeling many clients one by one and in bulk."""
+
+  def _LabelClientsOneByOne(self, client_urns, label, index):
+    for client in aff4.FACTORY.MultiOpen(
+        client_urns,
+        aff4_type=aff4_grr.VFSGRRClient,
+        mode="rw",
+        token=self.token):
+      client.AddLabels(label)
+      index.AddClient(client)
+      client.Close()
+
+  def _UnlabelClientsOneByOne(self, client_urns, label, index):
+    for client in aff4.FACTORY.MultiOpen(
+        client_urns,
+        aff4_type=aff4_grr.VFSGRRClient,
+        mode="rw",
+        token=self.token):
+      index.RemoveClientLabels(client)
+      client.RemoveLabels(label)
+      index.AddClient(client)
+      client.Close()
+
+  @test_lib.SetLabel("benchmark")
+  def testLabelClients(self):
+    client_count = 200
+    index = client_index.CreateClientIndex(token=self.token)
+    client_urns = self.SetupClients(client_count)
+
+    labels = iter(range(1000))
+
+    def LabelClients(add, remove):
+      label = "label-%d" % next(labels)
+      add(label)
+      remove(label)
+
+    self.TimeIt(
+        lambda: LabelClients(
+            lambda l: self._LabelClientsOneByOne(client_urns, l, index),
+            lambda l: self._UnlabelClientsOneByOne(client_urns, l, index)),
+        name="One by one, %d clients" % client_count,
+        repetitions=3)
+    self.TimeIt(
+        lambda: LabelClients(
+            lambda l: client_index.BulkAddLabels(
+                client_urns, [l], owner="test", token=self.token,
+                client_index=index),
+            lambda l: client_index.BulkRemoveLabels(
+                client_urns, [l], owner="test", token=self.token,
+                client_index=index)),
+        name="Bulk, %d clients" % client_count,
+        repetitions=3)
+
 
 def main(argv):
   test_lib.main(argv)
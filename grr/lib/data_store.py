@@ -139,33 +139,9 @@ class MutationPool(object):
 
   def Flush(self):
     """Flushing actually applies all the operations in the pool."""
-    DB.DeleteSubjects(
-        self.delete_subject_requests, token=self.token, sync=False)
-
-    for req in self.delete_attributes_requests:
-      subject, attributes, start, end = req
-      DB.DeleteAttributes(
-          subject,
-          attributes,
-          start=start,
-          end=end,
-          token=self.token,
-          sync=False)
-
-    for req in self.set_requests:
-      subject, values, timestamp, replace, to_delete = req
-      DB.MultiSet(
-          subject,
-          values,
-          timestamp=timestamp,
-          replace=replace,
-          to_delete=to_delete,
-          token=self.token,
-          sync=False)
-
     if (self.delete_subject_requests or self.delete_attributes_requests or
         self.set_requests):
-      DB.Flush()
+      DB.ApplyMutations(self, token=self.token)
 
     self.delete_subject_requests = []
     self.set_requests = []
@@ -434,6 +410,40 @@ class DataStore(object):
       token: An ACL token.
     """
 
+  def ApplyMutations(self, mutations, sync=True, token=None):
+    """Applies a batch of mutations.
+
+    Subjects are deleted first, then attributes, and then values are set, each
+    in the order they were queued. This implementation replays every mutation
+    as a single data store call, data stores which can apply many mutations at
+    once should override it.
+
+    Args:
+      mutations: A MutationPool holding the mutations.
+      sync: If true we block until the operations complete.
+      token: An ACL token.
+    """
+    self.DeleteSubjects(
+        mutations.delete_subject_requests, sync=False, token=token)
+
+    for subject, attributes, start, end in mutations.delete_attributes_requests:
+      self.DeleteAttributes(
+          subject, attributes, start=start, end=end, sync=False, token=token)
+
+    for (subject, values, timestamp, replace,
+         to_delete) in mutations.set_requests:
+      self.MultiSet(
+          subject,
+          values,
+          timestamp=timestamp,
+          replace=replace,
+          to_delete=to_delete,
+          sync=False,
+          token=token)
+
+    if sync:
+      self.Flush()
+
   def Resolve(self, subject, attribute, token=None):
     """Retrieve a value set for a subject's attribute.
 
@@ -1856,6 +1856,41 @@ class _DataStoreTest(test_lib.GRRBaseTest):
     self.assertEqual(stored, "hello")
     self.assertEqual(type(stored), str)
 
+  @DeletionTest
+  def testPoolAppliesMutationsInOrder(self):
+    predicate = "metadata:predicate"
+    other_row = "aff4:/C.1000000000000000/row"
+    deleted_row = "aff4:/deleted_row"
+    data_store.DB.Set(deleted_row, predicate, "hello", token=self.token)
+    data_store.DB.Set(other_row, predicate, "old", token=self.token)
+
+    with data_store.DB.GetMutationPool(token=self.token) as pool:
+      for i in range(10):
+        pool.Set(self.test_row, predicate, "value%d" % i, timestamp=1000 + i,
+                 replace=False)
+      pool.DeleteSubject(deleted_row)
+      pool.Set(other_row, predicate, "new", replace=False, timestamp=2000)
+      pool.MultiSet(other_row, {"metadata:other": ["other"]},
+                    to_delete=[predicate])
+      pool.Set(other_row, predicate, "newest", replace=False, timestamp=3000)
+
+    values = data_store.DB.ResolvePrefix(
+        self.test_row, predicate, timestamp=data_store.DB.ALL_TIMESTAMPS,
+        token=self.token)
+    self.assertEqual(len(values), 10)
+    self.assertEqual(values[0][1:], ("value9", 1009))
+
+    values = data_store.DB.ResolvePrefix(
+        other_row, "metadata:", timestamp=data_store.DB.ALL_TIMESTAMPS,
+        token=self.token)
+    self.assertItemsEqual([v[:2] for v in values],
+                          [("metadata:other", "other"),
+                           (predicate, "newest")])
+
+    stored, _ = data_store.DB.Resolve(
+        deleted_row, predicate, token=self.token)
+    self.assertIsNone(stored)
+
   @DeletionTest
   def testPoolDeleteAttributes(self):
     predicate = "metadata:predicate"
@@ -2633,6 +2668,7 @@ class DataStoreBenchmarks(test_lib.MicroBenchmarks):
 
     self.BenchmarkWriting()
     self.BenchmarkReading()
+    self.BenchmarkMutationPool()
 
     self.BenchmarkWritingThreaded()
     self.BenchmarkReadingThreaded()
@@ -2744,6 +2780,47 @@ class DataStoreBenchmarks(test_lib.MicroBenchmarks):
     self.AddResult("Get large values", (end_time - start_time) / self.small_n,
                    self.small_n)
 
+  def BenchmarkMutationPool(self):
+
+    value = os.urandom(100)
+
+    def ReplayMutations(pool):
+      data_store.DataStore.ApplyMutations(data_store.DB, pool, token=self.token)
+
+    def ApplyMutations(pool):
+      data_store.DB.ApplyMutations(pool, token=self.token)
+
+    for name, apply_mutations in [("replayed", ReplayMutations),
+                                  ("applied", ApplyMutations)]:
+      # Many values of a single subject, like a collection would write.
+      pool = data_store.DB.GetMutationPool(token=self.token)
+      for i in xrange(self.n):
+        pool.Set("aff4:/pool_%s_row" % name,
+                 "task:flow%d" % i,
+                 value,
+                 replace=False)
+
+      start_time = time.time()
+      apply_mutations(pool)
+      end_time = time.time()
+
+      self.AddResult("Pool set attributes, %s" % name,
+                     (end_time - start_time) / self.n, self.n)
+
+      # Values of subjects spread across clients.
+      pool = data_store.DB.GetMutationPool(token=self.token)
+      for i in xrange(self.n):
+        pool.MultiSet("aff4:/C.%016X/pool_%s_row" % (i % 10, name),
+                      {"task:flow%d" % i: [value]},
+                      replace=False)
+
+      start_time = time.time()
+      apply_mutations(pool)
+      end_time = time.time()
+
+      self.AddResult("Pool set rows, %s" % name,
+                     (end_time - start_time) / self.n, self.n)
+
   def BenchmarkWritingThreaded(self):
 
     subject_template = "aff4:/threadedrow%d"
@@ -136,6 +136,7 @@ class CloudBigTableDataStore(data_store.DataStore):
       },
       "index": {},
       "notify": {},
+      "notify_bucket": {},
       "kw_index": {},
       "task": {},
   }
@@ -215,19 +216,27 @@ class CloudBigTableDataStore(data_store.DataStore):
     if not table:
       table = btinstance.table(tablename)
       table.create()
-      for column, gc_rules in self.COLUMN_FAMILIES.iteritems():
-        gc_rule = None
-        if gc_rules:
-          age = gc_rules.get("age", None)
-          if age:
-            gc_rule = bigtable.column_family.MaxAgeGCRule(age)
-
-          version_max = gc_rules.get("versions", None)
-          if version_max:
-            gc_rule = bigtable.column_family.MaxVersionsGCRule(version_max)
-
-        cf = table.column_family(column, gc_rule=gc_rule)
-        cf.create()
+      existing_families = {}
+    else:
+      # Tables created by older versions may lack newer column families.
+      existing_families = table.list_column_families()
+
+    for column, gc_rules in self.COLUMN_FAMILIES.iteritems():
+      if column in existing_families:
+        continue
+
+      gc_rule = None
+      if gc_rules:
+        age = gc_rules.get("age", None)
+        if age:
+          gc_rule = bigtable.column_family.MaxAgeGCRule(age)
+
+        version_max = gc_rules.get("versions", None)
+        if version_max:
+          gc_rule = bigtable.column_family.MaxVersionsGCRule(version_max)
+
+      cf = table.column_family(column, gc_rule=gc_rule)
+      cf.create()
 
     return btinstance
 
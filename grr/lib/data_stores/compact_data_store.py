@@ -0,0 +1,570 @@
+#!/usr/bin/env python
+"""A compact in-memory data store for large scale benchmarks.
+
+Like the FakeDataStore everything is kept in memory, but the layout is chosen
+so that millions of rows fit in memory and many threads can use the store at
+once:
+
+- Subjects and attribute names are kept as (interned) byte strings.
+- All the versions of an attribute are kept in a single flat tuple of
+  (timestamp, value, timestamp, value, ...), sorted by timestamp.
+- A sorted index of subjects, which new subjects are merged into, serves prefix
+  scans without sorting all the subjects on every scan.
+- Rows are guarded by a fixed number of striped locks instead of a single
+  store-wide lock.
+
+The contents of the store can be saved to disk and loaded again, so that large
+fixtures only have to be built once.
+"""
+
+
+import bisect
+import marshal
+import os
+import sys
+import threading
+import time
+
+from grr.lib import data_store
+from grr.lib import rdfvalue
+from grr.lib import utils
+
+
+def _Versions(cell):
+  """Returns the (value, timestamp) pairs of a cell, oldest first."""
+  return zip(cell[1::2], cell[::2])
+
+
+class CompactDBSubjectLock(data_store.DBSubjectLock):
+  """A subject lock kept in the memory of the compact data store."""
+
+  def _Acquire(self, lease_time):
+    self.expires = int((time.time() + lease_time) * 1e6)
+    with self.store.GetStripeLock(self.subject):
+      expires = self.store.transactions.get(self.subject)
+      if expires and (time.time() * 1e6) < expires:
+        raise data_store.DBSubjectLockError("Subject is locked")
+      self.store.transactions[self.subject] = self.expires
+      self.locked = True
+
+  def UpdateLease(self, duration):
+    self.expires = int((time.time() + duration) * 1e6)
+    with self.store.GetStripeLock(self.subject):
+      self.store.transactions[self.subject] = self.expires
+
+  def Release(self):
+    with self.store.GetStripeLock(self.subject):
+      if self.locked:
+        self.store.transactions.pop(self.subject, None)
+        self.locked = False
+
+
+class CompactDataStore(data_store.DataStore):
+  """A compact in-memory data store with striped locks."""
+
+  # The number of locks rows are distributed over.
+  LOCK_STRIPES = 64
+
+  # The index is compacted once this fraction of it are deleted subjects.
+  DELETED_SUBJECTS_RATIO = 0.5
+
+  # Up to this many new subjects are inserted into the index one by one, more
+  # are merged into it by sorting.
+  INSORT_LIMIT = 64
+
+  # The number of subjects scans read from the index at once.
+  SCAN_BATCH_SIZE = 1000
+
+  def __init__(self):
+    super(CompactDataStore, self).__init__()
+    self.stripe_locks = [threading.RLock() for _ in range(self.LOCK_STRIPES)]
+    # The set of all transactions in flight.
+    self.transactions = {}
+    self._InitRows({})
+
+  def _InitRows(self, rows):
+    """Replaces the contents of the store.
+
+    Args:
+      rows: A dict of rows keyed by subject. Rows are dicts keyed by attribute,
+        with cells holding the versions of the attribute as values.
+    """
+    self.index_lock = threading.Lock()
+    self.rows = rows
+    # Subjects of the rows in sorted order. Subjects added since the index was
+    # last read are kept in unsorted_subjects, subjects deleted since it was
+    # last compacted in deleted_subjects.
+    self.sorted_subjects = sorted(rows)
+    self.unsorted_subjects = []
+    self.deleted_subjects = set()
+
+  def GetStripeLock(self, subject):
+    return self.stripe_locks[hash(subject) % self.LOCK_STRIPES]
+
+  def _Encode(self, value):
+    """Encodes the value into one of the types supported by the store.
+
+    The data store only supports the following values:
+      -Integer
+      -Unicode
+      -Bytes (python string)
+
+    We preserve integers and unicode objects, but serialize anything else.
+
+    Args:
+       value: The value to be encoded.
+
+    Returns:
+      An encoded value.
+    """
+    if isinstance(value, (basestring, int, float)):
+      return value
+
+    try:
+      return value.SerializeToDataStore()
+    except AttributeError:
+      try:
+        return value.SerializeToString()
+      except AttributeError:
+        return utils.SmartStr(value)
+
+  def _GetRow(self, subject, create=False):
+    """Returns the row of a subject, the stripe lock must be held."""
+    row = self.rows.get(subject)
+    if row is None and create:
+      row = self.rows[subject] = {}
+      with self.index_lock:
+        # A subject deleted since the last compaction is still in the index.
+        if subject in self.deleted_subjects:
+          self.deleted_subjects.discard(subject)
+        else:
+          self.unsorted_subjects.append(subject)
+
+    return row
+
+  def _DropRow(self, subject):
+    """Deletes the row of a subject, the stripe lock must be held."""
+    if self.rows.pop(subject, None) is None:
+      return
+
+    with self.index_lock:
+      self.deleted_subjects.add(subject)
+
+  def _UpdateSortedSubjects(self):
+    """Merges new subjects into the index, the index lock must be held."""
+    if self.unsorted_subjects:
+      if len(self.unsorted_subjects) <= self.INSORT_LIMIT:
+        for subject in self.unsorted_subjects:
+          bisect.insort(self.sorted_subjects, subject)
+      else:
+        # Sorting two sorted runs is linear in the size of the index.
+        self.unsorted_subjects.sort()
+        self.sorted_subjects.extend(self.unsorted_subjects)
+        self.sorted_subjects.sort()
+      self.unsorted_subjects = []
+
+    if (len(self.deleted_subjects) >
+        len(self.sorted_subjects) * self.DELETED_SUBJECTS_RATIO):
+      self.sorted_subjects = [
+          s for s in self.sorted_subjects if s not in self.deleted_subjects
+      ]
+      self.deleted_subjects = set()
+
+  def _IterSortedSubjects(self, start="", after=None):
+    """Yields the subjects of the index in sorted order.
+
+    The index changes while subjects are yielded, so it is read in batches,
+    each of them starting after the last subject yielded.
+
+    Args:
+      start: Only subjects from this one on are yielded.
+      after: If given, only subjects after this one are yielded.
+
+    Yields:
+      Subjects, which may include subjects deleted since the index was last
+      compacted.
+    """
+    while True:
+      with self.index_lock:
+        self._UpdateSortedSubjects()
+        if after is None:
+          position = bisect.bisect_left(self.sorted_subjects, start)
+        else:
+          position = bisect.bisect_right(self.sorted_subjects, after)
+        batch = self.sorted_subjects[position:position + self.SCAN_BATCH_SIZE]
+
+      for subject in batch:
+        yield subject
+
+      if len(batch) < self.SCAN_BATCH_SIZE:
+        return
+      after = batch[-1]
+
+  def _TimestampRange(self, timestamp):
+    if timestamp in [None, self.NEWEST_TIMESTAMP, self.ALL_TIMESTAMPS]:
+      return 0, (2**63) - 1
+    # Does timestamp represent a range?
+    elif isinstance(timestamp, (list, tuple)):
+      start, end = timestamp  # pylint: disable=unpacking-non-sequence
+      return int(start), int(end)
+    else:
+      raise ValueError("Invalid timestamp: %s" % timestamp)
+
+  def DeleteSubject(self, subject, sync=False, token=None):
+    _ = sync
+    self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+    subject = utils.SmartStr(subject)
+    with self.GetStripeLock(subject):
+      self._DropRow(subject)
+
+  def Clear(self):
+    for lock in self.stripe_locks:
+      lock.acquire()
+    try:
+      self._InitRows({})
+    finally:
+      for lock in self.stripe_locks:
+        lock.release()
+
+  def DBSubjectLock(self, subject, lease_time=None, token=None):
+    return CompactDBSubjectLock(
+        self, subject, lease_time=lease_time, token=token)
+
+  def _SetValues(self, row, attribute, values, replace):
+    """Adds (value, timestamp) pairs to a cell, the stripe lock must be held."""
+    attribute = intern(utils.SmartStr(attribute))
+    if replace or attribute not in row:
+      versions = []
+    else:
+      versions = _Versions(row[attribute])
+
+    for value, timestamp in values:
+      versions.append((self._Encode(value), int(timestamp)))
+
+    # Versions with equal timestamps keep the order they were set in.
+    versions.sort(key=lambda x: x[1])
+    cell = []
+    for value, timestamp in versions:
+      cell.append(timestamp)
+      cell.append(value)
+    row[attribute] = tuple(cell)
+
+  def Set(self,
+          subject,
+          attribute,
+          value,
+          timestamp=None,
+          token=None,
+          replace=True,
+          sync=True):
+    """Set the value into the data store."""
+    _ = sync
+    self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+
+    if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
+      timestamp = time.time() * 1000000
+
+    subject = utils.SmartStr(subject)
+    with self.GetStripeLock(subject):
+      self._SetValues(
+          self._GetRow(subject, create=True), attribute, [(value, timestamp)],
+          replace)
+
+  def MultiSet(self,
+               subject,
+               values,
+               timestamp=None,
+               token=None,
+               replace=True,
+               sync=True,
+               to_delete=None):
+    _ = sync
+    self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+
+    if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
+      timestamp = time.time() * 1000000
+
+    subject = utils.SmartStr(subject)
+    with self.GetStripeLock(subject):
+      if to_delete:
+        self.DeleteAttributes(subject, to_delete, token=token)
+
+      row = self._GetRow(subject, create=True)
+      for attribute, seq in values.items():
+        attribute_values = []
+        for v in seq:
+          if isinstance(v, (list, tuple)):
+            v, element_timestamp = v
+          else:
+            element_timestamp = timestamp
+          if element_timestamp is None:
+            element_timestamp = time.time() * 1000000
+          attribute_values.append((v, element_timestamp))
+
+        self._SetValues(row, attribute, attribute_values, replace)
+
+  def DeleteAttributes(self,
+                       subject,
+                       attributes,
+                       start=None,
+                       end=None,
+                       token=None,
+                       sync=None):
+    _ = sync  # Unimplemented.
+    self.security_manager.CheckDataStoreAccess(token, [subject], "w")
+
+    if isinstance(attributes, basestring):
+      raise ValueError(
+          "String passed to DeleteAttributes (non string iterable expected).")
+
+    start = int(start or 0)
+    if end is None:
+      end = (2**63) - 1  # sys.maxint
+    end = int(end)
+
+    subject = utils.SmartStr(subject)
+    with self.GetStripeLock(subject):
+      row = self._GetRow(subject)
+      if row is None:
+        return
+
+      for attribute in attributes:
+        attribute = utils.SmartStr(attribute)
+        cell = row.get(attribute)
+        if cell is None:
+          continue
+
+        new_cell = []
+        for value, timestamp in _Versions(cell):
+          if not start <= timestamp <= end:
+            new_cell.append(timestamp)
+            new_cell.append(value)
+
+        if new_cell:
+          row[attribute] = tuple(new_cell)
+        else:
+          del row[attribute]
+
+  def ScanAttributes(self,
+                     subject_prefix,
+                     attributes,
+                     after_urn="",
+                     max_records=None,
+                     token=None,
+                     relaxed_order=False):
+    subject_prefix = utils.SmartStr(rdfvalue.RDFURN(subject_prefix))
+    if subject_prefix[-1] != "/":
+      subject_prefix += "/"
+    self.security_manager.CheckDataStoreAccess(token, [subject_prefix], "qr")
+
+    if after_urn:
+      subjects = self._IterSortedSubjects(after=utils.SmartStr(after_urn))
+    else:
+      subjects = self._IterSortedSubjects(start=subject_prefix)
+    attributes = [utils.SmartStr(a) for a in attributes]
+
+    return_count = 0
+    for subject in subjects:
+      if not subject.startswith(subject_prefix):
+        break
+      if max_records and return_count >= max_records:
+        break
+
+      with self.GetStripeLock(subject):
+        row = self._GetRow(subject)
+        if row is None:
+          continue
+
+        results = {}
+        for attribute in attributes:
+          cell = row.get(attribute)
+          if cell:
+            results[attribute] = (cell[-2], cell[-1])
+
+      if results:
+        return_count += 1
+        yield (utils.SmartUnicode(subject), results)
+
+  def ResolveMulti(self,
+                   subject,
+                   attributes,
+                   timestamp=None,
+                   limit=None,
+                   token=None):
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attributes))
+
+    # Does timestamp represent a range?
+    if isinstance(timestamp, (list, tuple)):
+      start, end = timestamp  # pylint: disable=unpacking-non-sequence
+    else:
+      start, end = -1, 1 << 65
+
+    start = int(start)
+    end = int(end)
+
+    if isinstance(attributes, str):
+      attributes = [attributes]
+
+    subject = utils.SmartStr(subject)
+    results = []
+    with self.GetStripeLock(subject):
+      row = self._GetRow(subject)
+      if row is None:
+        return
+
+      # Return the results in the same order they requested.
+      for attribute in attributes:
+        cell = row.get(utils.SmartStr(attribute))
+        if not cell:
+          continue
+
+        if timestamp == self.NEWEST_TIMESTAMP:
+          versions = [(cell[-1], cell[-2])]
+        else:
+          versions = [(value, ts)
+                      for value, ts in reversed(_Versions(cell))
+                      if start <= ts <= end]
+
+        for value, ts in versions:
+          results.append((attribute, value, ts))
+          if limit and len(results) >= limit:
+            break
+
+        if limit and len(results) >= limit:
+          break
+
+    for result in results:
+      yield result
+
+  def MultiResolvePrefix(self,
+                         subjects,
+                         attribute_prefix,
+                         token=None,
+                         timestamp=None,
+                         limit=None):
+    required_access = self.GetRequiredResolveAccess(attribute_prefix)
+
+    result = {}
+    for subject in subjects:
+      # If any of the subjects is forbidden we fail the entire request.
+      self.security_manager.CheckDataStoreAccess(token, [subject],
+                                                 required_access)
+
+      values = self.ResolvePrefix(
+          subject,
+          attribute_prefix,
+          token=token,
+          timestamp=timestamp,
+          limit=limit)
+
+      if not values:
+        continue
+
+      result[subject] = values
+      if limit:
+        limit -= len(values)
+        if limit <= 0:
+          break
+
+    return result.iteritems()
+
+  def Flush(self):
+    pass
+
+  def ResolvePrefix(self,
+                    subject,
+                    attribute_prefix,
+                    token=None,
+                    timestamp=None,
+                    limit=None):
+    """Resolve all attributes for a subject starting with a prefix."""
+    self.security_manager.CheckDataStoreAccess(
+        token, [subject], self.GetRequiredResolveAccess(attribute_prefix))
+
+    start, end = self._TimestampRange(timestamp)
+
+    if isinstance(attribute_prefix, basestring):
+      prefixes = utils.SmartStr(attribute_prefix)
+    else:
+      prefixes = tuple(utils.SmartStr(prefix) for prefix in attribute_prefix)
+
+    subject = utils.SmartStr(subject)
+    results = []
+    with self.GetStripeLock(subject):
+      row = self._GetRow(subject)
+      if row is None:
+        return []
+
+      for attribute in sorted(a for a in row if a.startswith(prefixes)):
+        cell = row[attribute]
+        if timestamp == self.NEWEST_TIMESTAMP:
+          first = len(cell) - 2
+        else:
+          first = 0
+
+        # Return triples (attribute_name, data, timestamp), newest first.
+        for i in xrange(len(cell) - 2, first - 1, -2):
+          ts = cell[i]
+          if start <= ts <= end:
+            results.append((attribute, cell[i + 1], ts))
+            if limit and len(results) >= limit:
+              return results
+
+    return results
+
+  def Size(self):
+    total_size = sys.getsizeof(self.rows) + sys.getsizeof(self.sorted_subjects)
+    for subject, row in self.rows.iteritems():
+      total_size += sys.getsizeof(subject)
+      total_size += sys.getsizeof(row)
+      for cell in row.itervalues():
+        total_size += sys.getsizeof(cell)
+        for item in cell:
+          total_size += sys.getsizeof(item)
+    return total_size
+
+  def SaveSnapshot(self, path):
+    """Writes the contents of the store to a file.
+
+    The snapshot uses the marshal format, so it can only be loaded by the same
+    Python version.
+
+    Args:
+      path: The file to write.
+    """
+    for lock in self.stripe_locks:
+      lock.acquire()
+    try:
+      tmp_path = "%s.tmp" % path
+      with open(tmp_path, "wb") as fd:
+        marshal.dump(self.rows, fd)
+      os.rename(tmp_path, path)
+    finally:
+      for lock in self.stripe_locks:
+        lock.release()
+
+  def LoadSnapshot(self, path):
+    """Replaces the contents of the store with a snapshot.
+
+    Args:
+      path: A file written by SaveSnapshot().
+    """
+    with open(path, "rb") as fd:
+      rows = marshal.load(fd)
+
+    for lock in self.stripe_locks:
+      lock.acquire()
+    try:
+      self._InitRows(rows)
+    finally:
+      for lock in self.stripe_locks:
+        lock.release()
+
+  def PrintSubjects(self, literal=None):
+    for s in self._IterSortedSubjects():
+      if s not in self.rows:
+        continue
+      if literal and literal not in s:
+        continue
+      print s
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""The benchmark tests for the compact data store."""
+
+
+import os
+import threading
+import time
+
+
+from grr.lib import data_store_test
+from grr.lib import flags
+from grr.lib import test_lib
+
+from grr.lib.data_stores import compact_data_store
+from grr.lib.data_stores import compact_data_store_test
+from grr.lib.data_stores import fake_data_store
+
+
+class CompactDataStoreBenchmarks(compact_data_store_test.CompactTestMixin,
+                                 data_store_test.DataStoreBenchmarks):
+  """Benchmark the compact data store."""
+
+
+class CompactDataStoreCSVBenchmarks(compact_data_store_test.CompactTestMixin,
+                                    data_store_test.DataStoreCSVBenchmarks):
+  """Benchmark the compact data store."""
+
+
+class InMemoryDataStoresBenchmark(test_lib.MicroBenchmarks):
+  """Compares the in-memory data stores on a fixture with many subjects."""
+
+  units = "s"
+
+  SUBJECTS = 5000
+  THREADS = 4
+  SCANS = 100
+
+  def setUp(self):
+    super(InMemoryDataStoresBenchmark, self).setUp(["Size (MB)"], ["<20"])
+
+  def _Subject(self, i):
+    return "aff4:/C.%016X/fs/os/%d" % (i % 1000, i)
+
+  def _Fill(self, store):
+
+    def Writer(first):
+      for i in xrange(first, self.SUBJECTS, self.THREADS):
+        store.MultiSet(
+            self._Subject(i), {
+                "aff4:type": ["VFSDirectory"],
+                "metadata:last": [i],
+                "aff4:stat": ["x" * 100],
+                "index:dir/%d" % i: [(str(i), 1000), (str(i), 2000)]
+            },
+            replace=False,
+            token=self.token)
+
+    writers = [
+        threading.Thread(target=Writer, args=(i,)) for i in range(self.THREADS)
+    ]
+    for writer in writers:
+      writer.start()
+    for writer in writers:
+      writer.join()
+
+  def _Benchmark(self, name, store):
+    store.security_manager = test_lib.MockSecurityManager()
+
+    start_time = time.time()
+    self._Fill(store)
+    self.AddResult("%s: %d threads writing" % (name, self.THREADS),
+                   time.time() - start_time, self.SUBJECTS,
+                   "%.1f" % (store.Size() / 1e6))
+
+    start_time = time.time()
+    for i in range(self.SCANS):
+      scanned = list(
+          store.ScanAttributes(
+              "aff4:/C.%016X" % i, ["aff4:type"], token=self.token))
+      self.assertEqual(len(scanned), self.SUBJECTS / 1000)
+    self.AddResult("%s: client scans" % name, time.time() - start_time,
+                   self.SCANS, "")
+
+    start_time = time.time()
+    for i in range(self.SUBJECTS):
+      store.ResolvePrefix(self._Subject(i), "index:", token=self.token)
+    self.AddResult("%s: prefix resolves" % name, time.time() - start_time,
+                   self.SUBJECTS, "")
+
+  @test_lib.SetLabel("benchmark")
+  def testManySubjects(self):
+    self._Benchmark("Fake", fake_data_store.FakeDataStore())
+
+    store = compact_data_store.CompactDataStore()
+    self._Benchmark("Compact", store)
+
+    path = os.path.join(self.temp_dir, "snapshot")
+    start_time = time.time()
+    store.SaveSnapshot(path)
+    self.AddResult("Compact: save snapshot", time.time() - start_time, 1,
+                   "%.1f" % (os.path.getsize(path) / 1e6))
+
+    start_time = time.time()
+    compact_data_store.CompactDataStore().LoadSnapshot(path)
+    self.AddResult("Compact: load snapshot", time.time() - start_time, 1, "")
+
+
+def main(args):
+  test_lib.main(args)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""Tests the compact in-memory data store."""
+
+
+import os
+
+
+from grr.lib import data_store
+from grr.lib import data_store_test
+from grr.lib import flags
+from grr.lib import test_lib
+from grr.lib import utils
+
+from grr.lib.data_stores import compact_data_store
+
+# pylint: mode=test
+
+
+class CompactTestMixin(object):
+
+  def InitDatastore(self):
+    self.old_data_store = data_store.DB
+    data_store.DB = compact_data_store.CompactDataStore()
+    data_store.DB.Initialize()
+    data_store.DB.security_manager = test_lib.MockSecurityManager()
+
+  def DestroyDatastore(self):
+    data_store.DB = self.old_data_store
+
+
+class CompactDataStoreTest(CompactTestMixin, data_store_test._DataStoreTest):
+  """Test the compact data store."""
+
+  def testApi(self):
+    """The compact datastore doesn't strictly conform to the api either."""
+
+  def testCorrectDataStore(self):
+    self.assertTrue(
+        isinstance(data_store.DB, compact_data_store.CompactDataStore))
+
+  def _ScanSubjects(self, prefix, **kwargs):
+    return [
+        subject
+        for subject, _ in data_store.DB.ScanAttributes(
+            prefix, ["metadata:value"], token=self.token, **kwargs)
+    ]
+
+  def testScansFollowTheSubjectIndex(self):
+    for name in ["b", "a", "c", "ab"]:
+      data_store.DB.Set(
+          "aff4:/scan/%s" % name, "metadata:value", name, token=self.token)
+    data_store.DB.Set(
+        "aff4:/scanned", "metadata:value", "other", token=self.token)
+    self.assertEqual(
+        self._ScanSubjects("aff4:/scan"),
+        ["aff4:/scan/a", "aff4:/scan/ab", "aff4:/scan/b", "aff4:/scan/c"])
+
+    # Deleted subjects are skipped, subjects added later are indexed.
+    data_store.DB.DeleteSubject("aff4:/scan/ab", token=self.token)
+    data_store.DB.Set(
+        "aff4:/scan/aa", "metadata:value", "aa", token=self.token)
+    self.assertEqual(
+        self._ScanSubjects("aff4:/scan"),
+        ["aff4:/scan/a", "aff4:/scan/aa", "aff4:/scan/b", "aff4:/scan/c"])
+    self.assertEqual(
+        self._ScanSubjects("aff4:/scan", after_urn="aff4:/scan/aa",
+                           max_records=1), ["aff4:/scan/b"])
+
+    # A subject deleted and created again is listed once.
+    data_store.DB.DeleteSubject("aff4:/scan/b", token=self.token)
+    data_store.DB.Set("aff4:/scan/b", "metadata:value", "b", token=self.token)
+    self.assertEqual(
+        self._ScanSubjects("aff4:/scan"),
+        ["aff4:/scan/a", "aff4:/scan/aa", "aff4:/scan/b", "aff4:/scan/c"])
+
+  def testScansSeeSubjectsAddedWhileScanning(self):
+    for name in ["a", "c", "e", "g"]:
+      data_store.DB.Set(
+          "aff4:/scan/%s" % name, "metadata:value", name, token=self.token)
+
+    subjects = []
+    with utils.Stubber(data_store.DB, "SCAN_BATCH_SIZE", 2):
+      for subject, _ in data_store.DB.ScanAttributes(
+          "aff4:/scan", ["metadata:value"], token=self.token):
+        subjects.append(subject)
+        if subject == "aff4:/scan/c":
+          # Subjects before the scan position are not listed, those after it
+          # are, whichever batch the scan is in.
+          for name in ["b", "d", "f"]:
+            data_store.DB.Set(
+                "aff4:/scan/%s" % name, "metadata:value", name,
+                token=self.token)
+
+    self.assertEqual(subjects, [
+        "aff4:/scan/a", "aff4:/scan/c", "aff4:/scan/d", "aff4:/scan/e",
+        "aff4:/scan/f", "aff4:/scan/g"
+    ])
+
+  def testNewSubjectsAreMergedIntoTheIndex(self):
+    names = ["%03d" % i for i in range(200)]
+    for name in names[::2]:
+      data_store.DB.Set(
+          "aff4:/merge/%s" % name, "metadata:value", name, token=self.token)
+    self._ScanSubjects("aff4:/merge")
+    sorted_subjects = data_store.DB.sorted_subjects
+
+    # Few new subjects are inserted, many are merged in a single sort.
+    for new_names in [names[1:10:2], names[11::2]]:
+      for name in new_names:
+        data_store.DB.Set(
+            "aff4:/merge/%s" % name, "metadata:value", name, token=self.token)
+      self._ScanSubjects("aff4:/merge", max_records=1)
+
+    self.assertIs(data_store.DB.sorted_subjects, sorted_subjects)
+    self.assertEqual(
+        self._ScanSubjects("aff4:/merge"),
+        ["aff4:/merge/%s" % name for name in names])
+
+  def testSnapshotsCanBeLoadedIntoAnotherStore(self):
+    for i in range(10):
+      data_store.DB.MultiSet(
+          "aff4:/snapshot/%d" % i, {
+              "metadata:value": [(i, 1000), (u"\u2603%d" % i, 2000)],
+              "metadata:blob": ["\x00\xff"]
+          },
+          replace=False,
+          token=self.token)
+    path = os.path.join(self.temp_dir, "snapshot")
+    data_store.DB.SaveSnapshot(path)
+
+    saved_store = data_store.DB
+    data_store.DB = compact_data_store.CompactDataStore()
+    data_store.DB.security_manager = test_lib.MockSecurityManager()
+    data_store.DB.LoadSnapshot(path)
+
+    for i in range(10):
+      subject = "aff4:/snapshot/%d" % i
+      self.assertEqual(
+          data_store.DB.ResolvePrefix(subject, "metadata:", token=self.token),
+          saved_store.ResolvePrefix(subject, "metadata:", token=self.token))
+    self.assertEqual(
+        self._ScanSubjects("aff4:/snapshot"),
+        ["aff4:/snapshot/%d" % i for i in range(10)])
+
+
+def main(args):
+  test_lib.main(args)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
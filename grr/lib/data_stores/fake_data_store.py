@@ -150,6 +150,11 @@ class FakeDataStore(data_store.DataStore):
                  replace=replace,
                  sync=sync)
 
+  @utils.Synchronized
+  def ApplyMutations(self, mutations, sync=True, token=None):
+    super(FakeDataStore, self).ApplyMutations(
+        mutations, sync=sync, token=token)
+
   @utils.Synchronized
   def DeleteAttributes(self,
                        subject,
@@ -4,6 +4,7 @@
 
 # pylint: disable=g-import-not-at-top,unused-import
 
+from grr.lib.data_stores import compact_data_store
 from grr.lib.data_stores import fake_data_store
 
 try:
@@ -8,8 +8,10 @@ SQLite database files are created by taking the root of each AFF4 object.
 
 import itertools
 import os
+import Queue
 import re
 import stat
+import sys
 import tempfile
 import thread
 import threading
@@ -25,6 +27,8 @@ from grr.lib import data_store
 from grr.lib import utils
 from grr.lib.data_stores import common
 
+from grr.server.data_server import constants
+
 SQLITE_EXTENSION = ".sqlite"
 SQLITE_TIMEOUT = 600.0
 SQLITE_ISOLATION = "DEFERRED"
@@ -35,8 +39,118 @@ SQLITE_CACHED_STATEMENTS = 20
 SQLITE_PAGE_SIZE = 1024
 
 
+class DatabaseFileIndex(object):
+  """A trie of the database files below the data store root.
+
+  Database files are identified by their destination key, i.e. their path
+  relative to the data store root without the extension. Every trie node is a
+  dict mapping path components to child nodes, and the node of a database file
+  holds a None key.
+  """
+
+  def __init__(self, keys=()):
+    self.root = {}
+    for key in keys:
+      self.Add(key)
+
+  def Add(self, key):
+    node = self.root
+    for component in key.split("/"):
+      node = node.setdefault(component, {})
+    node[None] = True
+
+  def Remove(self, key):
+    """Removes a database file, pruning the nodes left without files."""
+    nodes = [self.root]
+    components = key.split("/")
+    for component in components:
+      try:
+        nodes.append(nodes[-1][component])
+      except KeyError:
+        return
+
+    nodes[-1].pop(None, None)
+    for i in xrange(len(components), 0, -1):
+      if nodes[i]:
+        break
+      del nodes[i - 1][components[i - 1]]
+
+  def __contains__(self, key):
+    node = self.root
+    for component in key.split("/"):
+      node = node.get(component)
+      if node is None:
+        return False
+    return None in node
+
+  def _Collect(self, node, path, results):
+    for component, child in node.iteritems():
+      if component is None:
+        results.append("/".join(path))
+      else:
+        self._Collect(child, path + [component], results)
+
+  def Lookup(self, path_prefix):
+    """Returns the sorted keys which extend path_prefix or are extended by it.
+
+    Keys are compared as strings, so "hunts/H%3A1" is returned for both the
+    "hunts/H%3A" and the "hunts/H%3A12" path prefixes.
+
+    Args:
+      path_prefix: A path relative to the data store root.
+
+    Returns:
+      A sorted list of keys.
+    """
+    components = [c for c in path_prefix.split("/") if c]
+    results = []
+    if not components:
+      self._Collect(self.root, [], results)
+      return sorted(results)
+
+    node = self.root
+    path = []
+    for component in components[:-1]:
+      # Only the keys which are string prefixes of component can be string
+      # prefixes of path_prefix.
+      for i in xrange(1, len(component)):
+        child = node.get(component[:i])
+        if child is not None and None in child:
+          results.append("/".join(path + [component[:i]]))
+
+      node = node.get(component)
+      if node is None:
+        return sorted(results)
+      path.append(component)
+      if None in node:
+        results.append("/".join(path))
+
+    last_component = components[-1]
+    for name, child in node.iteritems():
+      if name is None:
+        continue
+      if name.startswith(last_component):
+        self._Collect(child, path + [name], results)
+      elif last_component.startswith(name) and None in child:
+        results.append("/".join(path + [name]))
+
+    return sorted(results)
+
+
 class SqliteConnectionCache(utils.FastStore):
-  """A local cache of SQLite connection objects."""
+  """A local cache of SQLite connection objects.
+
+  The cache also keeps an index of the database files on disk, which is used
+  to find the databases matching a path prefix. The index is updated when the
+  cache creates a database or finds one missing, and is rebuilt from the files
+  on disk every SqliteDatastore.database_index_refresh_interval seconds, so
+  databases created by other processes may be missed by scans until then.
+  Rebuilding the index walks the directory tree without holding the cache
+  lock.
+  """
+
+  # The key of the database holding the subjects which match no other path.
+  ROOT_DATABASE_KEY = "aff4"
 
   # Contents of the database that are written initially to a database file.
   template = None
@@ -136,6 +250,14 @@ class SqliteConnectionCache(utils.FastStore):
   def __init__(self, max_size, path):
     super(SqliteConnectionCache, self).__init__(max_size=max_size)
     self.root_path = path or config_lib.CONFIG.Get("Datastore.location")
+    self.journal_mode = config_lib.CONFIG["SqliteDatastore.journal_mode"]
+    self.database_index = None
+    self.database_index_time = 0
+    # Databases created or found missing while the index is being rebuilt, as
+    # (key, exists) tuples to apply to the new index.
+    self.database_index_changes = None
+    # Only one thread rebuilds the index at a time.
+    self.database_index_lock = threading.Lock()
     self._CreateModelDatabase()
     self.RecreatePathing()
 
@@ -151,25 +273,43 @@ class SqliteConnectionCache(utils.FastStore):
   def RootPath(self):
     return self.root_path
 
+  @utils.Synchronized
   def ChangePath(self, new_path):
     self.root_path = new_path
+    self.database_index = None
 
   def KillObject(self, conn):
     conn.Close()
 
+  def GetDestinationKey(self, subject):
+    """Returns a name identifying the database file of the subject."""
+    filename, directory = common.ResolveSubjectDestination(subject,
+                                                           self.path_regexes)
+    return common.MakeDestinationKey(directory, filename)
+
   @utils.Synchronized
   def Get(self, subject):
     """This will create the connection if needed so should not fail."""
     filename, directory = common.ResolveSubjectDestination(subject,
                                                            self.path_regexes)
+    return self._GetDatabase(directory, filename)
+
+  def _DatabasePath(self, directory, filename):
+    dirname = utils.JoinPath(self.root_path, directory)
+    path = utils.JoinPath(dirname, filename) + SQLITE_EXTENSION
+    return utils.SmartStr(dirname), utils.SmartStr(path)
+
+  @utils.Synchronized
+  def _GetDatabase(self, directory, filename, create=True):
+    """Returns a connection to a database, or None if it doesn't exist."""
     key = common.MakeDestinationKey(directory, filename)
     try:
       return super(SqliteConnectionCache, self).Get(key)
     except KeyError:
-      dirname = utils.JoinPath(self.root_path, directory)
-      path = utils.JoinPath(dirname, filename) + SQLITE_EXTENSION
-      dirname = utils.SmartStr(dirname)
-      path = utils.SmartStr(path)
+      dirname, path = self._DatabasePath(directory, filename)
+      if not create and not os.path.exists(path):
+        self._UpdateDatabaseIndex(key, False)
+        return None
 
       # Make sure directory exists.
       if not os.path.isdir(dirname):
@@ -178,9 +318,13 @@ class SqliteConnectionCache(utils.FastStore):
         except OSError:
           pass
       self._EnsureDatabaseExists(path)
-      connection = SqliteConnection(path)
+      if self.journal_mode == "WAL":
+        connection = SqliteWALConnection(path)
+      else:
+        connection = SqliteConnection(path)
 
       super(SqliteConnectionCache, self).Put(key, connection)
+      self._UpdateDatabaseIndex(key, True)
 
       return connection
 
@@ -207,6 +351,9 @@ class SqliteConnectionCache(utils.FastStore):
   def DatabasesInDir(self, directory):
     """Returns a list of the database files in directory."""
     for (path, dirs, files) in os.walk(directory, topdown=True):
+      # Files being moved in by a rebalance operation are not databases yet.
+      if constants.REBALANCE_DIRECTORY in dirs:
+        dirs.remove(constants.REBALANCE_DIRECTORY)
       dirs.sort()  # controls os.walk recurse order!
       files.sort()
       for f in files:
@@ -214,51 +361,100 @@ class SqliteConnectionCache(utils.FastStore):
           f = f[:-len(SQLITE_EXTENSION)]
           yield utils.JoinPath(path, f)
 
-  @utils.Synchronized
+  def _UpdateDatabaseIndex(self, key, exists):
+    """Records a database created or found missing. Needs the cache lock."""
+    if self.database_index is not None:
+      if exists:
+        self.database_index.Add(key)
+      else:
+        self.database_index.Remove(key)
+    if self.database_index_changes is not None:
+      self.database_index_changes.append((key, exists))
+
+  def _DatabaseIndexIsStale(self):
+    refresh_interval = config_lib.CONFIG[
+        "SqliteDatastore.database_index_refresh_interval"]
+    with self.lock:
+      return (self.database_index is None or
+              time.time() - self.database_index_time >= refresh_interval)
+
+  def _RebuildDatabaseIndex(self):
+    """Builds the index from the files on disk and swaps it in."""
+    with self.lock:
+      root_path = self.root_path
+      self.database_index_changes = []
+
+    database_index = None
+    try:
+      database_index = DatabaseFileIndex(
+          utils.SmartStr(os.path.relpath(db, root_path))
+          for db in self.DatabasesInDir(root_path))
+    finally:
+      with self.lock:
+        changes, self.database_index_changes = self.database_index_changes, None
+        # The root path may have changed while the files were listed.
+        if database_index is not None and self.root_path == root_path:
+          for key, exists in changes:
+            if exists:
+              database_index.Add(key)
+            else:
+              database_index.Remove(key)
+          self.database_index = database_index
+          self.database_index_time = time.time()
+
+  def RefreshDatabaseIndex(self):
+    """Rebuilds the index of database files from the files on disk."""
+    with self.database_index_lock:
+      self._RebuildDatabaseIndex()
+
+  def _MatchingDatabaseKeys(self, path_prefix):
+    if self._DatabaseIndexIsStale():
+      with self.database_index_lock:
+        # Another thread may have rebuilt the index in the meantime.
+        if self._DatabaseIndexIsStale():
+          self._RebuildDatabaseIndex()
+
+    with self.lock:
+      database_index = self.database_index or DatabaseFileIndex()
+      keys = database_index.Lookup(utils.SmartStr(path_prefix).lstrip("/"))
+      # The root database may hold subjects with any prefix.
+      if (self.ROOT_DATABASE_KEY in database_index and
+          self.ROOT_DATABASE_KEY not in keys):
+        keys.insert(0, self.ROOT_DATABASE_KEY)
+      return keys
+
   def DatabasesByPath(self, path_prefix):
     """Yields connections which might contain data prefixed by path_prefix."""
-
-    # We are looking for database files which start with this prefix, or
-    # which could be extended to match this prefix.
-    dir_prefix = utils.JoinPath(self.root_path, path_prefix)
-
-    # Shortened path_prefix - we will shorten it one component at a time
-    # checking directories for databases of interest as we go.
-    shortened_path_prefix = path_prefix
-
-    databases_found = set()
-    while True:
-      shortened_path = utils.JoinPath(self.root_path, shortened_path_prefix)
-      if os.path.isdir(shortened_path):
-        for db in self.DatabasesInDir(shortened_path):
-          if db in databases_found:
-            continue
-          mod_db = db
-          if mod_db == utils.JoinPath(self.root_path, "aff4"):
-            mod_db = self.root_path
-          if mod_db.startswith(dir_prefix) or dir_prefix.startswith(mod_db):
-            databases_found.add(db)
-            yield SqliteConnection(db + SQLITE_EXTENSION)
-      if not shortened_path_prefix:
-        break
-      components = shortened_path_prefix.split(os.path.sep)
-      shortened_path_prefix = utils.JoinPath(*(components[:-1]))
-      if shortened_path_prefix == "/":
-        shortened_path_prefix = ""
+    for key in self._MatchingDatabaseKeys(path_prefix):
+      directory, filename = os.path.split(key)
+      # Databases removed behind our back, e.g. by a rebalance operation, are
+      # not recreated.
+      connection = self._GetDatabase(directory, filename, create=False)
+      if connection is not None:
+        yield connection
 
 
 class SqliteConnection(object):
   """A wrapper around the raw SQLite connection."""
 
-  def __init__(self, filename):
+  def __init__(self, filename, journal_mode="OFF", synchronous="OFF"):
+    """Constructor.
+
+    Args:
+      filename: The database file.
+      journal_mode: The journal mode to set, or None to keep the journal mode
+        of the database.
+      synchronous: How hard SQLite tries to make writes reach the disk.
+    """
     self.filename = filename
     self.conn = sqlite3.connect(filename, SQLITE_TIMEOUT, SQLITE_DETECT_TYPES,
                                 SQLITE_ISOLATION, False, SQLITE_FACTORY,
                                 SQLITE_CACHED_STATEMENTS)
     self.conn.text_factory = str
     self.cursor = self.conn.cursor()
-    self.Execute("PRAGMA synchronous = OFF")
-    self.Execute("PRAGMA journal_mode = OFF")
+    self.Execute("PRAGMA synchronous = %s" % synchronous)
+    if journal_mode:
+      self.Execute("PRAGMA journal_mode = %s" % journal_mode)
     self.Execute("PRAGMA count_changes = OFF")
     self.Execute("PRAGMA cache_size = 10000")
     self.lock = threading.RLock()
@@ -270,6 +466,22 @@ class SqliteConnection(object):
   def Filename(self):
     return self.filename
 
+  def Reader(self):
+    """Returns a context manager providing a connection to read from."""
+    return self
+
+  def Write(self, write_fn):
+    """Runs write_fn(connection) and commits the writes.
+
+    Args:
+      write_fn: A function writing to the connection it is passed.
+
+    Returns:
+      The result of write_fn.
+    """
+    with self:
+      return write_fn(self)
+
   def Execute(self, *args):
     try:
       return self.cursor.execute(*args)
@@ -278,6 +490,14 @@ class SqliteConnection(object):
                         args)
       raise
 
+  def ExecuteMany(self, query, rows):
+    try:
+      return self.cursor.executemany(query, rows)
+    except sqlite3.DatabaseError:
+      logging.exception("DB error in file: %s for query: %s", self.filename,
+                        query)
+      raise
+
   @utils.Synchronized
   def GetLock(self, subject):
     """Gets the expiration time for a given subject."""
@@ -486,6 +706,16 @@ class SqliteConnection(object):
     self.dirty = True
     self.deleted = max(0, self.deleted - self.cursor.rowcount)
 
+  @utils.Synchronized
+  def SetAttributes(self, rows):
+    """Sets many values, rows are (subject, attribute, timestamp, value)."""
+    if not rows:
+      return
+    query = "INSERT INTO tbl VALUES (?, ?, ?, ?)"
+    self.ExecuteMany(query, rows)
+    self.dirty = True
+    self.deleted = max(0, self.deleted - self.cursor.rowcount)
+
   @utils.Synchronized
   def DeleteAttributeRange(self, subject, attribute, start, end):
     """Deletes all values of a attribute within the range [start, end]."""
@@ -605,6 +835,189 @@ class SqliteConnection(object):
     self.cursor = None
 
 
+class _SqliteWriteRequest(object):
+  """A write waiting for the writer thread of a SqliteWALConnection."""
+
+  def __init__(self, write_fn):
+    self.write_fn = write_fn
+    self.done = threading.Event()
+    self.result = None
+    self.exc_info = None
+
+  def Run(self, connection):
+    try:
+      self.result = self.write_fn(connection)
+    except Exception:  # pylint: disable=broad-except
+      self.exc_info = sys.exc_info()
+
+
+class _SqliteReader(object):
+  """Borrows a read connection for the duration of a with block."""
+
+  def __init__(self, wal_connection):
+    self.wal_connection = wal_connection
+    self.connection = None
+
+  def __enter__(self):
+    self.connection = self.wal_connection.BorrowReader()
+    return self.connection
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.wal_connection.readers.put(self.connection)
+    self.connection = None
+
+
+class SqliteWALConnection(SqliteConnection):
+  """A connection to a SQLite database in write-ahead logging mode.
+
+  All the writes are done by a dedicated writer thread, which commits the
+  writes queued while it was busy in a single transaction. Readers use a pool
+  of up to SqliteDatastore.read_connections read-only connections, so they
+  neither wait for the writer nor for each other. The write-ahead log is
+  checkpointed automatically once it reaches SqliteDatastore.wal_autocheckpoint
+  pages, and by the writer thread after a commit if the last checkpoint is older
+  than SqliteDatastore.wal_checkpoint_interval seconds.
+  """
+
+  # The maximum number of writes committed in a single transaction.
+  MAX_GROUP_COMMIT_SIZE = 1000
+
+  def __init__(self, filename):
+    super(SqliteWALConnection, self).__init__(
+        filename, journal_mode="WAL", synchronous="NORMAL")
+    self.Execute("PRAGMA wal_autocheckpoint = %d" %
+                 config_lib.CONFIG["SqliteDatastore.wal_autocheckpoint"])
+    self.checkpoint_mode = config_lib.CONFIG[
+        "SqliteDatastore.wal_checkpoint_mode"]
+    self.checkpoint_interval = config_lib.CONFIG[
+        "SqliteDatastore.wal_checkpoint_interval"]
+    self.last_checkpoint = time.time()
+
+    # Read connections are opened on demand, most databases only ever see a
+    # single reader at a time.
+    self.readers = Queue.Queue()
+    self.max_readers = config_lib.CONFIG["SqliteDatastore.read_connections"]
+    self.reader_count = 0
+    self.reader_count_lock = threading.Lock()
+
+    self.closed = False
+    self.write_requests = Queue.Queue()
+    self.writer_thread = threading.Thread(
+        name="SQLite writer %s" % filename, target=self._WriterLoop)
+    self.writer_thread.daemon = True
+    self.writer_thread.start()
+
+  def Reader(self):
+    return _SqliteReader(self)
+
+  def BorrowReader(self):
+    """Takes an idle read connection, opening one if all are busy."""
+    try:
+      return self.readers.get_nowait()
+    except Queue.Empty:
+      pass
+
+    with self.reader_count_lock:
+      open_reader = self.reader_count < self.max_readers
+      if open_reader:
+        self.reader_count += 1
+
+    if not open_reader:
+      return self.readers.get()
+
+    reader = SqliteConnection(self.filename, journal_mode=None)
+    reader.Execute("PRAGMA query_only = ON")
+    return reader
+
+  def Write(self, write_fn):
+    if self.closed:
+      raise data_store.Error("Database %s is closed." % self.filename)
+
+    # Writes issued by the writer thread itself, e.g. by a lock released when
+    # it is garbage collected, would otherwise wait for themselves.
+    if threading.current_thread() is self.writer_thread:
+      return write_fn(self)
+
+    request = _SqliteWriteRequest(write_fn)
+    self.write_requests.put(request)
+    request.done.wait()
+    if request.exc_info:
+      raise request.exc_info[0], request.exc_info[1], request.exc_info[2]
+    return request.result
+
+  def _WriterLoop(self):
+    """Commits the queued writes until the connection is closed."""
+    while True:
+      # Timed waits poll in Python 2, which adds up over many idle databases,
+      # so checkpoints are only run after commits.
+      request = self.write_requests.get()
+
+      requests = []
+      while request is not None:
+        requests.append(request)
+        if len(requests) >= self.MAX_GROUP_COMMIT_SIZE:
+          break
+        try:
+          request = self.write_requests.get_nowait()
+        except Queue.Empty:
+          break
+
+      for write_request in requests:
+        write_request.Run(self)
+
+      try:
+        self.Flush()
+      except Exception:  # pylint: disable=broad-except
+        exc_info = sys.exc_info()
+        for write_request in requests:
+          write_request.exc_info = write_request.exc_info or exc_info
+
+      for write_request in requests:
+        write_request.done.set()
+
+      # None is queued by Close() to stop the writer thread.
+      if request is None:
+        return
+
+      if (self.checkpoint_interval and
+          time.time() - self.last_checkpoint >= self.checkpoint_interval):
+        self.Checkpoint()
+
+  @utils.Synchronized
+  def Checkpoint(self):
+    """Copies the write-ahead log into the database."""
+    self.Execute("PRAGMA wal_checkpoint(%s)" % self.checkpoint_mode)
+    self.last_checkpoint = time.time()
+
+  def Close(self):
+    """Stops the writer thread and closes all the connections."""
+    if self.closed:
+      return
+    self.closed = True
+
+    self.write_requests.put(None)
+    self.writer_thread.join()
+
+    # Fail the writes queued after the writer thread stopped.
+    while True:
+      try:
+        request = self.write_requests.get_nowait()
+      except Queue.Empty:
+        break
+      if request is not None:
+        request.exc_info = (data_store.Error, data_store.Error(
+            "Database %s is closed." % self.filename), None)
+        request.done.set()
+
+    while True:
+      try:
+        self.readers.get_nowait().Close()
+      except Queue.Empty:
+        break
+
+    super(SqliteWALConnection, self).Close()
+
+
 class SqliteDataStore(data_store.DataStore):
   """A file based data store using the SQLite database."""
 
@@ -665,29 +1078,40 @@ class SqliteDataStore(data_store.DataStore):
     if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
       timestamp = time.time() * 1000000
 
+    def Write(sqlite_connection):
+      # Delete attribute if needed.
+      for attribute in self._AttributesToDelete(values, replace, to_delete):
+        sqlite_connection.DeleteAttribute(subject, attribute)
+
+      sqlite_connection.SetAttributes(
+          self._MakeRows(subject, values, timestamp))
+
+    self.cache.Get(subject).Write(Write)
+
+  def _AttributesToDelete(self, values, replace, to_delete):
+    """Returns the attributes MultiSet deletes before setting values."""
     to_delete = set(to_delete or [])
+    if replace:
+      to_delete.update(values.keys())
+    return to_delete
 
-    with self.cache.Get(subject) as sqlite_connection:
-      if replace:
-        to_delete.update(values.keys())
+  def _MakeRows(self, subject, values, timestamp):
+    """Returns the table rows storing MultiSet values."""
+    subject = utils.SmartStr(subject)
+    rows = []
+    for attribute, seq in values.items():
+      attribute = utils.SmartStr(attribute)
+      for v in seq:
+        element_timestamp = None
+        if isinstance(v, (list, tuple)):
+          v, element_timestamp = v
+        if element_timestamp is None:
+          element_timestamp = timestamp
 
-      # Delete attribute if needed.
-      if to_delete:
-        for attribute in to_delete:
-          sqlite_connection.DeleteAttribute(subject, attribute)
-
-      for attribute, seq in values.items():
-        for v in seq:
-          element_timestamp = None
-          if isinstance(v, (list, tuple)):
-            v, element_timestamp = v
-          if element_timestamp is None:
-            element_timestamp = timestamp
-
-          element_timestamp = long(element_timestamp)
-          value = self._Encode(v)
-          sqlite_connection.SetAttribute(subject, attribute, value,
-                                         element_timestamp)
+        rows.append((subject, attribute, long(element_timestamp),
+                     self._Encode(v)))
+
+    return rows
 
   def DeleteAttributes(self,
                        subject,
@@ -704,26 +1128,93 @@ class SqliteDataStore(data_store.DataStore):
       raise ValueError(
           "String passed to DeleteAttributes (non string iterable expected).")
 
-    with self.cache.Get(subject) as sqlite_connection:
-      if start is None and end is None:
-        # This is done when we delete all attributes at once without
-        # caring about timestamps.
-        for attribute in list(attributes):
-          sqlite_connection.DeleteAttribute(subject, attribute)
-      else:
-        # This code path is taken when we have a timestamp range.
-        start = start or 0
-        if end is None:
-          end = (2**63) - 1  # sys.maxint
-        for attribute in list(attributes):
-          sqlite_connection.DeleteAttributeRange(subject, attribute, start, end)
+    self.cache.Get(subject).Write(
+        lambda c: self._DeleteAttributes(c, subject, attributes, start, end))
+
+  def _DeleteAttributes(self, sqlite_connection, subject, attributes, start,
+                        end):
+    if start is None and end is None:
+      # This is done when we delete all attributes at once without
+      # caring about timestamps.
+      for attribute in list(attributes):
+        sqlite_connection.DeleteAttribute(subject, attribute)
+    else:
+      # This code path is taken when we have a timestamp range.
+      start = start or 0
+      if end is None:
+        end = (2**63) - 1  # sys.maxint
+      for attribute in list(attributes):
+        sqlite_connection.DeleteAttributeRange(subject, attribute, start, end)
+
+  def ApplyMutations(self, mutations, sync=True, token=None):
+    """Applies a batch of mutations with one transaction per database file."""
+    _ = sync
+
+    # Mutations are grouped by database file. For every file we keep a subject
+    # stored in it and the subject deletions, attribute deletions and sets.
+    mutations_by_file = {}
+    subjects = set()
+
+    def FileMutations(subject):
+      subjects.add(subject)
+      key = self.cache.GetDestinationKey(subject)
+      try:
+        return mutations_by_file[key][1]
+      except KeyError:
+        result = mutations_by_file[key] = (subject, ([], [], []))
+        return result[1]
+
+    for subject in mutations.delete_subject_requests:
+      FileMutations(subject)[0].append(subject)
+
+    for request in mutations.delete_attributes_requests:
+      if isinstance(request[1], basestring):
+        raise ValueError(
+            "String passed to DeleteAttributes (non string iterable expected).")
+      FileMutations(request[0])[1].append(request)
+
+    for request in mutations.set_requests:
+      FileMutations(request[0])[2].append(request)
+
+    self.security_manager.CheckDataStoreAccess(token, list(subjects), "w")
+
+    for subject, file_mutations in mutations_by_file.itervalues():
+      self.cache.Get(subject).Write(
+          lambda c: self._ApplyFileMutations(c, *file_mutations))
+
+  def _ApplyFileMutations(self, sqlite_connection, delete_subject_requests,
+                          delete_attributes_requests, set_requests):
+    """Applies the mutations of subjects stored in a single database file."""
+    for subject in delete_subject_requests:
+      sqlite_connection.DeleteSubject(subject)
+
+    for subject, attributes, start, end in delete_attributes_requests:
+      self._DeleteAttributes(sqlite_connection, subject, attributes, start, end)
+
+    # Consecutive sets are inserted with a single statement, as long as no
+    # attributes are deleted in between.
+    rows = []
+    for subject, values, timestamp, replace, to_delete in set_requests:
+      if timestamp is None or timestamp == self.NEWEST_TIMESTAMP:
+        timestamp = time.time() * 1000000
+
+      to_delete = self._AttributesToDelete(values, replace, to_delete)
+      if to_delete and rows:
+        sqlite_connection.SetAttributes(rows)
+        rows = []
+      for attribute in to_delete:
+        sqlite_connection.DeleteAttribute(subject, attribute)
+
+      rows.extend(self._MakeRows(subject, values, timestamp))
+
+    if rows:
+      sqlite_connection.SetAttributes(rows)
 
   def DeleteSubject(self, subject, sync=False, token=None):
     _ = sync
     self.security_manager.CheckDataStoreAccess(token, [subject], "w")
 
-    with self.cache.Get(subject) as sqlite_connection:
-      sqlite_connection.DeleteSubject(subject)
+    self.cache.Get(subject).Write(lambda c: c.DeleteSubject(subject))
 
   def MultiResolvePrefix(self,
                          subjects,
@@ -786,7 +1277,7 @@ class SqliteDataStore(data_store.DataStore):
     # are lists of timestamped data.
     results = []
 
-    with self.cache.Get(subject) as sqlite_connection:
+    with self.cache.Get(subject).Reader() as sqlite_connection:
       for prefix in attribute_prefix:
         nr_results = len(results)
         if limit and nr_results >= limit:
@@ -842,10 +1333,10 @@ class SqliteDataStore(data_store.DataStore):
     connection_iter = self.cache.GetPrefix(subject_prefix)
     if relaxed_order:
       for sqlite_connection in connection_iter:
-        with sqlite_connection:
+        with sqlite_connection.Reader() as reader:
           for r in self._GroupSubjects(
               list(
-                  sqlite_connection.ScanAttributes(
+                  reader.ScanAttributes(
                       subject_prefix,
                       attributes,
                       after_urn=after_urn,
@@ -862,10 +1353,10 @@ class SqliteDataStore(data_store.DataStore):
     if not first_connections:
       return
     if len(first_connections) == 1:
-      with first_connections[0] as sqlite_connection:
+      with first_connections[0].Reader() as reader:
         for r in self._GroupSubjects(
             list(
-                sqlite_connection.ScanAttributes(
+                reader.ScanAttributes(
                     subject_prefix,
                     attributes,
                     after_urn=after_urn,
@@ -876,12 +1367,13 @@ class SqliteDataStore(data_store.DataStore):
     raw_results = []
     for sqlite_connection in itertools.chain(first_connections,
                                              connection_iter):
-      for record in sqlite_connection.ScanAttributes(
-          subject_prefix,
-          attributes,
-          after_urn=after_urn,
-          max_records=max_records):
-        raw_results.append(record)
+      with sqlite_connection.Reader() as reader:
+        raw_results.extend(
+            reader.ScanAttributes(
+                subject_prefix,
+                attributes,
+                after_urn=after_urn,
+                max_records=max_records))
     for r in self._GroupSubjects(
         sorted(
             raw_results, key=lambda x: x[0]), max_records):
@@ -902,7 +1394,7 @@ class SqliteDataStore(data_store.DataStore):
     results = []
     start, end = self._GetStartEndTimestamp(timestamp)
 
-    with self.cache.Get(subject) as sqlite_connection:
+    with self.cache.Get(subject).Reader() as sqlite_connection:
       for attribute in attributes:
         if timestamp == self.NEWEST_TIMESTAMP:
           ret = sqlite_connection.GetNewestValue(subject, attribute)
@@ -983,8 +1475,8 @@ class SqliteDBSubjectLock(data_store.DBSubjectLock):
 
     # We first check if there is a lock on the subject.
     # Next we set our lease time and lock_token as identification.
-    with sqlite_connection:
-      locked_until, stored_token = sqlite_connection.GetLock(self.subject)
+    def TakeLease(sqlite_connection):
+      locked_until, _ = sqlite_connection.GetLock(self.subject)
 
       # This is currently locked by another thread.
       if locked_until and (time.time() * 1e6) < float(locked_until):
@@ -995,12 +1487,15 @@ class SqliteDBSubjectLock(data_store.DBSubjectLock):
       self.expires = int((time.time() + lease_time) * 1e6)
       sqlite_connection.SetLock(self.subject, self.expires, self.lock_token)
 
+    sqlite_connection.Write(TakeLease)
+
     # TODO(user): This shouldn't really be necessary, and seems fragile. We
     # should be able to use an UPDATE WHERE lock_expiration < now inside a
     # transaction and check that we changed one row.
     # Check if the lock stuck. If the stored token is not ours
     # then probably someone was able to grab it before us.
-    locked_until, stored_token = sqlite_connection.GetLock(self.subject)
+    with sqlite_connection.Reader() as reader:
+      _, stored_token = reader.GetLock(self.subject)
     if stored_token != self.lock_token:
       raise data_store.DBSubjectLockError("Unable to lock subject %s" %
                                           self.subject)
@@ -1008,12 +1503,12 @@ class SqliteDBSubjectLock(data_store.DBSubjectLock):
     self.locked = True
 
   def UpdateLease(self, duration):
-    with self.store.cache.Get(self.subject) as sqlite_connection:
-      self.expires = int((time.time() + duration) * 1e6)
-      sqlite_connection.SetLock(self.subject, self.expires, self.lock_token)
+    self.expires = int((time.time() + duration) * 1e6)
+    self.store.cache.Get(self.subject).Write(
+        lambda c: c.SetLock(self.subject, self.expires, self.lock_token))
 
   def Release(self):
     if self.locked:
-      with self.store.cache.Get(self.subject) as sqlite_connection:
-        sqlite_connection.RemoveLock(self.subject)
-        self.locked = False
+      self.store.cache.Get(self.subject).Write(
+          lambda c: c.RemoveLock(self.subject))
+      self.locked = False
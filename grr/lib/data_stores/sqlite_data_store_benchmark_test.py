@@ -14,6 +14,11 @@ class SqliteDataStoreBenchmarks(sqlite_data_store_test.SqliteTestMixin,
   """Benchmark the SQLite data store abstraction."""
 
 
+class SqliteWALDataStoreBenchmarks(sqlite_data_store_test.SqliteWALTestMixin,
+                                   data_store_test.DataStoreBenchmarks):
+  """Benchmark the SQLite data store in the WAL journal mode."""
+
+
 class SqliteDataStoreCSVBenchmarks(sqlite_data_store_test.SqliteTestMixin,
                                    data_store_test.DataStoreCSVBenchmarks):
   """Benchmark the SQLite data store abstraction."""
@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """Tests the SQLite data store."""
 
+import os
 import shutil
+import threading
 
 
 from grr.lib import access_control
@@ -18,12 +20,17 @@ from grr.lib.data_stores import sqlite_data_store
 
 class SqliteTestMixin(object):
 
+  journal_mode = "OFF"
+
   def InitDatastore(self):
     self.token = access_control.ACLToken(
         username="test", reason="Running tests")
     self.root_path = utils.SmartStr("%s/sqlite_test/" % self.temp_dir)
 
-    with test_lib.ConfigOverrider({"Datastore.location": self.root_path}):
+    with test_lib.ConfigOverrider({
+        "Datastore.location": self.root_path,
+        "SqliteDatastore.journal_mode": self.journal_mode
+    }):
 
       self.DestroyDatastore()
 
@@ -47,9 +54,191 @@ class SqliteTestMixin(object):
       pass
 
 
+class SqliteWALTestMixin(SqliteTestMixin):
+
+  journal_mode = "WAL"
+
+
 class SqliteDataStoreTest(SqliteTestMixin, data_store_test._DataStoreTest):
   """Test the sqlite data store."""
 
+  def _ScanHunts(self):
+    return [
+        subject
+        for subject, _ in data_store.DB.ScanAttributes(
+            "aff4:/hunts", ["metadata:value"], token=self.token)
+    ]
+
+  def _ScannedDatabases(self):
+    return [
+        os.path.basename(c.filename)
+        for c in data_store.DB.cache.DatabasesByPath("/hunts")
+    ]
+
+  def testPrefixScansSeeDatabasesCreatedElsewhere(self):
+    with test_lib.FakeTime(1000):
+      data_store.DB.cache.RefreshDatabaseIndex()
+      data_store.DB.Set(
+          "aff4:/hunts/H:1", "metadata:value", "H:1", token=self.token)
+      self.assertEqual(self._ScannedDatabases(), ["H%3A1.sqlite"])
+
+      shutil.copy(
+          os.path.join(self.root_path, "hunts", "H%3A1.sqlite"),
+          os.path.join(self.root_path, "hunts", "H%3A2.sqlite"))
+      self.assertEqual(self._ScannedDatabases(), ["H%3A1.sqlite"])
+
+    # The index is rebuilt from the files on disk once it is too old.
+    with test_lib.FakeTime(1060):
+      self.assertEqual(self._ScannedDatabases(),
+                       ["H%3A1.sqlite", "H%3A2.sqlite"])
+
+  def testDatabaseIndexIsRebuiltWithoutHoldingTheCacheLock(self):
+    cache = data_store.DB.cache
+    data_store.DB.Set(
+        "aff4:/hunts/H:1", "metadata:value", "H:1", token=self.token)
+    databases_in_dir = cache.DatabasesInDir
+    lock_acquired = []
+
+    def TryLock():
+      if cache.lock.acquire(False):
+        cache.lock.release()
+        lock_acquired.append(True)
+
+    def DatabasesInDir(directory):
+      databases = list(databases_in_dir(directory))
+      thread = threading.Thread(target=TryLock)
+      thread.start()
+      thread.join()
+      # Databases created while the files are listed end up in the index.
+      data_store.DB.Set(
+          "aff4:/hunts/H:2", "metadata:value", "H:2", token=self.token)
+      return databases
+
+    with utils.Stubber(cache, "DatabasesInDir", DatabasesInDir):
+      cache.RefreshDatabaseIndex()
+
+    self.assertEqual(lock_acquired, [True])
+    self.assertEqual(self._ScannedDatabases(),
+                     ["H%3A1.sqlite", "H%3A2.sqlite"])
+
+  def testPrefixScansUseDatabaseIndex(self):
+    with test_lib.ConfigOverrider({
+        "SqliteDatastore.database_index_refresh_interval": 300
+    }):
+      for hunt_id in ["H:1", "H:2"]:
+        data_store.DB.Set(
+            "aff4:/hunts/%s" % hunt_id, "metadata:value", hunt_id,
+            token=self.token)
+      self.assertEqual(self._ScanHunts(),
+                       ["aff4:/hunts/H:1", "aff4:/hunts/H:2"])
+
+      # Databases created by the store are indexed right away, without
+      # walking the directory tree.
+      with utils.Stubber(os, "walk", None):
+        data_store.DB.Set(
+            "aff4:/hunts/H:3", "metadata:value", "H:3", token=self.token)
+        self.assertEqual(
+            self._ScanHunts(),
+            ["aff4:/hunts/H:1", "aff4:/hunts/H:2", "aff4:/hunts/H:3"])
+
+      # Removed databases are skipped and not recreated.
+      hunt_path = os.path.join(self.root_path, "hunts", "H%3A2.sqlite")
+      data_store.DB.cache.ExpireObject("hunts/H%3A2")
+      os.unlink(hunt_path)
+      self.assertEqual(self._ScanHunts(),
+                       ["aff4:/hunts/H:1", "aff4:/hunts/H:3"])
+      self.assertFalse(os.path.exists(hunt_path))
+
+      # Databases created behind the store's back are found once the index is
+      # reconciled with the disk.
+      shutil.copy(
+          os.path.join(self.root_path, "hunts", "H%3A1.sqlite"), hunt_path)
+      self.assertEqual(self._ScannedDatabases(),
+                       ["H%3A1.sqlite", "H%3A3.sqlite"])
+      data_store.DB.cache.RefreshDatabaseIndex()
+      self.assertEqual(self._ScannedDatabases(),
+                       ["H%3A1.sqlite", "H%3A2.sqlite", "H%3A3.sqlite"])
+
+
+class DatabaseFileIndexTest(test_lib.GRRBaseTest):
+  """Test the trie of database files."""
+
+  def testLookup(self):
+    index = sqlite_data_store.DatabaseFileIndex([
+        "aff4", "C.1000000000000000", "C.1000000000000001", "hunts/H%3A1",
+        "hunts/H%3A12", "hunts/H%3A2", "files/hash/generic/sha256/abc"
+    ])
+
+    self.assertEqual(len(index.Lookup("")), 7)
+    self.assertEqual(index.Lookup("hunts"),
+                     ["hunts/H%3A1", "hunts/H%3A12", "hunts/H%3A2"])
+    self.assertEqual(index.Lookup("/hunts/H%3A1"),
+                     ["hunts/H%3A1", "hunts/H%3A12"])
+    self.assertEqual(index.Lookup("hunts/H%3A12/Results"),
+                     ["hunts/H%3A1", "hunts/H%3A12"])
+    self.assertEqual(index.Lookup("C.1000000000000001/fs/os"),
+                     ["C.1000000000000001"])
+    self.assertEqual(index.Lookup("files/hash"),
+                     ["files/hash/generic/sha256/abc"])
+    self.assertEqual(index.Lookup("flows"), [])
+
+  def testRemove(self):
+    index = sqlite_data_store.DatabaseFileIndex(
+        ["hunts/H%3A1", "hunts/H%3A1/nested", "hunts/H%3A2"])
+
+    index.Remove("hunts/H%3A1")
+    self.assertNotIn("hunts/H%3A1", index)
+    self.assertIn("hunts/H%3A1/nested", index)
+
+    index.Remove("hunts/H%3A1/nested")
+    index.Remove("hunts/H%3A2")
+    index.Remove("hunts/H%3A3")
+    self.assertEqual(index.root, {})
+
+
+class SqliteWALDataStoreTest(SqliteWALTestMixin,
+                             data_store_test._DataStoreTest):
+  """Test the sqlite data store in the WAL journal mode."""
+
+  def testWritesAreCommittedByTheWriterThread(self):
+    subject = "aff4:/C.1000000000000000/wal_row"
+    sqlite_connection = data_store.DB.cache.Get(subject)
+    self.assertIsInstance(sqlite_connection,
+                          sqlite_data_store.SqliteWALConnection)
+    mode = sqlite_connection.Execute("PRAGMA journal_mode").fetchone()[0]
+    self.assertEqual(mode, "wal")
+
+    threads = []
+    for i in range(10):
+      threads.append(
+          threading.Thread(
+              target=data_store.DB.Set,
+              args=(subject, "metadata:%d" % i, "value%d" % i),
+              kwargs=dict(token=self.token)))
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    values = data_store.DB.ResolvePrefix(
+        subject, "metadata:", token=self.token)
+    self.assertEqual(len(values), 10)
+
+    # Errors raised by a write are raised in the writing thread.
+    def FailingWrite(unused_connection):
+      raise ValueError("write failed")
+
+    with self.assertRaises(ValueError):
+      sqlite_connection.Write(FailingWrite)
+
+    sqlite_connection.Checkpoint()
+    data_store.DB.cache.Flush()
+    with self.assertRaises(data_store.Error):
+      sqlite_connection.Write(lambda c: c.RemoveLock(subject))
+
+    stored, _ = data_store.DB.Resolve(subject, "metadata:0", token=self.token)
+    self.assertEqual(stored, "value0")
+
 
 def main(args):
   test_lib.main(args)
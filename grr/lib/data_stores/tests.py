@@ -8,6 +8,7 @@ This module loads and registers all the data store tests.
 # These need to register plugins so,
 # pylint: disable=unused-import,g-import-not-at-top
 
+from grr.lib.data_stores import compact_data_store_test
 from grr.lib.data_stores import fake_data_store_test
 
 try:
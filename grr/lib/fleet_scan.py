@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""Scans over all the clients in the fleet."""
+
+
+from grr.lib import aff4
+from grr.lib import data_store
+from grr.lib import utils
+from grr.lib.aff4_objects import aff4_grr
+from grr.lib.rdfvalues import client as rdf_client
+
+
+class ClientProcessor(object):
+  """A processor which is fed every client by a FleetScan."""
+
+  # The VFSGRRClient attributes used by ProcessClient(). Clients are opened with
+  # only these attributes loaded. If None, all the attributes are loaded.
+  attributes = None
+
+  def Begin(self):
+    """Called before the first client is processed."""
+
+  def ProcessClient(self, client):
+    """Processes a single VFSGRRClient object."""
+    raise NotImplementedError()
+
+  def Finish(self):
+    """Called after the last client is processed."""
+
+
+class FleetScan(object):
+  """Feeds all the clients in the fleet to a number of processors in one pass.
+
+  Client URNs are taken from the children of the AFF4 root, so that clients
+  which are missing from the client index (e.g. clients which were never
+  indexed, or which have not been seen for longer than the index covers) are
+  processed too. Clients are opened in pages, so that only a single page of
+  client objects is held in memory at any time.
+  Each client is opened only once, with the union of attributes the processors
+  need, and is then passed to every processor.
+  """
+
+  def __init__(self, processors, page_size=1000, token=None):
+    """Constructor.
+
+    Args:
+      processors: A list of ClientProcessor instances.
+      page_size: The number of clients to open at once.
+      token: The security token to use.
+    """
+    self.processors = processors
+    self.page_size = page_size
+    self.token = token
+
+    self.predicates = set([aff4_grr.VFSGRRClient.SchemaCls.TYPE.predicate])
+    for processor in processors:
+      if processor.attributes is None:
+        self.predicates = None
+        break
+
+      self.predicates.update(a.predicate for a in processor.attributes)
+
+  def ListClients(self):
+    """Returns a sorted list of all the client URNs."""
+    root = aff4.FACTORY.Open(aff4.ROOT_URN, token=self.token)
+    client_urns = [
+        urn for urn in root.ListChildren() if rdf_client.ClientURN.Validate(urn)
+    ]
+    return sorted(client_urns, key=utils.SmartStr)
+
+  def OpenClients(self, client_urns):
+    """Opens the given clients, loading only the needed attributes."""
+    if self.predicates is None:
+      for client in aff4.FACTORY.MultiOpen(
+          client_urns,
+          mode="r",
+          aff4_type=aff4_grr.VFSGRRClient,
+          token=self.token):
+        yield client
+      return
+
+    for subject, values in data_store.DB.MultiResolvePrefix(
+        client_urns,
+        sorted(self.predicates),
+        timestamp=data_store.DB.NEWEST_TIMESTAMP,
+        token=self.token):
+      subject = utils.SmartUnicode(subject)
+      values.sort(key=lambda x: x[-1], reverse=True)
+      try:
+        yield aff4.FACTORY.Open(
+            subject,
+            mode="r",
+            aff4_type=aff4_grr.VFSGRRClient,
+            local_cache={subject: values},
+            token=self.token)
+      except aff4.InstantiationError:
+        pass
+
+  def Run(self, heartbeat=None):
+    """Runs the scan.
+
+    Args:
+      heartbeat: If set, a function called after every page of clients.
+
+    Returns:
+      The number of processed clients.
+    """
+    for processor in self.processors:
+      processor.Begin()
+
+    processed_count = 0
+    for client_urns in utils.Grouper(self.ListClients(), self.page_size):
+      for client in self.OpenClients(client_urns):
+        for processor in self.processors:
+          processor.ProcessClient(client)
+        processed_count += 1
+
+      if heartbeat is not None:
+        heartbeat()
+
+    for processor in self.processors:
+      processor.Finish()
+
+    return processed_count
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.fleet_scan."""
+
+
+from grr.lib import aff4
+from grr.lib import client_index
+from grr.lib import flags
+from grr.lib import fleet_scan
+from grr.lib import test_lib
+from grr.lib.aff4_objects import aff4_grr
+
+
+class _RecordingProcessor(fleet_scan.ClientProcessor):
+  """Records the clients it is fed."""
+
+  def __init__(self, attributes=None):
+    self.attributes = attributes
+    self.clients = []
+    self.begun = self.finished = False
+
+  def Begin(self):
+    self.begun = True
+
+  def ProcessClient(self, client):
+    self.clients.append(client)
+
+  def Finish(self):
+    self.finished = True
+
+
+class FleetScanTest(test_lib.GRRBaseTest):
+
+  def setUp(self):
+    super(FleetScanTest, self).setUp()
+    self.client_ids = self.SetupClients(25, system="Linux")
+
+  def testAllClientsAreFedToAllProcessors(self):
+    processors = [_RecordingProcessor(), _RecordingProcessor()]
+    heartbeats = []
+    processed_count = fleet_scan.FleetScan(
+        processors, page_size=10,
+        token=self.token).Run(heartbeat=lambda: heartbeats.append(1))
+
+    self.assertEqual(processed_count, 25)
+    self.assertEqual(len(heartbeats), 3)
+    for processor in processors:
+      self.assertTrue(processor.begun)
+      self.assertTrue(processor.finished)
+      self.assertItemsEqual([c.urn for c in processor.clients],
+                            self.client_ids)
+
+    # Each client is only opened once.
+    self.assertTrue(all(
+        a is b for a, b in zip(processors[0].clients, processors[1].clients)))
+
+  def testClientsMissingFromTheIndexAreProcessed(self):
+    client_id = "aff4:/C.1000000000000099"
+    with aff4.FACTORY.Create(
+        client_id, aff4_grr.VFSGRRClient, token=self.token) as client:
+      client.Set(client.Schema.SYSTEM("Linux"))
+
+    index = client_index.CreateClientIndex(token=self.token)
+    self.assertNotIn(client_id, index.LookupClients(["."]))
+
+    processor = _RecordingProcessor()
+    processed_count = fleet_scan.FleetScan(
+        [processor], token=self.token).Run()
+
+    self.assertEqual(processed_count, 26)
+    self.assertIn(client_id, [c.urn for c in processor.clients])
+
+  def testOnlyDeclaredAttributesAreLoaded(self):
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+    processors = [
+        _RecordingProcessor([schema.PING]), _RecordingProcessor([schema.SYSTEM])
+    ]
+    fleet_scan.FleetScan(processors, token=self.token).Run()
+
+    for client in processors[0].clients:
+      self.assertIsInstance(client, aff4_grr.VFSGRRClient)
+      self.assertTrue(client.Get(schema.PING))
+      self.assertEqual(client.Get(schema.SYSTEM), "Linux")
+      self.assertIsNone(client.Get(schema.HOSTNAME))
+
+  def testAllAttributesAreLoadedIfAnyProcessorNeedsThem(self):
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+    processors = [_RecordingProcessor([schema.PING]), _RecordingProcessor()]
+    fleet_scan.FleetScan(processors, token=self.token).Run()
+
+    for client in processors[0].clients:
+      self.assertTrue(client.Get(schema.HOSTNAME))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -55,8 +55,8 @@ from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import events
 from grr.lib import flow_runner
+from grr.lib import flow_start_index
 from grr.lib import queue_manager
-from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import server_stubs
@@ -221,8 +221,12 @@ class Responses(object):
             session_id.Add("state/request:%08X" % responses[0].request_id),
             "flow:",
             token=token),
-        data_store.DB.ResolvePrefix(
-            queues.FLOWS, "notify:%s" % session_id, token=token))
+        [
+            notification
+            for notification in queue_manager.QueueManager(
+                token=token).GetNotificationsForAllShards(session_id.Queue())
+            if notification.session_id == session_id
+        ])
 
 
 class FakeResponses(Responses):
@@ -638,6 +642,12 @@ class FlowBase(aff4.AFF4Volume):
     if not runner.OutstandingRequests():
       flow_obj.Terminate()
 
+    # Record flows started directly on a client for the flow throttler. The
+    # flow start is written along with the flow's requests.
+    if runner_args.client_id and runner_args.base_session_id is None:
+      runner.queue_manager.QueueFlowStart(
+          runner_args.client_id, flow_start_index.FlowStart.FromFlow(flow_obj))
+
     flow_obj.Close()
 
     # Publish an audit event, only for top level flows.
@@ -129,6 +129,8 @@ class FlowRunner(object):
       self.queue_manager = queue_manager.QueueManager(token=self.token)
 
     self.queued_replies = []
+    # Replies of flows started by hunts, written directly to the hunt results.
+    self.queued_hunt_replies = []
 
     self.outbound_lock = threading.Lock()
     self.flow_obj = flow_obj
@@ -896,6 +898,17 @@ class FlowRunner(object):
     if (self.runner_args.request_state.session_id and
         self.runner_args.send_replies):
 
+      # Flows started by hunts write their results to the hunt's collections
+      # themselves, so that the hunt doesn't have to be locked for every
+      # result.
+      if self.runner_args.parent_hunt_urn:
+        self.context.hunt_results_count += 1
+        self.queued_hunt_replies.append(response)
+
+        if self.runner_args.write_intermediate_results:
+          self.QueueReplyForResultsCollection(response)
+        return
+
       request_state = self.runner_args.request_state
 
       request_state.response_count += 1
@@ -923,6 +936,22 @@ class FlowRunner(object):
 
   def FlushMessages(self):
     """Flushes the messages that were queued."""
+    # Results are written before the status is sent, so that they are all
+    # in the hunt's collections by the time the hunt sees the flow done.
+    if self.queued_hunt_replies:
+      # The client is registered with the hunt along with its first results.
+      register_client = (
+          self.context.hunt_results_count == len(self.queued_hunt_replies))
+      with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+        aff4.AFF4Object.classes["GRRHunt"].StaticAddResults(
+            self.runner_args.parent_hunt_urn,
+            self.runner_args.client_id,
+            self.queued_hunt_replies,
+            register_client=register_client,
+            mutation_pool=mutation_pool,
+            token=self.token)
+      self.queued_hunt_replies = []
+
     # Only flush queues if we are the top level runner.
     if self.parent_runner is None:
       self.queue_manager.Flush()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""A rolling index of the flows recently started on each client.
+
+Every flow started directly on a client is recorded in a single row per client,
+with one versioned attribute per creator. This allows checking the flows run on
+a client over the last day with a constant number of data store reads, instead
+of opening every flow object.
+"""
+
+
+import hashlib
+
+from grr.lib import data_store
+from grr.lib import rdfvalue
+from grr.lib import utils
+
+# The period of flow starts the index is guaranteed to cover.
+WINDOW = rdfvalue.Duration("1d")
+
+FLOW_START_PREFIX = "index:flow_start:"
+# The time from which on all the flow starts on the client are indexed.
+INDEXED_SINCE = "index:flow_start_indexed_since"
+
+
+def ArgsFingerprint(args):
+  """Returns a digest identifying flow arguments.
+
+  Args:
+    args: The flow args RDFValue or None, which is equivalent to the
+      EmptyFlowArgs of flows which take no arguments.
+
+  Returns:
+    A hex digest of the arguments' type and canonical serialization.
+  """
+  if args is None:
+    args_type, data = "EmptyFlowArgs", ""
+  else:
+    args_type = args.__class__.__name__
+    # Primitive protos serialize fields in field number order.
+    data = args.AsPrimitiveProto().SerializeToString()
+
+  return hashlib.sha256("%s:%s" % (args_type, data)).hexdigest()
+
+
+class FlowStart(object):
+  """A single flow start on a client."""
+
+  def __init__(self, create_time, creator, flow_name, args_fingerprint,
+               flow_urn):
+    self.create_time = create_time
+    self.creator = creator
+    self.flow_name = flow_name
+    self.args_fingerprint = args_fingerprint
+    self.flow_urn = flow_urn
+
+  @classmethod
+  def FromFlow(cls, flow_obj):
+    context = flow_obj.context
+    return cls(context.create_time, context.creator,
+               flow_obj.runner_args.flow_name,
+               ArgsFingerprint(flow_obj.args), flow_obj.urn)
+
+  def SerializeToString(self):
+    return "%s %s %s" % (self.flow_name, self.args_fingerprint, self.flow_urn)
+
+  @classmethod
+  def FromSerializedString(cls, value, create_time, creator):
+    flow_name, args_fingerprint, flow_urn = utils.SmartStr(value).split(" ", 2)
+    return cls(create_time, creator, flow_name, args_fingerprint,
+               rdfvalue.RDFURN(flow_urn))
+
+
+def _IndexURN(client_id):
+  return rdfvalue.RDFURN(client_id).Add("flow_starts")
+
+
+def _WriteFlowStarts(index_urn, flow_starts, mutation_pool):
+  """Writes flow starts to the index and drops those older than the window."""
+  by_creator = {}
+  for flow_start in flow_starts:
+    by_creator.setdefault(flow_start.creator, []).append(
+        (flow_start.SerializeToString(),
+         flow_start.create_time.AsMicroSecondsFromEpoch()))
+
+  attributes = [FLOW_START_PREFIX + utils.SmartStr(c) for c in by_creator]
+  mutation_pool.MultiSet(
+      index_urn, dict(zip(attributes, by_creator.values())), replace=False)
+
+  expired = rdfvalue.RDFDatetime.Now() - WINDOW
+  mutation_pool.DeleteAttributes(
+      index_urn,
+      attributes,
+      start=0,
+      end=expired.AsMicroSecondsFromEpoch() - 1)
+
+
+def _ReadFlowStarts(index_urn, start, end, token=None):
+  flow_starts = []
+  for attribute, value, timestamp in data_store.DB.ResolvePrefix(
+      index_urn,
+      FLOW_START_PREFIX,
+      timestamp=(start.AsMicroSecondsFromEpoch(),
+                 end.AsMicroSecondsFromEpoch()),
+      token=token):
+    creator = utils.SmartUnicode(attribute[len(FLOW_START_PREFIX):])
+    flow_starts.append(
+        FlowStart.FromSerializedString(
+            value, rdfvalue.RDFDatetime(timestamp), creator))
+
+  return flow_starts
+
+
+def RecordFlowStarts(client_id, flow_starts, mutation_pool):
+  """Records the starts of flows on a client.
+
+  Args:
+    client_id: The client URN.
+    flow_starts: A list of FlowStart objects for flows which were just started.
+    mutation_pool: A MutationPool object to write to.
+  """
+  _WriteFlowStarts(_IndexURN(client_id), flow_starts, mutation_pool)
+
+
+def BackfillFlowStarts(client_id, flow_starts, since, token=None):
+  """Adds flow starts found by other means to the index.
+
+  Flows started before the index existed are not recorded in it. Once all the
+  flows started on the client since a point in time are backfilled, the index
+  can be used for queries starting from that time.
+
+  Args:
+    client_id: The client URN.
+    flow_starts: A list of FlowStart objects for all the flows run on the client
+      since the given time.
+    since: An RDFDatetime the backfilled flow starts cover.
+    token: The security token to use.
+  """
+  index_urn = _IndexURN(client_id)
+  # Some of the flows may have been recorded when they were started.
+  recorded = set(
+      f.flow_urn
+      for f in _ReadFlowStarts(
+          index_urn, since, rdfvalue.RDFDatetime.Now(), token=token))
+  flow_starts = [f for f in flow_starts if f.flow_urn not in recorded]
+  with data_store.DB.GetMutationPool(token=token) as mutation_pool:
+    if flow_starts:
+      _WriteFlowStarts(index_urn, flow_starts, mutation_pool)
+    mutation_pool.Set(index_urn, INDEXED_SINCE,
+                      since.AsMicroSecondsFromEpoch())
+
+
+def ListFlowStarts(client_id, start, end, token=None):
+  """Lists the flows started on a client within a time range.
+
+  Args:
+    client_id: The client URN.
+    start: An RDFDatetime, no older than WINDOW.
+    end: An RDFDatetime.
+    token: The security token to use.
+
+  Returns:
+    A list of FlowStart objects, or None if the index does not cover the time
+    range.
+  """
+  index_urn = _IndexURN(client_id)
+  indexed_since, _ = data_store.DB.Resolve(
+      index_urn, INDEXED_SINCE, token=token)
+  if indexed_since is None or start.AsMicroSecondsFromEpoch() < indexed_since:
+    return None
+
+  return _ReadFlowStarts(index_urn, start, end, token=token)
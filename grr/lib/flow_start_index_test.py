@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Tests for grr.lib.flow_start_index."""
+
+
+from grr.lib import access_control
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import flow
+from grr.lib import flow_start_index
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
+
+
+class FlowStartIndexTest(test_lib.GRRBaseTest):
+  BASE_TIME = 1439501002
+
+  def setUp(self):
+    super(FlowStartIndexTest, self).setUp()
+    self.client_id = self.SetupClients(1)[0]
+
+  def _ListFlowStarts(self):
+    now = rdfvalue.RDFDatetime.Now()
+    return flow_start_index.ListFlowStarts(
+        self.client_id,
+        now - flow_start_index.WINDOW,
+        now,
+        token=self.token)
+
+  def testFlowStartsAreListedOnceTheIndexCoversTheWindow(self):
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow_urn = flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+
+    with test_lib.FakeTime(self.BASE_TIME + 60):
+      # Flows started before the index was backfilled may be missing.
+      self.assertIsNone(self._ListFlowStarts())
+
+      flow_start_index.BackfillFlowStarts(
+          self.client_id, [],
+          rdfvalue.RDFDatetime.Now() - flow_start_index.WINDOW,
+          token=self.token)
+      flow_starts = self._ListFlowStarts()
+
+    self.assertEqual(len(flow_starts), 1)
+    self.assertEqual(flow_starts[0].flow_urn, flow_urn)
+    self.assertEqual(flow_starts[0].flow_name, "DummyLogFlow")
+    self.assertEqual(flow_starts[0].creator, self.token.username)
+    self.assertEqual(flow_starts[0].create_time,
+                     rdfvalue.RDFDatetime().FromSecondsFromEpoch(
+                         self.BASE_TIME))
+    self.assertEqual(flow_starts[0].args_fingerprint,
+                     flow_start_index.ArgsFingerprint(None))
+
+  def testFlowStartsAreWrittenWithTheFlowRequests(self):
+    with test_lib.Instrument(data_store.DB, "MultiSet") as multi_set:
+      with test_lib.Instrument(flow_start_index,
+                               "RecordFlowStarts") as record_flow_starts:
+        flow.GRRFlow.StartFlow(
+            client_id=self.client_id,
+            flow_name="DummyLogFlow",
+            sync=False,
+            token=self.token)
+
+    self.assertEqual(record_flow_starts.call_count, 1)
+    # The index is written as part of the queue manager's mutation pool, not
+    # by a synchronous write of its own.
+    index_urn = self.client_id.Add("flow_starts")
+    index_writes = [
+        kwargs for args, kwargs in zip(multi_set.args, multi_set.kwargs)
+        if args[0] == index_urn
+    ]
+    self.assertEqual(len(index_writes), 1)
+    self.assertFalse(index_writes[0]["sync"])
+
+  def testBackfillSkipsRecordedFlows(self):
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow_urn = flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+      flow_start = flow_start_index.FlowStart(
+          rdfvalue.RDFDatetime.Now(), self.token.username, "DummyLogFlow",
+          flow_start_index.ArgsFingerprint(None), flow_urn)
+
+      flow_start_index.BackfillFlowStarts(
+          self.client_id, [flow_start],
+          rdfvalue.RDFDatetime.Now() - flow_start_index.WINDOW,
+          token=self.token)
+      flow_starts = self._ListFlowStarts()
+
+    self.assertEqual(len(flow_starts), 1)
+    self.assertEqual(flow_starts[0].flow_urn, flow_urn)
+
+  def testChildAndHuntFlowsAreNotRecorded(self):
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id,
+          flow_name="DummyLogFlowChild",
+          base_session_id=self.client_id.Add("flows").Add("W:1234"),
+          token=self.token)
+      flow_start_index.BackfillFlowStarts(
+          self.client_id, [],
+          rdfvalue.RDFDatetime.Now() - flow_start_index.WINDOW,
+          token=self.token)
+      self.assertEqual(self._ListFlowStarts(), [])
+
+  def testExpiredFlowStartsAreDropped(self):
+    token2 = access_control.ACLToken(username="test2", reason="Running tests")
+    with test_lib.FakeTime(self.BASE_TIME):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=token2)
+
+    with test_lib.FakeTime(self.BASE_TIME + 86400 + 1):
+      flow.GRRFlow.StartFlow(
+          client_id=self.client_id, flow_name="DummyLogFlow", token=self.token)
+
+    index_urn = self.client_id.Add("flow_starts")
+    timestamps = {}
+    for attribute, _, timestamp in data_store.DB.ResolvePrefix(
+        index_urn,
+        flow_start_index.FLOW_START_PREFIX,
+        timestamp=data_store.DB.ALL_TIMESTAMPS,
+        token=self.token):
+      timestamps.setdefault(attribute, []).append(timestamp / 1000000)
+
+    # Only the flow starts of the creator of the latest flow were dropped.
+    self.assertEqual(timestamps, {
+        flow_start_index.FLOW_START_PREFIX + self.token.username:
+            [self.BASE_TIME + 86400 + 1],
+        flow_start_index.FLOW_START_PREFIX + "test2": [self.BASE_TIME]
+    })
+
+  def testArgsFingerprint(self):
+    args = rdf_file_finder.FileFinderArgs(
+        paths=["/tmp/1", "/tmp/2"],
+        action=rdf_file_finder.FileFinderAction(action_type="STAT"))
+    same_args = rdf_file_finder.FileFinderArgs(
+        action=rdf_file_finder.FileFinderAction(action_type="STAT"))
+    same_args.paths = ["/tmp/1", "/tmp/2"]
+    other_args = rdf_file_finder.FileFinderArgs(
+        paths=["/tmp/1", "/tmp/3"],
+        action=rdf_file_finder.FileFinderAction(action_type="STAT"))
+
+    fingerprint = flow_start_index.ArgsFingerprint
+    self.assertEqual(fingerprint(args), fingerprint(same_args))
+    self.assertNotEqual(fingerprint(args), fingerprint(other_args))
+    self.assertEqual(
+        fingerprint(None), fingerprint(flow.EmptyFlowArgs()))
+    self.assertNotEqual(
+        fingerprint(rdf_file_finder.FileFinderArgs()),
+        fingerprint(flow.EmptyFlowArgs()))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -4,8 +4,8 @@
 
 
 from grr.lib import aff4
-from grr.lib import client_index
 from grr.lib import config_lib
+from grr.lib import fleet_scan
 from grr.lib import flow
 from grr.lib import rdfvalue
 from grr.lib import utils
@@ -106,6 +106,38 @@ class CleanTemp(cronjobs.SystemCronFlow):
       self.HeartBeat()
 
 
+class _InactiveClientsDeleter(fleet_scan.ClientProcessor):
+  """Deletes clients which were not seen since a deadline."""
+
+  attributes = [
+      aff4_grr.VFSGRRClient.SchemaCls.LAST,
+      aff4_grr.VFSGRRClient.SchemaCls.LABELS
+  ]
+
+  def __init__(self, deadline, exception_label, batch_size=1000, token=None):
+    self.deadline = deadline
+    self.exception_label = exception_label
+    self.batch_size = batch_size
+    self.token = token
+    self.inactive_client_urns = []
+
+  def ProcessClient(self, client):
+    if self.exception_label in client.GetLabelsNames():
+      return
+
+    if client.Get(client.Schema.LAST) < self.deadline:
+      self.inactive_client_urns.append(client.urn)
+      if len(self.inactive_client_urns) >= self.batch_size:
+        self.Flush()
+
+  def Flush(self):
+    aff4.FACTORY.MultiDelete(self.inactive_client_urns, token=self.token)
+    self.inactive_client_urns = []
+
+  def Finish(self):
+    self.Flush()
+
+
 class CleanInactiveClients(cronjobs.SystemCronFlow):
   """Cleaner that deletes inactive clients."""
 
@@ -122,24 +154,9 @@ class CleanInactiveClients(cronjobs.SystemCronFlow):
     exception_label = config_lib.CONFIG[
         "DataRetention.inactive_client_ttl_exception_label"]
 
-    index = client_index.CreateClientIndex(token=self.token)
-
-    client_urns = index.LookupClients(["."])
-
     deadline = rdfvalue.RDFDatetime.Now() - inactive_client_ttl
 
-    for client_group in utils.Grouper(client_urns, 1000):
-      inactive_client_urns = []
-      for client in aff4.FACTORY.MultiOpen(
-          client_group,
-          mode="r",
-          aff4_type=aff4_grr.VFSGRRClient,
-          token=self.token):
-        if exception_label in client.GetLabelsNames():
-          continue
-
-        if client.Get(client.Schema.LAST) < deadline:
-          inactive_client_urns.append(client.urn)
-
-      aff4.FACTORY.MultiDelete(inactive_client_urns, token=self.token)
-      self.HeartBeat()
+    deleter = _InactiveClientsDeleter(
+        deadline, exception_label, token=self.token)
+    fleet_scan.FleetScan([deleter], token=self.token).Run(
+        heartbeat=self.HeartBeat)
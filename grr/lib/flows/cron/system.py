@@ -13,9 +13,11 @@ from grr.lib import aff4
 from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import export_utils
+from grr.lib import fleet_scan
 from grr.lib import flow
 from grr.lib import hunts
 from grr.lib import rdfvalue
+from grr.lib import registry
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import cronjobs
@@ -47,6 +49,7 @@ class _ActiveCounter(object):
     """
     self.attribute = attribute
     self.categories = dict([(x, {}) for x in self.active_days])
+    self.now = rdfvalue.RDFDatetime.Now()
 
   def Add(self, category, label, age):
     """Adds another instance of this category into the active_days counter.
@@ -61,12 +64,12 @@ class _ActiveCounter(object):
       label: Client label to which this should be applied.
       age: When this instance occurred.
     """
-    now = rdfvalue.RDFDatetime.Now()
     category = utils.SmartUnicode(category)
+    age_seconds = (self.now - age).seconds
 
     for active_time in self.active_days:
       self.categories[active_time].setdefault(label, {})
-      if (now - age).seconds < active_time * 24 * 60 * 60:
+      if age_seconds < active_time * 24 * 60 * 60:
         self.categories[active_time][label][category] = self.categories[
             active_time][label].get(category, 0) + 1
 
@@ -91,22 +94,16 @@ class _ActiveCounter(object):
       # pylint: enable=protected-access
 
 
-class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
-  """A cron job which opens every client in the system.
+class ClientStatsProcessor(fleet_scan.ClientProcessor):
+  """Computes fleet statistics which are stored by the cron flow."""
 
-  We feed all the client objects to the AbstractClientStatsCollector instances.
-  """
+  __metaclass__ = registry.MetaclassRegistry
+  __abstract = True  # pylint: disable=g-bad-name
 
-  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+  attributes = [aff4_grr.VFSGRRClient.SchemaCls.LABELS]
 
-  def BeginProcessing(self):
-    pass
-
-  def ProcessClient(self, client):
-    raise NotImplementedError()
-
-  def FinishProcessing(self):
-    pass
+  def __init__(self, cron_flow):
+    self.cron_flow = cron_flow
 
   def GetClientLabelsList(self, client):
     """Get set of labels applied to this client."""
@@ -115,60 +112,21 @@ class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
     client_labels.extend(label_set)
     return client_labels
 
-  def _StatsForLabel(self, label):
-    if label not in self.stats:
-      self.stats[label] = aff4.FACTORY.Create(
-          self.CLIENT_STATS_URN.Add(label),
-          aff4_stats.ClientFleetStats,
-          mode="w",
-          token=self.token)
-    return self.stats[label]
-
-  @flow.StateHandler()
-  def Start(self):
-    """Retrieve all the clients for the AbstractClientStatsCollectors."""
-    try:
-
-      self.stats = {}
-
-      self.BeginProcessing()
-
-      root = aff4.FACTORY.Open(aff4.ROOT_URN, token=self.token)
-      children_urns = list(root.ListChildren())
-      logging.debug("Found %d children.", len(children_urns))
-
-      processed_count = 0
-      for child in aff4.FACTORY.MultiOpen(
-          children_urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
-        if isinstance(child, aff4_grr.VFSGRRClient):
-          self.ProcessClient(child)
-          processed_count += 1
-
-        # This flow is not dead: we don't want to run out of lease time.
-        self.HeartBeat()
-
-      self.FinishProcessing()
-      for fd in self.stats.values():
-        fd.Close()
 
-      logging.info("%s: processed %d clients.", self.__class__.__name__,
-                   processed_count)
-    except Exception as e:  # pylint: disable=broad-except
-      logging.exception("Error while calculating stats: %s", e)
-      raise
-
-
-class GRRVersionBreakDown(AbstractClientStatsCronFlow):
+class GRRVersionStatsProcessor(ClientStatsProcessor):
   """Records relative ratios of GRR versions in 7 day actives."""
 
-  frequency = rdfvalue.Duration("4h")
+  attributes = ClientStatsProcessor.attributes + [
+      aff4_grr.VFSGRRClient.SchemaCls.PING,
+      aff4_grr.VFSGRRClient.SchemaCls.CLIENT_INFO
+  ]
 
-  def BeginProcessing(self):
+  def Begin(self):
     self.counter = _ActiveCounter(
         aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM)
 
-  def FinishProcessing(self):
-    self.counter.Save(self)
+  def Finish(self):
+    self.counter.Save(self.cron_flow)
 
   def ProcessClient(self, client):
     ping = client.Get(client.Schema.PING)
@@ -184,19 +142,25 @@ class GRRVersionBreakDown(AbstractClientStatsCronFlow):
         self.counter.Add(category, label, ping)
 
 
-class OSBreakDown(AbstractClientStatsCronFlow):
+class OSStatsProcessor(ClientStatsProcessor):
   """Records relative ratios of OS versions in 7 day actives."""
 
-  def BeginProcessing(self):
+  attributes = ClientStatsProcessor.attributes + [
+      aff4_grr.VFSGRRClient.SchemaCls.PING,
+      aff4_grr.VFSGRRClient.SchemaCls.SYSTEM,
+      aff4_grr.VFSGRRClient.SchemaCls.UNAME
+  ]
+
+  def Begin(self):
     self.counters = [
         _ActiveCounter(aff4_stats.ClientFleetStats.SchemaCls.OS_HISTOGRAM),
         _ActiveCounter(aff4_stats.ClientFleetStats.SchemaCls.RELEASE_HISTOGRAM),
     ]
 
-  def FinishProcessing(self):
+  def Finish(self):
     # Write all the counter attributes.
     for counter in self.counters:
-      counter.Save(self)
+      counter.Save(self.cron_flow)
 
   def ProcessClient(self, client):
     """Update counters for system, version and release attributes."""
@@ -215,9 +179,13 @@ class OSBreakDown(AbstractClientStatsCronFlow):
       self.counters[1].Add(uname, label, ping)
 
 
-class LastAccessStats(AbstractClientStatsCronFlow):
+class LastAccessStatsProcessor(ClientStatsProcessor):
   """Calculates a histogram statistics of clients last contacted times."""
 
+  attributes = ClientStatsProcessor.attributes + [
+      aff4_grr.VFSGRRClient.SchemaCls.PING
+  ]
+
   # The number of clients fall into these bins (number of hours ago)
   _bins = [1, 2, 3, 7, 14, 30, 60]
 
@@ -226,12 +194,13 @@ class LastAccessStats(AbstractClientStatsCronFlow):
       self.values[label] = [0] * len(self._bins)
     return self.values[label]
 
-  def BeginProcessing(self):
+  def Begin(self):
     self._bins = [long(x * 1e6 * 24 * 60 * 60) for x in self._bins]
 
     self.values = {}
+    self.now = rdfvalue.RDFDatetime.Now()
 
-  def FinishProcessing(self):
+  def Finish(self):
     # Build and store the graph now. Day actives are cumulative.
     for label in self.values.iterkeys():
       cumulative_count = 0
@@ -240,15 +209,15 @@ class LastAccessStats(AbstractClientStatsCronFlow):
         cumulative_count += y
         graph.Append(x_value=x, y_value=cumulative_count)
 
-      self._StatsForLabel(label).AddAttribute(graph)
+      # pylint: disable=protected-access
+      self.cron_flow._StatsForLabel(label).AddAttribute(graph)
+      # pylint: enable=protected-access
 
   def ProcessClient(self, client):
-    now = rdfvalue.RDFDatetime.Now()
-
     ping = client.Get(client.Schema.PING)
     if ping:
       for label in self.GetClientLabelsList(client):
-        time_ago = now - ping
+        time_ago = self.now - ping
         pos = bisect.bisect(self._bins, time_ago.microseconds)
 
         # If clients are older than the last bin forget them.
@@ -258,6 +227,87 @@ class LastAccessStats(AbstractClientStatsCronFlow):
           pass
 
 
+class AbstractClientStatsCronFlow(cronjobs.SystemCronFlow):
+  """A cron job which feeds every client in the system to stats processors.
+
+  All the processors are run in a single FleetScan, so every client is only
+  read once.
+  """
+
+  CLIENT_STATS_URN = rdfvalue.RDFURN("aff4:/stats/ClientFleetStats")
+
+  # The ClientStatsProcessor classes to run.
+  processors = []
+
+  def _StatsForLabel(self, label):
+    if label not in self.stats:
+      self.stats[label] = aff4.FACTORY.Create(
+          self.CLIENT_STATS_URN.Add(label),
+          aff4_stats.ClientFleetStats,
+          mode="w",
+          token=self.token)
+    return self.stats[label]
+
+  @flow.StateHandler()
+  def Start(self):
+    """Feed all the clients to the ClientStatsProcessors."""
+    try:
+
+      self.stats = {}
+
+      scan = fleet_scan.FleetScan(
+          [cls(self) for cls in self.processors], token=self.token)
+      # This flow is not dead: we don't want to run out of lease time.
+      processed_count = scan.Run(heartbeat=self.HeartBeat)
+
+      for fd in self.stats.values():
+        fd.Close()
+
+      logging.info("%s: processed %d clients.", self.__class__.__name__,
+                   processed_count)
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error while calculating stats: %s", e)
+      raise
+
+
+class GRRVersionBreakDown(AbstractClientStatsCronFlow):
+  """Records relative ratios of GRR versions in 7 day actives."""
+
+  frequency = rdfvalue.Duration("4h")
+  processors = [GRRVersionStatsProcessor]
+
+
+class OSBreakDown(AbstractClientStatsCronFlow):
+  """Records relative ratios of OS versions in 7 day actives."""
+
+  processors = [OSStatsProcessor]
+
+
+class LastAccessStats(AbstractClientStatsCronFlow):
+  """Calculates a histogram statistics of clients last contacted times."""
+
+  processors = [LastAccessStatsProcessor]
+
+
+class ClientFleetStatsCronFlow(AbstractClientStatsCronFlow):
+  """Computes all the registered client fleet statistics in a single pass.
+
+  This job can replace the cron jobs which compute a single statistic each.
+  It is disabled by default, and until an operator opts in the statistics are
+  computed by GRRVersionBreakDown, OSBreakDown and LastAccessStats as before,
+  with one scan of the fleet each. To switch over, enable this job and add the
+  three other jobs to Cron.disabled_system_jobs.
+  """
+
+  frequency = rdfvalue.Duration("4h")
+  disabled = True
+
+  @property
+  def processors(self):
+    return sorted(
+        ClientStatsProcessor.classes.values(), key=lambda cls: cls.__name__)
+
+
 class InterrogateClientsCronFlow(cronjobs.SystemCronFlow):
   """A cron job which runs an interrogate hunt on all clients.
 
@@ -7,14 +7,18 @@ from grr.endtoend_tests import endtoend_mocks
 from grr.lib import action_mocks
 from grr.lib import aff4
 from grr.lib import client_fixture
+from grr.lib import client_index
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import flow
+from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib import utils
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import stats as aff4_stats
 from grr.lib.flows.cron import system
 from grr.lib.flows.general import endtoend as endtoend_flows
+from grr.lib.rdfvalues import aff4_rdfvalues
 from grr.lib.rdfvalues import client as client_rdf
 from grr.lib.rdfvalues import flows
 
@@ -176,6 +180,23 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
     # All our clients appeared at the same time but this label is only half.
     self._CheckAccessStats("Label2", count=10L)
 
+  def testClientFleetStatsCronFlowComputesAllStats(self):
+    for _ in test_lib.TestFlowHelper(
+        "ClientFleetStatsCronFlow", token=self.token):
+      pass
+
+    self._CheckVersionStats(
+        "All", aff4_stats.ClientFleetStats.SchemaCls.GRRVERSION_HISTOGRAM,
+        [0, 0, 20, 20])
+    self._CheckOSStats(
+        "Label1", aff4_stats.ClientFleetStats.SchemaCls.OS_HISTOGRAM,
+        [0, 0, {
+            "Windows": 10
+        }, {
+            "Windows": 10
+        }])
+    self._CheckAccessStats("All", count=20L)
+
   def testPurgeClientStats(self):
     max_age = system.PurgeClientStats.MAX_AGE
 
@@ -308,6 +329,85 @@ class SystemCronFlowTest(test_lib.FlowTestsBaseclass):
     ])
 
 
+class ClientStatsCronFlowBenchmark(test_lib.AverageMicroBenchmarks):
+  """Compares ways of computing client fleet statistics."""
+
+  NUM_CLIENTS = 10000
+
+  def _CreateClients(self):
+    schema = aff4_grr.VFSGRRClient.SchemaCls
+    now = rdfvalue.RDFDatetime.Now()
+    client_info = client_rdf.ClientInformation(
+        client_name="GRR Monitor", client_version=3000)
+    knowledge_base = client_rdf.KnowledgeBase(users=[
+        client_rdf.User(username="user%d" % i, homedir="/home/user%d" % i)
+        for i in range(20)
+    ])
+    labels = aff4_rdfvalues.AFF4ObjectLabelsList()
+    labels.AddLabel(aff4_rdfvalues.AFF4ObjectLabel(name="Label1", owner="GRR"))
+
+    index = client_index.CreateClientIndex(token=self.token)
+    for i in range(self.NUM_CLIENTS):
+      client_id = "C.%016x" % i
+      data_store.DB.MultiSet(
+          rdfvalue.RDFURN(client_id), {
+              schema.TYPE.predicate: [aff4_grr.VFSGRRClient.__name__],
+              schema.PING.predicate: [now - rdfvalue.Duration("%ds" % i)],
+              schema.CLIENT_INFO.predicate: [client_info],
+              schema.SYSTEM.predicate: ["Linux" if i % 2 else "Windows"],
+              schema.UNAME.predicate: ["Linux-Ubuntu-16.04"],
+              schema.LABELS.predicate: [labels],
+              schema.HOSTNAME.predicate: ["host%d" % i],
+              schema.KNOWLEDGE_BASE.predicate: [knowledge_base],
+          },
+          token=self.token)
+      data_store.DB.Set(
+          aff4.ROOT_URN,
+          "index:dir/%s" % client_id,
+          aff4.EMPTY_DATA,
+          token=self.token,
+          sync=False)
+      index.AddKeywordsForName(client_id, ["."], sync=False)
+    data_store.DB.Flush()
+
+  def _ListAndOpenAllChildren(self, processor_cls):
+    """Computes a statistic the way the client stats cron flows used to."""
+    processor = processor_cls(self)
+    processor.Begin()
+    root = aff4.FACTORY.Open(aff4.ROOT_URN, token=self.token)
+    children_urns = list(root.ListChildren())
+    for child in aff4.FACTORY.MultiOpen(
+        children_urns, mode="r", token=self.token, age=aff4.NEWEST_TIME):
+      if isinstance(child, aff4_grr.VFSGRRClient):
+        processor.ProcessClient(child)
+
+  def _RunFlows(self, flow_names):
+    for flow_name in flow_names:
+      for _ in test_lib.TestFlowHelper(flow_name, token=self.token):
+        pass
+
+  @test_lib.SetLabel("benchmark")
+  def testClientStats(self):
+    self._CreateClients()
+
+    self.TimeIt(
+        lambda: [self._ListAndOpenAllChildren(cls) for cls in [
+            system.GRRVersionStatsProcessor, system.OSStatsProcessor,
+            system.LastAccessStatsProcessor
+        ]],
+        name="Full reads of all root children, 3 stats",
+        repetitions=1)
+    self.TimeIt(
+        lambda: self._RunFlows(
+            ["GRRVersionBreakDown", "OSBreakDown", "LastAccessStats"]),
+        name="Fleet scans, 3 flows",
+        repetitions=1)
+    self.TimeIt(
+        lambda: self._RunFlows(["ClientFleetStatsCronFlow"]),
+        name="Single fleet scan, 1 flow",
+        repetitions=1)
+
+
 def main(argv):
   # Run the full test suite
   test_lib.GrrTestProgram(argv=argv)
@@ -184,6 +184,70 @@ class GRRFuseDatastoreOnlyTest(GRRFuseTestBase):
       existing_dir = os.path.join(self.root, self.client_name, "/fs/os/c/bin")
       self.passthrough.Read(existing_dir)
 
+  def _CreateImage(self, path, contents, chunksize=10):
+    urn = rdfvalue.RDFURN(self.client_name).Add(path)
+    with aff4.FACTORY.Create(
+        urn, aff4.AFF4Image, mode="w", token=self.token) as fd:
+      fd.SetChunksize(chunksize)
+      fd.Write(contents)
+    return os.path.join("/", self.client_name, path)
+
+  def testBlockCacheRead(self):
+    contents = "".join(chr(ord("a") + i % 26) for i in range(1000))
+    path = self._CreateImage("fs/os/c/image", contents)
+
+    for offset, length in [(0, 1000), (5, 17), (995, 100), (1000, 10),
+                           (333, 1), (0, None)]:
+      expected = contents[offset:offset + length if length else None]
+      self.assertEqual(self.passthrough.Read(path, length, offset), expected)
+
+  def testBlockCacheReadahead(self):
+    contents = "x" * 1000
+    path = self._CreateImage("fs/os/c/image", contents)
+
+    self.passthrough.Read(path, 10, 0)
+    self.assertEqual(len(self.passthrough.block_cache), 1)
+
+    # A sequential read pulls in the readahead window as well.
+    self.passthrough.Read(path, 10, 10)
+    self.assertEqual(
+        len(self.passthrough.block_cache),
+        2 + self.passthrough.readahead_blocks)
+
+    def FailRead(*unused_args):
+      raise AssertionError("Read should have been served from the cache.")
+
+    # Reads inside the readahead window come from the cache.
+    with utils.Stubber(aff4.AFF4Image, "Read", FailRead):
+      self.assertEqual(self.passthrough.Read(path, 30, 30), "x" * 30)
+
+  def testBlockCacheSeesNewVersions(self):
+    path = self._CreateImage("fs/os/c/image", "a" * 100)
+    self.assertEqual(self.passthrough.Read(path, 10, 0), "a" * 10)
+
+    # The opened object is still cached, but the write changed its version.
+    self._CreateImage("fs/os/c/image", "b" * 100)
+    self.assertEqual(self.passthrough.Read(path, 10, 0), "b" * 10)
+
+  def testAttributeCache(self):
+    bash_path = os.path.join("/", self.client_name, "fs/os/c/bin/bash")
+    first = self.passthrough.getattr(bash_path)
+
+    with utils.Stubber(aff4.FACTORY, "Open", None):
+      self.assertEqual(self.passthrough.getattr(bash_path), first)
+
+    self.passthrough.InvalidatePath(bash_path)
+    self.assertEqual(self.passthrough.getattr(bash_path), first)
+
+  def testAttributeCacheDisabled(self):
+    passthrough = fuse_mount.GRRFuseDatastoreOnly(
+        self.root, token=self.token, attribute_cache_ttl=0)
+    bash_path = os.path.join("/", self.client_name, "fs/os/c/bin/bash")
+    passthrough.getattr(bash_path)
+
+    self.assertEqual(len(passthrough.stat_cache), 0)
+    self.assertEqual(len(passthrough.fd_cache), 0)
+
 
 class GRRFuseTest(GRRFuseTestBase):
 
@@ -458,6 +522,46 @@ class GRRFuseTest(GRRFuseTestBase):
           break
 
 
+class GRRFuseBenchmark(test_lib.AverageMicroBenchmarks):
+  """Measures reading a large AFF4Image through the FUSE layer."""
+
+  REPEATS = 5
+  FILE_SIZE = 4 * 1024 * 1024
+  READ_SIZE = 128 * 1024
+
+  def setUp(self):
+    super(GRRFuseBenchmark, self).setUp()
+    self.client_name = "C." + "1" * 16
+    test_lib.ClientFixture(self.client_name, token=self.token)
+
+    urn = rdfvalue.RDFURN(self.client_name).Add("fs/os/c/large_image")
+    with aff4.FACTORY.Create(
+        urn, aff4.AFF4Image, mode="w", token=self.token) as fd:
+      for _ in xrange(self.FILE_SIZE / (1024 * 1024)):
+        fd.Write(os.urandom(1024 * 1024))
+
+    self.path = os.path.join("/", self.client_name, "fs/os/c/large_image")
+
+  def _ReadSequentially(self, passthrough):
+    passthrough.block_cache.Flush()
+    for offset in xrange(0, self.FILE_SIZE, self.READ_SIZE):
+      passthrough.Read(self.path, self.READ_SIZE, offset)
+
+  @test_lib.SetLabel("benchmark")
+  def testSequentialRead(self):
+    """Reads a 4mb AFF4Image in FUSE sized pieces."""
+    uncached = fuse_mount.GRRFuseDatastoreOnly(
+        "/", token=self.token, block_cache_size=0, attribute_cache_ttl=0)
+    self.TimeIt(
+        self._ReadSequentially, name="Uncached", passthrough=uncached)
+
+    cached = fuse_mount.GRRFuseDatastoreOnly("/", token=self.token)
+    self.TimeIt(
+        self._ReadSequentially,
+        name="Block cache and readahead",
+        passthrough=cached)
+
+
 def main(argv):
   # Run the full test suite
   test_lib.GrrTestProgram(argv=argv)
@@ -7,6 +7,7 @@
 import logging
 
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import flow
 
@@ -16,6 +17,7 @@ from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib import utils
+from grr.lib.rdfvalues import hunts as rdf_hunts
 from grr.server import foreman as rdf_foreman
 
 
@@ -326,6 +328,86 @@ class HuntTest(test_lib.FlowTestsBaseclass):
     self.assertEqual(started, 10)
     self.assertEqual(finished, 10)
 
+  def _RunSampleHunt(self, client_ids):
+    client_rule_set = rdf_foreman.ForemanClientRuleSet(rules=[
+        rdf_foreman.ForemanClientRule(
+            rule_type=rdf_foreman.ForemanClientRule.Type.REGEX,
+            regex=rdf_foreman.ForemanRegexClientRule(
+                attribute_name="GRR client", attribute_regex="GRR"))
+    ])
+
+    with hunts.GRRHunt.StartHunt(
+        hunt_name="SampleHunt",
+        client_rule_set=client_rule_set,
+        client_rate=0,
+        token=self.token) as hunt:
+
+      hunt.GetRunner().Start()
+
+    foreman = aff4.FACTORY.Open("aff4:/foreman", mode="rw", token=self.token)
+    for client_id in client_ids:
+      foreman.AssignTasksToClient(client_id)
+
+    client_mock = test_lib.SampleHuntMock()
+    test_lib.TestHuntHelper(client_mock, client_ids[1:], False, self.token)
+
+    return hunt.session_id
+
+  def testClientCompletionStatsAreUpdatedIncrementally(self):
+    client_ids = self.SetupClients(10)
+    hunt_urn = self._RunSampleHunt(client_ids)
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, mode="r", token=self.token)
+    stats = hunt_obj.client_completion_stats
+    self.assertEqual(stats.started_count, 10)
+    self.assertEqual(stats.completed_count, 9)
+
+    # Counters must match what the clients collections say.
+    # pylint: disable=protected-access
+    expected = hunt_obj._BuildClientCompletionStats()
+    # pylint: enable=protected-access
+    self.assertEqual(stats.GetDataPoints(), expected.GetDataPoints())
+
+  def testClientCompletionStatsAreReconciled(self):
+    client_ids = self.SetupClients(10)
+    hunt_urn = self._RunSampleHunt(client_ids)
+
+    # Lose all the counters, as if the hunt was created before they existed.
+    data_store.DB.DeleteAttributes(
+        hunt_urn, [hunts.GRRHunt.SchemaCls.CLIENT_COMPLETION_STATS],
+        sync=True,
+        token=self.token)
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, mode="r", token=self.token)
+    self.assertIsNone(hunt_obj.client_completion_stats)
+    # Counters are still computed, but from the clients collections.
+    self.assertEqual(hunt_obj.GetClientsCounts(), (10, 9, 0))
+
+    # The next time the hunt is processed, the counters are rebuilt.
+    with aff4.FACTORY.OpenWithLock(hunt_urn, token=self.token):
+      pass
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, mode="r", token=self.token)
+    self.assertEqual(hunt_obj.client_completion_stats.started_count, 10)
+    self.assertEqual(hunt_obj.client_completion_stats.completed_count, 9)
+
+    # Stale counters are reconciled too.
+    with aff4.FACTORY.OpenWithLock(hunt_urn, token=self.token) as hunt_obj:
+      hunt_obj.client_completion_stats = rdf_hunts.HuntClientCompletionStats(
+          reconcile_time=rdfvalue.RDFDatetime.Now())
+      hunt_obj.client_completion_stats_changed = True
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, mode="r", token=self.token)
+    self.assertEqual(hunt_obj.GetClientsCounts(), (0, 0, 0))
+
+    with test_lib.FakeTime(rdfvalue.RDFDatetime.Now() + rdfvalue.Duration(
+        "2h")):
+      with aff4.FACTORY.OpenWithLock(hunt_urn, token=self.token):
+        pass
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, mode="r", token=self.token)
+    self.assertEqual(hunt_obj.GetClientsCounts(), (10, 9, 0))
+
   def testHangingClients(self):
     """This tests if the hunt completes when some clients hang or raise."""
     # Set up 10 clients.
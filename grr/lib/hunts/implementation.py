@@ -909,6 +909,13 @@ class GRRHunt(flow.FlowBase):
         versioned=False,
         creates_new_object_version=False)
 
+    CLIENT_COMPLETION_STATS = aff4.Attribute(
+        "aff4:client_completion_stats",
+        rdf_hunts.HuntClientCompletionStats,
+        "Counters of started, completed and failed clients.",
+        versioned=False,
+        creates_new_object_version=False)
+
     # This needs to be kept out the args semantic value since must be updated
     # without taking a lock on the hunt object.
     STATE = aff4.Attribute(
@@ -927,14 +934,30 @@ class GRRHunt(flow.FlowBase):
 
   args_type = None
 
+  # How often client completion counters are recomputed from the clients
+  # collections to correct any drift.
+  client_completion_stats_reconcile_interval = rdfvalue.Duration("1h")
+
+  # If True, flows started on clients write their results directly to the
+  # hunt's results collections, without sending them to the hunt. The hunt is
+  # then only notified when the flows complete.
+  child_flows_write_results = False
+
   def Initialize(self):
     super(GRRHunt, self).Initialize()
     # Hunts run in multiple threads so we need to protect access.
     self.lock = threading.RLock()
     self.processed_responses = False
 
+    # Counters are only written back if they were updated through this object,
+    # so that opening a hunt without a lock doesn't overwrite them.
+    self.client_completion_stats = None
+    self.client_completion_stats_changed = False
+
     if "r" in self.mode:
       self.client_count = self.Get(self.Schema.CLIENT_COUNT)
+      self.client_completion_stats = self.Get(
+          self.Schema.CLIENT_COMPLETION_STATS)
       self.runner_args = self.Get(self.Schema.HUNT_RUNNER_ARGS)
       self.context = self.Get(self.Schema.HUNT_CONTEXT)
 
@@ -1015,11 +1038,23 @@ class GRRHunt(flow.FlowBase):
   def _ClientSymlinkUrn(self, client_id):
     return client_id.Add("flows").Add("%s:hunt" % (self.urn.Basename()))
 
+  def _UpdateClientCompletionStats(self, method_name):
+    # Hunts created before the counters were introduced get them on the next
+    # reconciliation.
+    if self.client_completion_stats is None:
+      return
+
+    getattr(self.client_completion_stats,
+            method_name)(rdfvalue.RDFDatetime.Now())
+    self.client_completion_stats_changed = True
+
   def RegisterClient(self, client_urn):
     self._AddURNToCollection(client_urn, self.all_clients_collection_urn)
+    self._UpdateClientCompletionStats("RegisterStartedClient")
 
   def RegisterCompletedClient(self, client_urn):
     self._AddURNToCollection(client_urn, self.completed_clients_collection_urn)
+    self._UpdateClientCompletionStats("RegisterCompletedClient")
 
   def RegisterClientWithResults(self, client_urn):
     self._AddURNToCollection(client_urn,
@@ -1031,6 +1066,7 @@ class GRRHunt(flow.FlowBase):
       error.log_message = utils.SmartUnicode(log_message)
 
     self._AddHuntErrorToCollection(error, self.clients_errors_collection_urn)
+    self._UpdateClientCompletionStats("RegisterClientError")
 
   def OnDelete(self, deletion_pool=None):
     super(GRRHunt, self).OnDelete(deletion_pool=deletion_pool)
@@ -1180,29 +1216,61 @@ class GRRHunt(flow.FlowBase):
     """A shortcut method for stopping the hunt."""
     self.GetRunner().Stop()
 
-  def AddResultsToCollection(self, responses, client_id):
-    if responses.success:
-      with self.lock:
-        self.processed_responses = True
+  @classmethod
+  def StaticAddResults(cls,
+                       hunt_urn,
+                       client_id,
+                       responses,
+                       register_client=True,
+                       mutation_pool=None,
+                       token=None):
+    """Adds results of a client to the hunt's collections.
+
+    This does not require the hunt to be open or locked, so it can be called
+    concurrently by the flows running on the hunt's clients.
+
+    Args:
+      hunt_urn: The URN of the hunt.
+      client_id: The URN of the client which produced the results.
+      responses: An iterable of RDFValues to add.
+      register_client: If True, the client is also added to the clients with
+        results, unless there are no responses.
+      mutation_pool: An optional MutationPool object to write to.
+      token: The security token to use.
+    """
+    hunt_urn = rdfvalue.RDFURN(hunt_urn)
+    msgs = [
+        rdf_flows.GrrMessage(payload=response, source=client_id)
+        for response in responses
+    ]
 
-        msgs = [
-            rdf_flows.GrrMessage(
-                payload=response, source=client_id) for response in responses
-        ]
+    for msg in msgs:
+      hunts_results.HuntResultCollection.StaticAdd(
+          hunt_urn.Add("Results"), token, msg, mutation_pool=mutation_pool)
 
-        for msg in msgs:
-          hunts_results.HuntResultCollection.StaticAdd(
-              self.results_collection_urn, self.token, msg)
+    for msg in msgs:
+      multi_type_collection.MultiTypeCollection.StaticAdd(
+          hunt_urn.Add("ResultsPerType"),
+          token,
+          msg,
+          mutation_pool=mutation_pool)
 
-        for msg in msgs:
-          multi_type_collection.MultiTypeCollection.StaticAdd(
-              self.multi_type_output_urn, self.token, msg)
+    if msgs and register_client:
+      ClientUrnCollection.StaticAdd(
+          hunt_urn.Add("ClientsWithResults"),
+          token,
+          client_id,
+          mutation_pool=mutation_pool)
 
-        if responses:
-          self.RegisterClientWithResults(client_id)
+    # Update stats.
+    stats.STATS.IncrementCounter("hunt_results_added", delta=len(msgs))
 
-        # Update stats.
-        stats.STATS.IncrementCounter("hunt_results_added", delta=len(msgs))
+  def AddResultsToCollection(self, responses, client_id):
+    if responses.success:
+      with self.lock:
+        self.processed_responses = True
+        self.StaticAddResults(
+            self.urn, client_id, responses, token=self.token)
     else:
       self.LogClientError(
           client_id, log_message=utils.SmartStr(responses.status))
@@ -1219,6 +1287,9 @@ class GRRHunt(flow.FlowBase):
       # The flow is stored in the hunt namespace,
       base_session_id = self.urn.Add(client_id.Basename())
 
+      if self.child_flows_write_results:
+        kwargs["parent_hunt_urn"] = self.urn
+
     # Actually start the new flow.
     child_urn = self.runner.CallFlow(
         flow_name=flow_name,
@@ -1263,6 +1334,11 @@ class GRRHunt(flow.FlowBase):
     with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
       self.CreateCollections(mutation_pool)
 
+    # A new hunt has no clients, so there's nothing to reconcile yet.
+    self.client_completion_stats = rdf_hunts.HuntClientCompletionStats(
+        reconcile_time=rdfvalue.RDFDatetime.Now())
+    self.client_completion_stats_changed = True
+
     if not self.runner_args.description:
       self.SetDescription()
 
@@ -1361,7 +1437,8 @@ class GRRHunt(flow.FlowBase):
       status: Status returned from the client.
     """
 
-  def GetClientsCounts(self):
+  def _BuildClientCompletionStats(self):
+    """Computes client completion counters from the clients collections."""
     collections = aff4.FACTORY.MultiOpen(
         [
             self.all_clients_collection_urn,
@@ -1373,18 +1450,54 @@ class GRRHunt(flow.FlowBase):
 
     collections_dict = dict((coll.urn, coll) for coll in collections)
 
-    def CollectionLen(collection_urn):
+    def CollectionItems(collection_urn):
       if collection_urn in collections_dict:
-        return collections_dict[collection_urn].CalculateLength()
+        return collections_dict[collection_urn].GenerateItems()
       else:
-        return 0
+        return []
+
+    started = {}
+    for client in CollectionItems(self.all_clients_collection_urn):
+      started[client] = min(started.get(client, client.age), client.age)
+
+    completed = {}
+    for client in CollectionItems(self.completed_clients_collection_urn):
+      completed[client] = min(completed.get(client, client.age), client.age)
+
+    errors = [
+        error.age
+        for error in CollectionItems(self.clients_errors_collection_urn)
+    ]
+
+    def ToSeconds(timestamps):
+      return [t.AsSecondsFromEpoch() for t in timestamps]
 
-    all_clients_count = CollectionLen(self.all_clients_collection_urn)
-    completed_clients_count = CollectionLen(
-        self.completed_clients_collection_urn)
-    clients_errors_count = CollectionLen(self.clients_errors_collection_urn)
+    result = rdf_hunts.HuntClientCompletionStats.FromTimestamps(
+        ToSeconds(started.values()),
+        ToSeconds(completed.values()), ToSeconds(errors))
+    result.reconcile_time = rdfvalue.RDFDatetime.Now()
+    return result
 
-    return all_clients_count, completed_clients_count, clients_errors_count
+  def ReconcileClientCompletionStats(self):
+    """Recomputes client completion counters from the clients collections."""
+    self.client_completion_stats = self._BuildClientCompletionStats()
+    self.client_completion_stats_changed = True
+
+  def GetClientCompletionStats(self):
+    """Returns counters of started, completed and failed clients.
+
+    Returns:
+      HuntClientCompletionStats.
+    """
+    if self.client_completion_stats is None:
+      # Hunt hasn't been reconciled since the counters were introduced.
+      return self._BuildClientCompletionStats()
+
+    return self.client_completion_stats
+
+  def GetClientsCounts(self):
+    stats = self.GetClientCompletionStats()
+    return stats.started_count, stats.completed_count, stats.errors_count
 
   def GetClientsErrors(self, client_id=None):
     errors = self._GetCollectionItems(self.clients_errors_collection_urn)
@@ -1435,6 +1548,13 @@ class GRRHunt(flow.FlowBase):
     if not runner.IsCompleted():
       runner.CheckExpiry()
 
+    # Only a hunt holding a lock can safely replace the counters.
+    if "r" in self.mode and self.locked:
+      stats = self.client_completion_stats
+      if (stats is None or rdfvalue.RDFDatetime.Now() - stats.reconcile_time >
+          self.client_completion_stats_reconcile_interval):
+        self.ReconcileClientCompletionStats()
+
   @staticmethod
   def GetAllSubflowUrns(hunt_urn, client_urns, top_level_only=False,
                         token=None):
@@ -1470,6 +1590,10 @@ class GRRHunt(flow.FlowBase):
       self.Set(self.Schema.HUNT_CONTEXT(self.context))
       self.Set(self.Schema.HUNT_RUNNER_ARGS(self.runner_args))
 
+      if self.client_completion_stats_changed:
+        self.Set(self.Schema.CLIENT_COMPLETION_STATS(
+            self.client_completion_stats))
+
 
 class HuntInitHook(registry.InitHook):
 
@@ -3,6 +3,8 @@
 """
 
 import logging
+import sys
+import threading
 
 from grr.lib import aff4
 from grr.lib import flow
@@ -48,6 +50,13 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
 
   The ProcessHuntResultCollectionsCronFlow reads hunt results stored in
   HuntResultCollections and feeds runs output plugins on them.
+
+  Notifications of new results are claimed from a HuntResultQueue shard while
+  holding the shard's lease, which is released before the results are
+  processed. A hunt's results are then only processed by the holder of the
+  lease on its results collection. Runs of the flow overlap, and each run
+  processes a number of shards concurrently, so hunts are spread over all the
+  workers running the flow.
   """
 
   frequency = rdfvalue.Duration("5m")
@@ -58,6 +67,10 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
 
   DEFAULT_BATCH_SIZE = 5000
 
+  # The number of batches of results read while the output plugins process the
+  # current batch.
+  PREFETCH_BATCHES = 1
+
   def CheckIfRunningTooLong(self):
     if self.args.max_running_time:
       elapsed = (rdfvalue.RDFDatetime.Now().AsSecondsFromEpoch() -
@@ -82,60 +95,154 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
       used_plugins.append((plugin_def, plugin_def.GetPluginForState(state)))
     return output_plugins, used_plugins
 
-  def RunPlugins(self, hunt_urn, plugins, results, exceptions_by_plugin):
-    for plugin_def, plugin in plugins:
-      try:
-        plugin.ProcessResponses(results)
-        plugin.Flush()
-
-        plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
-            plugin_descriptor=plugin_def,
-            status="SUCCESS",
-            batch_size=len(results))
-        stats.STATS.IncrementCounter(
-            "hunt_results_ran_through_plugin",
-            delta=len(results),
-            fields=[plugin_def.plugin_name])
-
-      except Exception as e:  # pylint: disable=broad-except
-        logging.exception("Error processing hunt results: hunt %s, "
-                          "plugin %s", hunt_urn, utils.SmartStr(plugin))
-        self.Log("Error processing hunt results (hunt %s, "
-                 "plugin %s): %s" % (hunt_urn, utils.SmartStr(plugin), e))
-        stats.STATS.IncrementCounter(
-            "hunt_output_plugin_errors", fields=[plugin_def.plugin_name])
-
-        plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
-            plugin_descriptor=plugin_def,
-            status="ERROR",
-            summary=utils.SmartStr(e),
-            batch_size=len(results))
-        exceptions_by_plugin.setdefault(plugin_def, []).append(e)
-
+  def RunPlugin(self, hunt_urn, plugin_def, plugin, results):
+    """Runs a single output plugin over a batch of results.
+
+    Args:
+      hunt_urn: The URN of the hunt the results belong to.
+      plugin_def: The OutputPluginDescriptor of the plugin.
+      plugin: The OutputPlugin instance.
+      results: A list of GrrMessages.
+
+    Returns:
+      The exception raised by the plugin, or None.
+    """
+    exception = None
+    try:
+      plugin.ProcessResponses(results)
+      plugin.Flush()
+
+      plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
+          plugin_descriptor=plugin_def,
+          status="SUCCESS",
+          batch_size=len(results))
+      stats.STATS.IncrementCounter(
+          "hunt_results_ran_through_plugin",
+          delta=len(results),
+          fields=[plugin_def.plugin_name])
+
+    except Exception as e:  # pylint: disable=broad-except
+      logging.exception("Error processing hunt results: hunt %s, "
+                        "plugin %s", hunt_urn, utils.SmartStr(plugin))
+      self.Log("Error processing hunt results (hunt %s, "
+               "plugin %s): %s" % (hunt_urn, utils.SmartStr(plugin), e))
+      stats.STATS.IncrementCounter(
+          "hunt_output_plugin_errors", fields=[plugin_def.plugin_name])
+
+      plugin_status = output_plugin.OutputPluginBatchProcessingStatus(
+          plugin_descriptor=plugin_def,
+          status="ERROR",
+          summary=utils.SmartStr(e),
+          batch_size=len(results))
+      exception = e
+
+    aff4.FACTORY.Open(
+        hunt_urn.Add("OutputPluginsStatus"),
+        hunts_implementation.PluginStatusCollection,
+        mode="w",
+        token=self.token).Add(plugin_status)
+    if plugin_status.status == plugin_status.Status.ERROR:
       aff4.FACTORY.Open(
-          hunt_urn.Add("OutputPluginsStatus"),
+          hunt_urn.Add("OutputPluginsErrors"),
           hunts_implementation.PluginStatusCollection,
           mode="w",
           token=self.token).Add(plugin_status)
-      if plugin_status.status == plugin_status.Status.ERROR:
-        aff4.FACTORY.Open(
-            hunt_urn.Add("OutputPluginsErrors"),
-            hunts_implementation.PluginStatusCollection,
-            mode="w",
-            token=self.token).Add(plugin_status)
-
-  def ProcessOneHunt(self, exceptions_by_hunt):
-    """Reads results for one hunt and process them."""
-    hunt_results_urn, results = (
-        hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
-            start_time=self.args.start_processing_time,
-            token=self.token,
-            lease_time=self.lifetime))
+
+    return exception
+
+  def RunPlugins(self, hunt_urn, plugins, results, exceptions_by_plugin):
+    """Runs the output plugins over a batch of results concurrently."""
+    plugin_exceptions = [None] * len(plugins)
+
+    def Run(i):
+      plugin_def, plugin = plugins[i]
+      plugin_exceptions[i] = self.RunPlugin(hunt_urn, plugin_def, plugin,
+                                            results)
+
+    if len(plugins) == 1:
+      Run(0)
+    else:
+      threads = [
+          threading.Thread(target=Run, args=(i,), name="OutputPlugin")
+          for i in range(len(plugins))
+      ]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+
+    for (plugin_def, _), exception in zip(plugins, plugin_exceptions):
+      if exception is not None:
+        exceptions_by_plugin.setdefault(plugin_def, []).append(exception)
+
+  def _ResolveBatches(self, collection_obj, notifications, batch_size):
+    for batch in utils.Grouper(notifications, batch_size):
+      yield batch, list(
+          collection_obj.MultiResolve([(ts, suffix)
+                                       for (_, ts, suffix) in batch]))
+
+  def HeartBeat(self):
+    # Shards are processed in multiple threads.
+    with self.heartbeat_lock:
+      super(ProcessHuntResultCollectionsCronFlow, self).HeartBeat()
+
+  def ProcessOneShard(self, shard, exceptions_by_hunt):
+    """Processes the results of one hunt from a shard of the results queue.
+
+    Args:
+      shard: The URN of a HuntResultQueue shard.
+      exceptions_by_hunt: A dict to which the exceptions raised by output
+        plugins are added.
+
+    Returns:
+      The number of processed results. This is 0 if the shard is empty or if
+      it is processed by someone else.
+    """
+    try:
+      queue_obj = aff4.FACTORY.OpenWithLock(
+          shard,
+          aff4_type=hunts_results.HuntResultQueue,
+          lease_time=600,
+          blocking=False,
+          token=self.token)
+    except aff4.LockError:
+      return 0
+
+    # The claimed notifications are leased to this run, so the shard is only
+    # locked while claiming them.
+    with queue_obj:
+      hunt_results_urn, results = queue_obj.ClaimNotifications(
+          start_time=self.args.start_processing_time,
+          lease_time=self.lifetime)
     logging.debug("Found %d results for hunt %s",
                   len(results), hunt_results_urn)
     if not results:
       return 0
 
+    try:
+      self.ProcessHuntResults(hunt_results_urn, results, exceptions_by_hunt)
+    except aff4.LockError:
+      # The hunt's results are being processed by someone else, who will
+      # claim these notifications as well.
+      hunts_results.HuntResultQueue.ReleaseRecords(
+          [record_id for (record_id, _, _) in results], token=self.token)
+      return 0
+
+    return len(results)
+
+  def ProcessHuntResults(self, hunt_results_urn, results, exceptions_by_hunt):
+    """Runs the hunt's output plugins over the claimed results.
+
+    Args:
+      hunt_results_urn: The URN of the hunt's HuntResultCollection.
+      results: The claimed notifications, as (record_id, timestamp, suffix)
+        tuples.
+      exceptions_by_hunt: A dict to which the exceptions raised by output
+        plugins are added.
+
+    Raises:
+      LockError: The results collection is locked by someone else.
+    """
     hunt_urn = rdfvalue.RDFURN(hunt_results_urn.Dirname())
     batch_size = self.args.batch_size or self.DEFAULT_BATCH_SIZE
     metadata_urn = hunt_urn.Add("ResultsMetadata")
@@ -145,30 +252,42 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
         hunt_results_urn,
         aff4_type=hunts_results.HuntResultCollection,
         lease_time=600,
+        blocking=False,
         token=self.token) as collection_obj:
       with aff4.FACTORY.OpenWithLock(
           metadata_urn, lease_time=600, token=self.token) as metadata_obj:
         all_plugins, used_plugins = self.LoadPlugins(metadata_obj)
         num_processed = int(
             metadata_obj.Get(metadata_obj.Schema.NUM_PROCESSED_RESULTS))
-        for batch in utils.Grouper(results, batch_size):
-          results = list(
-              collection_obj.MultiResolve([(ts, suffix)
-                                           for (_, ts, suffix) in batch]))
+        for batch, results in utils.Prefetch(
+            self._ResolveBatches(collection_obj, results, batch_size),
+            max_pages=self.PREFETCH_BATCHES,
+            page_size=1):
           self.RunPlugins(hunt_urn, used_plugins, results, exceptions_by_plugin)
 
           hunts_results.HuntResultQueue.DeleteNotifications(
               [record_id for (record_id, _, _) in batch], token=self.token)
           num_processed += len(batch)
           num_processed_for_hunt += len(batch)
+          self.RecordLag(hunt_urn, batch)
           self.HeartBeat()
           collection_obj.UpdateLease(600)
+          # Plugins' state is written after every batch, so that processing
+          # resumes from here if it is interrupted.
+          if all_plugins:
+            metadata_obj.Set(metadata_obj.Schema.OUTPUT_PLUGINS(all_plugins))
           metadata_obj.Set(
               metadata_obj.Schema.NUM_PROCESSED_RESULTS(num_processed))
+          metadata_obj.Flush()
           metadata_obj.UpdateLease(600)
           if self.CheckIfRunningTooLong():
             logging.warning("Run too long, stopping.")
             break
+        else:
+          # All the claimed results are processed, so there is no lag to
+          # report for this hunt until new results arrive.
+          stats.STATS.DeleteGaugeValue(
+              "hunt_results_processing_lag", fields=[str(hunt_urn)])
 
         metadata_obj.Set(metadata_obj.Schema.OUTPUT_PLUGINS(all_plugins))
         metadata_obj.Set(
@@ -180,7 +299,38 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
             plugin, []).extend(exceptions)
 
     logging.debug("Processed %d results.", num_processed_for_hunt)
-    return len(results)
+
+  def RecordLag(self, hunt_urn, batch):
+    """Exports how long ago the oldest result of a processed batch arrived."""
+    oldest = min(ts for (_, ts, _) in batch)
+    lag = (rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch() - oldest) / 1e6
+    stats.STATS.SetGaugeValue(
+        "hunt_results_processing_lag", max(lag, 0), fields=[str(hunt_urn)])
+
+  def ProcessShards(self, shards, exceptions_by_hunt, errors):
+    """Processes the given shards in turn until they are all done.
+
+    Args:
+      shards: A list of HuntResultQueue shard URNs.
+      exceptions_by_hunt: A dict to which the exceptions raised by output
+        plugins are added.
+      errors: A list to which the exc_info of an unexpected exception is
+        added. This method runs in its own thread, so the exception is
+        re-raised by the caller.
+    """
+    try:
+      while not self.CheckIfRunningTooLong():
+        count = 0
+        for shard in shards:
+          count += self.ProcessOneShard(shard, exceptions_by_hunt)
+          if self.CheckIfRunningTooLong():
+            break
+
+        if not count:
+          break
+    except Exception:  # pylint: disable=broad-except
+      logging.exception("Error processing hunt results shards.")
+      errors.append(sys.exc_info())
 
   @flow.StateHandler()
   def Start(self):
@@ -191,10 +341,33 @@ class ProcessHuntResultCollectionsCronFlow(cronjobs.SystemCronFlow):
       self.args.max_running_time = rdfvalue.Duration("%ds" % int(
           ProcessHuntResultCollectionsCronFlow.lifetime.seconds * 0.6))
 
-    while not self.CheckIfRunningTooLong():
-      count = self.ProcessOneHunt(exceptions_by_hunt)
-      if not count:
-        break
+    self.heartbeat_lock = threading.Lock()
+    shards = hunts_results.HuntResultQueue.GetAllShards()
+    threads_count = max(1, min(self.args.processing_threads, len(shards)))
+    # Every thread starts with a different shard and skips the shards which
+    # are being processed by others.
+    exceptions = [{} for _ in range(threads_count)]
+    errors = []
+    threads = [
+        threading.Thread(
+            target=self.ProcessShards,
+            args=(shards[i:] + shards[:i], exceptions[i], errors),
+            name="ProcessHuntResults") for i in range(threads_count)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    if errors:
+      exc_type, exc_value, exc_traceback = errors[0]
+      raise exc_type, exc_value, exc_traceback
+
+    for thread_exceptions in exceptions:
+      for hunt_urn, exceptions_by_plugin in thread_exceptions.items():
+        for plugin, plugin_exceptions in exceptions_by_plugin.items():
+          exceptions_by_hunt.setdefault(hunt_urn, {}).setdefault(
+              plugin, []).extend(plugin_exceptions)
 
     if exceptions_by_hunt:
       e = ResultsProcessingError()
@@ -2,10 +2,14 @@
 """Classes to store and manage hunt results.
 """
 
+import zlib
+
 from grr.lib import access_control
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import rdfvalue
 from grr.lib import registry
+from grr.lib import utils
 from grr.lib.aff4_objects import queue as aff4_queue
 from grr.lib.aff4_objects import sequential_collection
 from grr.lib.rdfvalues import structs as rdf_structs
@@ -20,9 +24,47 @@ RESULT_NOTIFICATION_QUEUE = rdfvalue.RDFURN("aff4:/hunt_results_queue")
 
 
 class HuntResultQueue(aff4_queue.Queue):
-  """A global queue of hunt results which need to be processed."""
+  """A global queue of hunt results which need to be processed.
+
+  The queue is split into Worker.hunt_result_queue_shards shards, each of them
+  a HuntResultQueue of its own. All the notifications for a collection go to
+  the same shard, so that results are added without contention on a single
+  queue and claiming notifications for a collection only locks its shard.
+  """
   rdf_type = HuntResultNotification
 
+  @classmethod
+  def GetAllShards(cls):
+    """Returns the URNs of all the shards of the queue."""
+    shards = [RESULT_NOTIFICATION_QUEUE]
+    for i in range(1, config_lib.CONFIG["Worker.hunt_result_queue_shards"]):
+      shards.append(RESULT_NOTIFICATION_QUEUE.Add(str(i)))
+    return shards
+
+  @classmethod
+  def GetShardForCollection(cls, collection_urn):
+    """Returns the URN of the shard holding notifications for a collection."""
+    shards = cls.GetAllShards()
+    shard_index = zlib.crc32(utils.SmartStr(collection_urn)) & 0xffffffff
+    return shards[shard_index % len(shards)]
+
+  @classmethod
+  def _ShardsByOldestNotification(cls, start_time=None, token=None):
+    """Returns the non-empty shards, oldest unclaimed notification first."""
+    shards = cls.GetAllShards()
+    if len(shards) == 1:
+      return shards
+
+    oldest = []
+    for queue in aff4.FACTORY.MultiOpen(
+        shards, aff4_type=HuntResultQueue, token=token):
+      for record_id, _ in queue.PeekRecords(start_time=start_time):
+        # Record ids end with the hex encoded timestamp of the record.
+        oldest.append((utils.SmartStr(record_id).rsplit("/", 1)[-1],
+                       queue.urn))
+
+    return [shard for _, shard in sorted(oldest)]
+
   @classmethod
   def ClaimNotificationsForCollection(cls,
                                       token=None,
@@ -52,6 +94,45 @@ class HuntResultQueue(aff4_queue.Queue):
 
     """
 
+    if collection is None:
+      shards = cls._ShardsByOldestNotification(
+          start_time=start_time, token=token)
+    else:
+      shards = [cls.GetShardForCollection(collection)]
+
+    for shard in shards:
+      with aff4.FACTORY.OpenWithLock(
+          shard,
+          aff4_type=HuntResultQueue,
+          lease_time=300,
+          blocking=True,
+          blocking_sleep_interval=15,
+          blocking_lock_timeout=600,
+          token=token) as queue:
+        result_collection, results = queue.ClaimNotifications(
+            start_time=start_time, lease_time=lease_time, collection=collection)
+
+      if results:
+        return (result_collection, results)
+
+    return (collection, [])
+
+  def ClaimNotifications(self, start_time=None, lease_time=200,
+                         collection=None):
+    """Claims notifications for a collection from this shard of the queue.
+
+    The queue must be locked.
+
+    Args:
+      start_time: See ClaimNotificationsForCollection().
+      lease_time: See ClaimNotificationsForCollection().
+      collection: See ClaimNotificationsForCollection().
+
+    Returns:
+      A pair (collection, results) as returned by
+      ClaimNotificationsForCollection().
+    """
+
     class CollectionFilter(object):
 
       def __init__(self, collection):
@@ -64,20 +145,12 @@ class HuntResultQueue(aff4_queue.Queue):
 
     f = CollectionFilter(collection)
     results = []
-    with aff4.FACTORY.OpenWithLock(
-        RESULT_NOTIFICATION_QUEUE,
-        aff4_type=HuntResultQueue,
-        lease_time=300,
-        blocking=True,
-        blocking_sleep_interval=15,
-        blocking_lock_timeout=600,
-        token=token) as queue:
-      for record_id, value in queue.ClaimRecords(
-          record_filter=f.FilterRecord,
-          start_time=start_time,
-          timeout=lease_time,
-          limit=100000):
-        results.append((record_id, value.timestamp, value.suffix))
+    for record_id, value in self.ClaimRecords(
+        record_filter=f.FilterRecord,
+        start_time=start_time,
+        timeout=lease_time,
+        limit=100000):
+      results.append((record_id, value.timestamp, value.suffix))
     return (f.collection, results)
 
   @classmethod
@@ -105,11 +178,12 @@ class HuntResultCollection(sequential_collection.GrrMessageCollection):
         suffix=suffix,
         **kwargs)
     HuntResultQueue.StaticAdd(
-        RESULT_NOTIFICATION_QUEUE,
+        HuntResultQueue.GetShardForCollection(collection_urn),
         token,
         HuntResultNotification(
             result_collection_urn=collection_urn, timestamp=ts[0],
-            suffix=ts[1]))
+            suffix=ts[1]),
+        mutation_pool=kwargs.get("mutation_pool"))
     return ts
 
 
@@ -118,11 +192,12 @@ class ResultQueueInitHook(registry.InitHook):
 
   def Run(self):
     try:
-      with aff4.FACTORY.Create(
-          RESULT_NOTIFICATION_QUEUE,
-          HuntResultQueue,
-          mode="w",
-          token=aff4.FACTORY.root_token):
-        pass
+      for shard in HuntResultQueue.GetAllShards():
+        with aff4.FACTORY.Create(
+            shard,
+            HuntResultQueue,
+            mode="w",
+            token=aff4.FACTORY.root_token):
+          pass
     except access_control.UnauthorizedAccess:
       pass
@@ -2,11 +2,18 @@
 """Tests for grr.lib.hunts.results."""
 
 
+import threading
+import time
+
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
+from grr.lib import hunts
 from grr.lib import rdfvalue
 from grr.lib import test_lib
+from grr.lib.hunts import implementation
 from grr.lib.hunts import results as hunts_results
+from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
 
 
@@ -167,6 +174,179 @@ class ResultTest(test_lib.AFF4ObjectTest):
         values_read.append(message.request_id)
     self.assertEqual(sorted(values_read), range(100, 200))
 
+  def testNotificationsAreShardedByCollection(self):
+    collection_urns = [
+        rdfvalue.RDFURN("aff4:/testNotificationsAreShardedByCollection/%d" % i)
+        for i in range(20)
+    ]
+    shards = set(
+        hunts_results.HuntResultQueue.GetShardForCollection(urn)
+        for urn in collection_urns)
+    self.assertEqual(shards, set(hunts_results.HuntResultQueue.GetAllShards()))
+
+    for i, urn in enumerate(collection_urns):
+      hunts_results.HuntResultCollection.StaticAdd(
+          urn, self.token, rdf_flows.GrrMessage(request_id=i))
+
+    # Claiming for a collection only returns its own notifications.
+    for i, urn in enumerate(collection_urns):
+      collection, results = (
+          hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
+              collection=urn, token=self.token))
+      self.assertEqual(collection, urn)
+      self.assertEqual(len(results), 1)
+
+  def testOldestNotificationIsClaimedFirstAcrossShards(self):
+    shards = hunts_results.HuntResultQueue.GetAllShards()
+    collection_urns = {}
+    i = 0
+    while len(collection_urns) < len(shards):
+      urn = rdfvalue.RDFURN(
+          "aff4:/testOldestNotificationIsClaimedFirstAcrossShards/%d" % i)
+      shard = hunts_results.HuntResultQueue.GetShardForCollection(urn)
+      collection_urns.setdefault(shard, urn)
+      i += 1
+
+    # Add results to the shards in reverse order.
+    ordered_urns = [collection_urns[shard] for shard in reversed(shards)]
+    for i, urn in enumerate(ordered_urns):
+      with test_lib.FakeTime(1000 + i):
+        hunts_results.HuntResultCollection.StaticAdd(
+            urn, self.token, rdf_flows.GrrMessage(request_id=i))
+
+    with test_lib.FakeTime(2000):
+      for urn in ordered_urns:
+        collection, results = (
+            hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
+                token=self.token))
+        self.assertEqual(collection, urn)
+        self.assertEqual(len(results), 1)
+
+  def testConcurrentWritersDoNotLoseResults(self):
+    collection_urns = [
+        rdfvalue.RDFURN("aff4:/testConcurrentWritersDoNotLoseResults/%d" % i)
+        for i in range(4)
+    ]
+    threads_count = 8
+    results_per_thread = 50
+
+    def AddResults(thread_index):
+      with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+        for i in range(results_per_thread):
+          request_id = thread_index * results_per_thread + i
+          hunts_results.HuntResultCollection.StaticAdd(
+              collection_urns[request_id % len(collection_urns)],
+              self.token,
+              rdf_flows.GrrMessage(request_id=request_id),
+              mutation_pool=mutation_pool)
+
+    threads = [
+        threading.Thread(target=AddResults, args=(i,))
+        for i in range(threads_count)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    request_ids = []
+    while True:
+      collection_urn, results = (
+          hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
+              token=self.token))
+      if not results:
+        break
+
+      collection = aff4.FACTORY.Create(
+          collection_urn,
+          aff4_type=hunts_results.HuntResultCollection,
+          mode="r",
+          token=self.token)
+      for message in collection.MultiResolve(
+          [(ts, suffix) for (_, ts, suffix) in results]):
+        self.assertEqual(
+            collection_urns[message.request_id % len(collection_urns)],
+            collection_urn)
+        request_ids.append(message.request_id)
+
+    self.assertEqual(
+        sorted(request_ids), range(threads_count * results_per_thread))
+
+
+class HuntResultsAppendBenchmark(test_lib.MicroBenchmarks):
+  """Compares adding hunt results under the hunt lock and without it."""
+
+  units = "s"
+
+  WORKERS = 4
+  FLOWS_PER_WORKER = 10
+  RESULTS_PER_FLOW = 10
+
+  def setUp(self):
+    super(HuntResultsAppendBenchmark, self).setUp(["Results/s"], ["<20"])
+
+  def _CreateHunt(self):
+    with hunts.GRRHunt.StartHunt(
+        hunt_name="GenericHunt",
+        flow_runner_args=rdf_flows.FlowRunnerArgs(flow_name="GetFile"),
+        client_rate=0,
+        token=self.token) as hunt:
+      return hunt.urn
+
+  def _AddResultsLocked(self, hunt_urn, client_id, responses):
+    with aff4.FACTORY.OpenWithLock(
+        hunt_urn,
+        blocking=True,
+        blocking_sleep_interval=0.01,
+        token=self.token):
+      implementation.GRRHunt.StaticAddResults(
+          hunt_urn, client_id, responses, token=self.token)
+
+  def _AddResultsUnlocked(self, hunt_urn, client_id, responses):
+    with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
+      implementation.GRRHunt.StaticAddResults(
+          hunt_urn,
+          client_id,
+          responses,
+          mutation_pool=mutation_pool,
+          token=self.token)
+
+  def _Benchmark(self, name, add_results):
+    hunt_urn = self._CreateHunt()
+
+    def Worker(worker_index):
+      for i in range(self.FLOWS_PER_WORKER):
+        client_id = rdf_client.ClientURN(
+            "C.%016x" % (worker_index * self.FLOWS_PER_WORKER + i))
+        responses = [
+            rdf_client.StatEntry(st_size=j)
+            for j in range(self.RESULTS_PER_FLOW)
+        ]
+        add_results(hunt_urn, client_id, responses)
+
+    workers = [
+        threading.Thread(target=Worker, args=(i,)) for i in range(self.WORKERS)
+    ]
+    start_time = time.time()
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    time_taken = time.time() - start_time
+
+    results_count = (
+        self.WORKERS * self.FLOWS_PER_WORKER * self.RESULTS_PER_FLOW)
+    collection = aff4.FACTORY.Open(hunt_urn.Add("Results"), token=self.token)
+    self.assertEqual(len(list(collection)), results_count)
+
+    self.AddResult(name, time_taken, results_count,
+                   "%.0f" % (results_count / time_taken))
+
+  @test_lib.SetLabel("benchmark")
+  def testAppendThroughput(self):
+    self._Benchmark("Under hunt lock", self._AddResultsLocked)
+    self._Benchmark("Lock free", self._AddResultsUnlocked)
+
 
 def main(argv):
   test_lib.main(argv)
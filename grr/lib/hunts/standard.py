@@ -511,6 +511,8 @@ class GenericHunt(implementation.GRRHunt):
 
   args_type = GenericHuntArgs
 
+  child_flows_write_results = True
+
   def _CreateAuditEvent(self, event_action):
     flow_name = self.hunt_obj.args.flow_runner_args.flow_name
 
@@ -699,5 +701,7 @@ class StandardHuntInitHook(registry.InitHook):
         "hunt_output_plugin_errors", fields=[("plugin", str)])
     stats.STATS.RegisterCounterMetric(
         "hunt_results_ran_through_plugin", fields=[("plugin", str)])
+    stats.STATS.RegisterGaugeMetric(
+        "hunt_results_processing_lag", float, fields=[("hunt", str)])
     stats.STATS.RegisterCounterMetric("hunt_results_compacted")
     stats.STATS.RegisterCounterMetric("hunt_results_compaction_locking_errors")
@@ -4,6 +4,7 @@
 
 
 import math
+import threading
 import time
 
 
@@ -28,6 +29,7 @@ from grr.lib.flows.general import administrative
 from grr.lib.flows.general import transfer
 from grr.lib.hunts import implementation
 from grr.lib.hunts import process_results
+from grr.lib.hunts import results as hunts_results
 from grr.lib.hunts import standard
 from grr.lib.rdfvalues import client as rdf_client
 from grr.lib.rdfvalues import flows as rdf_flows
@@ -71,6 +73,24 @@ class StatefulDummyHuntOutputPlugin(output_plugin.OutputPlugin):
     self.state.index += 1
 
 
+class ConcurrentDummyHuntOutputPlugin(output_plugin.OutputPlugin):
+  """Waits until all the plugin instances process a batch at the same time."""
+  instances = 2
+  running = []
+  lock = threading.Lock()
+  all_running = threading.Event()
+
+  def ProcessResponses(self, unused_responses):
+    with ConcurrentDummyHuntOutputPlugin.lock:
+      ConcurrentDummyHuntOutputPlugin.running.append(self)
+      if (len(ConcurrentDummyHuntOutputPlugin.running) ==
+          ConcurrentDummyHuntOutputPlugin.instances):
+        ConcurrentDummyHuntOutputPlugin.all_running.set()
+
+    if not ConcurrentDummyHuntOutputPlugin.all_running.wait(10):
+      raise RuntimeError("Output plugins do not run concurrently.")
+
+
 class LongRunningDummyHuntOutputPlugin(output_plugin.OutputPlugin):
   num_calls = 0
 
@@ -230,6 +250,8 @@ class StandardHuntTest(test_lib.FlowTestsBaseclass, StandardHuntTestMixin):
     DummyHuntOutputPlugin.num_responses = 0
     StatefulDummyHuntOutputPlugin.data = []
     LongRunningDummyHuntOutputPlugin.num_calls = 0
+    ConcurrentDummyHuntOutputPlugin.running = []
+    ConcurrentDummyHuntOutputPlugin.all_running.clear()
 
     with test_lib.FakeTime(0):
       # Clean up the foreman to remove any rules.
@@ -366,6 +388,36 @@ class StandardHuntTest(test_lib.FlowTestsBaseclass, StandardHuntTestMixin):
       self.assertListEqual(per_type_collection.ListStoredTypes(),
                            [rdf_client.StatEntry.__name__])
 
+  def testClientFlowsWriteResultsDirectlyToHuntCollections(self):
+    with test_lib.Instrument(implementation.GRRHunt,
+                             "AddResultsToCollection") as add_results:
+      hunt_urn = self.StartHunt()
+      self.AssignTasksToClients()
+      self.RunHunt()
+
+    # The hunt only gets the statuses of the flows, the results were written
+    # by the flows themselves.
+    self.assertEqual(add_results.call_count, 10)
+    for args in add_results.args:
+      self.assertEqual(len(list(args[1])), 0)
+
+    hunt_obj = aff4.FACTORY.Open(hunt_urn, token=self.token)
+    collection = aff4.FACTORY.Open(
+        hunt_obj.results_collection_urn, token=self.token)
+    sources = [x.source for x in collection]
+    self.assertEqual(len(sources), 5)
+    self.assertEqual(len(set(sources)), 5)
+
+    clients_with_results = aff4.FACTORY.Open(
+        hunt_obj.clients_with_results_collection_urn, token=self.token)
+    self.assertItemsEqual(list(clients_with_results), sources)
+
+    # All the results are announced to the output plugins.
+    _, notifications = (
+        hunts_results.HuntResultQueue.ClaimNotificationsForCollection(
+            collection=hunt_obj.results_collection_urn, token=self.token))
+    self.assertEqual(len(notifications), 5)
+
   def testHuntWithoutForemanRules(self):
     """Check no foreman rules are created if we pass add_foreman_rules=False."""
     hunt_urn = self.StartHunt(add_foreman_rules=False)
@@ -741,6 +793,153 @@ class StandardHuntTest(test_lib.FlowTestsBaseclass, StandardHuntTestMixin):
     self.assertListEqual(StatefulDummyHuntOutputPlugin.data,
                          [0, 1, 2, 3, 4, 5, 6, 7, 8, 9])
 
+  def testOutputPluginsProcessBatchesConcurrently(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="ConcurrentDummyHuntOutputPlugin"),
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="ConcurrentDummyHuntOutputPlugin")
+    ])
+
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+    self.ProcessHuntOutputPlugins()
+
+    self.assertEqual(len(ConcurrentDummyHuntOutputPlugin.running), 2)
+    errors = aff4.FACTORY.Open(
+        hunt_urn.Add("OutputPluginsErrors"), token=self.token)
+    self.assertEqual(len(list(errors)), 0)
+
+  def testHuntsInShardsLeasedByOthersAreNotProcessed(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    shard = hunts_results.HuntResultQueue.GetShardForCollection(
+        hunt_urn.Add("Results"))
+    with aff4.FACTORY.OpenWithLock(shard, lease_time=600, token=self.token):
+      self.ProcessHuntOutputPlugins()
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 0)
+
+    self.ProcessHuntOutputPlugins()
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 10)
+
+  def testHuntsLeasedByOthersAreProcessedOnceTheLeaseIsReleased(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    with aff4.FACTORY.OpenWithLock(
+        hunt_urn.Add("Results"), lease_time=600, token=self.token):
+      self.ProcessHuntOutputPlugins()
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 0)
+
+    # The claimed notifications were released, so they are processed by the
+    # next run.
+    self.ProcessHuntOutputPlugins()
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 10)
+
+  def testShardIsNotLeasedWhileOutputPluginsRun(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    shard = hunts_results.HuntResultQueue.GetShardForCollection(
+        hunt_urn.Add("Results"))
+    run_plugins = process_results.ProcessHuntResultCollectionsCronFlow.RunPlugins
+    shard_leased = []
+
+    def RunPlugins(flow_obj, *args):
+      try:
+        with aff4.FACTORY.OpenWithLock(
+            shard, lease_time=600, blocking=False, token=self.token):
+          shard_leased.append(False)
+      except aff4.LockError:
+        shard_leased.append(True)
+      return run_plugins(flow_obj, *args)
+
+    with utils.Stubber(process_results.ProcessHuntResultCollectionsCronFlow,
+                       "RunPlugins", RunPlugins):
+      self.ProcessHuntOutputPlugins()
+
+    self.assertEqual(shard_leased, [False])
+    self.assertEqual(DummyHuntOutputPlugin.num_responses, 10)
+
+  def testProcessedResultsCountIsStoredAfterEveryBatch(self):
+    hunt_urn = self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    run_plugins = process_results.ProcessHuntResultCollectionsCronFlow.RunPlugins
+    stored_counts = []
+
+    def RunPlugins(flow_obj, *args):
+      metadata = aff4.FACTORY.Open(
+          hunt_urn.Add("ResultsMetadata"), token=self.token)
+      stored_counts.append(
+          metadata.Get(metadata.Schema.NUM_PROCESSED_RESULTS))
+      return run_plugins(flow_obj, *args)
+
+    with utils.Stubber(process_results.ProcessHuntResultCollectionsCronFlow,
+                       "RunPlugins", RunPlugins):
+      self.ProcessHuntOutputPlugins(batch_size=3)
+
+    self.assertEqual(stored_counts, [0, 3, 6, 9])
+
+  def testProcessingLagIsExportedPerHunt(self):
+    with test_lib.FakeTime(1000):
+      hunt_urn = self.StartHunt(output_plugins=[
+          output_plugin.OutputPluginDescriptor(
+              plugin_name="DummyHuntOutputPlugin")
+      ])
+      self.AssignTasksToClients()
+      self.RunHunt(failrate=-1)
+
+    with test_lib.FakeTime(1060):
+      with test_lib.Instrument(stats.STATS, "SetGaugeValue") as set_gauge:
+        self.ProcessHuntOutputPlugins()
+
+    lags = [
+        args[1] for args, kwargs in zip(set_gauge.args, set_gauge.kwargs)
+        if args[0] == "hunt_results_processing_lag" and
+        kwargs["fields"] == [str(hunt_urn)]
+    ]
+    self.assertTrue(lags)
+    for lag in lags:
+      self.assertAlmostEqual(lag, 60, delta=1)
+
+    # All the results are processed, so the hunt's lag is not exported anymore.
+    self.assertNotIn((str(hunt_urn),),
+                     stats.STATS.GetMetricFields("hunt_results_processing_lag"))
+
+  def testUnexpectedProcessingErrorsAreRaised(self):
+    self.StartHunt(output_plugins=[
+        output_plugin.OutputPluginDescriptor(
+            plugin_name="DummyHuntOutputPlugin")
+    ])
+    self.AssignTasksToClients()
+    self.RunHunt(failrate=-1)
+
+    def Fail(*unused_args):
+      raise RuntimeError("Shard processing failed.")
+
+    with utils.Stubber(process_results.ProcessHuntResultCollectionsCronFlow,
+                       "ProcessOneShard", Fail):
+      with self.assertRaisesRegexp(RuntimeError, "Shard processing failed"):
+        self.ProcessHuntOutputPlugins(processing_threads=2)
+
   def testMultipleHuntsOutputIsProcessedCorrectly(self):
     self.StartHunt(output_plugins=[
         output_plugin.OutputPluginDescriptor(
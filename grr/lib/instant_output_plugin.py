@@ -225,12 +225,16 @@ class InstantOutputPluginWithExportConversion(InstantOutputPlugin):
         break
 
 
-def ApplyPluginToMultiTypeCollection(plugin, output_collection):
+def ApplyPluginToMultiTypeCollection(plugin,
+                                     output_collection,
+                                     prefetch_pages=2):
   """Applies instant output plugin to a multi-type collection.
 
   Args:
     plugin: InstantOutputPlugin instance.
     output_collection: MultiTypeCollection instance.
+    prefetch_pages: The number of pages of values read ahead in a background
+      thread while the plugin converts the current ones.
 
   Yields:
     Bytes chunks, as generated by the plugin.
@@ -243,7 +247,8 @@ def ApplyPluginToMultiTypeCollection(plugin, output_collection):
 
     # pylint: disable=cell-var-from-loop
     def GetValues():
-      for timestamp, value in output_collection.ScanByType(stored_type_name):
+      for timestamp, value in output_collection.ScanByType(
+          stored_type_name, prefetch_pages=prefetch_pages):
         _ = timestamp
         yield value
 
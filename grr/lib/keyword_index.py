@@ -6,10 +6,245 @@ possible to search for those names which match all keywords.
 
 """
 
+import array
+import bisect
+import threading
 
 from grr.lib import aff4
+from grr.lib import config_lib
 from grr.lib import data_store
 from grr.lib import rdfvalue
+from grr.lib import utils
+
+
+class PostingList(object):
+  """Names associated with a keyword, stored as sorted integer ids.
+
+  Every id has a timestamp of the latest time the keyword was associated with
+  the name, so that lookups can be restricted to a time range.
+  """
+
+  def __init__(self):
+    self.ids = array.array("l")
+    self.timestamps = array.array("l")
+
+  def Add(self, name_id, timestamp):
+    index = bisect.bisect_left(self.ids, name_id)
+    if index < len(self.ids) and self.ids[index] == name_id:
+      self.timestamps[index] = max(self.timestamps[index], timestamp)
+    else:
+      self.ids.insert(index, name_id)
+      self.timestamps.insert(index, timestamp)
+
+  def Remove(self, name_id):
+    index = bisect.bisect_left(self.ids, name_id)
+    if index < len(self.ids) and self.ids[index] == name_id:
+      self.ids.pop(index)
+      self.timestamps.pop(index)
+
+  def Select(self, start_time, end_time):
+    """Returns a posting list restricted to a given time range."""
+    result = PostingList()
+    if not self.timestamps:
+      return result
+
+    if start_time <= min(self.timestamps) and max(self.timestamps) <= end_time:
+      result.ids = self.ids[:]
+      result.timestamps = self.timestamps[:]
+    else:
+      for name_id, timestamp in zip(self.ids, self.timestamps):
+        if start_time <= timestamp <= end_time:
+          result.ids.append(name_id)
+          result.timestamps.append(timestamp)
+
+    return result
+
+  def __len__(self):
+    return len(self.ids)
+
+  @staticmethod
+  def IntersectIds(posting_lists):
+    """Returns sorted ids present in all of the given posting lists."""
+    posting_lists = sorted(posting_lists, key=len)
+    result = posting_lists[0].ids
+    for posting_list in posting_lists[1:]:
+      if not result:
+        break
+
+      ids = posting_list.ids
+      num_ids = len(ids)
+      intersection = array.array("l")
+      lo = 0
+      for name_id in result:
+        lo = bisect.bisect_left(ids, name_id, lo)
+        if lo == num_ids:
+          break
+        if ids[lo] == name_id:
+          intersection.append(name_id)
+      result = intersection
+
+    return result
+
+
+class PostingListsCache(object):
+  """A per-process cache of keyword indexes' posting lists.
+
+  Names are mapped to dense integer ids, so that posting lists take little
+  memory and can be intersected without building sets of strings. Changes
+  made through AFF4KeywordIndex are applied to the cached posting lists, while
+  changes made by other processes become visible once the cached posting lists
+  expire.
+
+  Ids of names that no cached posting list refers to anymore are released
+  from time to time, so posting lists and the ids they use must only be
+  accessed while holding the lock.
+  """
+
+  # Ids are not released while there are fewer of them than this.
+  MIN_IDS_TO_RELEASE = 10000
+
+  def __init__(self, max_size=1000, max_age=60):
+    self.max_size = max_size
+    self.max_age = max_age
+    self.posting_lists = utils.AgeBasedCache(max_size=max_size, max_age=max_age)
+    # The posting lists store is locked by its housekeeping thread, sharing
+    # its lock avoids lock ordering problems.
+    self.lock = self.posting_lists.lock
+    self._ResetIds()
+
+  def _ResetIds(self):
+    self.name_ids = {}
+    self.names = []
+    self.free_ids = []
+    self.release_ids_at = self.MIN_IDS_TO_RELEASE
+
+  @utils.Synchronized
+  def GetNameId(self, name):
+    try:
+      return self.name_ids[name]
+    except KeyError:
+      if self.free_ids:
+        name_id = self.free_ids.pop()
+        self.names[name_id] = name
+      else:
+        name_id = len(self.names)
+        self.names.append(name)
+
+      self.name_ids[name] = name_id
+      return name_id
+
+  def GetName(self, name_id):
+    return self.names[name_id]
+
+  @utils.Synchronized
+  def ReleaseUnusedIds(self):
+    """Releases ids of names that no cached posting list refers to.
+
+    This only does work once the number of ids has doubled since the last
+    release, so its cost is spread over the ids allocated in between.
+    """
+    if len(self.name_ids) < self.release_ids_at:
+      return
+
+    used_ids = set()
+    for _, (_, posting_list) in self.posting_lists:
+      used_ids.update(posting_list.ids)
+
+    for name_id, name in enumerate(self.names):
+      if name is not None and name_id not in used_ids:
+        del self.name_ids[name]
+        self.names[name_id] = None
+        self.free_ids.append(name_id)
+
+    self.release_ids_at = max(self.MIN_IDS_TO_RELEASE, 2 * len(self.name_ids))
+
+  @utils.Synchronized
+  def Contains(self, index_urn, keyword):
+    try:
+      self.posting_lists.Get((index_urn, keyword))
+      return True
+    except KeyError:
+      return False
+
+  @utils.Synchronized
+  def Get(self, index_urn, keyword):
+    """Returns the cached posting list or raises KeyError."""
+    return self.posting_lists.Get((index_urn, keyword))
+
+  @utils.Synchronized
+  def Build(self, names_with_timestamps):
+    """Builds a posting list from (name, timestamp) pairs."""
+    posting_list = PostingList()
+    for name, timestamp in names_with_timestamps:
+      posting_list.Add(self.GetNameId(name), timestamp)
+
+    return posting_list
+
+  @utils.Synchronized
+  def Put(self, index_urn, keyword, posting_list):
+    if self.max_age > 0:
+      self.posting_lists.Put((index_urn, keyword), posting_list)
+
+  @utils.Synchronized
+  def AddName(self, index_urn, keywords, name, timestamp):
+    posting_lists = []
+    for keyword in keywords:
+      try:
+        posting_lists.append(self.posting_lists.Get((index_urn, keyword)))
+      except KeyError:
+        pass
+
+    # Only names in cached posting lists get an id.
+    if posting_lists:
+      name_id = self.GetNameId(name)
+      for posting_list in posting_lists:
+        posting_list.Add(name_id, timestamp)
+
+  @utils.Synchronized
+  def RemoveName(self, index_urn, keywords, name):
+    name_id = self.name_ids.get(name)
+    if name_id is None:
+      return
+
+    for keyword in keywords:
+      try:
+        self.posting_lists.Get((index_urn, keyword)).Remove(name_id)
+      except KeyError:
+        pass
+
+  @utils.Synchronized
+  def Flush(self):
+    self.posting_lists.Flush()
+    self._ResetIds()
+
+
+_POSTING_LISTS_CACHE = None
+_POSTING_LISTS_CACHE_LOCK = threading.Lock()
+
+
+def GetPostingListsCache():
+  """Returns the process-wide posting lists cache.
+
+  Returns:
+    A PostingListsCache, or None if caching is disabled.
+  """
+  global _POSTING_LISTS_CACHE
+
+  max_age = config_lib.CONFIG["AFF4.keyword_index_cache_age"]
+  max_size = config_lib.CONFIG["AFF4.keyword_index_cache_max_size"]
+
+  with _POSTING_LISTS_CACHE_LOCK:
+    if max_age <= 0:
+      # Changes are not applied to the cache while it is disabled, so it can't
+      # be reused if it is enabled again.
+      _POSTING_LISTS_CACHE = None
+    elif (_POSTING_LISTS_CACHE is None or
+          _POSTING_LISTS_CACHE.max_age != max_age or
+          _POSTING_LISTS_CACHE.max_size != max_size):
+      _POSTING_LISTS_CACHE = PostingListsCache(
+          max_size=max_size, max_age=max_age)
+
+    return _POSTING_LISTS_CACHE
 
 
 class AFF4KeywordIndex(aff4.AFF4Object):
@@ -26,32 +261,136 @@ class AFF4KeywordIndex(aff4.AFF4Object):
   def _KeywordToURN(self, keyword):
     return self.urn.Add(keyword)
 
-  def Lookup(self, keywords, **kwargs):
+  def _FetchPostingLists(self, keywords):
+    """Reads (name, timestamp) pairs of the keywords from the data store."""
+    # Posting lists are cached for all times, so that they can be reused by
+    # queries with any time range.
+    keyword_urns = {self._KeywordToURN(k): k for k in keywords}
+    names_with_timestamps = dict((kw, []) for kw in keywords)
+    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
+        keyword_urns.keys(),
+        self.INDEX_PREFIX,
+        timestamp=(self.FIRST_TIMESTAMP, self.LAST_TIMESTAMP + 1),
+        token=self.token):
+      kw = keyword_urns[keyword_urn]
+      for column, _, ts in value:
+        names_with_timestamps[kw].append((column[self.INDEX_PREFIX_LEN:], ts))
+
+    return names_with_timestamps
+
+  def _ReadUncachedPostingLists(self, keywords, start_time, end_time,
+                                last_seen_map):
+    """Reads sets of names of the keywords from the data store."""
+    keyword_urns = {self._KeywordToURN(k): k for k in keywords}
+    result = {}
+    for kw in keywords:
+      result[kw] = set()
+
+    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
+        keyword_urns.keys(),
+        self.INDEX_PREFIX,
+        timestamp=(start_time, end_time + 1),
+        token=self.token):
+      for column, _, ts in value:
+        kw = keyword_urns[keyword_urn]
+        name = column[self.INDEX_PREFIX_LEN:]
+        result[kw].add(name)
+        if last_seen_map is not None:
+          last_seen_map[(kw, name)] = max(last_seen_map.get((kw, name), -1), ts)
+
+    return result
+
+  def _ReadCachedPostingLists(self, cache, keywords, start_time, end_time,
+                              last_seen_map, process):
+    """Reads posting lists of the keywords, using the cache when possible.
+
+    Args:
+      cache: The PostingListsCache to use.
+      keywords: A collection of keywords.
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+      last_seen_map: If present, is populated to map pairs (keyword, name) to
+        the timestamp of the latest connection found.
+      process: A function that is called with the cache and a dict mapping
+        each keyword to a PostingList. Posting lists refer to names by ids of
+        the cache, so it is called while the cache is locked.
+
+    Returns:
+      The result of process.
+    """
+    # Data store reads are done without holding the lock.
+    fetched = self._FetchPostingLists(
+        [kw for kw in keywords if not cache.Contains(self.urn, kw)])
+
+    with cache.lock:
+      cache.ReleaseUnusedIds()
+
+      posting_lists = {}
+      for kw in keywords:
+        try:
+          posting_lists[kw] = cache.Get(self.urn, kw)
+          continue
+        except KeyError:
+          pass
+
+        # The posting list was not cached, or expired since it was checked.
+        if kw not in fetched:
+          fetched.update(self._FetchPostingLists([kw]))
+        posting_lists[kw] = cache.Build(fetched[kw])
+        cache.Put(self.urn, kw, posting_lists[kw])
+
+      result = {}
+      for kw in keywords:
+        posting_list = posting_lists[kw].Select(start_time, end_time)
+        result[kw] = posting_list
+
+        if last_seen_map is not None:
+          for name_id, ts in zip(posting_list.ids, posting_list.timestamps):
+            key = (kw, cache.GetName(name_id))
+            last_seen_map[key] = max(last_seen_map.get(key, -1), ts)
+
+      return process(cache, result)
+
+  def Lookup(self,
+             keywords,
+             start_time=FIRST_TIMESTAMP,
+             end_time=LAST_TIMESTAMP,
+             last_seen_map=None):
     """Finds objects associated with keywords.
 
     Find the names related to all keywords.
 
     Args:
       keywords: A collection of keywords that we are interested in.
-      **kwargs: Additional arguments to be passed to the underlying call to
-        ReadPostingLists
+      start_time: Only considers keywords added at or after this point in time.
+      end_time: Only considers keywords at or before this point in time.
+      last_seen_map: If present, is treated as a dict and populated to map pairs
+        (keyword, name) to the timestamp of the latest connection found.
     Returns:
       A set of potentially relevant names.
 
     """
 
-    posting_lists = self.ReadPostingLists(keywords, **kwargs)
-
-    results = posting_lists.values()
-    relevant_set = results[0]
+    cache = GetPostingListsCache()
+    if cache is None:
+      posting_lists = self._ReadUncachedPostingLists(keywords, start_time,
+                                                     end_time, last_seen_map)
+      results = sorted(posting_lists.values(), key=len)
+      relevant_set = results[0]
+      for hits in results[1:]:
+        if not relevant_set:
+          break
+        relevant_set &= hits
 
-    for hits in results:
-      relevant_set &= hits
+      return relevant_set
 
-      if not relevant_set:
-        return relevant_set
+    def Intersect(cache, posting_lists):
+      return set(
+          cache.GetName(name_id)
+          for name_id in PostingList.IntersectIds(posting_lists.values()))
 
-    return relevant_set
+    return self._ReadCachedPostingLists(cache, keywords, start_time, end_time,
+                                        last_seen_map, Intersect)
 
   def ReadPostingLists(self,
                        keywords,
@@ -70,30 +409,27 @@ class AFF4KeywordIndex(aff4.AFF4Object):
       A dict mapping each keyword to a set of relevant names.
 
     """
-    keyword_urns = {self._KeywordToURN(k): k for k in keywords}
-    result = {}
-    for kw in keywords:
-      result[kw] = set()
 
-    for keyword_urn, value in data_store.DB.MultiResolvePrefix(
-        keyword_urns.keys(),
-        self.INDEX_PREFIX,
-        timestamp=(start_time, end_time + 1),
-        token=self.token):
-      for column, _, ts in value:
-        kw = keyword_urns[keyword_urn]
-        name = column[self.INDEX_PREFIX_LEN:]
-        result[kw].add(name)
-        if last_seen_map is not None:
-          last_seen_map[(kw, name)] = max(last_seen_map.get((kw, name), -1), ts)
+    cache = GetPostingListsCache()
+    if cache is None:
+      return self._ReadUncachedPostingLists(keywords, start_time, end_time,
+                                            last_seen_map)
 
-    return result
+    def ToNames(cache, posting_lists):
+      result = {}
+      for kw, posting_list in posting_lists.iteritems():
+        result[kw] = set(cache.GetName(name_id) for name_id in posting_list.ids)
+      return result
+
+    return self._ReadCachedPostingLists(cache, keywords, start_time, end_time,
+                                        last_seen_map, ToNames)
 
   def AddKeywordsForName(self,
                          name,
                          keywords,
                          sync=True,
                          timestamp=None,
+                         mutation_pool=None,
                          **kwargs):
     """Associates keywords with name.
 
@@ -104,11 +440,24 @@ class AFF4KeywordIndex(aff4.AFF4Object):
       keywords: A collection of keywords to associate with name.
       sync: Sync to data store immediately.
       timestamp: timestamp to use for the underlying datastore write
+      mutation_pool: An optional MutationPool object to write to. If given,
+                     sync is ignored and the pool's owner flushes the writes.
       **kwargs: Additional arguments to pass to the datastore.
     """
     if timestamp is None:
       timestamp = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
-    if sync:
+    cache = GetPostingListsCache()
+    if cache is not None:
+      cache.AddName(self.urn, set(keywords), name, timestamp)
+
+    if mutation_pool is not None:
+      for keyword in set(keywords):
+        mutation_pool.Set(self._KeywordToURN(keyword),
+                          self.INDEX_COLUMN_FORMAT % name,
+                          "",
+                          timestamp=timestamp,
+                          **kwargs)
+    elif sync:
       with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
         for keyword in set(keywords):
           mutation_pool.Set(self._KeywordToURN(keyword),
@@ -126,15 +475,26 @@ class AFF4KeywordIndex(aff4.AFF4Object):
                           timestamp=timestamp,
                           **kwargs)
 
-  def RemoveKeywordsForName(self, name, keywords, sync=True):
+  def RemoveKeywordsForName(self, name, keywords, sync=True,
+                            mutation_pool=None):
     """Removes keywords for a name.
 
     Args:
       name: A name which should not be associated with some keywords anymore.
       keywords: A collection of keywords.
       sync: Sync to data store immediately.
+      mutation_pool: An optional MutationPool object to write to. If given,
+                     sync is ignored and the pool's owner flushes the writes.
     """
-    if sync:
+    cache = GetPostingListsCache()
+    if cache is not None:
+      cache.RemoveName(self.urn, set(keywords), name)
+
+    if mutation_pool is not None:
+      for keyword in set(keywords):
+        mutation_pool.DeleteAttributes(
+            self._KeywordToURN(keyword), [self.INDEX_COLUMN_FORMAT % name])
+    elif sync:
       with data_store.DB.GetMutationPool(token=self.token) as mutation_pool:
         for keyword in set(keywords):
           mutation_pool.DeleteAttributes(
@@ -3,9 +3,11 @@
 
 
 from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import keyword_index
 from grr.lib import test_lib
+from grr.lib import utils
 
 
 class KeywordIndexTest(test_lib.AFF4ObjectTest):
@@ -91,11 +93,159 @@ class KeywordIndexTest(test_lib.AFF4ObjectTest):
     self.assertEqual(1009 * 1000000, ls_map[("popular_keyword2", "C.000000")])
 
 
+  def testCachedPostingListsAreUpdated(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index3/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(10):
+      index.AddKeywordsForName("C.%X" % i, ["kw1", "kw2"], sync=self.sync)
+
+    with test_lib.ConfigOverrider({"AFF4.keyword_index_cache_age": 60}):
+      # Populate the cache.
+      self.assertEqual(len(index.Lookup(["kw1", "kw2"])), 10)
+
+      index.AddKeywordsForName("C.%X" % 10, ["kw1", "kw2"], sync=self.sync)
+      index.RemoveKeywordsForName("C.%X" % 0, ["kw2"], sync=self.sync)
+
+      self.assertEqual(len(index.Lookup(["kw1"])), 11)
+      self.assertEqual(len(index.Lookup(["kw2"])), 10)
+      self.assertEqual(
+          index.Lookup(["kw1", "kw2"]), set("C.%X" % i for i in range(1, 11)))
+
+  def testCachedPostingListsExpire(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index4/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    with test_lib.ConfigOverrider({"AFF4.keyword_index_cache_age": 60}):
+      with test_lib.FakeTime(1000):
+        for i in range(10):
+          index.AddKeywordsForName("C.%X" % i, ["kw1"], sync=self.sync)
+        self.assertEqual(len(index.Lookup(["kw1"])), 10)
+
+        # Changes made directly in the data store (e.g. by other processes)
+        # are not visible while the posting list is cached...
+        data_store.DB.DeleteSubject(index.urn.Add("kw1"), token=self.token)
+        self.assertEqual(len(index.Lookup(["kw1"])), 10)
+
+        # ...but time-bounded queries are still served from the cache.
+        self.assertEqual(
+            len(index.Lookup(["kw1"], start_time=1001 * 1000000)), 0)
+
+      with test_lib.FakeTime(1000 + 3600):
+        self.assertEqual(len(index.Lookup(["kw1"])), 0)
+
+  def testChangesInDataStoreAreVisibleByDefault(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index5/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    index.AddKeywordsForName("C.0", ["kw1"], sync=self.sync)
+    self.assertEqual(index.Lookup(["kw1"]), set(["C.0"]))
+
+    data_store.DB.DeleteSubject(index.urn.Add("kw1"), token=self.token)
+    self.assertEqual(index.Lookup(["kw1"]), set())
+
+  def testNoCacheIsCreatedByDefault(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index7/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    with test_lib.Instrument(keyword_index.PostingListsCache,
+                             "__init__") as init:
+      index.AddKeywordsForName("C.0", ["kw1", "kw2"], sync=self.sync)
+      index.AddKeywordsForName("C.1", ["kw1"], sync=self.sync)
+      self.assertEqual(index.Lookup(["kw1", "kw2"]), set(["C.0"]))
+      self.assertEqual(
+          index.ReadPostingLists(["kw1", "kw2"]),
+          {"kw1": set(["C.0", "C.1"]), "kw2": set(["C.0"])})
+      index.RemoveKeywordsForName("C.0", ["kw2"], sync=self.sync)
+      self.assertEqual(index.Lookup(["kw1", "kw2"]), set())
+
+    self.assertEqual(init.call_count, 0)
+
+  def testNameIdsAreReleased(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index6/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(10):
+      index.AddKeywordsForName("C.%X" % i, ["kw%d" % i], sync=self.sync)
+
+    with test_lib.ConfigOverrider({
+        "AFF4.keyword_index_cache_age": 60,
+        "AFF4.keyword_index_cache_max_size": 2
+    }):
+      cache = keyword_index.GetPostingListsCache()
+      with utils.Stubber(cache, "MIN_IDS_TO_RELEASE", 0):
+        cache.Flush()
+
+        # Names not in any cached posting list don't get ids.
+        index.RemoveKeywordsForName("C.unknown", ["kw0"], sync=self.sync)
+        self.assertEqual(cache.name_ids, {})
+
+        for i in range(10):
+          self.assertEqual(index.Lookup(["kw%d" % i]), set(["C.%X" % i]))
+
+        # Ids of names that are not in a cached posting list are released
+        # once the number of ids doubles.
+        self.assertLessEqual(len(cache.name_ids), 4)
+        self.assertEqual(index.Lookup(["kw8"]), set(["C.8"]))
+        self.assertEqual(index.Lookup(["kw0"]), set(["C.0"]))
+
+
 class AsyncKeywordIndexTest(KeywordIndexTest):
 
   sync = False
 
 
+class KeywordIndexBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark keyword index lookups on a large index."""
+
+  NUM_NAMES = 50000
+
+  @test_lib.SetLabel("benchmark")
+  def testLookup(self):
+    index = aff4.FACTORY.Create(
+        "aff4:/index_benchmark/",
+        aff4_type=keyword_index.AFF4KeywordIndex,
+        mode="rw",
+        token=self.token)
+    for i in range(self.NUM_NAMES):
+      keywords = [".", "label:%d" % (i % 10)]
+      if i % 100 == 0:
+        keywords.append("host-%d" % (i // 100))
+      index.AddKeywordsForName("C.%016X" % i, keywords, sync=False)
+
+    for keywords in [["."], [".", "label:3"], [".", "label:3", "host-123"]]:
+      self.TimeIt(
+          lambda: index.Lookup(keywords),
+          name="Lookup without cache %s" % keywords,
+          repetitions=3)
+
+      with test_lib.ConfigOverrider({"AFF4.keyword_index_cache_age": 600}):
+        cache = keyword_index.GetPostingListsCache()
+
+        def LookupUncached():
+          cache.Flush()
+          index.Lookup(keywords)
+
+        self.TimeIt(
+            LookupUncached,
+            name="Uncached lookup %s" % keywords,
+            repetitions=3)
+        self.TimeIt(
+            lambda: index.Lookup(keywords),
+            name="Cached lookup %s" % keywords,
+            repetitions=3)
+
+
 def main(argv):
   test_lib.main(argv)
 
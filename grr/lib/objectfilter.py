@@ -141,6 +141,14 @@ class Filter(object):
   def Matches(self, obj):
     """Whether object obj matches this filter."""
 
+  def BuildMatcher(self):
+    """Returns a function of an object equivalent to Matches.
+
+    Filters override this to do all the work which doesn't depend on the
+    matched object, like splitting attribute paths, only once.
+    """
+    return self.Matches
+
   def Filter(self, objects):
     """Returns a list of objects that pass the filter."""
     return filter(self.Matches, objects)
@@ -162,6 +170,19 @@ class AndFilter(Filter):
         return False
     return True
 
+  def BuildMatcher(self):
+    matchers = [child_filter.BuildMatcher() for child_filter in self.args]
+    if len(matchers) == 1:
+      return matchers[0]
+
+    def Matcher(obj):
+      for matcher in matchers:
+        if not matcher(obj):
+          return False
+      return True
+
+    return Matcher
+
 
 class OrFilter(Filter):
   """Performs a boolean OR of the given Filter instances as arguments.
@@ -177,6 +198,22 @@ class OrFilter(Filter):
         return True
     return False
 
+  def BuildMatcher(self):
+    if not self.args:
+      return IdentityFilter().BuildMatcher()
+
+    matchers = [child_filter.BuildMatcher() for child_filter in self.args]
+    if len(matchers) == 1:
+      return matchers[0]
+
+    def Matcher(obj):
+      for matcher in matchers:
+        if matcher(obj):
+          return True
+      return False
+
+    return Matcher
+
 
 class Operator(Filter):
   """Base class for all operators."""
@@ -187,6 +224,9 @@ class IdentityFilter(Operator):
   def Matches(self, _):
     return True
 
+  def BuildMatcher(self):
+    return lambda _: True
+
 
 class UnaryOperator(Operator):
   """Base class for unary operators."""
@@ -225,6 +265,39 @@ class GenericBinaryOperator(BinaryOperator):
   def Operation(self, x, y):
     """Performs the operation between two values."""
 
+  def BuildOperation(self):
+    """Returns a function of x equivalent to Operation(x, right_operand)."""
+    operation = self.Operation
+    right_operand = self.right_operand
+    return lambda x: operation(x, right_operand)
+
+  def BuildOperate(self):
+    """Returns a function of values equivalent to Operate."""
+    operation = self.BuildOperation()
+
+    def Operate(values):
+      for val in values:
+        try:
+          if operation(val):
+            return True
+        except (ValueError, TypeError):
+          continue
+      return False
+
+    return Operate
+
+  def BuildMatcher(self):
+    expand = self.value_expander.BuildExpander(self.left_operand)
+    operate = self.BuildOperate()
+
+    def Matcher(obj):
+      values = expand(obj)
+      if values and operate(values):
+        return True
+      return False
+
+    return Matcher
+
   def Operate(self, values):
     """Takes a list of values and if at least one matches, returns True."""
     for val in values:
@@ -251,6 +324,10 @@ class Equals(GenericBinaryOperator):
   def Operation(self, x, y):
     return x == y
 
+  def BuildOperation(self):
+    y = self.right_operand
+    return lambda x: x == y
+
 
 class NotEquals(GenericBinaryOperator):
   """Matches when the right operand isn't equal to the expanded value."""
@@ -260,6 +337,12 @@ class NotEquals(GenericBinaryOperator):
         arguments=self.args,
         value_expander=self.value_expander_cls).Operate(values)
 
+  def BuildOperate(self):
+    operate = Equals(
+        arguments=self.args,
+        value_expander=self.value_expander_cls).BuildOperate()
+    return lambda values: not operate(values)
+
 
 class Less(GenericBinaryOperator):
   """Whether the expanded value >= right_operand."""
@@ -267,6 +350,10 @@ class Less(GenericBinaryOperator):
   def Operation(self, x, y):
     return x < y
 
+  def BuildOperation(self):
+    y = self.right_operand
+    return lambda x: x < y
+
 
 class LessEqual(GenericBinaryOperator):
   """Whether the expanded value <= right_operand."""
@@ -274,6 +361,10 @@ class LessEqual(GenericBinaryOperator):
   def Operation(self, x, y):
     return x <= y
 
+  def BuildOperation(self):
+    y = self.right_operand
+    return lambda x: x <= y
+
 
 class Greater(GenericBinaryOperator):
   """Whether the expanded value > right_operand."""
@@ -281,6 +372,10 @@ class Greater(GenericBinaryOperator):
   def Operation(self, x, y):
     return x > y
 
+  def BuildOperation(self):
+    y = self.right_operand
+    return lambda x: x > y
+
 
 class GreaterEqual(GenericBinaryOperator):
   """Whether the expanded value >= right_operand."""
@@ -288,6 +383,10 @@ class GreaterEqual(GenericBinaryOperator):
   def Operation(self, x, y):
     return x >= y
 
+  def BuildOperation(self):
+    y = self.right_operand
+    return lambda x: x >= y
+
 
 class Contains(GenericBinaryOperator):
   """Whether the right operand is contained in the value."""
@@ -309,6 +408,12 @@ class NotContains(GenericBinaryOperator):
         arguments=self.args,
         value_expander=self.value_expander_cls).Operate(values)
 
+  def BuildOperate(self):
+    operate = Contains(
+        arguments=self.args,
+        value_expander=self.value_expander_cls).BuildOperate()
+    return lambda values: not operate(values)
+
 
 # TODO(user): Change to an N-ary Operator?
 class InSet(GenericBinaryOperator):
@@ -332,6 +437,41 @@ class InSet(GenericBinaryOperator):
     except TypeError:
       return False
 
+  # Values of these types compare equal exactly when their hashes do, so they
+  # can be looked up in a set instead of a list.
+  HASHED_TYPES = frozenset([str, unicode, int, long, float, bool])
+
+  def BuildOperation(self):
+    y = self.right_operand
+    hashed_types = self.HASHED_TYPES
+    if (not isinstance(y, (list, tuple, set, frozenset)) or
+        any(type(value) not in hashed_types for value in y)):
+      return super(InSet, self).BuildOperation()
+
+    hashed_y = frozenset(y)
+
+    def Contained(value):
+      if type(value) in hashed_types:
+        return value in hashed_y
+      return value in y
+
+    def Operation(x):
+      if Contained(x):
+        return True
+
+      if isinstance(x, basestring) or isinstance(x, bytes):
+        return False
+
+      try:
+        for value in x:
+          if not Contained(value):
+            return False
+        return True
+      except TypeError:
+        return False
+
+    return Operation
+
 
 class NotInSet(GenericBinaryOperator):
   """Whether at least a value is not present in the right operand."""
@@ -341,6 +481,12 @@ class NotInSet(GenericBinaryOperator):
         arguments=self.args,
         value_expander=self.value_expander_cls).Operate(values)
 
+  def BuildOperate(self):
+    operate = InSet(
+        arguments=self.args,
+        value_expander=self.value_expander_cls).BuildOperate()
+    return lambda values: not operate(values)
+
 
 class Regexp(GenericBinaryOperator):
   """Whether the value matches the regexp in the right operand."""
@@ -360,6 +506,19 @@ class Regexp(GenericBinaryOperator):
     except TypeError:
       return False
 
+  def BuildOperation(self):
+    search = self.compiled_re.search
+    smart_unicode = utils.SmartUnicode
+
+    def Operation(x):
+      try:
+        if search(smart_unicode(x)):
+          return True
+      except TypeError:
+        return False
+
+    return Operation
+
 
 class Context(Operator):
   """Restricts the child operators to a specific context within the object.
@@ -435,6 +594,19 @@ class Context(Operator):
           return True
     return False
 
+  def BuildMatcher(self):
+    expand = self.value_expander.BuildExpander(self.context)
+    condition = self.condition.BuildMatcher()
+
+    def Matcher(obj):
+      for object_list in expand(obj):
+        for sub_object in object_list:
+          if condition(sub_object):
+            return True
+      return False
+
+    return Matcher
+
 
 OP2FN = {
     "equals": Equals,
@@ -455,6 +627,21 @@ OP2FN = {
 }
 
 
+# Maps types to whether they are mappings.
+_MAPPING_TYPES = {}
+
+
+def _IsMapping(value):
+  """Same as isinstance(value, collections.Mapping), but cached per type."""
+  value_type = type(value)
+  try:
+    return _MAPPING_TYPES[value_type]
+  except KeyError:
+    is_mapping = isinstance(value, collections.Mapping)
+    _MAPPING_TYPES[value_type] = is_mapping
+    return is_mapping
+
+
 class ValueExpander(object):
   """Encapsulates the logic to expand values available in an object.
 
@@ -474,7 +661,7 @@ class ValueExpander(object):
 
   def _AtLeaf(self, attr_value):
     """Called when at a leaf value. Should yield a value."""
-    if isinstance(attr_value, collections.Mapping):
+    if _IsMapping(attr_value):
       # If the result is a dict, return each key/value pair as a new dict.
       for k, v in attr_value.items():
         yield {k: v}
@@ -484,7 +671,7 @@ class ValueExpander(object):
   def _AtNonLeaf(self, attr_value, path):
     """Called when at a non-leaf value. Should recurse and yield values."""
     try:
-      if isinstance(attr_value, collections.Mapping):
+      if _IsMapping(attr_value):
         # If it's dictionary-like, treat the dict key as the attribute..
         sub_obj = attr_value.get(path[1])
         if len(path) > 2:
@@ -493,7 +680,7 @@ class ValueExpander(object):
         if isinstance(sub_obj, basestring):
           # If it is a string, stop here
           yield sub_obj
-        elif isinstance(sub_obj, collections.Mapping):
+        elif _IsMapping(sub_obj):
           # If the result is a dict, return each key/value pair as a new dict.
           for k, v in sub_obj.items():
             yield {k: v}
@@ -542,12 +729,65 @@ class ValueExpander(object):
       for value in self._AtNonLeaf(attr_value, path):
         yield value
 
+  def BuildExpander(self, path):
+    """Returns a function of an object equivalent to Expand(obj, path).
+
+    The path is split and the first attribute name resolved only once.
+
+    Args:
+      path: A string or a list of strings.
+
+    Returns:
+      A function returning an iterable of the values.
+    """
+    expand = getattr(self.Expand, "im_func", None)
+    if expand is not ValueExpander.Expand.im_func:
+      return lambda obj: self.Expand(obj, path)
+
+    if isinstance(path, basestring):
+      path = path.split(self.FIELD_SEPARATOR)
+
+    attr_name = self._GetAttributeName(path)
+    get_value = self._GetValue
+
+    if len(path) > 1:
+      at_non_leaf = self._AtNonLeaf
+
+      def ExpandNonLeaf(obj):
+        attr_value = get_value(obj, attr_name)
+        if attr_value is None:
+          return ()
+        return at_non_leaf(attr_value, path)
+
+      return ExpandNonLeaf
+
+    at_leaf = self._AtLeaf
+    if getattr(at_leaf, "im_func", None) is not ValueExpander._AtLeaf.im_func:
+
+      def ExpandCustomLeaf(obj):
+        attr_value = get_value(obj, attr_name)
+        if attr_value is None:
+          return ()
+        return at_leaf(attr_value)
+
+      return ExpandCustomLeaf
+
+    def ExpandLeaf(obj):
+      attr_value = get_value(obj, attr_name)
+      if attr_value is None:
+        return ()
+      if _IsMapping(attr_value):
+        return at_leaf(attr_value)
+      return (attr_value,)
+
+    return ExpandLeaf
+
 
 class AttributeValueExpander(ValueExpander):
   """An expander that gives values based on object attribute names."""
 
   def _GetValue(self, obj, attr_name):
-    if isinstance(obj, collections.Mapping):
+    if _IsMapping(obj):
       return obj.get(attr_name)
     return getattr(obj, attr_name, None)
 
@@ -877,3 +1117,45 @@ class DictFilterImplementation(BaseFilterImplementation):
   FILTERS = {}
   FILTERS.update(BaseFilterImplementation.FILTERS)
   FILTERS.update({"ValueExpander": DictValueExpander})
+
+
+class CompiledFilter(Filter):
+  """A filter tree turned into a single function by BuildMatcher."""
+
+  def __init__(self, filter_obj):
+    super(CompiledFilter, self).__init__(arguments=[filter_obj])
+    self.matcher = filter_obj.BuildMatcher()
+
+  def Matches(self, obj):
+    return self.matcher(obj)
+
+  def Filter(self, objects):
+    return filter(self.matcher, objects)
+
+
+COMPILED_QUERIES_CACHE = utils.FastStore(max_size=1000)
+
+
+def CompileQuery(query, filter_implementation=BaseFilterImplementation):
+  """Parses and compiles a query, caching the result.
+
+  Args:
+    query: The query string.
+    filter_implementation: The filter implementation to compile the query with.
+
+  Returns:
+    A CompiledFilter.
+
+  Raises:
+    Error: If the query is malformed.
+  """
+  key = (query, filter_implementation)
+  try:
+    return COMPILED_QUERIES_CACHE.Get(key)
+  except KeyError:
+    pass
+
+  compiled_filter = CompiledFilter(
+      Parser(query).Parse().Compile(filter_implementation))
+  COMPILED_QUERIES_CACHE.Put(key, compiled_filter)
+  return compiled_filter
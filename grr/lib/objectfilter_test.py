@@ -215,6 +215,8 @@ class ObjectFilterTest(unittest.TestCase):
             "value_expander": self.value_expander
         }
         self.assertEqual(test_unit[0], operator(**kwargs).Matches(self.file))
+        self.assertEqual(test_unit[0],
+                         operator(**kwargs).BuildMatcher()(self.file))
 
   def testExpand(self):
     # Case insensitivity
@@ -351,6 +353,7 @@ class ObjectFilterTest(unittest.TestCase):
         value_expander=self.value_expander)
     # With context, it doesn't match because both don't match in the same dll
     self.assertEqual(False, context.Matches(self.file))
+    self.assertEqual(False, context.BuildMatcher()(self.file))
 
     # "One imported_dll imports only 1 function AND one imported_dll imports
     # function RegQueryValueEx"
@@ -365,6 +368,7 @@ class ObjectFilterTest(unittest.TestCase):
     context = objectfilter.Context(
         ["imported_dlls", condition], value_expander=self.value_expander)
     self.assertEqual(True, context.Matches(self.file))
+    self.assertEqual(True, context.BuildMatcher()(self.file))
 
     # Now test the context with a straight query
     query = """
@@ -544,6 +548,44 @@ AND @exported_symbols(name is 'inject')
     filter_ = parser.Compile(self.filter_imp)
     self.assertEqual(filter_.Matches(obj), False)
 
+  def testCompileQuery(self):
+    queries = [
+        ("name is 'boot.ini' and size > 5", True),
+        ("name is 'boot.ini' and size > 50", False),
+        ("name is 'nope' or size > 5", True),
+        ("attributes inset ['Archive', 'Backup']", True),
+        ("attributes notinset ['Archive']", True),
+        ("mapping.string is 'mate'", True),
+        ("hash.md5 regexp '^456'", True),
+        ("@imported_dlls(name is 'b.dll' and num_imported_functions == 1)",
+         True),
+        ("@imported_dlls(name is 'a.dll' and num_imported_functions == 1)",
+         False),
+    ]
+    for query, expected in queries:
+      filter_ = objectfilter.CompileQuery(query, self.filter_imp)
+      parsed = objectfilter.Parser(query).Parse().Compile(self.filter_imp)
+      self.assertEqual(parsed.Matches(self.file), expected, query)
+      self.assertEqual(filter_.Matches(self.file), expected, query)
+      self.assertEqual(filter_.Filter([self.file]), [self.file] * expected)
+
+      # Compiled queries are cached.
+      self.assertIs(filter_, objectfilter.CompileQuery(query, self.filter_imp))
+      self.assertIsNot(filter_, objectfilter.CompileQuery(query))
+
+    self.assertRaises(objectfilter.ParseError, objectfilter.CompileQuery,
+                      "name is")
+
+  def testInsetWithUnhashableValues(self):
+    obj = DummyObject("attributes", [["a"], ["b"]])
+    filter_ = objectfilter.CompileQuery("attributes inset ['b']")
+    self.assertFalse(filter_.Matches(obj))
+
+    filter_ = objectfilter.InSet(
+        arguments=["attributes", [["a"], ["b"], "c"]],
+        value_expander=self.value_expander).BuildMatcher()
+    self.assertTrue(filter_(obj))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -13,6 +13,7 @@ import logging
 
 from grr.lib import config_lib
 from grr.lib import data_store
+from grr.lib import flow_start_index
 from grr.lib import rdfvalue
 from grr.lib import registry
 from grr.lib import stats
@@ -79,11 +80,30 @@ class QueueManager(object):
 
   TASK_PREDICATE_PREFIX = "task:"
   TASK_PREDICATE_TEMPLATE = TASK_PREDICATE_PREFIX + "%s"
+
+  # Notifications are kept in time buckets, one subject per queue shard and
+  # bucket, so that reads only touch buckets which are due. The predicate
+  # starts with a key sorting the notifications by priority: stuck flows first,
+  # then high, medium and low priority flows.
   NOTIFY_PREDICATE_PREFIX = "notify:"
-  NOTIFY_PREDICATE_TEMPLATE = NOTIFY_PREDICATE_PREFIX + "%s"
+  NOTIFY_PREDICATE_TEMPLATE = NOTIFY_PREDICATE_PREFIX + "%s:%s"
+  NOTIFY_PRIORITY_KEYS = ["0", "1", "2", "3"]
+  NOTIFICATION_BUCKET_SIZE = 60 * 1000000
+
+  # Each queue shard lists the start times of its notification buckets.
+  NOTIFY_BUCKET_PREFIX = "notify_bucket:"
+  NOTIFY_BUCKET_TEMPLATE = NOTIFY_BUCKET_PREFIX + "%016X"
+
+  # Notifications written by older versions are kept in the queue shard itself,
+  # in a single attribute per session id. They are still read and deleted until
+  # MigrateLegacyNotifications() moves them to buckets.
+  LEGACY_NOTIFY_PREDICATE_TEMPLATE = NOTIFY_PREDICATE_PREFIX + "%s"
 
   STUCK_PRIORITY = "Flow stuck"
 
+  # The maximum number of notifications read from a queue shard at once.
+  notification_limit = 10000
+
   request_limit = 1000000
   response_limit = 1000000
 
@@ -105,10 +125,17 @@ class QueueManager(object):
     self.client_messages_to_delete = {}
     self.new_client_messages = []
     self.notifications = {}
+    # Flow starts to record in the flow start index. Keys are client ids, values
+    # are lists of FlowStart objects.
+    self.flow_starts = {}
 
     self.prev_frozen_timestamps = []
     self.frozen_timestamp = None
 
+    # The bucket start times of each queue shard, as last read. Keys are queue
+    # shards, values are sets of microseconds since epoch.
+    self.notification_buckets = {}
+
     self.num_notification_shards = config_lib.CONFIG["Worker.queue_shards"]
 
   def GetNotificationShard(self, queue):
@@ -153,12 +180,14 @@ class QueueManager(object):
     """
     self.prev_frozen_timestamps.append(self.frozen_timestamp)
     self.frozen_timestamp = rdfvalue.RDFDatetime.Now()
+    self.notification_buckets = {}
 
   def UnfreezeTimestamp(self):
     """Unfreezes the timestamp used for resolve/delete database queries."""
     if not self.prev_frozen_timestamps:
       raise RuntimeError("Unbalanced UnfreezeTimestamp call.")
     self.frozen_timestamp = self.prev_frozen_timestamps.pop()
+    self.notification_buckets = {}
 
   def __enter__(self):
     """Supports 'with' protocol."""
@@ -410,6 +439,10 @@ class QueueManager(object):
               timestamp=timestamp,
               mutation_pool=mutation_pool)
 
+      for client_id, flow_starts in self.flow_starts.iteritems():
+        flow_start_index.RecordFlowStarts(client_id, flow_starts,
+                                          mutation_pool)
+
     if self.notifications:
       for notification, timestamp in self.notifications.itervalues():
         self.NotifyQueue(
@@ -422,6 +455,7 @@ class QueueManager(object):
     self.client_messages_to_delete = {}
     self.notifications = {}
     self.new_client_messages = []
+    self.flow_starts = {}
 
   def QueueResponse(self, session_id, response, timestamp=None):
     """Queues the message on the flow's state."""
@@ -452,6 +486,10 @@ class QueueManager(object):
     queue.setdefault(self.FLOW_REQUEST_TEMPLATE % request_state.id, []).append(
         (request_state.SerializeToString(), timestamp))
 
+  def QueueFlowStart(self, client_id, flow_start):
+    """Queues a flow start to be recorded in the client's flow start index."""
+    self.flow_starts.setdefault(client_id, []).append(flow_start)
+
   def QueueClientMessage(self, msg, timestamp=None):
     if timestamp is None:
       timestamp = self.frozen_timestamp
@@ -614,10 +652,83 @@ class QueueManager(object):
         key=lambda notification: notification.priority, reverse=True)
     return notifications
 
+  def _NotificationPriorityKey(self, notification):
+    """Returns the key sorting a notification by priority."""
+    if notification.in_progress:
+      return self.NOTIFY_PRIORITY_KEYS[0]
+    return self.NOTIFY_PRIORITY_KEYS[3 - int(notification.priority)]
+
+  def _NotificationBucketSubject(self, queue_shard, bucket):
+    return queue_shard.Add("notifications").Add("%016X" % bucket)
+
+  def _GetNotificationBuckets(self, queue_shard, refresh=False):
+    """Returns the sorted start times of the notification buckets of a shard.
+
+    Args:
+      queue_shard: urn of queue shard
+      refresh: If False and the timestamp is frozen, buckets read before are
+        not read again.
+
+    Returns:
+      A list of bucket start times in microseconds since epoch.
+    """
+    if (refresh or self.frozen_timestamp is None or
+        queue_shard not in self.notification_buckets):
+      buckets = set()
+      for predicate, _, _ in self.data_store.ResolvePrefix(
+          queue_shard, self.NOTIFY_BUCKET_PREFIX, token=self.token):
+        buckets.add(int(predicate[len(self.NOTIFY_BUCKET_PREFIX):], 16))
+      self.notification_buckets[queue_shard] = buckets
+
+    return sorted(self.notification_buckets[queue_shard])
+
+  def _AddNotification(self, subject, predicate, serialized_notification, ts,
+                       session_id, notifications_by_session_id):
+    """Parses a notification, keeping only the latest one per session id."""
+    try:
+      notification = rdf_flows.GrrNotification.FromSerializedString(
+          serialized_notification)
+    except Exception:  # pylint: disable=broad-except
+      logging.exception("Can't unserialize notification, deleting it: "
+                        "predicate=%s, ts=%d", predicate, ts)
+      self.data_store.DeleteAttributes(
+          subject,
+          [predicate],
+          token=self.token,
+          # Make the time range narrow, but be sure to include the needed
+          # notification.
+          start=ts,
+          end=ts,
+          sync=True)
+      return
+
+    notification.session_id = session_id
+    notification.timestamp = ts
+
+    existing = notifications_by_session_id.get(notification.session_id)
+    if existing:
+      # If we have a notification for this session_id already, we only store
+      # the one that was scheduled last.
+      if notification.first_queued > existing.first_queued:
+        notifications_by_session_id[notification.session_id] = notification
+      elif notification.first_queued == existing.first_queued and (
+          notification.last_status > existing.last_status):
+        # Multiple notifications with the same timestamp should not happen.
+        # We can still do the correct thing and use the latest one.
+        logging.warn(
+            "Notifications with equal first_queued fields detected: %s %s",
+            notification, existing)
+        notifications_by_session_id[notification.session_id] = notification
+    else:
+      notifications_by_session_id[notification.session_id] = notification
+
   def _GetUnsortedNotifications(self,
                                 queue_shard,
                                 notifications_by_session_id=None):
-    """Returns all the available notifications for a queue_shard.
+    """Returns the available notifications for a queue_shard.
+
+    Only the buckets which are due are read, in priority order, until
+    notification_limit notifications are found.
 
     Args:
       queue_shard: urn of queue shard
@@ -630,52 +741,70 @@ class QueueManager(object):
     if notifications_by_session_id is None:
       notifications_by_session_id = {}
     end_time = self.frozen_timestamp or rdfvalue.RDFDatetime.Now()
-    for predicate, serialized_notification, ts in self.data_store.ResolvePrefix(
+    limit = self.notification_limit
+
+    # Notifications in the legacy layout are older than the bucketed ones, so
+    # they are read first.
+    legacy_values = self.data_store.ResolvePrefix(
         queue_shard,
         self.NOTIFY_PREDICATE_PREFIX,
         timestamp=(0, end_time),
         token=self.token,
-        limit=10000):
-
-      # Parse the notification.
-      try:
-        notification = rdf_flows.GrrNotification.FromSerializedString(
-            serialized_notification)
-      except Exception:  # pylint: disable=broad-except
-        logging.exception("Can't unserialize notification, deleting it: "
-                          "predicate=%s, ts=%d", predicate, ts)
+        limit=limit)
+    for predicate, serialized_notification, ts in legacy_values:
+      self._AddNotification(queue_shard, predicate, serialized_notification, ts,
+                            predicate[len(self.NOTIFY_PREDICATE_PREFIX):],
+                            notifications_by_session_id)
+    limit -= len(legacy_values)
+
+    buckets = [
+        bucket
+        for bucket in self._GetNotificationBuckets(queue_shard, refresh=True)
+        if bucket <= end_time.AsMicroSecondsFromEpoch()
+    ]
+    subjects = [
+        self._NotificationBucketSubject(queue_shard, bucket)
+        for bucket in buckets
+    ]
+    non_empty_subjects = set()
+    for key in self.NOTIFY_PRIORITY_KEYS:
+      if limit <= 0 or not subjects:
+        break
+
+      prefix = self.NOTIFY_PREDICATE_TEMPLATE % (key, "")
+      for subject, values in self.data_store.MultiResolvePrefix(
+          subjects,
+          prefix,
+          timestamp=(0, end_time),
+          limit=limit,
+          token=self.token):
+        non_empty_subjects.add(utils.SmartStr(subject))
+        for predicate, serialized_notification, ts in values:
+          self._AddNotification(subject, predicate, serialized_notification, ts,
+                                predicate[len(prefix):],
+                                notifications_by_session_id)
+        limit -= len(values)
+
+    # If all the notifications were read, buckets which are empty and too old
+    # to receive new notifications are dropped from the shard.
+    if limit > 0:
+      expiry_time = rdfvalue.Duration(
+          "%ds" % config_lib.CONFIG["Worker.notification_expiry_time"])
+      cutoff = (end_time - expiry_time).AsMicroSecondsFromEpoch()
+      empty_buckets = []
+      for bucket, subject in zip(buckets, subjects):
+        if (bucket + self.NOTIFICATION_BUCKET_SIZE < cutoff and
+            utils.SmartStr(subject) not in non_empty_subjects):
+          empty_buckets.append(bucket)
+
+      if empty_buckets:
         self.data_store.DeleteAttributes(
             queue_shard,
-            [predicate],
-            token=self.token,
-            # Make the time range narrow, but be sure to include the needed
-            # notification.
-            start=ts,
-            end=ts,
-            sync=True)
-        continue
-
-      # Strip the prefix from the predicate to get the session_id.
-      session_id = predicate[len(self.NOTIFY_PREDICATE_PREFIX):]
-      notification.session_id = session_id
-      notification.timestamp = ts
-
-      existing = notifications_by_session_id.get(notification.session_id)
-      if existing:
-        # If we have a notification for this session_id already, we only store
-        # the one that was scheduled last.
-        if notification.first_queued > existing.first_queued:
-          notifications_by_session_id[notification.session_id] = notification
-        elif notification.first_queued == existing.first_queued and (
-            notification.last_status > existing.last_status):
-          # Multiple notifications with the same timestamp should not happen.
-          # We can still do the correct thing and use the latest one.
-          logging.warn(
-              "Notifications with equal first_queued fields detected: %s %s",
-              notification, existing)
-          notifications_by_session_id[notification.session_id] = notification
-      else:
-        notifications_by_session_id[notification.session_id] = notification
+            [self.NOTIFY_BUCKET_TEMPLATE % bucket for bucket in empty_buckets],
+            end=end_time,
+            sync=True,
+            token=self.token)
+        self.notification_buckets[queue_shard].difference_update(empty_buckets)
 
     return notifications_by_session_id
 
@@ -718,8 +847,13 @@ class QueueManager(object):
                         sync=True,
                         mutation_pool=None):
     """Does the actual queuing."""
-    serialized_notifications = {}
     now = rdfvalue.RDFDatetime.Now()
+    # The timestamp decides the bucket, so it can't be left to the data store.
+    if timestamp is None:
+      timestamp = now
+    timestamp = int(timestamp)
+
+    serialized_notifications = {}
     expiry_time = config_lib.CONFIG["Worker.notification_expiry_time"]
     for notification in notifications:
       if not notification.first_queued:
@@ -735,22 +869,62 @@ class QueueManager(object):
       # Don't serialize session ids to save some bytes.
       notification.session_id = None
       notification.timestamp = None
-      serialized_notifications[session_id] = notification.SerializeToString()
+      predicate = self.NOTIFY_PREDICATE_TEMPLATE % (
+          self._NotificationPriorityKey(notification), session_id)
+      serialized_notifications[predicate] = notification.SerializeToString()
 
-    values = {}
-    for session_id, data in serialized_notifications.iteritems():
-      values[self.NOTIFY_PREDICATE_TEMPLATE % session_id] = [(data, timestamp)]
+    if serialized_notifications:
+      self._WriteNotifications(
+          self.GetNotificationShard(queue),
+          [(predicate, data, timestamp)
+           for predicate, data in serialized_notifications.iteritems()],
+          sync=sync,
+          mutation_pool=mutation_pool)
+
+  def _WriteNotifications(self,
+                          queue_shard,
+                          notifications,
+                          sync=True,
+                          mutation_pool=None):
+    """Writes notifications to the buckets of a queue shard.
 
+    Args:
+      queue_shard: urn of queue shard
+      notifications: A list of (predicate, serialized notification, timestamp)
+        tuples. Timestamps are in microseconds since epoch.
+      sync: If True, sync to the data_store immediately.
+      mutation_pool: An optional MutationPool object to write to.
+    """
+    values_by_bucket = {}
+    for predicate, data, timestamp in notifications:
+      bucket = timestamp - timestamp % self.NOTIFICATION_BUCKET_SIZE
+      values_by_bucket.setdefault(bucket, {}).setdefault(predicate, []).append(
+          (data, timestamp))
+
+    # The buckets are listed after the notifications are written, so that a
+    # listed bucket is never dropped for being empty before they arrive.
+    bucket_values = dict((self.NOTIFY_BUCKET_TEMPLATE % bucket, [bucket])
+                         for bucket in values_by_bucket)
     if mutation_pool:
-      mutation_pool.MultiSet(
-          self.GetNotificationShard(queue), values, replace=False)
+      for bucket, values in values_by_bucket.iteritems():
+        mutation_pool.MultiSet(
+            self._NotificationBucketSubject(queue_shard, bucket),
+            values,
+            replace=False)
+      mutation_pool.MultiSet(queue_shard, bucket_values)
     else:
+      for bucket, values in values_by_bucket.iteritems():
+        self.data_store.MultiSet(
+            self._NotificationBucketSubject(queue_shard, bucket),
+            values,
+            sync=sync,
+            replace=False,
+            token=self.token)
       self.data_store.MultiSet(
-          self.GetNotificationShard(queue),
-          values,
-          sync=sync,
-          replace=False,
-          token=self.token)
+          queue_shard, bucket_values, sync=sync, token=self.token)
+
+    if queue_shard in self.notification_buckets:
+      self.notification_buckets[queue_shard].update(values_by_bucket)
 
   def DeleteNotification(self, session_id, start=None, end=None):
     self.DeleteNotifications([session_id], start=start, end=end)
@@ -775,15 +949,83 @@ class QueueManager(object):
 
     for queue, ids in utils.GroupBy(
         session_ids, lambda session_id: session_id.Queue()).iteritems():
-      queue_shards = self.GetAllNotificationShards(queue)
+      # Notifications in the legacy layout are kept in the shards themselves.
+      subjects = []
+      for queue_shard in self.GetAllNotificationShards(queue):
+        subjects.append(queue_shard)
+        # Other workers may have created buckets since they were last read, so
+        # they are always read again.
+        for bucket in self._GetNotificationBuckets(queue_shard, refresh=True):
+          if bucket <= int(end) and (
+              bucket + self.NOTIFICATION_BUCKET_SIZE > start):
+            subjects.append(
+                self._NotificationBucketSubject(queue_shard, bucket))
+
+      # The priority of the notifications is not known, so all the keys are
+      # deleted.
+      attributes = []
+      for session_id in ids:
+        attributes.append(self.LEGACY_NOTIFY_PREDICATE_TEMPLATE % session_id)
+        for key in self.NOTIFY_PRIORITY_KEYS:
+          attributes.append(self.NOTIFY_PREDICATE_TEMPLATE % (key, session_id))
+
       self.data_store.MultiDeleteAttributes(
-          queue_shards,
-          [self.NOTIFY_PREDICATE_TEMPLATE % session_id for session_id in ids],
+          subjects,
+          attributes,
           token=self.token,
           start=start,
           end=end,
           sync=True)
 
+  def MigrateLegacyNotifications(self, queue):
+    """Moves notifications written by older versions into buckets.
+
+    Notifications in the legacy layout are still processed, but they are read
+    in full on every pass. This moves all of them, including the ones which
+    are not due yet, to the bucketed layout.
+
+    Args:
+      queue: usually rdfvalue.RDFURN("aff4:/W")
+
+    Returns:
+      The number of notifications moved.
+    """
+    migrated_count = 0
+    for queue_shard in self.GetAllNotificationShards(queue):
+      values = self.data_store.ResolvePrefix(
+          queue_shard,
+          self.NOTIFY_PREDICATE_PREFIX,
+          timestamp=self.data_store.ALL_TIMESTAMPS,
+          token=self.token)
+      if not values:
+        continue
+
+      notifications = []
+      for predicate, serialized_notification, ts in values:
+        try:
+          notification = rdf_flows.GrrNotification.FromSerializedString(
+              serialized_notification)
+        except Exception:  # pylint: disable=broad-except
+          logging.exception("Can't unserialize notification, deleting it: "
+                            "predicate=%s, ts=%d", predicate, ts)
+          continue
+
+        session_id = predicate[len(self.NOTIFY_PREDICATE_PREFIX):]
+        notifications.append((self.NOTIFY_PREDICATE_TEMPLATE % (
+            self._NotificationPriorityKey(notification), session_id),
+                              serialized_notification, ts))
+
+      self._WriteNotifications(queue_shard, notifications)
+
+      with self.data_store.GetMutationPool(token=self.token) as mutation_pool:
+        for predicate, _, ts in values:
+          mutation_pool.DeleteAttributes(
+              queue_shard, [predicate], start=ts, end=ts)
+
+      migrated_count += len(notifications)
+
+    return migrated_count
+
   def Query(self, queue, limit=1, task_id=None):
     """Retrieves tasks from a queue without leasing them.
 
@@ -13,6 +13,7 @@ from grr.lib import queues
 from grr.lib import rdfvalue
 from grr.lib import stats
 from grr.lib import test_lib
+from grr.lib import utils
 from grr.lib.rdfvalues import flows as rdf_flows
 
 # pylint: mode=test
@@ -470,6 +471,26 @@ class QueueManagerTest(test_lib.FlowTestsBaseclass):
         self.assertEqual(
             len(manager2.GetNotificationsForAllShards(queues.HUNTS)), 1)
 
+  def testDeletingNotificationsSeesBucketsCreatedAfterFreezing(self):
+    session_id = rdfvalue.SessionID(
+        base="aff4:/hunts", queue=queues.HUNTS, flow_name="123456")
+    with queue_manager.QueueManager(token=self.token) as manager1:
+      # Reads the notification buckets while the timestamp is frozen.
+      manager1.DeleteNotification(session_id)
+
+      # Another worker adds a notification to a bucket which did not exist.
+      manager2 = queue_manager.QueueManager(token=self.token)
+      manager2.QueueNotification(
+          session_id=session_id,
+          timestamp=manager1.frozen_timestamp - rdfvalue.Duration("5m"))
+      manager2.Flush()
+      self.assertEqual(
+          len(manager2.GetNotificationsForAllShards(queues.HUNTS)), 1)
+
+      manager1.DeleteNotification(session_id)
+      self.assertEqual(
+          len(manager2.GetNotificationsForAllShards(queues.HUNTS)), 0)
+
   def testMultipleNotificationsForTheSameSessionId(self):
     manager = queue_manager.QueueManager(token=self.token)
     manager.QueueNotification(
@@ -509,6 +530,133 @@ class QueueManagerTest(test_lib.FlowTestsBaseclass):
     self._current_mock_time += 10
     self.assertEqual(len(manager.GetNotificationsForAllShards(queues.HUNTS)), 0)
 
+  def testNotificationsAreReadInPriorityOrderUpToTheLimit(self):
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      manager = queue_manager.QueueManager(token=self.token)
+      priorities = [
+          rdf_flows.GrrMessage.Priority.LOW_PRIORITY,
+          rdf_flows.GrrMessage.Priority.MEDIUM_PRIORITY,
+          rdf_flows.GrrMessage.Priority.HIGH_PRIORITY
+      ]
+      for i in range(9):
+        manager.QueueNotification(
+            session_id=rdfvalue.SessionID(
+                base="aff4:/hunts", queue=queues.HUNTS, flow_name="%d" % i),
+            priority=priorities[i % 3])
+      manager.QueueNotification(
+          session_id=rdfvalue.SessionID(
+              base="aff4:/hunts", queue=queues.HUNTS, flow_name="stuck"),
+          in_progress=True)
+      manager.Flush()
+
+      manager.notification_limit = 4
+      notifications_by_priority = manager.GetNotificationsByPriority(
+          queues.HUNTS)
+      self.assertEqual(
+          sorted(notifications_by_priority),
+          sorted([
+              rdf_flows.GrrMessage.Priority.HIGH_PRIORITY,
+              manager.STUCK_PRIORITY
+          ]))
+      self.assertEqual(
+          len(notifications_by_priority[
+              rdf_flows.GrrMessage.Priority.HIGH_PRIORITY]), 3)
+
+      manager.notification_limit = 7
+      notifications = manager.GetNotifications(queues.HUNTS)
+      self.assertEqual(len(notifications), 7)
+      self.assertEqual([n.priority for n in notifications if not n.in_progress],
+                       [rdf_flows.GrrMessage.Priority.HIGH_PRIORITY] * 3 +
+                       [rdf_flows.GrrMessage.Priority.MEDIUM_PRIORITY] * 3)
+
+  def testNotificationBucketsWhichAreNotDueAreNotRead(self):
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      manager = queue_manager.QueueManager(token=self.token)
+      manager.QueueNotification(session_id=rdfvalue.SessionID(
+          base="aff4:/hunts", queue=queues.HUNTS, flow_name="due"))
+      manager.QueueNotification(
+          session_id=rdfvalue.SessionID(
+              base="aff4:/hunts", queue=queues.HUNTS, flow_name="pending"),
+          timestamp=(self._current_mock_time + 3600) * 1e6)
+      manager.Flush()
+
+      read_subjects = set()
+
+      def MultiResolvePrefix(subjects, *args, **kwargs):
+        read_subjects.update(subjects)
+        return MultiResolvePrefix.old_target(subjects, *args, **kwargs)
+
+      with utils.Stubber(data_store.DB, "MultiResolvePrefix",
+                         MultiResolvePrefix):
+        notifications = manager.GetNotifications(queues.HUNTS)
+
+      self.assertEqual([n.session_id for n in notifications], [
+          rdfvalue.SessionID(
+              base="aff4:/hunts", queue=queues.HUNTS, flow_name="due")
+      ])
+      self.assertEqual(len(read_subjects), 1)
+
+  def testLegacyNotificationsAreReadDeletedAndMigrated(self):
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      manager = queue_manager.QueueManager(token=self.token)
+      timestamps = [self._current_mock_time, self._current_mock_time + 3600]
+      session_ids = []
+      for i, timestamp in enumerate(timestamps):
+        session_id = rdfvalue.SessionID(
+            base="aff4:/hunts", queue=queues.HUNTS, flow_name="legacy%d" % i)
+        session_ids.append(session_id)
+        notification = rdf_flows.GrrNotification(
+            first_queued=rdfvalue.RDFDatetime.Now())
+        data_store.DB.Set(
+            queues.HUNTS,
+            manager.LEGACY_NOTIFY_PREDICATE_TEMPLATE % session_id,
+            notification.SerializeToString(),
+            timestamp=int(timestamp * 1e6),
+            replace=False,
+            token=self.token)
+
+      notifications = manager.GetNotifications(queues.HUNTS)
+      self.assertEqual([n.session_id for n in notifications], session_ids[:1])
+
+      self.assertEqual(manager.MigrateLegacyNotifications(queues.HUNTS), 2)
+      self.assertFalse(
+          data_store.DB.ResolvePrefix(
+              queues.HUNTS, manager.NOTIFY_PREDICATE_PREFIX, token=self.token))
+
+      notifications = manager.GetNotifications(queues.HUNTS)
+      self.assertEqual([n.session_id for n in notifications], session_ids[:1])
+      manager.DeleteNotification(session_ids[0])
+      self.assertFalse(manager.GetNotifications(queues.HUNTS))
+
+      self._current_mock_time += 3600
+      notifications = manager.GetNotifications(queues.HUNTS)
+      self.assertEqual([n.session_id for n in notifications], session_ids[1:])
+
+  def testEmptyNotificationBucketsAreDropped(self):
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      manager = queue_manager.QueueManager(token=self.token)
+      session_id = rdfvalue.SessionID(
+          base="aff4:/hunts", queue=queues.HUNTS, flow_name="123456")
+      manager.QueueNotification(session_id=session_id)
+      manager.Flush()
+      self.assertEqual(len(manager.GetNotifications(queues.HUNTS)), 1)
+      manager.DeleteNotification(session_id)
+
+      # Empty buckets may still receive notifications for a while.
+      self.assertFalse(manager.GetNotifications(queues.HUNTS))
+      self.assertEqual(
+          len(
+              data_store.DB.ResolvePrefix(
+                  queues.HUNTS,
+                  manager.NOTIFY_BUCKET_PREFIX,
+                  token=self.token)), 1)
+
+      self._current_mock_time += (
+          config_lib.CONFIG["Worker.notification_expiry_time"] + 120)
+      self.assertFalse(manager.GetNotifications(queues.HUNTS))
+      self.assertFalse(
+          data_store.DB.ResolvePrefix(
+              queues.HUNTS, manager.NOTIFY_BUCKET_PREFIX, token=self.token))
 
 class MultiShardedQueueManagerTest(QueueManagerTest):
   """Test for QueueManager with multiple notification shards enabled."""
@@ -641,6 +789,52 @@ class MultiShardedQueueManagerTest(QueueManagerTest):
           self.assertEqual(len(notifications), 0)
 
 
+class NotificationBacklogBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark reading notifications from a queue with a large backlog."""
+
+  DUE_COUNT = 500
+  PENDING_COUNT = 2500
+
+  def _WriteLegacyNotifications(self):
+    now = rdfvalue.RDFDatetime.Now()
+    values = {}
+    for i in range(self.DUE_COUNT + self.PENDING_COUNT):
+      session_id = rdfvalue.SessionID(
+          base="aff4:/flows", queue=queues.FLOWS, flow_name="%08X" % i)
+      # Most of the backlog is not due yet, like the notifications which
+      # terminate flows if they get stuck.
+      if i < self.DUE_COUNT:
+        timestamp = now - rdfvalue.Duration("%ds" % (i + 1))
+      else:
+        timestamp = now + rdfvalue.Duration("%ds" % i)
+      notification = rdf_flows.GrrNotification(first_queued=now)
+      values[queue_manager.QueueManager.LEGACY_NOTIFY_PREDICATE_TEMPLATE %
+             session_id] = [(notification.SerializeToString(),
+                             timestamp.AsMicroSecondsFromEpoch())]
+
+    data_store.DB.MultiSet(
+        queues.FLOWS, values, replace=False, token=self.token)
+
+  def _TimeReads(self, manager, name):
+    self.TimeIt(
+        lambda: manager.GetNotificationsByPriority(queues.FLOWS),
+        name=name,
+        repetitions=5)
+
+  @test_lib.SetLabel("benchmark")
+  def testReadingABacklog(self):
+    with test_lib.ConfigOverrider({"Worker.queue_shards": 1}):
+      manager = queue_manager.QueueManager(token=self.token)
+      self._WriteLegacyNotifications()
+      self._TimeReads(manager, "Legacy layout")
+
+      manager.MigrateLegacyNotifications(queues.FLOWS)
+      self._TimeReads(manager, "Bucketed layout")
+
+      manager.notification_limit = 100
+      self._TimeReads(manager, "Bucketed layout, 100 at a time")
+
+
 def main(argv):
   test_lib.main(argv)
 
@@ -2,7 +2,9 @@
 """RDFValue implementations for hunts."""
 
 
+import threading
 
+from grr.lib import utils
 from grr.lib.rdfvalues import structs as rdf_structs
 from grr.proto import flows_pb2
 from grr.proto import jobs_pb2
@@ -16,6 +18,150 @@ class HuntContext(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.HuntContext
 
 
+class HuntClientCompletionStatsBucket(rdf_structs.RDFProtoStruct):
+  protobuf = flows_pb2.HuntClientCompletionStatsBucket
+
+
+class HuntClientCompletionStats(rdf_structs.RDFProtoStruct):
+  """Time-bucketed counters of hunt's started, completed and failed clients."""
+  protobuf = flows_pb2.HuntClientCompletionStats
+
+  # Buckets get twice as wide every time there are more of them than this.
+  MAX_BUCKETS = 2000
+
+  def __init__(self, initializer=None, **kwargs):
+    super(HuntClientCompletionStats, self).__init__(
+        initializer=initializer, **kwargs)
+
+    self.lock = threading.RLock()
+
+  @classmethod
+  def FromTimestamps(cls, started, completed, errors):
+    """Builds the counters from scratch.
+
+    Args:
+      started: Iterable with times (in seconds since epoch) when clients were
+        started.
+      completed: Iterable with times when clients completed.
+      errors: Iterable with times when clients failed.
+
+    Returns:
+      HuntClientCompletionStats.
+    """
+    result = cls()
+
+    counts = {}
+    for index, timestamps in enumerate([started, completed, errors]):
+      for timestamp in timestamps:
+        counts.setdefault(timestamp, [0, 0, 0])[index] += 1
+
+    result.started_count = sum(c[0] for c in counts.itervalues())
+    result.completed_count = sum(c[1] for c in counts.itervalues())
+    result.errors_count = sum(c[2] for c in counts.itervalues())
+    result._SetBuckets(counts)  # pylint: disable=protected-access
+
+    return result
+
+  def _SetBuckets(self, counts):
+    """Replaces buckets with {timestamp: [started, completed, errors]} dict."""
+    while len(counts) > self.MAX_BUCKETS:
+      self.bucket_size *= 2
+
+      merged_counts = {}
+      for timestamp, values in counts.iteritems():
+        merged = merged_counts.setdefault(
+            timestamp - timestamp % self.bucket_size, [0, 0, 0])
+        for index, value in enumerate(values):
+          merged[index] += value
+      counts = merged_counts
+
+    self.buckets = [
+        HuntClientCompletionStatsBucket(
+            timestamp=timestamp,
+            started_count=started,
+            completed_count=completed,
+            errors_count=errors)
+        for timestamp, (started, completed, errors) in sorted(counts.items())
+    ]
+
+  def _GetBucket(self, timestamp):
+    """Returns the bucket for a given RDFDatetime, creating it if needed."""
+    seconds = timestamp.AsSecondsFromEpoch()
+    bucket_timestamp = seconds - seconds % self.bucket_size
+
+    # Clients are mostly registered in chronological order, so the bucket we're
+    # looking for is usually the last one.
+    index = len(self.buckets)
+    while index > 0:
+      bucket = self.buckets[index - 1]
+      if bucket.timestamp == bucket_timestamp:
+        return bucket
+      if bucket.timestamp < bucket_timestamp:
+        break
+      index -= 1
+
+    if len(self.buckets) >= self.MAX_BUCKETS:
+      counts = {}
+      for bucket in self.buckets:
+        counts[bucket.timestamp] = [
+            bucket.started_count, bucket.completed_count, bucket.errors_count
+        ]
+      counts[bucket_timestamp] = [0, 0, 0]
+      self._SetBuckets(counts)
+      return self._GetBucket(timestamp)
+
+    bucket = HuntClientCompletionStatsBucket(timestamp=bucket_timestamp)
+    buckets = list(self.buckets)
+    buckets.insert(index, bucket)
+    self.buckets = buckets
+
+    return bucket
+
+  @utils.Synchronized
+  def RegisterStartedClient(self, timestamp):
+    self.started_count += 1
+    self._GetBucket(timestamp).started_count += 1
+
+  @utils.Synchronized
+  def RegisterCompletedClient(self, timestamp):
+    self.completed_count += 1
+    self._GetBucket(timestamp).completed_count += 1
+
+  @utils.Synchronized
+  def RegisterClientError(self, timestamp):
+    self.errors_count += 1
+    self._GetBucket(timestamp).errors_count += 1
+
+  def GetDataPoints(self):
+    """Returns cumulative numbers of started and completed clients over time.
+
+    Returns:
+      A tuple with lists of started and completed data points. Every data point
+      is a tuple of time (in hours since the hunt has started) and the number
+      of clients started (or completed) by that time.
+    """
+    buckets = [b for b in self.buckets if b.started_count or b.completed_count]
+    if not buckets:
+      return ([], [])
+
+    started_buckets = [b for b in buckets if b.started_count] or buckets
+    start_time = started_buckets[0].timestamp - self.bucket_size
+
+    start_points = [(0.0, 0)]
+    complete_points = [(0.0, 0)]
+    started = 0
+    completed = 0
+    for bucket in buckets:
+      started += bucket.started_count
+      completed += bucket.completed_count
+
+      hours = (bucket.timestamp - start_time) / 3600.0
+      start_points.append((hours, started))
+      complete_points.append((hours, completed))
+
+    return (start_points, complete_points)
+
+
 class HuntRunnerArgs(rdf_structs.RDFProtoStruct):
   protobuf = flows_pb2.HuntRunnerArgs
 
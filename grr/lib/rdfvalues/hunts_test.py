@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Tests for hunts-related RDFValues."""
+
+
+
+from grr.lib import flags
+from grr.lib import rdfvalue
+from grr.lib import test_lib
+from grr.lib.rdfvalues import hunts as rdf_hunts
+from grr.lib.rdfvalues import test_base
+
+
+class HuntClientCompletionStatsTest(test_base.RDFValueTestCase):
+  rdfvalue_class = rdf_hunts.HuntClientCompletionStats
+
+  def GenerateSample(self, number=0):
+    return rdf_hunts.HuntClientCompletionStats.FromTimestamps(
+        [number, number + 1], [number + 1], [])
+
+  def _Time(self, seconds):
+    return rdfvalue.RDFDatetime().FromSecondsFromEpoch(seconds)
+
+  def _Buckets(self, stats):
+    return [(b.timestamp, b.started_count, b.completed_count, b.errors_count)
+            for b in stats.buckets]
+
+  def testCountersAreUpdatedIncrementally(self):
+    stats = rdf_hunts.HuntClientCompletionStats()
+    stats.RegisterStartedClient(self._Time(10))
+    stats.RegisterStartedClient(self._Time(10))
+    stats.RegisterStartedClient(self._Time(12))
+    stats.RegisterCompletedClient(self._Time(15))
+    stats.RegisterClientError(self._Time(15))
+
+    self.assertEqual(stats.started_count, 3)
+    self.assertEqual(stats.completed_count, 1)
+    self.assertEqual(stats.errors_count, 1)
+    self.assertEqual(
+        self._Buckets(stats), [(10, 2, 0, 0), (12, 1, 0, 0), (15, 0, 1, 1)])
+
+  def testOutOfOrderEventsAreInsertedIntoTheRightBucket(self):
+    stats = rdf_hunts.HuntClientCompletionStats()
+    stats.RegisterStartedClient(self._Time(20))
+    stats.RegisterStartedClient(self._Time(10))
+    stats.RegisterCompletedClient(self._Time(20))
+
+    self.assertEqual(self._Buckets(stats), [(10, 1, 0, 0), (20, 1, 1, 0)])
+
+  def testIncrementalCountersMatchCountersBuiltFromScratch(self):
+    started = range(0, 100, 3)
+    completed = range(5, 105, 3)
+    errors = range(7, 50, 11)
+
+    incremental = rdf_hunts.HuntClientCompletionStats()
+    for t in started:
+      incremental.RegisterStartedClient(self._Time(t))
+    for t in completed:
+      incremental.RegisterCompletedClient(self._Time(t))
+    for t in errors:
+      incremental.RegisterClientError(self._Time(t))
+
+    from_scratch = rdf_hunts.HuntClientCompletionStats.FromTimestamps(
+        started, completed, errors)
+    self.assertEqual(self._Buckets(incremental), self._Buckets(from_scratch))
+    self.assertEqual(incremental.started_count, from_scratch.started_count)
+    self.assertEqual(incremental.completed_count, from_scratch.completed_count)
+    self.assertEqual(incremental.errors_count, from_scratch.errors_count)
+
+  def testBucketsGetWiderWhenThereAreTooManyOfThem(self):
+    stats = rdf_hunts.HuntClientCompletionStats()
+    stats.MAX_BUCKETS = 4
+    for t in range(10):
+      stats.RegisterStartedClient(self._Time(t))
+
+    self.assertEqual(stats.bucket_size, 4)
+    self.assertEqual([(b.timestamp, b.started_count) for b in stats.buckets],
+                     [(0, 4), (4, 4), (8, 2)])
+    self.assertEqual(stats.started_count, 10)
+
+  def testDataPointsAreCumulative(self):
+    stats = rdf_hunts.HuntClientCompletionStats.FromTimestamps(
+        [3600, 3600, 7200], [7200, 10800], [])
+
+    start_points, complete_points = stats.GetDataPoints()
+    self.assertEqual(start_points, [(0.0, 0), (1 / 3600.0, 2),
+                                    (3601 / 3600.0, 3), (7201 / 3600.0, 3)])
+    self.assertEqual(complete_points, [(0.0, 0), (1 / 3600.0, 0),
+                                       (3601 / 3600.0, 1), (7201 / 3600.0, 2)])
+
+  def testNoDataPointsWithoutClients(self):
+    stats = rdf_hunts.HuntClientCompletionStats.FromTimestamps([], [], [10])
+    self.assertEqual(stats.GetDataPoints(), ([], []))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -263,6 +263,11 @@ class _GaugeMetric(_Metric):
     key = self._FieldsToKey(fields)
     self._values[key] = callback
 
+  def Delete(self, fields=None):
+    """Removes metric's value for the given fields."""
+    key = self._FieldsToKey(fields)
+    self._values.pop(key, None)
+
   def Get(self, fields=None):
     """Returns current metric's value (executing callback if needed)."""
     result = super(_GaugeMetric, self).Get(fields=fields)
@@ -477,6 +482,20 @@ class StatsCollector(object):
     """
     self._metrics[varname].Set(value, fields)
 
+  @utils.Synchronized
+  def DeleteGaugeValue(self, varname, fields=None):
+    """Removes value of a given gauge metric for the given fields.
+
+    This is used to stop exporting gauge values for fields which are no longer
+    relevant, e.g. for objects which don't exist anymore.
+
+    Args:
+      varname: Metric name.
+      fields: Values for this metric's fields. Should be None if the metric
+              was registered without any fields.
+    """
+    self._metrics[varname].Delete(fields)
+
   @utils.Synchronized
   def SetGaugeCallback(self, varname, callback, fields=None):
     """Attached callback to the gauge metric.
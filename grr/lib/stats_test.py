@@ -126,6 +126,28 @@ class StatsTests(test_lib.GRRBaseTest):
         stats.STATS.GetMetricValue(
             "test_int_gauge", fields=["dimension_value_2"]))
 
+  def testGaugeValuesCanBeDeleted(self):
+    stats.STATS.RegisterGaugeMetric(
+        "test_int_gauge", int, fields=[("dimension", str)])
+
+    stats.STATS.SetGaugeValue("test_int_gauge", 1, fields=["dimension_value_1"])
+    stats.STATS.SetGaugeValue("test_int_gauge", 2, fields=["dimension_value_2"])
+    stats.STATS.DeleteGaugeValue("test_int_gauge", fields=["dimension_value_1"])
+    # Deleting a value which is not set is a no-op.
+    stats.STATS.DeleteGaugeValue("test_int_gauge", fields=["dimension_value_3"])
+
+    self.assertEqual(
+        [("dimension_value_2",)],
+        list(stats.STATS.GetMetricFields("test_int_gauge")))
+    self.assertEqual(
+        0,
+        stats.STATS.GetMetricValue(
+            "test_int_gauge", fields=["dimension_value_1"]))
+    self.assertEqual(
+        2,
+        stats.STATS.GetMetricValue(
+            "test_int_gauge", fields=["dimension_value_2"]))
+
   def testGaugeWithCallback(self):
     stats.STATS.RegisterGaugeMetric("test_int_gauge", int)
     stats.STATS.RegisterGaugeMetric("test_string_gauge", str)
@@ -55,6 +55,7 @@ from grr.lib import email_alerts
 from grr.lib import events
 from grr.lib import flags
 from grr.lib import flow
+from grr.lib import keyword_index
 # pylint: disable=unused-import
 from grr.lib import local as _
 # pylint: enable=unused-import
@@ -73,6 +74,7 @@ from grr.lib import worker_mocks
 
 from grr.lib.aff4_objects import aff4_grr
 from grr.lib.aff4_objects import filestore
+from grr.lib.aff4_objects import sequential_collection
 from grr.lib.aff4_objects import standard as aff4_standard
 from grr.lib.aff4_objects import user_managers
 from grr.lib.aff4_objects import users
@@ -80,6 +82,7 @@ from grr.lib.aff4_objects import users
 # pylint: disable=unused-import
 from grr.lib.blob_stores import registry_init as _
 
+from grr.lib.data_stores import compact_data_store as _
 from grr.lib.data_stores import fake_data_store as _
 
 # Importing administrative to import ClientCrashHandler flow that
@@ -464,6 +467,10 @@ class GRRBaseTest(unittest.TestCase):
       self.InitDatastore()
 
     aff4.FACTORY.Flush()
+    posting_lists_cache = keyword_index.GetPostingListsCache()
+    if posting_lists_cache is not None:
+      posting_lists_cache.Flush()
+    sequential_collection.GetIndexCache().Flush()
 
     # Create a Foreman and Filestores, they are used in many tests.
     aff4_grr.GRRAFF4Init().Run()
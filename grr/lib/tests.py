@@ -26,6 +26,8 @@ from grr.lib import email_alerts_test
 from grr.lib import events_test
 from grr.lib import export_test
 from grr.lib import export_utils_test
+from grr.lib import fleet_scan_test
+from grr.lib import flow_start_index_test
 from grr.lib import flow_test
 from grr.lib import flow_utils_test
 from grr.lib import front_end_test
@@ -60,5 +62,6 @@ from grr.lib.local import tests
 from grr.lib.output_plugins import tests
 from grr.lib.rdfvalues import tests
 
+from grr.tools import fleet_benchmark_test
 from grr.tools import http_server_test
 # pylint: enable=unused-import,g-import-not-at-top
@@ -2,7 +2,7 @@
 """Throttle user calls to flows."""
 
 from grr.lib import aff4
-from grr.lib import flow
+from grr.lib import flow_start_index
 from grr.lib import rdfvalue
 
 
@@ -46,6 +46,10 @@ class FlowThrottler(object):
     we aren't exceeding our limits. Raises if limits will be exceeded by running
     the specified flow.
 
+    Flows are looked up in the flow start index. If the index doesn't cover the
+    last day yet, the client's flows are opened instead and the index is
+    backfilled with them.
+
     Args:
       client_id: client URN
       user: username string
@@ -62,37 +66,35 @@ class FlowThrottler(object):
     if not self.dup_interval and not self.daily_req_limit:
       return
 
-    flows_dir = aff4.FACTORY.Open(client_id.Add("flows"), token=token)
     now = rdfvalue.RDFDatetime.Now()
-    earlier = now - rdfvalue.Duration("1d")
+    earlier = now - flow_start_index.WINDOW
     dup_boundary = now - self.dup_interval
 
-    flow_count = 0
-    flow_list = flows_dir.ListChildren(age=(earlier.AsMicroSecondsFromEpoch(),
-                                            now.AsMicroSecondsFromEpoch()))
+    flow_starts = flow_start_index.ListFlowStarts(
+        client_id, earlier, now, token=token)
+    if flow_starts is None:
+      flow_starts = self._ListFlowStarts(client_id, earlier, now, token=token)
+      flow_start_index.BackfillFlowStarts(
+          client_id, flow_starts, earlier, token=token)
 
-    # Save DB roundtrips by checking both conditions at once. This means the dup
-    # interval has a maximum of 1 day.
-    for flow_obj in aff4.FACTORY.MultiOpen(flow_list, token=token):
-      flow_context = flow_obj.context
+    args_fingerprint = flow_start_index.ArgsFingerprint(flow_args)
 
+    flow_count = 0
+    # The dup interval has a maximum of 1 day, as both conditions are checked
+    # on the flows run within the last day.
+    for flow_start in flow_starts:
       # If dup_interval is set, check for identical flows run within the
       # duplicate interval.
-      if self.dup_interval and flow_context.create_time > dup_boundary:
-        if flow_obj.runner_args.flow_name == flow_name:
-
-          # Raise if either the args are the same, or the args were empty, to
-          # which None is the equivalent.
-          if flow_obj.args == flow_args or (
-              isinstance(flow_obj.args, flow.EmptyFlowArgs) and
-              flow_args is None):
-            raise ErrorFlowDuplicate(
-                "Identical %s already run on %s at %s" %
-                (flow_name, client_id, flow_context.create_time),
-                flow_urn=flow_obj.urn)
+      if (self.dup_interval and flow_start.create_time > dup_boundary and
+          flow_start.flow_name == flow_name and
+          flow_start.args_fingerprint == args_fingerprint):
+        raise ErrorFlowDuplicate(
+            "Identical %s already run on %s at %s" %
+            (flow_name, client_id, flow_start.create_time),
+            flow_urn=flow_start.flow_urn)
 
       # Filter for flows started by user within the 1 day window.
-      if flow_context.creator == user and flow_context.create_time > earlier:
+      if flow_start.creator == user and flow_start.create_time > earlier:
         flow_count += 1
 
     # If limit is set, enforce it.
@@ -100,3 +102,15 @@ class FlowThrottler(object):
       raise ErrorDailyFlowRequestLimitExceeded(
           "%s flows run since %s, limit: %s" % (flow_count, earlier,
                                                 self.daily_req_limit))
+
+  def _ListFlowStarts(self, client_id, start, end, token=None):
+    """Lists the flows started on a client by opening all of them."""
+    flows_dir = aff4.FACTORY.Open(client_id.Add("flows"), token=token)
+    flow_list = flows_dir.ListChildren(age=(start.AsMicroSecondsFromEpoch(),
+                                            end.AsMicroSecondsFromEpoch()))
+
+    flow_starts = []
+    for flow_obj in aff4.FACTORY.MultiOpen(flow_list, token=token):
+      flow_starts.append(flow_start_index.FlowStart.FromFlow(flow_obj))
+
+    return flow_starts
@@ -2,11 +2,15 @@
 """Tests for grr.lib.throttle."""
 
 from grr.lib import access_control
+from grr.lib import aff4
+from grr.lib import data_store
 from grr.lib import flags
 from grr.lib import flow
+from grr.lib import flow_start_index
 from grr.lib import rdfvalue
 from grr.lib import test_lib
 from grr.lib import throttle
+from grr.lib import utils
 from grr.lib.rdfvalues import file_finder as rdf_file_finder
 
 
@@ -153,6 +157,118 @@ class ThrottleTest(test_lib.GRRBaseTest):
           args,
           token=self.token)
 
+  def testIndexIsUsedOnceBackfilled(self):
+    throttler = throttle.FlowThrottler(
+        daily_req_limit=3, dup_interval=rdfvalue.Duration("1200s"))
+
+    with test_lib.FakeTime(self.BASE_TIME):
+      # The index doesn't cover the last day yet, so the flows are opened.
+      throttler.EnforceLimits(
+          self.client_id,
+          self.token.username,
+          "DummyLogFlow",
+          None,
+          token=self.token)
+
+    def Fail(*_, **unused_kwargs):
+      raise AssertionError("Flows shouldn't be opened.")
+
+    with utils.Stubber(throttler, "_ListFlowStarts", Fail):
+      with test_lib.FakeTime(self.BASE_TIME + 1):
+        flow_urn = flow.GRRFlow.StartFlow(
+            client_id=self.client_id,
+            flow_name="DummyLogFlow",
+            token=self.token)
+
+        with self.assertRaises(throttle.ErrorFlowDuplicate) as context:
+          throttler.EnforceLimits(
+              self.client_id,
+              self.token.username,
+              "DummyLogFlow",
+              None,
+              token=self.token)
+        self.assertEqual(context.exception.flow_urn, flow_urn)
+
+      with test_lib.FakeTime(self.BASE_TIME + 2):
+        for _ in range(2):
+          flow.GRRFlow.StartFlow(
+              client_id=self.client_id,
+              flow_name="DummyLogFlowChild",
+              token=self.token)
+
+        with self.assertRaises(throttle.ErrorDailyFlowRequestLimitExceeded):
+          throttler.EnforceLimits(
+              self.client_id,
+              self.token.username,
+              "FileFinder",
+              None,
+              token=self.token)
+
+  def testFlowsMissingFromTheIndexAreFound(self):
+    throttler = throttle.FlowThrottler(
+        daily_req_limit=2, dup_interval=rdfvalue.Duration("1200s"))
+
+    with test_lib.FakeTime(self.BASE_TIME):
+      for flow_name in ["DummyLogFlow", "DummyLogFlowChild"]:
+        flow.GRRFlow.StartFlow(
+            client_id=self.client_id, flow_name=flow_name, token=self.token)
+
+      # Flows started before the index existed aren't recorded in it.
+      data_store.DB.DeleteSubject(
+          self.client_id.Add("flow_starts"), token=self.token)
+
+      with self.assertRaises(throttle.ErrorDailyFlowRequestLimitExceeded):
+        throttler.EnforceLimits(
+            self.client_id,
+            self.token.username,
+            "FileFinder",
+            None,
+            token=self.token)
+
+    with test_lib.FakeTime(self.BASE_TIME + 1):
+      with utils.Stubber(aff4.FACTORY, "MultiOpen", None):
+        with self.assertRaises(throttle.ErrorFlowDuplicate):
+          throttler.EnforceLimits(
+              self.client_id,
+              "test2",
+              "DummyLogFlow",
+              None,
+              token=self.token)
+
+
+class ThrottleBenchmark(test_lib.AverageMicroBenchmarks):
+  """Benchmark enforcing limits on a client with many recent flows."""
+
+  @test_lib.SetLabel("benchmark")
+  def testEnforceLimits(self):
+    """Compare opening all the flows to reading the flow start index."""
+    client_id = self.SetupClients(1)[0]
+    for i in range(50):
+      flow.GRRFlow.StartFlow(
+          client_id=client_id,
+          flow_name="FileFinder",
+          paths=["/tmp/%d" % i],
+          token=self.token)
+
+    throttler = throttle.FlowThrottler(
+        daily_req_limit=1000, dup_interval=rdfvalue.Duration("1200s"))
+    args = rdf_file_finder.FileFinderArgs(paths=["/tmp/new"])
+
+    def EnforceLimits():
+      throttler.EnforceLimits(
+          client_id, self.token.username, "FileFinder", args, token=self.token)
+
+    with utils.Stubber(flow_start_index, "ListFlowStarts",
+                       lambda *_, **unused_kwargs: None):
+      with utils.Stubber(flow_start_index, "BackfillFlowStarts",
+                         lambda *_, **unused_kwargs: None):
+        self.TimeIt(EnforceLimits, name="Open flows", repetitions=10)
+
+    # The first call backfills the index.
+    self.TimeIt(
+        EnforceLimits, name="Flow start index", repetitions=10,
+        pre=EnforceLimits)
+
 
 def main(argv):
   # Run the full test suite
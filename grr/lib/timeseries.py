@@ -2,13 +2,19 @@
 """Operations on a series of points, indexed by time.
 """
 
+import array
+import bisect
 import copy
+import itertools
+import operator
 
 from grr.lib import rdfvalue
 
 NORMALIZE_MODE_GAUGE = 1
 NORMALIZE_MODE_COUNTER = 2
 
+_NAN = float("nan")
+
 
 class Timeseries(object):
   """Timeseries contains a sequence of points, each with a timestamp."""
@@ -219,3 +225,295 @@ class Timeseries(object):
     if not values:
       return None
     return sum(values) / len(values)
+
+
+class _ReadOnlyList(list):
+  """A list which raises on any attempt to modify it."""
+
+  def _RaiseReadOnly(self, *unused_args, **unused_kwargs):
+    raise TypeError("CompactTimeseries.data can't be modified in place, "
+                    "assign a new list of points to it instead.")
+
+  __setitem__ = __delitem__ = __setslice__ = __delslice__ = _RaiseReadOnly
+  __iadd__ = __imul__ = _RaiseReadOnly
+  append = extend = insert = pop = remove = reverse = sort = _RaiseReadOnly
+
+  # Copies are regular, modifiable lists.
+  def __copy__(self):
+    return list(self)
+
+  def __deepcopy__(self, memo):
+    return [copy.deepcopy(item, memo) for item in self]
+
+
+class CompactTimeseries(Timeseries):
+  """A Timeseries which keeps its points in two parallel numeric arrays.
+
+  Values are kept as doubles, with missing (None) values stored as NaN, and
+  timestamps as integers. As long as only integer values were added, values
+  are returned as integers, so results match the ones of Timeseries. Since
+  they are stored as doubles, integers above 2**53 lose precision.
+
+  Compared to a list of [value, timestamp] pairs this takes a fraction of the
+  memory. The operations are not vectorized: apart from the slicing done by
+  FilterRange and Normalize, which locate the points of every interval by
+  bisection since timestamps are sorted, they still go over the points one by
+  one in Python, so they are only moderately faster than the ones of
+  Timeseries (and Mean is not faster at all).
+
+  The data attribute is still available, but it's a read-only copy of the
+  points: the points can be replaced by assigning to it, but modifying it in
+  place raises a TypeError.
+  """
+
+  def __init__(self, initializer=None):
+    """Create a timeseries with an optional initializer.
+
+    Args:
+      initializer: An optional Timeseries or CompactTimeseries to clone.
+
+    Raises:
+      RuntimeError: If initializer is not understood.
+    """
+    self._values = array.array("d")
+    self._timestamps = array.array("l")
+    # Whether all the values are integers (or None).
+    self._integral = True
+    if initializer is None:
+      return
+    # pylint: disable=protected-access
+    if isinstance(initializer, CompactTimeseries):
+      self._values = array.array("d", initializer._values)
+      self._timestamps = array.array("l", initializer._timestamps)
+      self._integral = initializer._integral
+      return
+    # pylint: enable=protected-access
+    if isinstance(initializer, Timeseries):
+      self.MultiAppend(initializer.data)
+      return
+    raise RuntimeError("Unrecognized initializer.")
+
+  @staticmethod
+  def _IsNone(value):
+    # NaN is the only value which is not equal to itself.
+    return value != value  # pylint: disable=comparison-with-itself
+
+  @staticmethod
+  def _IsIntegral(value):
+    return value is None or isinstance(value, (int, long))
+
+  @property
+  def data(self):
+    convert = int if self._integral else float
+    # pylint: disable=comparison-with-itself
+    return _ReadOnlyList(
+        _ReadOnlyList([None if v != v else convert(v), t])
+        for v, t in itertools.izip(self._values, self._timestamps))
+    # pylint: enable=comparison-with-itself
+
+  @data.setter
+  def data(self, points):
+    self._values = array.array("d")
+    self._timestamps = array.array("l")
+    self._integral = True
+    self.MultiAppend(points)
+
+  def __len__(self):
+    return len(self._timestamps)
+
+  def Append(self, value, timestamp):
+    """Adds value at timestamp.
+
+    Values must be added in order of increasing timestamp.
+
+    Args:
+      value: An observed value.
+      timestamp: The timestamp at which value was observed.
+
+    Raises:
+      RuntimeError: If timestamp is smaller than the previous timstamp.
+    """
+    timestamp = self._NormalizeTime(timestamp)
+    if self._timestamps and timestamp < self._timestamps[-1]:
+      raise RuntimeError("Next timestamp must be larger.")
+    self._values.append(_NAN if value is None else value)
+    self._timestamps.append(timestamp)
+    self._integral = self._integral and self._IsIntegral(value)
+
+  def MultiAppend(self, value_timestamp_pairs):
+    """Adds multiple value<->timestamp pairs.
+
+    Args:
+      value_timestamp_pairs: Tuples of (value, timestamp).
+
+    Raises:
+      RuntimeError: If the timestamps are not increasing.
+    """
+    values = array.array("d")
+    timestamps = array.array("l")
+    integral = self._integral
+    for value, timestamp in value_timestamp_pairs:
+      values.append(_NAN if value is None else value)
+      timestamps.append(self._NormalizeTime(timestamp))
+      integral = integral and self._IsIntegral(value)
+
+    if not timestamps:
+      return
+    if ((self._timestamps and timestamps[0] < self._timestamps[-1]) or
+        any(itertools.imap(operator.gt, timestamps,
+                           itertools.islice(timestamps, 1, None)))):
+      raise RuntimeError("Next timestamp must be larger.")
+
+    self._values.extend(values)
+    self._timestamps.extend(timestamps)
+    self._integral = integral
+
+  def _Slice(self, start, stop):
+    self._values = self._values[start:stop]
+    self._timestamps = self._timestamps[start:stop]
+
+  def FilterRange(self, start_time=None, stop_time=None):
+    """Filter the series to lie between start_time and stop_time.
+
+    Args:
+      start_time: If set, timestamps before start_time will be dropped.
+      stop_time: If set, timestamps at or past stop_time will be dropped.
+    """
+    start = 0
+    if start_time is not None:
+      start = bisect.bisect_left(self._timestamps,
+                                 self._NormalizeTime(start_time))
+    stop = len(self._timestamps)
+    if stop_time is not None:
+      stop = bisect.bisect_left(self._timestamps,
+                                self._NormalizeTime(stop_time), start)
+    self._Slice(start, stop)
+
+  def Normalize(self, period, start_time, stop_time, mode=NORMALIZE_MODE_GAUGE):
+    """Normalize the series to have a fixed period over a fixed time range.
+
+    See Timeseries.Normalize for the description of the modes.
+
+    Args:
+      period: The desired time between points. Should be an rdfvalue.Duration or
+        a count of microseconds.
+      start_time: The first timestamp will be at start_time. Should be an
+        rdfvalue.RDFDatetime or a count of microseconds since epoch.
+      stop_time: The last timestamp will be at stop_time - period. Should be an
+        rdfvalue.RDFDatetime or a count of microseconds since epoch.
+      mode: The type of normalization to perform. May be NORMALIZE_MODE_GAUGE or
+        NORMALIZE_MODE_COUNTER.
+
+    Raises:
+      RuntimeError: In case the sequence values are misordered.
+    """
+    period = self._NormalizeTime(period)
+    start_time = self._NormalizeTime(start_time)
+    stop_time = self._NormalizeTime(stop_time)
+    if not self._timestamps:
+      return
+
+    self.FilterRange(start_time, stop_time)
+
+    values = self._values
+    if mode != NORMALIZE_MODE_GAUGE and any(
+        itertools.imap(operator.gt, values, itertools.islice(values, 1, None))):
+      raise RuntimeError("Next value must not be smaller.")
+
+    new_timestamps = array.array("l", xrange(start_time, stop_time, period))
+    new_values = array.array("d")
+    last_value = _NAN
+    lo = 0
+    for timestamp in new_timestamps:
+      hi = bisect.bisect_left(self._timestamps, timestamp + period, lo)
+      if mode == NORMALIZE_MODE_GAUGE:
+        if hi > lo:
+          new_values.append(sum(values[lo:hi]) / (hi - lo))
+        else:
+          new_values.append(_NAN)
+      else:
+        if hi > lo:
+          last_value = values[hi - 1]
+        new_values.append(last_value)
+      lo = hi
+
+    self._values = new_values
+    self._timestamps = new_timestamps
+    if mode == NORMALIZE_MODE_GAUGE:
+      self._integral = False
+
+  def MakeIncreasing(self):
+    """Makes the time series increasing.
+
+    See Timeseries.MakeIncreasing for the assumptions this makes.
+    """
+    values = self._values
+    # Indices of the points where the counter has been reset.
+    resets = [
+        i + 1
+        for i, (prev, cur) in enumerate(
+            itertools.izip(values, itertools.islice(values, 1, None)))
+        if prev and prev > cur
+    ]
+    if not resets:
+      return
+
+    new_values = values[:resets[0]]
+    offset = 0
+    for start, stop in itertools.izip(resets, resets[1:] + [len(values)]):
+      offset += values[start - 1]
+      new_values.extend([v + offset for v in values[start:stop]])
+    self._values = new_values
+
+  def ToDeltas(self):
+    """Convert the sequence to the sequence of differences between points.
+
+    The value of each point v[i] is replaced by v[i+1] - v[i], except for the
+    last point which is dropped.
+    """
+    values = self._values
+    self._values = array.array(
+        "d",
+        itertools.imap(operator.sub, itertools.islice(values, 1, None), values))
+    self._timestamps = self._timestamps[:-1]
+
+  def Add(self, other):
+    """Add other to self pointwise.
+
+    Args:
+      other: The Timeseries or CompactTimeseries to add to self.
+
+    Raises:
+      RuntimeError: other does not contain the same timestamps as self.
+    """
+    if not isinstance(other, CompactTimeseries):
+      other = CompactTimeseries(other)
+
+    if len(self) != len(other):
+      raise RuntimeError("Can only add series of identical lengths.")
+    # pylint: disable=protected-access
+    if self._timestamps != other._timestamps:
+      raise RuntimeError("Timestamp mismatch.")
+
+    is_none = self._IsNone
+    self._values = array.array("d", [
+        v1 + v2 if not (is_none(v1) or is_none(v2)) else
+        (v2 if is_none(v1) else v1)
+        for v1, v2 in itertools.izip(self._values, other._values)
+    ])
+    self._integral = self._integral and other._integral
+    # pylint: enable=protected-access
+
+  def Rescale(self, multiplier):
+    """Multiply pointwise by multiplier."""
+    self._values = array.array("d", [v * multiplier for v in self._values])
+    self._integral = self._integral and self._IsIntegral(multiplier)
+
+  def Mean(self):
+    """Return the arithmatic mean of all values."""
+    values = [v for v in self._values if not self._IsNone(v)]
+    if not values:
+      return None
+    if self._integral:
+      return int(sum(values)) // len(values)
+    return sum(values) / len(values)
@@ -8,8 +8,10 @@ from grr.lib import timeseries
 
 class TimeseriesTest(test_lib.GRRBaseTest):
 
+  timeseries_cls = timeseries.Timeseries
+
   def makeSeries(self):
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(1, 101):
       s.Append(i, (i + 5) * 10000)
     return s
@@ -32,7 +34,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual([9.5, 100000], s.data[0])
     self.assertEqual([49.5, 500000], s.data[-1])
 
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(0, 1000):
       s.Append(0.5, i * 10)
     s.Normalize(200, 5000, 10000)
@@ -40,7 +42,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertListEqual(s.data[0], [0.5, 5000])
     self.assertListEqual(s.data[24], [0.5, 9800])
 
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(0, 1000):
       s.Append(i, i * 10)
     s.Normalize(200, 5000, 10000, mode=timeseries.NORMALIZE_MODE_COUNTER)
@@ -56,7 +58,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual([1, 60000], s.data[0])
     self.assertEqual([1, 1040000], s.data[-1])
 
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(0, 1000):
       s.Append(i, i * 1e6)
     s.Normalize(
@@ -69,7 +71,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertListEqual(s.data[23], [20, int(960 * 1e6)])
 
   def testNormalizeFillsGapsWithNone(self):
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(21, 51):
       s.Append(i, (i + 5) * 10000)
     for i in range(81, 101):
@@ -82,7 +84,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual([None, 1100000], s.data[-1])
 
   def testMakeIncreasing(self):
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     for i in range(0, 5):
       s.Append(i, i * 1000)
     for i in range(0, 5):
@@ -94,10 +96,10 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual([8, 10000], s.data[-1])
 
   def testAddRescale(self):
-    s1 = timeseries.Timeseries()
+    s1 = self.timeseries_cls()
     for i in range(0, 5):
       s1.Append(i, i * 1000)
-    s2 = timeseries.Timeseries()
+    s2 = self.timeseries_cls()
     for i in range(0, 5):
       s2.Append(2 * i, i * 1000)
     s1.Add(s2)
@@ -110,7 +112,7 @@ class TimeseriesTest(test_lib.GRRBaseTest):
       self.assertEqual(i, s1.data[i][0])
 
   def testMean(self):
-    s = timeseries.Timeseries()
+    s = self.timeseries_cls()
     self.assertEqual(None, s.Mean())
 
     s = self.makeSeries()
@@ -118,6 +120,124 @@ class TimeseriesTest(test_lib.GRRBaseTest):
     self.assertEqual(50, s.Mean())
 
 
+class CompactTimeseriesTest(TimeseriesTest):
+
+  timeseries_cls = timeseries.CompactTimeseries
+
+  def testValueTypesArePreserved(self):
+    s = self.makeSeries()
+    self.assertIsInstance(s.data[0][0], int)
+    s.ToDeltas()
+    self.assertIsInstance(s.data[0][0], int)
+    s.Rescale(0.5)
+    self.assertEqual(s.data[0], [0.5, 60000])
+
+    s = self.makeSeries()
+    s.Normalize(10 * 10000, 100000, 600000)
+    self.assertIsInstance(s.data[0][0], float)
+
+  def testInitializeFromTimeseries(self):
+    s = timeseries.Timeseries()
+    for i in range(0, 5):
+      s.Append(i, i * 1000)
+    s.Append(None, 5000)
+
+    compact = timeseries.CompactTimeseries(s)
+    self.assertEqual(compact.data, s.data)
+    self.assertEqual(timeseries.Timeseries(compact).data, s.data)
+
+  def testDataCanBeReplaced(self):
+    s = self.makeSeries()
+    s.data = [[1, 1000], [None, 2000]]
+    self.assertEqual(s.data, [[1, 1000], [None, 2000]])
+
+    with self.assertRaises(RuntimeError):
+      s.data = [[1, 2000], [2, 1000]]
+
+  def testDataIsReadOnly(self):
+    s = self.makeSeries()
+    with self.assertRaises(TypeError):
+      s.data[0][0] = 2
+    with self.assertRaises(TypeError):
+      s.data.append([1, 2000000])
+    with self.assertRaises(TypeError):
+      del s.data[0]
+
+    # Copies can be modified.
+    data = timeseries.Timeseries(s).data
+    data[0][0] = 2
+    self.assertEqual(s.data[0], [1, 60000])
+
+  def testMisorderedValuesAreRejected(self):
+    s = self.makeSeries()
+    with self.assertRaises(RuntimeError):
+      s.Append(1, 0)
+    with self.assertRaises(RuntimeError):
+      s.MultiAppend([(1, 2000000), (2, 1000000)])
+    self.assertEqual(100, len(s.data))
+
+    s = self.timeseries_cls()
+    s.MultiAppend([(2, 1000), (1, 2000)])
+    with self.assertRaises(RuntimeError):
+      s.Normalize(1000, 0, 3000, mode=timeseries.NORMALIZE_MODE_COUNTER)
+
+  def testAddTreatsNoneAsZero(self):
+    s1 = self.timeseries_cls()
+    s1.MultiAppend([(None, 1000), (1, 2000), (None, 3000)])
+    s2 = timeseries.Timeseries()
+    s2.MultiAppend([(None, 1000), (None, 2000), (2, 3000)])
+
+    s1.Add(s2)
+    self.assertEqual(s1.data, [[None, 1000], [1, 2000], [2, 3000]])
+
+    s2.Append(3, 4000)
+    with self.assertRaises(RuntimeError):
+      s1.Add(s2)
+
+  def testMakeIncreasingHandlesMultipleResets(self):
+    s = self.timeseries_cls()
+    s.MultiAppend([(1, 0), (3, 1), (2, 2), (5, 3), (1, 4), (4, 5)])
+    s.MakeIncreasing()
+    self.assertEqual([v for v, _ in s.data], [1, 3, 5, 8, 9, 12])
+
+
+class TimeseriesBenchmark(test_lib.AverageMicroBenchmarks):
+  """Compares Timeseries and CompactTimeseries on 200k point series."""
+
+  NUM_POINTS = 200000
+
+  def _MakeSeries(self, cls):
+    s = cls()
+    # A counter which is reset every 20k points, sampled every 10 seconds.
+    s.MultiAppend((i % 20000, i * 10000000) for i in xrange(self.NUM_POINTS))
+    return s
+
+  def _TimeOperation(self, cls, name, operation):
+    series = []
+    self.TimeIt(
+        lambda: operation(series[0]),
+        name="%s %s" % (cls.__name__, name),
+        pre=lambda: series.append(self._MakeSeries(cls)),
+        repetitions=1)
+
+  @test_lib.SetLabel("benchmark")
+  def testOperations(self):
+    end = self.NUM_POINTS * 10000000
+    operations = [
+        ("Normalize (gauge)", lambda s: s.Normalize(300000000, 0, end)),
+        ("MakeIncreasing + Normalize (counter)", lambda s: (
+            s.MakeIncreasing(),
+            s.Normalize(300000000, 0, end,
+                        mode=timeseries.NORMALIZE_MODE_COUNTER))),
+        ("ToDeltas", lambda s: s.ToDeltas()),
+        ("Add", lambda s: s.Add(s)),
+        ("Mean", lambda s: s.Mean()),
+    ]
+    for name, operation in operations:
+      for cls in [timeseries.Timeseries, timeseries.CompactTimeseries]:
+        self._TimeOperation(cls, name, operation)
+
+
 def main(argv):
   test_lib.main(argv)
 
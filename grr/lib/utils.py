@@ -15,6 +15,7 @@ import re
 import shutil
 import socket
 import struct
+import sys
 import tarfile
 import tempfile
 import threading
@@ -757,6 +758,63 @@ def Grouper(iterable, n):
     yield items
 
 
+def Prefetch(iterable, max_pages=2, page_size=100):
+  """Iterates over iterable in a background thread.
+
+  The background thread keeps up to max_pages pages of page_size items ahead
+  of the caller, so that slow reads (and decoding) done by iterable overlap with
+  the processing of the items by the caller. Items are yielded in order, and
+  exceptions raised by iterable are reraised in the caller.
+
+  Args:
+    iterable: The iterable to read ahead. It must be safe to iterate over it in
+      a different thread.
+    max_pages: The maximum number of pages read ahead.
+    page_size: The number of items in a page.
+
+  Yields:
+    The items of iterable.
+  """
+  pages = Queue.Queue(maxsize=max_pages)
+  stopped = threading.Event()
+
+  def Put(item):
+    """Queues item, returns False if the caller stopped reading instead."""
+    while not stopped.is_set():
+      try:
+        pages.put(item, timeout=0.1)
+        return True
+      except Queue.Full:
+        pass
+    return False
+
+  def ReadPages():
+    try:
+      for page in Grouper(iterable, page_size):
+        if not Put((page, None)):
+          return
+      Put((None, None))
+    except Exception:  # pylint: disable=broad-except
+      Put((None, sys.exc_info()))
+
+  reader = threading.Thread(target=ReadPages, name="Prefetch")
+  reader.daemon = True
+  reader.start()
+
+  try:
+    while True:
+      page, exc_info = pages.get()
+      if exc_info:
+        raise exc_info[0], exc_info[1], exc_info[2]
+      if page is None:
+        return
+      for item in page:
+        yield item
+  finally:
+    # If the caller stops early, the reader thread stops at its next put.
+    stopped.set()
+
+
 def EncodeReasonString(reason):
   return base64.urlsafe_b64encode(SmartStr(reason))
 
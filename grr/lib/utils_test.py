@@ -3,6 +3,7 @@
 
 
 import os
+import Queue
 import StringIO
 import tarfile
 import threading
@@ -320,6 +321,67 @@ class UtilsTest(test_lib.GRRBaseTest):
 
     self.assertEqual(concat(prefix="a", suffix="b"), "a,b")
 
+  def testPrefetch(self):
+    self.assertEqual(
+        list(utils.Prefetch(xrange(1000), max_pages=2, page_size=7)),
+        range(1000))
+    self.assertEqual(list(utils.Prefetch([])), [])
+
+    def Failing():
+      yield 1
+      raise ValueError("read failed")
+
+    with self.assertRaises(ValueError):
+      list(utils.Prefetch(Failing(), page_size=1))
+
+  def testPrefetchStopsReadingWhenCallerStops(self):
+    read = []
+    done = threading.Event()
+
+    def Reader():
+      try:
+        for i in xrange(1000):
+          read.append(i)
+          yield i
+      finally:
+        done.set()
+
+    prefetched = utils.Prefetch(Reader(), max_pages=2, page_size=10)
+    self.assertEqual(prefetched.next(), 0)
+    prefetched.close()
+
+    self.assertTrue(done.wait(10))
+    # At most the pages in the queue, the page being read and the page put
+    # after the caller stopped are read.
+    self.assertLessEqual(len(read), 50)
+
+  def testPrefetchThreadExitsWhenCallerStops(self):
+    last_page_read = threading.Event()
+    stopped = threading.Event()
+    queue_cls = Queue.Queue
+
+    class DelayedQueue(queue_cls):
+
+      def put(self, item, *args, **kwargs):
+        page, _ = item
+        if page == [3]:
+          # The last page is queued after the caller stopped.
+          last_page_read.set()
+          stopped.wait(10)
+        queue_cls.put(self, item, *args, **kwargs)
+
+    threads = set(threading.enumerate())
+    with utils.Stubber(Queue, "Queue", DelayedQueue):
+      prefetched = utils.Prefetch(xrange(1, 4), max_pages=1, page_size=1)
+      self.assertEqual(prefetched.next(), 1)
+    self.assertTrue(last_page_read.wait(10))
+    prefetched.close()
+    stopped.set()
+
+    for thread in set(threading.enumerate()) - threads:
+      thread.join(10)
+      self.assertFalse(thread.is_alive())
+
 
 class RollingMemoryStreamTest(test_lib.GRRBaseTest):
   """Tests for RollingMemoryStream."""
@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+"""Benchmarks a local GRR server against a fleet of simulated clients.
+
+This starts a frontend and a worker in this process, using the configured data
+store, and a number of simulated clients in separate processes. The clients
+talk to the frontend over HTTP like real clients do, but answer client actions
+with the canned responses of the test action mocks.
+
+Once a client is enrolled, the benchmark starts a mix of Interrogate and
+FileFinder flows on it, and it is picked up by a hunt through the foreman. When
+all the flows are done, a JSON report is written with the frontend bundle rate,
+flow completion latency percentiles and data store operation counts.
+
+The data store is selected through the config, e.g.:
+
+  python grr/tools/fleet_benchmark.py --benchmark_clients 50 \
+    -p Datastore.implementation=SqliteDataStore \
+    -p Datastore.location=/tmp/fleet_benchmark
+"""
+
+
+import json
+import multiprocessing
+import Queue
+import sys
+import threading
+import time
+
+
+import logging
+
+# pylint: disable=unused-import,g-bad-import-order
+from grr.lib import server_plugins
+# pylint: enable=unused-import,g-bad-import-order
+
+from grr.client import client_utils
+from grr.client import comms
+from grr.client.client_actions import searching
+from grr.config import contexts
+from grr.lib import access_control
+from grr.lib import action_mocks
+from grr.lib import aff4
+from grr.lib import config_lib
+from grr.lib import data_store
+from grr.lib import flags
+from grr.lib import flow
+from grr.lib import hunts
+from grr.lib import rdfvalue
+from grr.lib import server_startup
+from grr.lib import stats
+from grr.lib import worker
+from grr.lib.rdfvalues import client as rdf_client
+from grr.lib.rdfvalues import crypto as rdf_crypto
+from grr.lib.rdfvalues import file_finder as rdf_file_finder
+from grr.lib.rdfvalues import flows as rdf_flows
+from grr.lib.rdfvalues import paths as rdf_paths
+from grr.server import foreman as rdf_foreman
+from grr.tools import http_server
+
+flags.DEFINE_integer("benchmark_clients", 10,
+                     "Number of simulated clients to run.")
+
+flags.DEFINE_integer("benchmark_processes", 2,
+                     "Number of processes to run the simulated clients in.")
+
+flags.DEFINE_list("benchmark_workloads", ["interrogate", "file_finder", "hunt"],
+                  "The workloads to run on every client.")
+
+flags.DEFINE_integer("benchmark_flows_per_client", 1,
+                     "Number of flows of each workload to start per client.")
+
+flags.DEFINE_list("benchmark_file_finder_paths", ["/etc/passwd"],
+                  "Paths the file finder workloads stat on the clients.")
+
+flags.DEFINE_integer("benchmark_timeout", 600,
+                     "Seconds to wait for all the flows to complete.")
+
+flags.DEFINE_string("benchmark_output", "",
+                    "File to write the JSON report to. Defaults to stdout.")
+
+WORKLOADS = ["interrogate", "file_finder", "hunt"]
+
+# The data store methods whose calls are counted.
+DATA_STORE_OPS = [
+    "DBSubjectLock", "DeleteAttributes", "DeleteSubject", "DeleteSubjects",
+    "MultiDeleteAttributes", "MultiResolvePrefix", "MultiSet", "Resolve",
+    "ResolveMulti", "ResolvePrefix", "ResolveRow", "ScanAttributes", "Set"
+]
+
+
+class FleetClientMock(action_mocks.InterrogatedClient):
+  """A client mock answering all the actions the benchmark workloads use."""
+
+  def __init__(self, *args, **kwargs):
+    super(FleetClientMock, self).__init__(searching.Grep, *args, **kwargs)
+    self.InitializeClient()
+
+
+class SimulatedClientWorker(comms.GRRClientWorker):
+  """A client worker which answers messages with a client action mock.
+
+  Unlike the real worker, this starts no nanny or stats threads, so that many
+  simulated clients can share a process.
+  """
+
+  def __init__(self, client_mock):
+    # pylint: disable=super-init-not-called
+    self.client_mock = client_mock
+    self._in_queue = []
+    self._out_queue = []
+    self._out_queue_size = 0
+    self._is_active = False
+    self.suspended_actions = {}
+    self.sent_bytes_per_flow = {}
+    self.lock = threading.RLock()
+
+  def __del__(self):
+    pass
+
+  def MemoryExceeded(self):
+    return False
+
+  def HandleMessage(self, message):
+    """Queues the responses of the client mock for the server."""
+    response_id = 1
+    status_sent = False
+    for response in self.client_mock.HandleMessage(message) or []:
+      if not isinstance(response, rdf_flows.GrrMessage):
+        if isinstance(response, rdf_flows.GrrStatus):
+          message_type = rdf_flows.GrrMessage.Type.STATUS
+        elif isinstance(response, rdf_client.Iterator):
+          message_type = rdf_flows.GrrMessage.Type.ITERATOR
+        else:
+          message_type = rdf_flows.GrrMessage.Type.MESSAGE
+
+        response = rdf_flows.GrrMessage(
+            session_id=message.session_id,
+            name=message.name,
+            response_id=response_id,
+            request_id=message.request_id,
+            task_id=message.task_id,
+            payload=response,
+            type=message_type)
+
+      response_id = response.response_id + 1
+      if response.type == rdf_flows.GrrMessage.Type.STATUS:
+        status_sent = True
+      self.QueueResponse(response, priority=message.priority)
+
+    if not status_sent:
+      self.QueueResponse(
+          rdf_flows.GrrMessage(
+              session_id=message.session_id,
+              name=message.name,
+              response_id=response_id,
+              request_id=message.request_id,
+              task_id=message.task_id,
+              payload=rdf_flows.GrrStatus(),
+              type=rdf_flows.GrrMessage.Type.STATUS),
+          priority=message.priority)
+
+
+def RunClients(client_count, poll_interval, ready, stop, enrolled_queue):
+  """Runs a number of simulated clients until stop is set.
+
+  Args:
+    client_count: The number of clients to run.
+    poll_interval: The time to sleep between polls of all the clients.
+    ready: A multiprocessing.Event set once the server is up.
+    stop: A multiprocessing.Event signalling the clients to stop.
+    enrolled_queue: A multiprocessing.Queue the client ids are put on once the
+      clients are enrolled.
+  """
+  clients = []
+  for _ in range(client_count):
+    key = rdf_crypto.RSAPrivateKey.GenerateKey(
+        bits=config_lib.CONFIG["Client.rsa_key_length"])
+    client_worker = SimulatedClientWorker(FleetClientMock())
+    clients.append(
+        comms.GRRHTTPClient(
+            ca_cert=config_lib.CONFIG["CA.certificate"],
+            worker=client_worker,
+            private_key=key))
+
+  nanny_controller = client_utils.NannyController()
+  enrolled = set()
+  ready.wait()
+  while not stop.is_set():
+    nanny_controller.Heartbeat()
+    for client in clients:
+      response = client.RunOnce()
+      if response.code == 200 and client not in enrolled:
+        enrolled.add(client)
+        client.SendForemanRequest()
+        enrolled_queue.put(str(client.communicator.common_name))
+
+    time.sleep(poll_interval)
+
+
+class DataStoreOpCounter(object):
+  """Counts the calls made to the data store.
+
+  Only the outermost calls are counted, so that a method implemented in terms
+  of another one is counted once.
+  """
+
+  def __init__(self, db, methods=None):
+    self.db = db
+    self.methods = methods or DATA_STORE_OPS
+    self.counts = dict((method, 0) for method in self.methods)
+    self.local = threading.local()
+    self.lock = threading.Lock()
+
+  def _Wrap(self, method, original):
+
+    def Wrapper(*args, **kwargs):
+      depth = getattr(self.local, "depth", 0)
+      if depth == 0 and not getattr(self.local, "paused", False):
+        with self.lock:
+          self.counts[method] += 1
+
+      self.local.depth = depth + 1
+      try:
+        return original(*args, **kwargs)
+      finally:
+        self.local.depth = depth
+
+    return Wrapper
+
+  def Start(self):
+    for method in self.methods:
+      setattr(self.db, method, self._Wrap(method, getattr(self.db, method)))
+
+  def Stop(self):
+    for method in self.methods:
+      delattr(self.db, method)
+
+  def Pause(self):
+    """Stops counting the calls made from the calling thread."""
+    self.local.paused = True
+
+  def Resume(self):
+    self.local.paused = False
+
+
+def Percentile(values, percentile):
+  """Returns the nearest-rank percentile of a sorted list of values."""
+  if not values:
+    return None
+
+  rank = max(int(round(percentile / 100.0 * len(values))), 1)
+  return values[rank - 1]
+
+
+class FleetBenchmark(object):
+  """Runs the benchmark workloads against a local frontend and worker."""
+
+  # The time to wait between polls of the pending flows. This bounds the
+  # resolution of the measured flow latencies.
+  POLL_INTERVAL = 0.1
+
+  def __init__(self,
+               client_count,
+               process_count=1,
+               workloads=None,
+               flows_per_client=1,
+               file_finder_paths=None,
+               client_poll_interval=0.1,
+               token=None):
+    """Constructor.
+
+    Args:
+      client_count: The number of simulated clients.
+      process_count: The number of processes the clients are spread over.
+      workloads: A list of workload names out of WORKLOADS.
+      flows_per_client: The number of Interrogate and FileFinder flows to start
+        on every client.
+      file_finder_paths: The paths file finder flows stat.
+      client_poll_interval: The time the clients sleep between polls.
+      token: The security token to use.
+
+    Raises:
+      ValueError: An unknown workload was requested.
+    """
+    self.client_count = client_count
+    self.process_count = max(min(process_count, client_count), 1)
+    self.workloads = workloads or WORKLOADS
+    for workload in self.workloads:
+      if workload not in WORKLOADS:
+        raise ValueError("Unknown workload: %s" % workload)
+
+    self.flows_per_client = flows_per_client
+    self.file_finder_paths = file_finder_paths or ["/etc/passwd"]
+    self.client_poll_interval = client_poll_interval
+    self.token = token
+
+    self.hunt_urn = None
+    # Maps flow URNs (or, for hunts, symlinks to them) to their workload.
+    self.pending = {}
+    self.latencies = dict((workload, []) for workload in self.workloads)
+    self.states = dict((workload, {}) for workload in self.workloads)
+
+  def _FileFinderArgs(self):
+    return rdf_file_finder.FileFinderArgs(
+        paths=self.file_finder_paths,
+        pathtype=rdf_paths.PathSpec.PathType.OS)
+
+  def _StartHunt(self):
+    with hunts.GRRHunt.StartHunt(
+        hunt_name="GenericHunt",
+        flow_runner_args=rdf_flows.FlowRunnerArgs(flow_name="FileFinder"),
+        flow_args=self._FileFinderArgs(),
+        client_rule_set=rdf_foreman.ForemanClientRuleSet(),
+        client_limit=0,
+        client_rate=0,
+        token=self.token) as hunt:
+      hunt.Run()
+      self.hunt_urn = hunt.urn
+
+  def _StartFlows(self, client_id):
+    """Starts the workloads on a newly enrolled client."""
+    for _ in range(self.flows_per_client):
+      if "interrogate" in self.workloads:
+        urn = flow.GRRFlow.StartFlow(
+            client_id=client_id, flow_name="Interrogate", token=self.token)
+        self.pending[urn] = "interrogate"
+
+      if "file_finder" in self.workloads:
+        urn = flow.GRRFlow.StartFlow(
+            client_id=client_id,
+            flow_name="FileFinder",
+            args=self._FileFinderArgs(),
+            token=self.token)
+        self.pending[urn] = "file_finder"
+
+    if self.hunt_urn:
+      # The foreman starts the hunt flow once it sees the client, and links it
+      # from the client's flows.
+      self.pending[client_id.Add("flows").Add(self.hunt_urn.Basename() +
+                                              ":hunt")] = "hunt"
+
+  def _CheckPendingFlows(self):
+    """Records the latency of all the flows which completed since last time."""
+    now = rdfvalue.RDFDatetime.Now().AsMicroSecondsFromEpoch()
+    for urn, workload in self.pending.items():
+      try:
+        flow_obj = aff4.FACTORY.Open(
+            urn, aff4_type=flow.GRRFlow, mode="r", token=self.token)
+      except aff4.InstantiationError:
+        # The hunt has not started its flow on the client yet.
+        continue
+
+      if flow_obj.GetRunner().IsRunning():
+        continue
+
+      del self.pending[urn]
+      create_time = flow_obj.context.create_time.AsMicroSecondsFromEpoch()
+      self.latencies[workload].append((now - create_time) / 1e6)
+      state = str(flow_obj.context.state)
+      self.states[workload][state] = self.states[workload].get(state, 0) + 1
+
+  def _RunWorker(self, stop):
+    grr_worker = worker.GRRWorker(token=self.token)
+    while not stop.is_set():
+      if not grr_worker.RunOnce():
+        time.sleep(0.05)
+
+  def _Report(self, duration, bundles, op_counter):
+    """Builds the report of a run."""
+    report = {
+        "clients": self.client_count,
+        "processes": self.process_count,
+        "data_store": data_store.DB.__class__.__name__,
+        "duration": duration,
+        "bundles": bundles,
+        "bundles_per_second": bundles / duration if duration else 0,
+        "pending_flows": len(self.pending),
+        "flows": {},
+        "data_store_ops": op_counter.counts,
+        "data_store_ops_total": sum(op_counter.counts.values()),
+    }
+
+    for workload in self.workloads:
+      latencies = sorted(self.latencies[workload])
+      report["flows"][workload] = {
+          "completed": len(latencies),
+          "states": self.states[workload],
+          "latency_p50": Percentile(latencies, 50),
+          "latency_p90": Percentile(latencies, 90),
+          "latency_p99": Percentile(latencies, 99),
+          "latency_max": latencies[-1] if latencies else None,
+      }
+
+    return report
+
+  def Run(self, timeout=600):
+    """Runs the benchmark.
+
+    Args:
+      timeout: The number of seconds to wait for all the flows to complete.
+
+    Returns:
+      A dict with the results of the run.
+    """
+    if "hunt" in self.workloads:
+      self._StartHunt()
+
+    # The clients connect to Client.server_urls, which must point to the
+    # frontend's bind address.
+    httpd = http_server.CreateServer()
+
+    # The client processes are forked before any server thread is started.
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    enrolled_queue = multiprocessing.Queue()
+    processes = []
+    for i in range(self.process_count):
+      count = (self.client_count + i) // self.process_count
+      process = multiprocessing.Process(
+          target=RunClients,
+          args=(count, self.client_poll_interval, ready, stop, enrolled_queue))
+      process.daemon = True
+      process.start()
+      processes.append(process)
+
+    op_counter = DataStoreOpCounter(data_store.DB)
+    op_counter.Start()
+    op_counter.Pause()
+    bundles_start = stats.STATS.GetMetricValue("grr_frontendserver_handle_num")
+
+    server_stop = threading.Event()
+    server_threads = [
+        threading.Thread(target=httpd.serve_forever),
+        threading.Thread(target=self._RunWorker, args=(server_stop,))
+    ]
+    for thread in server_threads:
+      thread.daemon = True
+      thread.start()
+
+    start_time = time.time()
+    ready.set()
+    try:
+      enrolled_count = 0
+      while time.time() - start_time < timeout:
+        while True:
+          try:
+            client_id = enrolled_queue.get_nowait()
+          except Queue.Empty:
+            break
+
+          enrolled_count += 1
+          op_counter.Resume()
+          try:
+            self._StartFlows(rdf_client.ClientURN(client_id))
+          finally:
+            op_counter.Pause()
+
+        self._CheckPendingFlows()
+        if enrolled_count == self.client_count and not self.pending:
+          break
+
+        time.sleep(self.POLL_INTERVAL)
+
+      duration = time.time() - start_time
+      bundles = (stats.STATS.GetMetricValue("grr_frontendserver_handle_num") -
+                 bundles_start)
+    finally:
+      stop.set()
+      for process in processes:
+        process.join(5)
+        if process.is_alive():
+          process.terminate()
+
+      httpd.shutdown()
+      server_stop.set()
+      for thread in server_threads:
+        thread.join()
+      op_counter.Stop()
+
+    if self.pending:
+      logging.warn("%d flows did not complete within %ss.",
+                   len(self.pending), timeout)
+
+    return self._Report(duration, bundles, op_counter)
+
+
+def main(unused_argv):
+  """Main."""
+  # The simulated clients use the test action mocks.
+  config_lib.CONFIG.AddContext(contexts.TEST_CONTEXT,
+                               "Context applied when we run tests.")
+  server_startup.Init()
+
+  token = access_control.ACLToken(
+      username="GRRFleetBenchmark", reason="Running the fleet benchmark.")
+  benchmark = FleetBenchmark(
+      flags.FLAGS.benchmark_clients,
+      process_count=flags.FLAGS.benchmark_processes,
+      workloads=flags.FLAGS.benchmark_workloads,
+      flows_per_client=flags.FLAGS.benchmark_flows_per_client,
+      file_finder_paths=flags.FLAGS.benchmark_file_finder_paths,
+      token=token)
+  report = benchmark.Run(timeout=flags.FLAGS.benchmark_timeout)
+
+  output = json.dumps(report, indent=2, sort_keys=True)
+  if flags.FLAGS.benchmark_output:
+    with open(flags.FLAGS.benchmark_output, "wb") as fd:
+      fd.write(output)
+  else:
+    sys.stdout.write(output + "\n")
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
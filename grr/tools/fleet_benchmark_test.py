@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Tests for the fleet benchmark tool."""
+
+
+import portpicker
+
+from grr.lib import config_lib
+from grr.lib import flags
+from grr.lib import front_end
+from grr.lib import key_utils
+from grr.lib import test_lib
+from grr.tools import fleet_benchmark
+
+
+class FleetBenchmarkTest(test_lib.GRRBaseTest):
+  """Runs a small fleet through all the workloads."""
+
+  def setUp(self):
+    super(FleetBenchmarkTest, self).setUp()
+    # Frontend must be initialized to register all the stats counters.
+    front_end.FrontendInit().RunOnce()
+
+  def testAllWorkloadsComplete(self):
+    port = portpicker.PickUnusedPort()
+    # The frontend certificate from the test config may have expired.
+    serial_number = config_lib.CONFIG["Frontend.certificate"].GetSerialNumber()
+    server_certificate = key_utils.MakeCASignedCert(
+        u"GRR Test Server",
+        config_lib.CONFIG["PrivateKeys.server_key"],
+        config_lib.CONFIG["CA.certificate"],
+        config_lib.CONFIG["PrivateKeys.ca_key"],
+        serial_number=serial_number)
+    with test_lib.ConfigOverrider({
+        "Frontend.certificate": server_certificate,
+        "Client.server_serial_number": serial_number,
+        "Frontend.bind_port": port,
+        "Client.server_urls": ["http://127.0.0.1:%d/" % port]
+    }):
+      benchmark = fleet_benchmark.FleetBenchmark(
+          3, process_count=2, token=self.token)
+      report = benchmark.Run(timeout=300)
+
+    self.assertEqual(report["clients"], 3)
+    self.assertEqual(report["pending_flows"], 0)
+    self.assertGreater(report["bundles"], 0)
+    self.assertGreater(report["bundles_per_second"], 0)
+    self.assertGreater(report["data_store_ops"]["MultiSet"], 0)
+    for workload in fleet_benchmark.WORKLOADS:
+      flows = report["flows"][workload]
+      self.assertEqual(flows["completed"], 3)
+      self.assertLessEqual(flows["latency_p50"], flows["latency_p99"])
+      self.assertLessEqual(flows["latency_p99"], flows["latency_max"])
+
+  def testPercentile(self):
+    values = range(1, 101)
+    self.assertEqual(fleet_benchmark.Percentile(values, 50), 50)
+    self.assertEqual(fleet_benchmark.Percentile(values, 99), 99)
+    self.assertEqual(fleet_benchmark.Percentile([3], 90), 3)
+    self.assertIsNone(fleet_benchmark.Percentile([], 50))
+
+
+def main(argv):
+  test_lib.main(argv)
+
+
+if __name__ == "__main__":
+  flags.StartMain(main)
@@ -6,6 +6,7 @@ import errno
 import getpass
 import stat
 import sys
+import threading
 
 
 # pylint: disable=unused-import,g-bad-import-order
@@ -79,6 +80,17 @@ flags.DEFINE_integer("sparse_image_threshold", 1024 * 1024 * 1024,
                      "If a client side file that's not in the datastore yet"
                      " is >= than this size, then store it as a sparse image.")
 
+flags.DEFINE_integer("block_cache_size", 1024,
+                     "Number of file blocks kept in the in-process read cache.")
+
+flags.DEFINE_integer("readahead_blocks", 8,
+                     "How many blocks to read ahead when a file is being read"
+                     " sequentially.")
+
+flags.DEFINE_integer("attribute_cache_ttl", 60,
+                     "Measured in seconds. How long stat results and directory"
+                     " listings are served from the in-process cache.")
+
 flags.DEFINE_string("username", None,
                     "Username to use for client authorization check.")
 
@@ -92,6 +104,9 @@ _DEFAULT_MODE_FILE = 33188
 # Taken from /etc/passwd
 _DEFAULT_MODE_DIRECTORY = 16877
 
+# Block size used for caching objects which do not have their own chunksize.
+_DEFAULT_BLOCK_SIZE = 64 * 1024
+
 
 class GRRFuseDatastoreOnly(object):
   """We implement the FUSE methods in this class."""
@@ -102,12 +117,59 @@ class GRRFuseDatastoreOnly(object):
       "/index/client"
   ]
 
-  def __init__(self, root="/", token=None):
+  def __init__(self,
+               root="/",
+               token=None,
+               block_cache_size=1024,
+               readahead_blocks=8,
+               attribute_cache_ttl=60):
+    """Create a new FUSE layer at the specified aff4 path.
+
+    Args:
+      root: String aff4 path for where we'd like to mount the FUSE layer.
+
+      token: Datastore access token.
+
+      block_cache_size: The maximum number of file blocks kept in the read
+      cache. 0 disables block caching.
+
+      readahead_blocks: How many extra blocks to fetch when a file is being
+      read sequentially.
+
+      attribute_cache_ttl: How long (in seconds) opened objects, stat results
+      and directory listings are reused. 0 disables these caches.
+    """
     self.root = rdfvalue.RDFURN(root)
     self.token = token
     self.default_file_mode = _DEFAULT_MODE_FILE
     self.default_dir_mode = _DEFAULT_MODE_DIRECTORY
 
+    self.readahead_blocks = readahead_blocks
+    self.attribute_cache_ttl = attribute_cache_ttl
+
+    # Blocks of file content keyed by (urn, version, block number). The version
+    # changes whenever the object is written to and Read() checks it against
+    # the data store, so stale blocks are never returned and simply age out of
+    # the LRU.
+    self.block_cache = utils.FastStore(max_size=block_cache_size)
+    self.block_cache_size = block_cache_size
+
+    # Opened aff4 objects, stat dicts and directory listings keyed by path.
+    self.fd_cache = utils.AgeBasedCache(
+        max_size=10000, max_age=attribute_cache_ttl)
+    self.stat_cache = utils.AgeBasedCache(
+        max_size=10000, max_age=attribute_cache_ttl)
+    self.dirent_cache = utils.AgeBasedCache(
+        max_size=1000, max_age=attribute_cache_ttl)
+
+    # The offset at which the last read of each path ended, used to detect
+    # sequential access.
+    self.read_ends = utils.FastStore(max_size=1000)
+
+    # Opened objects are shared between FUSE threads so Seek()/Read() on them
+    # must not be interleaved.
+    self.read_lock = threading.RLock()
+
     try:
       logging.info("Making sure supplied aff4path actually exists....")
       self.getattr(root)
@@ -147,6 +209,53 @@ class GRRFuseDatastoreOnly(object):
         "st_uid": 0
     }
 
+  def _Open(self, urn):
+    """Opens an aff4 object, reusing recently opened objects."""
+    urn = rdfvalue.RDFURN(urn)
+    if self.attribute_cache_ttl <= 0:
+      return aff4.FACTORY.Open(urn, token=self.token)
+
+    try:
+      return self.fd_cache.Get(urn)
+    except KeyError:
+      fd = aff4.FACTORY.Open(urn, token=self.token)
+      self.fd_cache.Put(urn, fd)
+      return fd
+
+  def _OpenCurrent(self, path):
+    """Opens the object at path, reopening it if it was written since cached.
+
+    Args:
+      path: The path of the object relative to the root.
+
+    Returns:
+      An opened aff4 object whose LAST attribute matches the data store, so
+      blocks cached under its version are never stale.
+    """
+    urn = self.root.Add(path)
+    fd = self._Open(urn)
+    if self.attribute_cache_ttl <= 0:
+      return fd
+
+    last, _ = data_store.DB.Resolve(
+        urn, fd.Schema.LAST.predicate, token=self.token)
+    if last is not None and int(last) != int(fd.Get(fd.Schema.LAST) or 0):
+      self.InvalidatePath(path)
+      fd = self._Open(urn)
+
+    return fd
+
+  def InvalidatePath(self, path):
+    """Drops all cached information about the given path."""
+    urn = self.root.Add(path)
+    self.fd_cache.ExpireObject(urn)
+    self.stat_cache.ExpireObject(path)
+    self.dirent_cache.ExpireObject(path)
+    self.read_ends.ExpireObject(urn)
+    for key, _ in self.block_cache:
+      if key[0] == urn:
+        self.block_cache.ExpireObject(key)
+
   def _IsDir(self, path):
     """True if and only if the path has the directory bit set in its mode."""
     return stat.S_ISDIR(int(self.getattr(path)["st_mode"]))
@@ -170,20 +279,26 @@ class GRRFuseDatastoreOnly(object):
     if not self._IsDir(path):
       raise fuse.FuseOSError(errno.ENOTDIR)
 
-    fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
-
-    children = fd.ListChildren()
+    try:
+      names = self.dirent_cache.Get(path)
+    except KeyError:
+      fd = self._Open(self.root.Add(path))
 
-    # Make these special directories unicode to be consistent with the rest of
-    # aff4.
-    for directory in [u".", u".."]:
-      yield directory
+      # Make these special directories unicode to be consistent with the rest
+      # of aff4.
+      names = [u".", u".."]
 
-    # ListChildren returns a generator, so we do the same.
-    for child in children:
       # Filter out any directories we've chosen to ignore.
-      if child.Path() not in self.ignored_dirs:
-        yield child.Basename()
+      for child in fd.ListChildren():
+        if child.Path() not in self.ignored_dirs:
+          names.append(child.Basename())
+
+      if self.attribute_cache_ttl > 0:
+        self.dirent_cache.Put(path, names)
+
+    # We return a generator to stay compatible with the FUSE interface.
+    for name in names:
+      yield name
 
   def Getattr(self, path, fh=None):
     """Performs a stat on a file or directory.
@@ -206,19 +321,30 @@ class GRRFuseDatastoreOnly(object):
     if not path:
       raise fuse.FuseOSError(errno.ENOENT)
 
+    try:
+      return self.stat_cache.Get(path)
+    except KeyError:
+      pass
+
+    result = self._Getattr(path)
+    if self.attribute_cache_ttl > 0:
+      self.stat_cache.Put(path, result)
+    return result
+
+  def _Getattr(self, path):
+    """Computes the stat for a path, bypassing the cache."""
     if path != self.root:
       full_path = self.root.Add(path)
     else:
       full_path = path
 
-    fd = aff4.FACTORY.Open(full_path, token=self.token)
+    fd = self._Open(full_path)
 
     # The root aff4 path technically doesn't exist in the data store, so
     # it is a special case.
     if full_path == "/":
       return self.MakePartialStat(fd)
 
-    fd = aff4.FACTORY.Open(full_path, token=self.token)
     # Grab the stat according to aff4.
     aff4_stat = fd.Get(fd.Schema.STAT)
 
@@ -267,21 +393,89 @@ class GRRFuseDatastoreOnly(object):
     if self._IsDir(path):
       raise fuse.FuseOSError(errno.EISDIR)
 
-    fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
+    fd = self._OpenCurrent(path)
 
     # If the object has Read() and Seek() methods, let's use them.
-    if all((hasattr(fd, "Read"), hasattr(fd, "Seek"), callable(fd.Read),
-            callable(fd.Seek))):
-      # By default, read the whole file.
-      if length is None:
-        length = fd.Get(fd.Schema.SIZE)
-
-      fd.Seek(offset)
-      return fd.Read(length)
-    else:
+    if not all((hasattr(fd, "Read"), hasattr(fd, "Seek"), callable(fd.Read),
+                callable(fd.Seek))):
       # If we don't have Read/Seek methods, we probably can't read this object.
       raise fuse.FuseOSError(errno.EIO)
 
+    # By default, read the whole file.
+    if length is None:
+      length = fd.Get(fd.Schema.SIZE)
+
+    # Sparse images get their chunks filled in lazily, so their content can't
+    # be cached by version.
+    if (self.block_cache_size <= 0 or
+        isinstance(fd, standard.AFF4SparseImage)):
+      with self.read_lock:
+        fd.Seek(offset)
+        return fd.Read(length)
+
+    return self._ReadCached(fd, length, offset)
+
+  def _ReadCached(self, fd, length, offset):
+    """Reads a range of an object through the block cache."""
+    size = int(fd.Get(fd.Schema.SIZE))
+    length = min(int(length), size - offset)
+    if length <= 0:
+      return ""
+
+    block_size = getattr(fd, "chunksize", _DEFAULT_BLOCK_SIZE)
+    version = int(fd.Get(fd.Schema.LAST) or 0)
+
+    start_block = offset / block_size
+    end_block = (offset + length - 1) / block_size
+
+    # Read ahead if this read continues where the last one ended.
+    last_block = end_block
+    try:
+      if self.read_ends.Get(fd.urn) == offset:
+        last_block += self.readahead_blocks
+    except KeyError:
+      pass
+    last_block = min(last_block, (size - 1) / block_size)
+    self.read_ends.Put(fd.urn, offset + length)
+
+    blocks = []
+    missing = []
+    for block in xrange(start_block, last_block + 1):
+      try:
+        data = self.block_cache.Get((fd.urn, version, block))
+      except KeyError:
+        data = None
+        missing.append(block)
+
+      if block <= end_block:
+        blocks.append(data)
+
+    # Fetch each contiguous run of missing blocks with a single read.
+    for run in self._ContiguousRuns(missing):
+      with self.read_lock:
+        fd.Seek(run[0] * block_size)
+        data = fd.Read(len(run) * block_size)
+
+      for i, block in enumerate(run):
+        block_data = data[i * block_size:(i + 1) * block_size]
+        self.block_cache.Put((fd.urn, version, block), block_data)
+        if block <= end_block:
+          blocks[block - start_block] = block_data
+
+    block_offset = offset - start_block * block_size
+    return "".join(blocks)[block_offset:block_offset + length]
+
+  @staticmethod
+  def _ContiguousRuns(numbers):
+    """Splits a sorted list of ints into runs of consecutive values."""
+    runs = []
+    for number in numbers:
+      if runs and runs[-1][-1] == number - 1:
+        runs[-1].append(number)
+      else:
+        runs.append([number])
+    return runs
+
   def RaiseReadOnlyError(self):
     """Raise an error complaining that the file system is read-only."""
     raise fuse.FuseOSError(errno.EROFS)
@@ -335,7 +529,10 @@ class GRRFuse(GRRFuseDatastoreOnly):
                ignore_cache=False,
                force_sparse_image=False,
                sparse_image_threshold=1024**3,
-               timeout=flow_utils.DEFAULT_TIMEOUT):
+               timeout=flow_utils.DEFAULT_TIMEOUT,
+               block_cache_size=1024,
+               readahead_blocks=8,
+               attribute_cache_ttl=60):
     """Create a new FUSE layer at the specified aff4 path.
 
     Args:
@@ -359,6 +556,14 @@ class GRRFuse(GRRFuseDatastoreOnly):
 
       timeout: How long to wait for a client to finish running a flow, maximum.
 
+      block_cache_size: The maximum number of file blocks kept in the read
+      cache.
+
+      readahead_blocks: How many extra blocks to fetch when a file is being
+      read sequentially.
+
+      attribute_cache_ttl: How long (in seconds) stat results and directory
+      listings are reused. Never longer than max_age_before_refresh.
     """
 
     self.size_threshold = sparse_image_threshold
@@ -376,7 +581,17 @@ class GRRFuse(GRRFuseDatastoreOnly):
     else:
       self.max_age_before_refresh = max_age_before_refresh
 
-    super(GRRFuse, self).__init__(root, token)
+    # Cached attributes must not outlive the point at which we would go back
+    # to the client for fresh data.
+    attribute_cache_ttl = min(attribute_cache_ttl,
+                              self.max_age_before_refresh.total_seconds())
+
+    super(GRRFuse, self).__init__(
+        root,
+        token,
+        block_cache_size=block_cache_size,
+        readahead_blocks=readahead_blocks,
+        attribute_cache_ttl=attribute_cache_ttl)
 
   def DataRefreshRequired(self, path=None, last=None):
     """True if we need to update this path from the client.
@@ -452,6 +667,7 @@ class GRRFuse(GRRFuseDatastoreOnly):
     """
     if self.DataRefreshRequired(path):
       self._RunAndWaitForVFSFileUpdate(path)
+      self.InvalidatePath(path)
 
     return super(GRRFuse, self).Readdir(path, fh=None)
 
@@ -482,9 +698,10 @@ class GRRFuse(GRRFuseDatastoreOnly):
     return sorted(missing_chunks)
 
   def UpdateSparseImageIfNeeded(self, fd, length, offset):
+    """Fetches missing chunks of a sparse image, True if any were fetched."""
     missing_chunks = self.GetMissingChunks(fd, length, offset)
     if not missing_chunks:
-      return
+      return False
 
     client_id = rdf_client.GetClientURNFromPath(fd.urn.Path())
     flow_utils.StartFlowAndWait(
@@ -493,15 +710,17 @@ class GRRFuse(GRRFuseDatastoreOnly):
         flow_name="UpdateSparseImageChunks",
         file_urn=fd.urn,
         chunks_to_fetch=missing_chunks)
+    return True
 
   def Read(self, path, length=None, offset=0, fh=None):
     fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
     last = fd.Get(fd.Schema.CONTENT_LAST)
     client_id = rdf_client.GetClientURNFromPath(path)
+    refreshed = False
 
     if isinstance(fd, standard.AFF4SparseImage):
       # If we have a sparse image, update just a part of it.
-      self.UpdateSparseImageIfNeeded(fd, length, offset)
+      refreshed = self.UpdateSparseImageIfNeeded(fd, length, offset)
     else:
 
       # If it's the first time we've seen this path (or we're asking
@@ -517,6 +736,7 @@ class GRRFuse(GRRFuseDatastoreOnly):
             flow_name="MakeNewAFF4SparseImage",
             pathspec=pathspec,
             size_threshold=self.size_threshold)
+        refreshed = True
 
         # Reopen the fd in case it's changed to be an AFF4SparseImage
         fd = aff4.FACTORY.Open(self.root.Add(path), token=self.token)
@@ -535,6 +755,11 @@ class GRRFuse(GRRFuseDatastoreOnly):
         # it the usual way.
         if self.DataRefreshRequired(last=last):
           self._RunAndWaitForVFSFileUpdate(path)
+          refreshed = True
+
+    # Anything we cached about this file may be out of date now.
+    if refreshed:
+      self.InvalidatePath(path)
 
     # Read the file from the datastore as usual.
     return super(GRRFuse, self).Read(path, length, offset, fh)
@@ -604,7 +829,10 @@ Try:
       ignore_cache=flags.FLAGS.ignore_cache,
       force_sparse_image=flags.FLAGS.force_sparse_image,
       sparse_image_threshold=flags.FLAGS.sparse_image_threshold,
-      timeout=flags.FLAGS.timeout)
+      timeout=flags.FLAGS.timeout,
+      block_cache_size=flags.FLAGS.block_cache_size,
+      readahead_blocks=flags.FLAGS.readahead_blocks,
+      attribute_cache_ttl=flags.FLAGS.attribute_cache_ttl)
 
   fuse.FUSE(
       fuse_operation,